@@ -0,0 +1,389 @@
+"""
+Admission control & load shedding (per worker process)
+
+Kalau database melambat, request menumpuk di pool SQLAlchemy dan SEMUA latency
+ikut meledak, termasuk /healthz. Middleware ini membatasi jumlah request yang
+sedang jalan (in-flight), mengantre sisanya sebentar, dan menolak lebih awal
+(503 + Retry-After) daripada membiarkan semua request timeout bersama.
+
+HOW IT WORKS:
+1. Tiap request diklasifikasikan per path/method (classify()):
+   health (/healthz, /metrics, halaman statis: tidak pernah diantre/ditolak),
+   read (GET ringan, :batchGet), write (POST/PUT/PATCH/DELETE), render (HTML invoice),
+   analytics (analytics, export, reconcile: berat), stream (change feed
+   long-poll / SSE: lama terbuka tapi idle tanpa koneksi database, tidak
+   lewat admission supaya tidak memakan slot & merusak estimasi service time).
+2. Dua sinyal antrean:
+   - lag event loop (task kecil tidur ADMISSION_LAG_PROBE_MS lalu ukur
+     telatnya): handler & auth menjalankan query sync di event loop, jadi
+     kalau database lambat request baru pertama-tama antre di event loop,
+     sebelum sampai ke middleware ini
+   - waktu tunggu pool database (request.state.db_wait, dari get_request_db)
+3. Limit in-flight total = AIMD:
+   - overload (lihat 5) atau tunggu pool minimum dalam satu
+     ADMISSION_INTERVAL_MS > ADMISSION_TARGET_MS → limit × ADMISSION_BACKOFF
+   - request selesai dengan tunggu pool + lag < target saat limit terpakai
+     penuh → limit + 1/limit (additive increase, ~+1 per "putaran")
+   Jadi limit turun sampai antrean pindah dari pool / event loop (tidak
+   terlihat, tanpa prioritas) ke antrean di sini (prioritas & timeout).
+4. Antrean per kelas, dilayani urut prioritas (read > write > render >
+   analytics), FIFO di dalam kelas. render & analytics juga dibatasi sebagian
+   dari limit (share) supaya tidak memakan semua slot.
+5. Shedding ala CoDel: kalau waktu antre minimum (antre di sini + lag event
+   loop) selama satu interval penuh > target, controller masuk state
+   "overloaded":
+   - request render/analytics baru langsung 503
+   - antrean read/write dibatasi sebesar limit
+   - request yang antre lebih lama dari target × toleransi kelasnya ditolak
+     saat gilirannya tiba (hasilnya toh sudah terlambat)
+   Di luar state itu, request hanya ditolak kalau antre melewati max wait
+   kelasnya (ADMISSION_INTERVAL_MS × toleransi) atau antrean penuh.
+6. Retry-After = perkiraan waktu antrean habis (service time rata-rata ×
+   antrean / limit), minimal 1 detik.
+
+Opt-in (ADMISSION=true): target & limit default di bawah perlu di-tune ke
+latency normal deployment-nya; dengan default ini burst create di database
+sehat pun bisa kena 503. Limit maksimum di-clamp ke concurrency nyata
+(concurrency_cap(): thread threadpool & connection pool database), karena
+request di atas itu tetap antre di threadpool / pool, tidak terlihat di sini.
+
+Satu controller per worker process (pool juga per process). Tanpa lock:
+semua state hanya diubah dari event loop.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+
+from . import metrics
+
+ADMISSION_ENABLED = os.getenv("ADMISSION", "false").lower() == "true"
+ADMISSION_TARGET_MS = float(os.getenv("ADMISSION_TARGET_MS", "25"))
+ADMISSION_INTERVAL_MS = float(os.getenv("ADMISSION_INTERVAL_MS", "100"))
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "16"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "128"))  # di-clamp ke concurrency_cap()
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_LAG_PROBE_MS = float(os.getenv("ADMISSION_LAG_PROBE_MS", "10"))
+
+# Kelas: (prioritas, share dari limit, toleransi antre × target / interval)
+ROUTE_CLASSES = {
+    "read": (0, 1.0, 4),
+    "write": (1, 1.0, 2),
+    "render": (2, 0.5, 1),
+    "analytics": (3, 0.25, 1),
+}
+_BY_PRIORITY = sorted(ROUTE_CLASSES, key=lambda name: ROUTE_CLASSES[name][0])
+
+_HEAVY_SUFFIXES = ("/analytics", "/export", ":reconcile")
+_READ_SUFFIXES = (":batchGet",)  # POST yang hanya membaca
+
+
+def _pool_capacity(pool):
+    """Connection maksimum satu pool SQLAlchemy (None = tidak dibatasi)"""
+    if not hasattr(pool, "_max_overflow") or pool._max_overflow < 0:
+        return None
+    return pool.size() + pool._max_overflow
+
+
+def concurrency_cap() -> int:
+    """
+    Request yang benar-benar bisa jalan bareng di process ini: thread di
+    threadpool anyio (dependency & handler sync) dan connection di pool
+    database (writer + reader, semua shard). Dipanggil dari event loop.
+    """
+    from anyio import to_thread
+    from . import database, shards
+
+    cap = int(to_thread.current_default_thread_limiter().total_tokens)
+    engines = {database.engine, database.read_engine}
+    for pair in shards.engines.values():
+        engines.update(pair)
+    capacities = [_pool_capacity(engine.pool) for engine in engines if engine is not None]
+    if capacities and None not in capacities:
+        cap = min(cap, sum(capacities))
+    return cap
+
+
+def classify(method: str, path: str) -> str:
+    """Kelas route untuk request ini ("health" / "stream" = tidak lewat admission)"""
+    if not (path.startswith("/v1/") or path.startswith("/admin/")) or path == "/v1/pricing":
+        return "health"
+    if path.startswith("/v1/invoices/changes"):
+        return "stream"
+    if path.endswith(_HEAVY_SUFFIXES):
+        return "analytics"
+    if path.endswith("/html"):
+        return "render"
+    if method not in ("GET", "HEAD") and not path.endswith(_READ_SUFFIXES):
+        return "write"
+    return "read"
+
+
+class Shed(Exception):
+    """Request ditolak admission controller (→ 503)"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """AIMD limit + antrean prioritas per kelas + shedding ala CoDel"""
+
+    def __init__(
+        self,
+        target_ms: float = ADMISSION_TARGET_MS,
+        interval_ms: float = ADMISSION_INTERVAL_MS,
+        initial_limit: int = ADMISSION_INITIAL_LIMIT,
+        min_limit: int = ADMISSION_MIN_LIMIT,
+        max_limit: int = ADMISSION_MAX_LIMIT,
+        clock=time.monotonic
+    ):
+        self.target = target_ms / 1000
+        self.interval = interval_ms / 1000
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit)
+        self.clock = clock
+        self.in_flight = 0
+        self.class_in_flight = dict.fromkeys(ROUTE_CLASSES, 0)
+        self.queues = {name: deque() for name in ROUTE_CLASSES}
+        self.overloaded = False
+        self.loop_lag = 0.0
+        self._service_time = 0.05  # EWMA detik per request
+        self._interval_end = clock() + self.interval
+        self._min_pool_wait = None
+        self._min_delay = None
+        self._monitor = None
+
+    def cap(self, max_limit: int):
+        """Turunkan limit maksimum (concurrency_cap() saat startup)"""
+        self.max_limit = max(self.min_limit, min(self.max_limit, max_limit))
+        self.limit = min(self.limit, float(self.max_limit))
+
+    # ---------- admission ----------
+
+    def _has_capacity(self, route_class: str) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        share = ROUTE_CLASSES[route_class][1]
+        return self.class_in_flight[route_class] < max(1, int(self.limit * share))
+
+    def _queued_ahead(self, route_class: str) -> bool:
+        priority = ROUTE_CLASSES[route_class][0]
+        return any(self.queues[name] for name in _BY_PRIORITY[:priority + 1])
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _admit(self, route_class: str):
+        self.in_flight += 1
+        self.class_in_flight[route_class] += 1
+
+    async def acquire(self, route_class: str) -> float:
+        """
+        Tunggu slot. Returns waktu antre (detik).
+
+        Raises:
+            Shed: overload, antrean penuh, atau antre terlalu lama
+        """
+        if self._has_capacity(route_class) and not self._queued_ahead(route_class):
+            self._admit(route_class)
+            self._observe_delay(self.loop_lag)
+            return 0.0
+
+        priority, _, tolerance = ROUTE_CLASSES[route_class]
+        if self.overloaded and (priority >= ROUTE_CLASSES["render"][0] or self.queued() >= int(self.limit)):
+            raise Shed("overload")
+        if self.queued() >= ADMISSION_MAX_QUEUE:
+            raise Shed("queue_full")
+
+        loop = asyncio.get_running_loop()
+        entry = [loop.create_future(), self.clock(), None]
+        entry[2] = loop.call_later(self.interval * tolerance, self._expire, route_class, entry)
+        self.queues[route_class].append(entry)
+        try:
+            return await entry[0]
+        except asyncio.CancelledError:
+            # Client putus saat antre; kalau slot sudah diberikan, kembalikan
+            if entry[0].done() and not entry[0].cancelled() and entry[0].exception() is None:
+                self.release(route_class, None, None)
+            else:
+                self._remove(route_class, entry)
+            raise
+
+    def _remove(self, route_class: str, entry):
+        entry[2].cancel()
+        try:
+            self.queues[route_class].remove(entry)
+        except ValueError:
+            pass
+
+    def _expire(self, route_class: str, entry):
+        if entry[0].done():
+            return
+        self._remove(route_class, entry)
+        self._observe_delay(self.clock() - entry[1] + self.loop_lag)
+        entry[0].set_exception(Shed("timeout"))
+
+    def _dispatch(self):
+        """Berikan slot kosong ke antrean, urut prioritas"""
+        now = self.clock()
+        for name in _BY_PRIORITY:
+            queue = self.queues[name]
+            tolerance = ROUTE_CLASSES[name][2]
+            while queue and self._has_capacity(name):
+                future, enqueued_at, timer = queue.popleft()
+                timer.cancel()
+                if future.done():
+                    continue
+                sojourn = now - enqueued_at
+                self._observe_delay(sojourn + self.loop_lag)
+                if self.overloaded and sojourn > self.target * tolerance:
+                    future.set_exception(Shed("overload"))
+                    continue
+                self._admit(name)
+                future.set_result(sojourn)
+
+    def release(self, route_class: str, pool_wait: float | None, service_time: float | None):
+        """Request selesai: update limit (AIMD) lalu jalankan antrean"""
+        self.in_flight -= 1
+        self.class_in_flight[route_class] -= 1
+        if service_time is not None:
+            self._service_time += 0.1 * (service_time - self._service_time)
+        if pool_wait is not None:
+            if self._min_pool_wait is None or pool_wait < self._min_pool_wait:
+                self._min_pool_wait = pool_wait
+            if pool_wait + self.loop_lag < self.target and self.in_flight + 1 >= int(self.limit):
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._tick()
+        self._dispatch()
+
+    # ---------- CoDel interval ----------
+
+    def _observe_delay(self, delay: float):
+        if self._min_delay is None or delay < self._min_delay:
+            self._min_delay = delay
+        self._tick()
+
+    def _tick(self):
+        now = self.clock()
+        if now < self._interval_end:
+            return
+        self.overloaded = self._min_delay is not None and self._min_delay > self.target
+        if self.overloaded or (self._min_pool_wait is not None and self._min_pool_wait > self.target):
+            self.limit = max(self.min_limit, self.limit * ADMISSION_BACKOFF)
+        self._min_pool_wait = self._min_delay = None
+        self._interval_end = now + self.interval
+
+    def ensure_monitor(self):
+        """Start task pengukur lag event loop (sekali per event loop)"""
+        loop = asyncio.get_running_loop()
+        if self._monitor is None or self._monitor.get_loop() is not loop or self._monitor.done():
+            self._monitor = loop.create_task(self._measure_loop_lag())
+
+    async def _measure_loop_lag(self):
+        interval = ADMISSION_LAG_PROBE_MS / 1000
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, time.monotonic() - start - interval)
+            self._observe_delay(self.loop_lag)
+
+    def retry_after(self) -> int:
+        """Detik sampai antrean kira-kira habis (header Retry-After)"""
+        drain = self._service_time * (self.queued() + 1) / max(1, int(self.limit))
+        return max(1, min(30, math.ceil(drain)))
+
+    def state(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued(),
+            "overloaded": self.overloaded,
+            "loop_lag_ms": round(self.loop_lag * 1000, 1)
+        }
+
+
+controller = AdmissionController()
+
+
+# ==================== METRICS ====================
+
+ADMISSION_LIMIT = metrics.Gauge(
+    "admission_limit", "Current adaptive in-flight limit (AIMD)",
+    callback=lambda: [((), round(controller.limit, 2))]
+)
+ADMISSION_OVERLOADED = metrics.Gauge(
+    "admission_overloaded", "1 while the admission controller is shedding (queue delay above target)",
+    callback=lambda: [((), int(controller.overloaded))]
+)
+ADMISSION_LOOP_LAG = metrics.Gauge(
+    "admission_event_loop_lag_seconds", "Latest measured event loop lag (queueing before the app sees a request)",
+    callback=lambda: [((), round(controller.loop_lag, 4))]
+)
+ADMISSION_IN_FLIGHT = metrics.Gauge(
+    "admission_in_flight", "Admitted requests in flight per route class", ["route_class"],
+    callback=lambda: [((name,), count) for name, count in controller.class_in_flight.items()]
+)
+ADMISSION_QUEUED = metrics.Gauge(
+    "admission_queued", "Requests waiting for admission per route class", ["route_class"],
+    callback=lambda: [((name,), len(queue)) for name, queue in controller.queues.items()]
+)
+ADMISSION_QUEUE_DELAY = metrics.Histogram(
+    "admission_queue_delay_seconds", "Time admitted requests waited in the admission queue", ["route_class"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+ADMISSION_SHED = metrics.Counter(
+    "admission_shed_total", "Requests rejected with 503 per route class and reason", ["route_class", "reason"]
+)
+
+
+# ==================== ASGI MIDDLEWARE ====================
+
+class AdmissionMiddleware:
+    """Antre / tolak request sebelum menyentuh pool database (lihat docstring modul)"""
+
+    def __init__(self, app, admission_controller: AdmissionController = None):
+        self.app = app
+        self.controller = admission_controller or controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        route_class = classify(scope["method"], scope["path"])
+        self.controller.ensure_monitor()
+        if route_class in ("health", "stream"):
+            return await self.app(scope, receive, send)
+
+        try:
+            delay = await self.controller.acquire(route_class)
+        except Shed as e:
+            ADMISSION_SHED.inc(route_class, e.reason)
+            return await self._reject(send, self.controller.retry_after())
+        ADMISSION_QUEUE_DELAY.observe(delay, route_class)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool_wait = scope.get("state", {}).get("db_wait")
+            self.controller.release(route_class, pool_wait, time.perf_counter() - start)
+
+    async def _reject(self, send, retry_after: int):
+        body = json.dumps({"detail": "Server is overloaded, please retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
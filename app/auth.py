@@ -1,17 +1,52 @@
 """
 Authentication module - Multi-tenant support
 """
+import hmac
 import os
-from fastapi import Header, HTTPException, Depends
-from sqlalchemy.orm import Session
-from datetime import datetime
+from fastapi import Header, HTTPException, Depends, Request
+from sqlalchemy.orm import Session, make_transient_to_detached
+from datetime import datetime, timedelta
+
+from .repository import Repository, get_repository
+from . import authcache, metrics, shards, tracing
+from .db_models import Merchant, hash_key
+
+
+# Seberapa sering last_used di-update (bukan tiap request → hemat 1 write per request)
+LAST_USED_RESOLUTION = timedelta(seconds=int(os.getenv("API_KEY_LAST_USED_RESOLUTION", "60")))
 
 
 # ==================== DATABASE AUTH (Multi-tenant) ====================
 
+# Kolom merchant yang ikut di auth cache (quota_used TIDAK: berubah tiap invoice)
+CACHED_MERCHANT_FIELDS = ("id", "name", "email", "plan", "quota_limit", "is_active", "shard_id", "shard_state")
+
+
+def _cache_entry(key_id: str, last_used: datetime | None, merchant: Merchant) -> dict:
+    data = {field: getattr(merchant, field) for field in CACHED_MERCHANT_FIELDS}
+    data["created_at"] = merchant.created_at.isoformat() if merchant.created_at else None
+    return {"key_id": key_id, "last_used": last_used.isoformat() if last_used else None, "merchant": data}
+
+
+def _merchant_from_cache(db: Session, entry: dict) -> Merchant:
+    """
+    Merchant dari snapshot cache, attached ke session request tanpa query.
+    Kolom yang tidak ada di snapshot (quota_used) di-load dari database saat
+    pertama kali diakses, jadi quota selalu fresh.
+    """
+    data = dict(entry["merchant"])
+    if data["created_at"]:
+        data["created_at"] = datetime.fromisoformat(data["created_at"])
+    merchant = Merchant(**data)
+    make_transient_to_detached(merchant)
+    db.add(merchant)
+    return merchant
+
+
 async def get_current_merchant(
+    request: Request,
     x_api_key: str = Header(alias="X-API-Key"),
-    db: Session = Depends(lambda: None)  # Will be injected properly by FastAPI
+    repo: Repository = Depends(get_repository)
 ):
     """
     Get current merchant from API key in database.
@@ -19,9 +54,19 @@ async def get_current_merchant(
     HOW IT WORKS:
     1. Extract API key dari header "X-API-Key"
     2. Hash API key (untuk keamanan)
-    3. Cari di database table `api_keys`
+    3. Cari di repository (table `api_keys`, lihat app/repository.py)
     4. Kalau ketemu & active → return merchant object
     5. Kalau tidak → error 401
+
+    Backend sql: langkah 3-4 di-cache di shared memory (app/authcache.py,
+    dipakai bareng semua worker): cache hit = 0 query auth. Cache di-invalidate
+    saat key dicabut / plan / status merchant berubah (lihat authcache session
+    events). Dengan DATABASE_SHARDS, request write tetap membaca shard map dari
+    database (1 query). Backend embedded tidak perlu cache (lookup = dict in-memory).
+
+    Repository-nya sama dengan repository handler (Depends(get_repository)),
+    jadi di backend sql merchant yang di-return masih attached ke session request,
+    dan sesudah repo.route(merchant) query tenant di session itu ke shard merchant.
     
     Returns:
         Merchant object (from database)
@@ -29,44 +74,71 @@ async def get_current_merchant(
     Raises:
         HTTPException 401: Invalid or inactive API key
     """
-    from app.database import get_db
-    from app.db_models import APIKey, Merchant, hash_key
-    
-    # Get database session
-    db = next(get_db())
-    
     try:
         # Hash API key untuk compare dengan database
         key_hash = hash_key(x_api_key)
-        
+        now = datetime.utcnow()
+
+        cache = authcache.get_cache() if repo.backend == "sql" else None
+        token = cache.token() if cache is not None else None
+        entry = cache.get(key_hash) if cache is not None else None
+        if entry is not None:
+            merchant = _merchant_from_cache(repo.db, entry)
+            if shards.ENABLED and not repo.db.info.get("readonly"):
+                # Write: shard map dari directory, bukan dari snapshot. Pindah shard hanya
+                # meng-invalidate cache di host CLI-nya; cache host lain bisa basi sampai
+                # AUTH_CACHE_TTL_S, dan write ke shard lama hilang saat data di sana dihapus.
+                # Satu SELECT by PK, sekalian quota_used (yang dibaca create invoice).
+                repo.db.refresh(merchant, ("shard_id", "shard_state", "quota_used"))
+            last_used = datetime.fromisoformat(entry["last_used"]) if entry["last_used"] else None
+            if not last_used or now - last_used >= LAST_USED_RESOLUTION:
+                repo.touch_api_key(entry["key_id"], now)
+                cache.put(key_hash, merchant.id, _cache_entry(entry["key_id"], now, merchant), token)
+            repo.route(merchant)
+            request.state.merchant_id = merchant.id
+            request.state.shard_id = merchant.shard_id
+            metrics.AUTH_OUTCOMES.inc("ok")
+            return merchant
+
         # Cari API key di database
-        api_key = db.query(APIKey).filter(
-            APIKey.key_hash == key_hash,
-            APIKey.is_active == True
-        ).first()
+        with tracing.span("auth_key"):
+            api_key = repo.find_active_key(key_hash)
         
         if not api_key:
+            metrics.AUTH_OUTCOMES.inc("invalid_key")
             raise HTTPException(
                 status_code=401,
                 detail="Invalid API key. Please check your API key or register at /v1/merchants/register"
             )
         
         # Update last used timestamp
-        api_key.last_used = datetime.utcnow()
-        db.commit()
+        last_used = api_key.last_used
+        if not last_used or now - last_used >= LAST_USED_RESOLUTION:
+            repo.touch_api_key(api_key.id, now)
+            last_used = now
         
         # Get merchant dari API key
-        merchant = db.query(Merchant).filter(
-            Merchant.id == api_key.merchant_id,
-            Merchant.is_active == True
-        ).first()
+        with tracing.span("auth_merchant"):
+            merchant = repo.get_active_merchant(api_key.merchant_id)
         
         if not merchant:
+            metrics.AUTH_OUTCOMES.inc("inactive_merchant")
             raise HTTPException(
                 status_code=401,
                 detail="Merchant account is inactive. Please contact support."
             )
         
+        if cache is not None:
+            cache.put(key_hash, merchant.id, _cache_entry(api_key.id, last_used, merchant), token)
+
+        # Data tenant (invoice, usage log, webhook) → shard merchant (app/shards.py)
+        repo.route(merchant)
+
+        # Untuk middleware logging
+        request.state.merchant_id = merchant.id
+        request.state.shard_id = getattr(merchant, "shard_id", None)
+        metrics.AUTH_OUTCOMES.inc("ok")
+        
         return merchant
         
     except HTTPException:
@@ -74,12 +146,19 @@ async def get_current_merchant(
         raise
     except Exception as e:
         # Catch unexpected errors
+        metrics.AUTH_OUTCOMES.inc("error")
         raise HTTPException(
             status_code=500,
             detail=f"Authentication error: {str(e)}"
         )
-    finally:
-        db.close()
+
+
+# ==================== ADMIN AUTH ====================
+
+def is_admin_key(value: str) -> bool:
+    """Cek admin key (env ADMIN_KEY) dengan constant-time compare"""
+    admin_key = os.getenv("ADMIN_KEY", "admin_secret_key_change_me")
+    return bool(value) and hmac.compare_digest(value.encode(), admin_key.encode())
 
 
 # ==================== LEGACY AUTH (Backward compatibility) ====================
@@ -89,8 +168,7 @@ LEGACY_API_KEY = os.getenv("API_KEY", "demo_merchant_key")
 async def require_api_key_legacy(x_api_key: str | None = Header(default=None)):
     """
     LEGACY: Simple auth dengan env var.
-    Hanya untuk backward compatibility saat USE_DATABASE=false.
-    AKAN DIHAPUS setelah full migration ke database mode.
+    Tidak dipakai endpoint manapun lagi (semua endpoint pakai get_current_merchant).
     """
     if not x_api_key or x_api_key != LEGACY_API_KEY:
         raise HTTPException(
@@ -0,0 +1,357 @@
+"""
+Shared-memory cache untuk hasil auth: API key → merchant (plan, quota_limit, ...)
+
+Satu tabel untuk semua uvicorn worker di host yang sama, jadi tidak ada N salinan
+cache per process (key cukup miss sekali per host), dan invalidation dari worker
+mana pun langsung terlihat oleh semua worker. Startup app = invalidate_all().
+
+HOW IT WORKS:
+1. File mmap (default di /dev/shm, mode 0600) dengan layout tetap:
+   header | generation counters per merchant | slot[0..AUTH_CACHE_SLOTS)
+   Bukan multiprocessing.shared_memory: segment itu di-unlink resource tracker
+   saat process pembuatnya exit, padahal worker datang & pergi.
+2. Slot = open addressing (linear probing, maks. _PROBES slot dari hash key).
+   Slot tidak pernah dikosongkan lagi (entry basi cuma ditimpa), jadi rantai
+   probe tidak pernah putus.
+3. Read tanpa lock (seqlock): writer menaikkan `seq` slot jadi ganjil, tulis,
+   lalu genap lagi; reader mengulang kalau `seq` ganjil / berubah selama copy.
+4. Write (miss, invalidation) di-serialize dengan flock + threading.Lock;
+   jarang terjadi dibanding read.
+5. Validitas entry: epoch entry == epoch global (invalidate_all) DAN generation
+   entry == counter merchant-nya (invalidate_merchant), dan belum lewat TTL.
+   Fill dari database dibatalkan kalau ada invalidation di antara mulai baca
+   database dan menulis ke cache (counter `invalidations`), supaya data lama
+   tidak pernah tersimpan dengan generation baru.
+6. quota_used sengaja TIDAK di-cache (berubah tiap invoice); dibaca dari
+   database saat dibutuhkan (lihat auth.get_current_merchant).
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_ENABLED = os.getenv("AUTH_CACHE", "true").lower() == "true"
+AUTH_CACHE_PATH = os.getenv("AUTH_CACHE_PATH", "")  # default: per DATABASE_URL di /dev/shm
+AUTH_CACHE_SLOTS = int(os.getenv("AUTH_CACHE_SLOTS", "8192"))
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "300"))
+
+_MAGIC = b"IACH"
+_VERSION = 1
+_SLOT_SIZE = 512
+_GENERATIONS = 4096  # counter per hash(merchant_id) % _GENERATIONS (tabrakan = miss ekstra saja)
+_PROBES = 8
+
+# Header: magic, version, slots, slot_size, generations, epoch, invalidations
+_HEADER = struct.Struct("<4sIIII4xQQ")
+_EPOCH_OFFSET = 24
+_INVALIDATIONS_OFFSET = 32
+_GEN_OFFSET = 64
+# Slot: seq, key digest, epoch, generation, generation index, payload length, expires_at
+_SLOT = struct.Struct("<Q32sQQIId")
+_U64 = struct.Struct("<Q")
+_EMPTY_KEY = bytes(32)
+
+
+def _generation_index(merchant_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(merchant_id.encode(), digest_size=8).digest(), "little") % _GENERATIONS
+
+
+class SharedAuthCache:
+    """Tabel fixed-size di file mmap; aman dipakai bareng oleh banyak process & thread"""
+
+    def __init__(self, path: str, slots: int = AUTH_CACHE_SLOTS, ttl: float = AUTH_CACHE_TTL_S):
+        self.path = path
+        self.slots = slots
+        self.ttl = ttl
+        self.size = _GEN_OFFSET + _GENERATIONS * 8 + slots * _SLOT_SIZE
+        self._slots_offset = _GEN_OFFSET + _GENERATIONS * 8
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._mm = None
+
+    # ---------- file & layout ----------
+
+    def _open(self):
+        """Buka (atau buat & format) file; dibuka ulang sesudah fork"""
+        if self._pid == os.getpid():
+            return self._mm
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+            mm = mmap.mmap(fd, self.size)
+            header = _HEADER.unpack_from(mm, 0)
+            if header[:5] != (_MAGIC, _VERSION, self.slots, _SLOT_SIZE, _GENERATIONS):
+                # File baru atau layout lain (versi / AUTH_CACHE_SLOTS berubah): format ulang
+                mm[:] = bytes(self.size)
+                _HEADER.pack_into(mm, 0, _MAGIC, _VERSION, self.slots, _SLOT_SIZE, _GENERATIONS, 1, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd, self._mm, self._pid = fd, mm, os.getpid()
+        return mm
+
+    def _write_lock(self):
+        return _WriteLock(self)
+
+    def _slot_offset(self, index: int) -> int:
+        return self._slots_offset + (index % self.slots) * _SLOT_SIZE
+
+    def _home(self, digest: bytes) -> int:
+        return int.from_bytes(digest[:8], "little") % self.slots
+
+    def _generation(self, mm, index: int) -> int:
+        return _U64.unpack_from(mm, _GEN_OFFSET + index * 8)[0]
+
+    # ---------- read (lock-free) ----------
+
+    def token(self) -> int:
+        """Counter invalidation saat ini; ambil SEBELUM baca database, kirim ke put()"""
+        return _U64.unpack_from(self._open(), _INVALIDATIONS_OFFSET)[0]
+
+    def get(self, key_hash: str):
+        """Entry (dict) untuk key_hash, atau None kalau tidak ada / basi"""
+        mm = self._open()
+        digest = bytes.fromhex(key_hash)
+        home = self._home(digest)
+        epoch = _U64.unpack_from(mm, _EPOCH_OFFSET)[0]
+        for probe in range(_PROBES):
+            offset = self._slot_offset(home + probe)
+            for _ in range(100):
+                seq, key, entry_epoch, generation, gen_index, length, expires_at = _SLOT.unpack_from(mm, offset)
+                if seq & 1:
+                    continue  # writer sedang menulis slot ini
+                if key != digest:
+                    break
+                start = offset + _SLOT.size
+                payload = mm[start:start + length]
+                if _U64.unpack_from(mm, offset)[0] != seq:
+                    continue  # slot berubah selama dibaca
+                if (entry_epoch != epoch or generation != self._generation(mm, gen_index)
+                        or expires_at < time.time()):
+                    metrics.AUTH_CACHE.inc("stale")
+                    return None
+                metrics.AUTH_CACHE.inc("hit")
+                return json.loads(payload)
+            else:
+                break
+            if key == _EMPTY_KEY:
+                break
+        metrics.AUTH_CACHE.inc("miss")
+        return None
+
+    # ---------- write ----------
+
+    def put(self, key_hash: str, merchant_id: str, data: dict, token: int) -> bool:
+        """
+        Simpan entry. `token` dari token() sebelum baca database: kalau sejak itu
+        ada invalidation, entry TIDAK disimpan (data yang dibaca mungkin sudah lama).
+        """
+        payload = json.dumps(data, separators=(",", ":")).encode()
+        if len(payload) > _SLOT_SIZE - _SLOT.size:
+            return False
+        digest = bytes.fromhex(key_hash)
+        gen_index = _generation_index(merchant_id)
+        with self._write_lock() as mm:
+            if _U64.unpack_from(mm, _INVALIDATIONS_OFFSET)[0] != token:
+                return False
+            epoch = _U64.unpack_from(mm, _EPOCH_OFFSET)[0]
+            now = time.time()
+            offset = self._choose_slot(mm, digest, epoch, now)
+            seq = _U64.unpack_from(mm, offset)[0]
+            _U64.pack_into(mm, offset, seq + 1)
+            _SLOT.pack_into(
+                mm, offset, seq + 1, digest, epoch, self._generation(mm, gen_index), gen_index,
+                len(payload), now + self.ttl
+            )
+            mm[offset + _SLOT.size:offset + _SLOT.size + len(payload)] = payload
+            _U64.pack_into(mm, offset, seq + 2)
+        return True
+
+    def _choose_slot(self, mm, digest: bytes, epoch: int, now: float) -> int:
+        """Slot key yang sama > slot kosong > entry basi > entry yang paling cepat expired"""
+        home = self._home(digest)
+        candidates = []
+        for probe in range(_PROBES):
+            offset = self._slot_offset(home + probe)
+            _, key, entry_epoch, generation, gen_index, _, expires_at = _SLOT.unpack_from(mm, offset)
+            if key == digest or key == _EMPTY_KEY:
+                return offset
+            stale = (entry_epoch != epoch or generation != self._generation(mm, gen_index)
+                     or expires_at < now)
+            candidates.append((not stale, expires_at, offset))
+        return min(candidates)[2]
+
+    def invalidate_merchant(self, merchant_id: str):
+        """Semua entry milik merchant ini basi (di semua worker), mis. plan berubah / key dicabut"""
+        index = _generation_index(merchant_id)
+        with self._write_lock() as mm:
+            offset = _GEN_OFFSET + index * 8
+            _U64.pack_into(mm, offset, _U64.unpack_from(mm, offset)[0] + 1)
+            _bump(mm, _INVALIDATIONS_OFFSET)
+
+    def invalidate_all(self):
+        with self._write_lock() as mm:
+            _bump(mm, _EPOCH_OFFSET)
+            _bump(mm, _INVALIDATIONS_OFFSET)
+
+    def stats(self) -> dict:
+        mm = self._open()
+        epoch = _U64.unpack_from(mm, _EPOCH_OFFSET)[0]
+        used = live = 0
+        now = time.time()
+        for index in range(self.slots):
+            _, key, entry_epoch, generation, gen_index, _, expires_at = _SLOT.unpack_from(mm, self._slot_offset(index))
+            if key != _EMPTY_KEY:
+                used += 1
+                live += (entry_epoch == epoch and generation == self._generation(mm, gen_index)
+                         and expires_at >= now)
+        return {
+            "path": self.path, "slots": self.slots, "used": used, "live": live, "epoch": epoch,
+            "invalidations": _U64.unpack_from(mm, _INVALIDATIONS_OFFSET)[0]
+        }
+
+
+class _WriteLock:
+    """threading.Lock (thread di process ini) + flock (process lain)"""
+
+    def __init__(self, cache: SharedAuthCache):
+        self.cache = cache
+
+    def __enter__(self):
+        mm = self.cache._open()
+        self.cache._lock.acquire()
+        fcntl.flock(self.cache._fd, fcntl.LOCK_EX)
+        return mm
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.cache._fd, fcntl.LOCK_UN)
+        self.cache._lock.release()
+
+
+def _bump(mm, offset: int):
+    _U64.pack_into(mm, offset, _U64.unpack_from(mm, offset)[0] + 1)
+
+
+# ==================== MODULE-LEVEL CACHE ====================
+
+_cache = None
+_disabled = not AUTH_CACHE_ENABLED
+
+
+def default_path(database_url: str) -> str:
+    """Satu file per database (benchmark / test dengan database lain tidak berbagi cache)"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    digest = hashlib.sha256(database_url.encode()).hexdigest()[:16]
+    return os.path.join(base, f"invoice-api-auth-{digest}")
+
+
+def get_cache():
+    """SharedAuthCache untuk database saat ini, atau None (AUTH_CACHE=false / gagal dibuka)"""
+    global _cache, _disabled
+    if _cache is None and not _disabled:
+        from . import database
+        try:
+            _cache = SharedAuthCache(AUTH_CACHE_PATH or default_path(str(database.engine.url)))
+            _cache._open()
+        except (OSError, ValueError) as e:
+            logger.warning("Auth cache disabled: %s", e)
+            _cache, _disabled = None, True
+    return _cache
+
+
+def invalidate_merchant(merchant_id: str):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate_merchant(merchant_id)
+
+
+def invalidate_all():
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate_all()
+
+
+# ==================== INVALIDATION (SQLAlchemy session events) ====================
+#
+# Setiap perubahan ORM yang mempengaruhi hasil auth di-invalidate SESUDAH commit
+# (sebelum commit, worker lain masih baca data lama dari database juga):
+# - Merchant: kolom yang di-cache berubah, atau dihapus
+# - APIKey: is_active / key_hash / merchant_id berubah, atau dihapus
+# - Bulk UPDATE/DELETE ORM ke merchants / api_keys → invalidate_all
+#   (kecuali execution_options(authcache_skip=True), mis. last_used)
+# Core statement di luar Session (engine.begin()) tidak terdeteksi: panggil
+# invalidate_merchant() / invalidate_all() sendiri kalau mengubah kolom di atas.
+
+_MERCHANT_FIELDS = ("name", "email", "plan", "quota_limit", "is_active", "shard_id", "shard_state")
+_API_KEY_FIELDS = ("is_active", "key_hash", "merchant_id")
+_ALL = "*"
+
+
+def _changed(obj, fields) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session, flush_context):
+    from .db_models import APIKey, Merchant
+
+    pending = session.info.setdefault("authcache_invalidate", set())
+    for obj in session.dirty:
+        if isinstance(obj, Merchant) and _changed(obj, _MERCHANT_FIELDS):
+            pending.add(obj.id)
+        elif isinstance(obj, APIKey) and _changed(obj, _API_KEY_FIELDS):
+            pending.add(obj.merchant_id)
+            pending.update(inspect(obj).attrs.merchant_id.history.deleted)
+    for obj in session.deleted:
+        if isinstance(obj, Merchant):
+            pending.add(obj.id)
+        elif isinstance(obj, APIKey):
+            pending.add(obj.merchant_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_invalidations(orm_execute_state):
+    from .db_models import APIKey, Merchant
+
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if orm_execute_state.execution_options.get("authcache_skip"):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in (Merchant, APIKey):
+        orm_execute_state.session.info.setdefault("authcache_invalidate", set()).add(_ALL)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session):
+    pending = session.info.pop("authcache_invalidate", None)
+    if not pending:
+        return
+    if _ALL in pending:
+        invalidate_all()
+        return
+    for merchant_id in pending:
+        if merchant_id:
+            invalidate_merchant(merchant_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("authcache_invalidate", None)
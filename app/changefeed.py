@@ -0,0 +1,428 @@
+"""
+Change feed invoice per merchant: GET /v1/invoices/changes (long-poll) & /stream (SSE)
+
+Pengganti polling GET /v1/invoices (+ COUNT) oleh integrasi ERP: client simpan
+cursor terakhir dan hanya menerima perubahan sesudahnya.
+
+HOW IT WORKS:
+1. Create / update / paid invoice menulis satu baris invoice_changes di transaksi
+   yang sama (ikut commit / rollback invoice-nya). seq = 1, 2, 3, ... per merchant,
+   dihitung di INSERT itu sendiri (subquery max(seq) + 1) → tanpa query tambahan.
+   Penulis per merchant ter-serialize (SQLite: satu writer per database;
+   PostgreSQL: advisory lock per merchant), jadi urutan seq = urutan commit dan
+   reader tidak pernah melihat seq 7 sebelum seq 6. Unique (merchant_id, seq)
+   sebagai pengaman terakhir.
+2. Cursor = seq terakhir yang sudah diterima client. seq tanpa celah, jadi resume
+   exact: since=N → mulai dari seq N+1, tidak ada yang terlewat atau dobel.
+   Celah di awal hasil (seq pertama > N+1) = perubahan sudah dihapus retention
+   → 410, client sync ulang lewat GET /v1/invoices lalu lanjut dari cursor baru.
+3. Long-poll: kalau belum ada perubahan, request menunggu (maks. `wait` detik)
+   tanpa memegang koneksi database, sampai dibangunkan broadcaster.
+4. Broadcaster: satu task per process. Tiap CHANGES_POLL_INTERVAL_MS (atau langsung
+   sesudah commit di process ini): satu query max(seq) GROUP BY merchant per shard
+   untuk merchant yang punya subscriber, lalu perubahan baru dibaca SEKALI per
+   merchant, di-serialize sekali, dan dibagikan ke queue semua subscriber-nya.
+   Commit dari worker / host lain ikut terdeteksi lewat query max(seq) itu.
+5. Subscriber yang tertinggal (baru connect, queue penuh karena client lambat,
+   celah seq) membaca sendiri dari database sampai menyusul, lalu kembali
+   menerima broadcast.
+6. Retention: job harian hapus perubahan > CHANGES_RETENTION_DAYS, kecuali baris
+   terakhir tiap merchant (supaya seq berikutnya tetap lanjut, tidak mulai dari 1).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import jobs, shards, sqlstats, tracing
+from .db_models import InvoiceChange, gen_id
+
+logger = logging.getLogger(__name__)
+
+CHANGES_POLL_INTERVAL_MS = float(os.getenv("CHANGES_POLL_INTERVAL_MS", "1000"))
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))  # maks. perubahan per query / per batch
+CHANGES_SUBSCRIBER_BUFFER = int(os.getenv("CHANGES_SUBSCRIBER_BUFFER", "64"))  # batch belum dibaca per subscriber
+CHANGES_LONGPOLL_MAX_S = float(os.getenv("CHANGES_LONGPOLL_MAX_S", "30"))
+CHANGES_HEARTBEAT_S = float(os.getenv("CHANGES_HEARTBEAT_S", "15"))
+# Stream SSE ditutup sesudah ini; client reconnect dengan Last-Event-ID (auth &
+# shard map dibaca ulang, mis. sesudah merchant dipindah shard)
+CHANGES_STREAM_MAX_S = float(os.getenv("CHANGES_STREAM_MAX_S", "300"))
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", "30"))
+CHANGES_RETENTION_BATCH = 5000
+SSE_RETRY_MS = 2000
+
+
+# ==================== WRITE (di transaksi invoice) ====================
+
+def lock_merchant(db, merchant_id: str):
+    """
+    Serialize transaksi yang menulis nomor invoice / change log / agregat satu
+    merchant sampai commit, sebelum COUNT / MAX(seq) dibaca.
+
+    PostgreSQL: advisory lock per merchant. SQLite: write lock database (BEGIN
+    IMMEDIATE) kalau transaksi belum mulai. pysqlite baru BEGIN sebelum DML
+    pertama, jadi SELECT sebelumnya jalan di autocommit di luar write lock: writer
+    pool satu connection hanya per process, dua worker uvicorn bisa membaca COUNT
+    yang sama. Transaksi yang sudah mulai (sudah ada DML) sudah memegang write lock.
+    """
+    bind = db.get_bind(InvoiceChange)
+    if bind.dialect.name == "postgresql":
+        key = int.from_bytes(hashlib.blake2b(merchant_id.encode(), digest_size=8).digest(), "big", signed=True)
+        db.execute(select(func.pg_advisory_xact_lock(key)))
+    elif bind.dialect.name == "sqlite":
+        raw = db.connection(bind_arguments={"mapper": InvoiceChange}).connection.dbapi_connection
+        if not raw.in_transaction:
+            # Langsung ke driver, menggantikan BEGIN implisit pysqlite (tunggu lock: busy_timeout)
+            raw.execute("BEGIN IMMEDIATE")
+
+
+def record(db, merchant_id: str, change_type: str, data: dict):
+    """
+    Tambah satu perubahan ke session `db` (di-commit oleh caller, bersama invoice-nya).
+    `data`: isi yang sama dengan event webhook (webhooks.invoice_data).
+    """
+    lock_merchant(db, merchant_id)
+    next_seq = (
+        select(func.coalesce(func.max(InvoiceChange.seq), 0) + 1)
+        .where(InvoiceChange.merchant_id == merchant_id)
+        .scalar_subquery()
+    )
+    db.add(InvoiceChange(
+        merchant_id=merchant_id, seq=next_seq, invoice_id=data["id"], type=change_type, data=data
+    ))
+    db.info.setdefault("changefeed_notify", set()).add(merchant_id)
+
+
+def record_many(db, merchant_id: str, change_type: str, datas):
+    """Seperti record(), untuk banyak invoice sekaligus (rekonsiliasi): satu bulk INSERT"""
+    datas = list(datas)
+    if not datas:
+        return
+    lock_merchant(db, merchant_id)
+    last = db.execute(
+        select(func.coalesce(func.max(InvoiceChange.seq), 0)).where(InvoiceChange.merchant_id == merchant_id)
+    ).scalar()
+    now = datetime.utcnow()
+    db.execute(insert(InvoiceChange.__table__), [
+        {
+            "id": gen_id("chg"), "merchant_id": merchant_id, "seq": last + n, "invoice_id": data["id"],
+            "type": change_type, "data": data, "created_at": now
+        }
+        for n, data in enumerate(datas, 1)
+    ])
+    db.info.setdefault("changefeed_notify", set()).add(merchant_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_committed(session):
+    if session.info.pop("changefeed_notify", None):
+        broadcaster.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_notify(session):
+    session.info.pop("changefeed_notify", None)
+
+
+# ==================== READ ====================
+
+# seq, body (dict untuk JSON response), sse (event SSE siap kirim)
+Change = namedtuple("Change", "seq body sse")
+
+
+def _change(row) -> Change:
+    body = {
+        "cursor": str(row.seq),
+        "type": row.type,
+        "invoice_id": row.invoice_id,
+        "data": row.data,
+        "created_at": row.created_at.isoformat() if row.created_at else None
+    }
+    sse = f"id: {row.seq}\nevent: {row.type}\ndata: {json.dumps(body, separators=(',', ':'))}\n\n"
+    return Change(row.seq, body, sse)
+
+
+def parse_cursor(value) -> int:
+    """Cursor dari client (query `since` / header Last-Event-ID); kosong = dari awal"""
+    if value is None or value == "":
+        return 0
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "Invalid cursor")
+    if seq < 0:
+        raise HTTPException(400, "Invalid cursor")
+    return seq
+
+
+def fetch(db, merchant_id: str, after: int, limit: int = CHANGES_PAGE_SIZE) -> list:
+    """Perubahan merchant dengan seq > after, urut seq (lewat index merchant_id, seq)"""
+    rows = db.execute(
+        select(InvoiceChange.seq, InvoiceChange.type, InvoiceChange.invoice_id, InvoiceChange.data,
+               InvoiceChange.created_at)
+        .where(InvoiceChange.merchant_id == merchant_id, InvoiceChange.seq > after)
+        .order_by(InvoiceChange.seq)
+        .limit(limit)
+    ).all()
+    return [_change(row) for row in rows]
+
+
+def read(db, merchant_id: str, after: int, limit: int = CHANGES_PAGE_SIZE) -> list:
+    """Seperti fetch(), tapi 410 kalau sebagian perubahan sesudah cursor sudah dihapus retention"""
+    changes = fetch(db, merchant_id, after, limit)
+    if after and changes and changes[0].seq > after + 1:
+        raise HTTPException(410, "Cursor expired: changes were purged, resync with GET /v1/invoices")
+    return changes
+
+
+def _fetch_shard(shard_id, merchant_id: str, after: int, limit: int = CHANGES_PAGE_SIZE) -> list:
+    db = shards.session(shard_id, readonly=True)
+    try:
+        return fetch(db, merchant_id, after, limit)
+    finally:
+        db.close()
+
+
+def _latest_seqs(shard_id, merchant_ids) -> dict:
+    """merchant_id → seq terakhir, satu query per CHANGES_PAGE_SIZE merchant"""
+    latest = {}
+    db = shards.session(shard_id, readonly=True)
+    try:
+        for i in range(0, len(merchant_ids), CHANGES_PAGE_SIZE):
+            latest.update(db.execute(
+                select(InvoiceChange.merchant_id, func.max(InvoiceChange.seq))
+                .where(InvoiceChange.merchant_id.in_(merchant_ids[i:i + CHANGES_PAGE_SIZE]))
+                .group_by(InvoiceChange.merchant_id)
+            ).all())
+    finally:
+        db.close()
+    return latest
+
+
+# ==================== BROADCASTER ====================
+
+class Subscription:
+    """Satu client (long-poll / SSE): cursor sendiri + queue batch dari broadcaster"""
+
+    def __init__(self, merchant_id: str, shard_id, cursor: int, limit: int = CHANGES_PAGE_SIZE,
+                 behind: bool = True):
+        self.merchant_id = merchant_id
+        self.shard_id = shard_id
+        self.cursor = cursor
+        self.limit = limit
+        self.behind = behind  # True = baca backlog sesudah cursor dari database dulu
+        self._queue = asyncio.Queue()
+
+    def push(self, changes):
+        """changes None = baca ulang dari database (mis. ada perubahan yang tidak di-broadcast)"""
+        if changes is not None and self._queue.qsize() < CHANGES_SUBSCRIBER_BUFFER:
+            self._queue.put_nowait(changes)
+            return
+        # Client terlalu lambat / perlu menyusul: buang antrian, nanti baca dari database
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def next(self, timeout: float) -> list:
+        """Perubahan berikutnya sesudah cursor (list Change, urut seq); [] kalau timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if self.behind:
+                changes = await asyncio.to_thread(_fetch_shard, self.shard_id, self.merchant_id, self.cursor,
+                                                  self.limit)
+                self.behind = len(changes) == self.limit
+                if changes:
+                    self.cursor = changes[-1].seq
+                    return changes
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return []
+            try:
+                batch = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return []
+            if batch is None:
+                self.behind = True
+                continue
+            fresh = [change for change in batch if change.seq > self.cursor]
+            if not fresh:
+                continue
+            if fresh[0].seq != self.cursor + 1:
+                self.behind = True  # ada yang terlewat (mis. commit sebelum topic mulai), baca dari database
+                continue
+            if len(fresh) > self.limit:
+                fresh = fresh[:self.limit]
+                self.behind = True
+            self.cursor = fresh[-1].seq
+            return fresh
+
+
+class _Topic:
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.last_seq = None  # None = belum dibaca (diisi max(seq) saat tick berikutnya)
+        self.subscribers = set()
+
+
+class ChangeBroadcaster:
+    """Satu task per process: baca perubahan baru sekali per merchant, bagikan ke semua subscriber"""
+
+    def __init__(self, poll_interval_ms: float = CHANGES_POLL_INTERVAL_MS):
+        self.poll_interval = poll_interval_ms / 1000
+        self.fetches = 0  # query baca perubahan oleh broadcaster (benchmark)
+        self._topics = {}  # merchant_id → _Topic
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+
+    def start(self):
+        """Start broadcaster task di event loop yang sedang jalan"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._topics = {}
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._loop = None
+
+    def notify(self):
+        """Ada perubahan yang baru di-commit di process ini (boleh dipanggil dari thread lain)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wakeup.set()
+        else:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def subscribe(self, merchant_id: str, shard_id, cursor: int, limit: int = CHANGES_PAGE_SIZE,
+                  behind: bool = True) -> Subscription:
+        """
+        behind=False: caller baru saja membaca semua perubahan sampai `cursor`, jadi
+        tidak perlu query backlog lagi (kecuali broadcast topic-nya sudah lewat cursor)
+        """
+        if self._loop is not asyncio.get_running_loop() or not self._task or self._task.done():
+            self.start()
+
+        sub = Subscription(merchant_id, shard_id, cursor, limit, behind)
+        topic = self._topics.get(merchant_id)
+        if topic is None:
+            topic = self._topics[merchant_id] = _Topic(shard_id)
+            self._wakeup.set()
+        # Merchant dipindah shard: ikut shard map dari auth terbaru (seq ikut disalin)
+        topic.shard_id = shard_id
+        if topic.last_seq is not None and topic.last_seq > cursor:
+            sub.behind = True  # perubahan (cursor, last_seq] sudah di-broadcast sebelum subscribe
+        topic.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        topic = self._topics.get(sub.merchant_id)
+        if topic is not None:
+            topic.subscribers.discard(sub)
+            if not topic.subscribers:
+                del self._topics[sub.merchant_id]
+
+    async def _run(self):
+        # Task ini mewarisi context request pertama; query-nya bukan milik request itu
+        sqlstats.current.set(None)
+        tracing.current.set(None)
+
+        while True:
+            self._wakeup.clear()
+            if self._topics:
+                try:
+                    await self._tick()
+                except Exception:
+                    logger.exception("Change feed broadcaster tick failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval if self._topics else None)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self):
+        by_shard = defaultdict(list)
+        for merchant_id, topic in self._topics.items():
+            by_shard[topic.shard_id].append(merchant_id)
+
+        for shard_id, merchant_ids in by_shard.items():
+            latest = await asyncio.to_thread(_latest_seqs, shard_id, merchant_ids)
+            for merchant_id in merchant_ids:
+                topic = self._topics.get(merchant_id)
+                if topic is None:
+                    continue  # subscriber terakhir pergi selama query
+                seq = latest.get(merchant_id, 0)
+                if topic.last_seq is None:
+                    # Topic baru: broadcast mulai dari sini; subscriber yang cursor-nya
+                    # lebih lama membaca sisanya sendiri dari database
+                    topic.last_seq = seq
+                    for sub in topic.subscribers:
+                        if sub.cursor < seq:
+                            sub.push(None)
+                    continue
+                while seq > topic.last_seq and topic.subscribers:
+                    changes = await asyncio.to_thread(_fetch_shard, shard_id, merchant_id, topic.last_seq)
+                    self.fetches += 1
+                    if not changes:
+                        break
+                    topic.last_seq = changes[-1].seq
+                    for sub in list(topic.subscribers):
+                        sub.push(changes)
+
+
+broadcaster = ChangeBroadcaster()
+
+
+# ==================== RETENTION ====================
+
+@jobs.handler("invoice_changes.retention")
+def purge_old_changes(payload: dict):
+    """Hapus perubahan > CHANGES_RETENTION_DAYS (baris terakhir tiap merchant disimpan), semua shard paralel"""
+    cutoff = datetime.utcnow() - timedelta(days=payload.get("days", CHANGES_RETENTION_DAYS))
+    latest = InvoiceChange.__table__.alias("latest")
+
+    def purge(shard_id):
+        stale = (
+            select(InvoiceChange.id)
+            .where(
+                InvoiceChange.created_at < cutoff,
+                InvoiceChange.seq < select(func.max(latest.c.seq))
+                .where(latest.c.merchant_id == InvoiceChange.merchant_id)
+                .scalar_subquery()
+            )
+            .limit(CHANGES_RETENTION_BATCH)
+            .correlate(None)  # bukan subquery dari DELETE di bawah
+        )
+        deleted = 0
+        while True:
+            with shards.writer(shard_id).begin() as conn:
+                count = conn.execute(delete(InvoiceChange).where(InvoiceChange.id.in_(stale))).rowcount
+            deleted += count
+            if count < CHANGES_RETENTION_BATCH:
+                return deleted
+
+    deleted = sum(shards.fan_out(purge).values())
+    logger.info("Invoice change retention: deleted %d changes", deleted)
+
+
+jobs.schedule("invoice_changes.retention", "45 3 * * *")
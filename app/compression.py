@@ -0,0 +1,210 @@
+"""
+Response compression (gzip / brotli) + halaman statis yang sudah di-compress
+
+HOW IT WORKS:
+1. CompressionMiddleware (ASGI) memilih encoding dari header Accept-Encoding:
+   br (kalau package `brotli` ter-install) → gzip → tanpa compress
+2. Hanya content-type teks (HTML, JSON, CSV, NDJSON, ...) yang di-compress;
+   response yang sudah punya Content-Encoding atau application/gzip dilewati
+3. Body kecil (< COMPRESSION_MIN_SIZE byte, satu chunk) dikirim apa adanya
+4. StreamingResponse di-compress per chunk (flush tiap chunk), jadi export
+   tetap streaming & memory konstan, tidak di-buffer dulu
+5. StaticPage: body statis (landing, pricing) di-compress sekali saat startup
+   dengan level maksimal, dikirim dengan ETag + Cache-Control (304 kalau
+   If-None-Match cocok)
+"""
+import hashlib
+import os
+import zlib
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+STATIC_CACHE_CONTROL = os.getenv("STATIC_CACHE_CONTROL", "public, max-age=86400, stale-while-revalidate=604800")
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "image/svg+xml"
+)
+
+
+def choose_encoding(accept_encoding: str):
+    """Pilih "br", "gzip" atau None dari header Accept-Encoding (hormati q=0)"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+
+    wildcard = accepted.get("*", 0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _GzipEncoder:
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def encode(self, data: bytes, final: bool) -> bytes:
+        out = self._c.compress(data)
+        return out + self._c.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY):
+        self._c = brotli.Compressor(quality=quality)
+
+    def encode(self, data: bytes, final: bool) -> bytes:
+        out = self._c.process(data)
+        return out + (self._c.finish() if final else self._c.flush())
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """Compress satu body utuh"""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else COMPRESSION_BROTLI_QUALITY)
+    return _GzipEncoder(9 if best else COMPRESSION_GZIP_LEVEL).encode(data, final=True)
+
+
+def _is_compressible(headers) -> bool:
+    content_type = ""
+    for name, value in headers:
+        name = name.lower()
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value.decode("latin-1").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _with_vary(headers):
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+
+class _CompressingSend:
+    """Bungkus `send`: tahan http.response.start sampai chunk body pertama datang"""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.encoder = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if self.passthrough:
+            return await self.send(message)
+
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            if not _is_compressible(headers) or message["status"] in (204, 304):
+                self.passthrough = True
+                return await self.send(message)
+            self.start = {**message, "headers": _with_vary(headers)}
+            return
+
+        if message["type"] != "http.response.body":
+            return await self.send(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is None:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start)
+                return await self.send(message)
+
+            self.encoder = _BrotliEncoder() if self.encoding == "br" else _GzipEncoder()
+            headers = [(k, v) for k, v in self.start["headers"] if k.lower() != b"content-length"]
+            headers.append((b"content-encoding", self.encoding.encode()))
+            await self.send({**self.start, "headers": headers})
+
+        await self.send({
+            "type": "http.response.body",
+            "body": self.encoder.encode(body, final=not more_body),
+            "more_body": more_body
+        })
+
+
+class CompressionMiddleware:
+    """gzip/brotli untuk response teks, termasuk StreamingResponse (per chunk)"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+
+        accept = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+
+class StaticPage:
+    """
+    Response statis yang di-compress sekali (prepare() di startup) dengan level
+    maksimal. ETag beda per encoding (strong ETag per representasi).
+    """
+
+    def __init__(self, body, media_type: str):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.media_type = media_type
+        self.variants = None
+
+    def prepare(self):
+        digest = hashlib.sha256(self.body).hexdigest()[:20]
+        variants = {None: (self.body, f'"{digest}"')}
+        if len(self.body) >= COMPRESSION_MIN_SIZE:
+            variants["gzip"] = (compress(self.body, "gzip", best=True), f'"{digest}-gzip"')
+            if brotli is not None:
+                variants["br"] = (compress(self.body, "br", best=True), f'"{digest}-br"')
+        self.variants = variants
+
+    def response(self, request) -> Response:
+        if self.variants is None:
+            self.prepare()
+
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding not in self.variants:
+            encoding = None
+        body, etag = self.variants[encoding]
+
+        headers = {"ETag": etag, "Cache-Control": STATIC_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")) or if_none_match == "*":
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=self.media_type, headers=headers)
@@ -0,0 +1,13 @@
+"""
+Load .env sekali, sebelum module lain baca setting
+
+Setting dibaca di level module (os.getenv saat import: SQLITE_PROFILE,
+GROUP_COMMIT, SLOW_QUERY_MS, ...), jadi .env harus sudah di-load sebelum module
+itu di-import. Module ini di-import paling awal oleh entrypoint (app/main.py,
+python -m app.jobs / app.invoicing / app.revenue / app.shards) dan oleh
+app/database.py (script yang langsung import database). Variable yang sudah
+ada di environment tidak di-override.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -0,0 +1,354 @@
+"""
+Customer per merchant: dedup data customer invoice + saldo per customer
+
+HOW IT WORKS:
+1. CreateInvoice.customer tetap disimpan utuh di payload (kompatibel), plus
+   invoices.customer_id → customers (unik per merchant_id, key). key = customer_key():
+   email (lowercase) → tax_id / NPWP (digit saja) → nama (NFKC, casefold, spasi
+   dirapikan). Customer tanpa email, tax id & nama → customer_id NULL
+2. Create invoice (transaksi yang sama, sebelum invoice di-insert):
+   - cache LRU per process (merchant_id, key) → (customer_id, data),
+     CUSTOMER_CACHE_SIZE entri. Hit → satu UPDATE by primary key (saldo, plus
+     name/email/data kalau dict customer-nya berubah)
+   - miss → INSERT ... ON CONFLICT (merchant_id, key) DO UPDATE ... RETURNING id
+   Cache baru diisi sesudah commit (rollback → customer baru tidak pernah di-cache).
+   UPDATE hit yang tidak kena baris (database di-reset) → fallback ke upsert
+3. Saldo di-update increment saat create & perubahan status (PATCH, rekonsiliasi
+   pembayaran): invoice_count (semua status), lifetime_total (selain void),
+   outstanding_total (issued). Nominal dijumlah apa adanya, tanpa konversi currency
+4. GET /v1/customers/{id}/invoices: index (customer_id, created_at, id), keyset
+   pagination seperti GET /v1/invoices?cursor=
+5. Invoice lama (customer_id NULL): job "customers.backfill"
+   (POST /admin/customers/backfill), per shard, batch urut id, satu transaksi
+   pendek per batch (customer + invoices.customer_id bersamaan, aman diulang)
+"""
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, bindparam, event, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, defer
+
+from . import jobs, shards
+from .db_models import Customer, Invoice, gen_id
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "10000"))
+CUSTOMER_BACKFILL_BATCH = int(os.getenv("CUSTOMER_BACKFILL_BATCH", "500"))
+CUSTOMER_BACKFILL_PAUSE_MS = int(os.getenv("CUSTOMER_BACKFILL_PAUSE_MS", "50"))
+
+_TEXT_MAX = 255  # key, name, email: String(255)
+
+
+# ==================== KEY ====================
+
+def _normalize(value) -> str:
+    return " ".join(unicodedata.normalize("NFKC", str(value or "")).casefold().split())
+
+
+def customer_key(customer) -> str:
+    """Lookup key ter-normalisasi untuk dict customer invoice (None = tidak bisa dikenali)"""
+    if not isinstance(customer, dict):
+        return None
+    email = _normalize(customer.get("email")).replace(" ", "")
+    tax_id = "".join(ch for ch in str(customer.get("tax_id") or customer.get("npwp") or "") if ch.isdigit())
+    name = _normalize(customer.get("name"))
+    if email:
+        key = f"email:{email}"
+    elif tax_id:
+        key = f"tax:{tax_id}"
+    elif name:
+        key = f"name:{name}"
+    else:
+        return None
+    return key[:_TEXT_MAX]
+
+
+def _details(data: dict) -> dict:
+    """Kolom customer dari dict customer invoice terbaru"""
+    name = str(data.get("name") or "").strip()
+    email = str(data.get("email") or "").strip()
+    return {"name": name[:_TEXT_MAX] or None, "email": email[:_TEXT_MAX] or None, "data": data}
+
+
+def _balance(status: str, grand_total: int):
+    """(lifetime, outstanding) satu invoice pada status ini"""
+    return (0 if status == "void" else grand_total, grand_total if status == "issued" else 0)
+
+
+# ==================== CACHE ====================
+
+class CustomerCache:
+    """LRU (merchant_id, key) → (customer_id, data), dipakai bareng semua thread process ini"""
+
+    def __init__(self, size: int = CUSTOMER_CACHE_SIZE):
+        self.size = size
+        self.hits = self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, merchant_id: str, key: str):
+        with self._lock:
+            item = self._items.get((merchant_id, key))
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end((merchant_id, key))
+            self.hits += 1
+            return item
+
+    def put(self, merchant_id: str, key: str, customer_id: str, data: dict):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[(merchant_id, key)] = (customer_id, data)
+            self._items.move_to_end((merchant_id, key))
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def discard(self, merchant_id: str, key: str):
+        with self._lock:
+            self._items.pop((merchant_id, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+
+cache = CustomerCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed(session):
+    for (merchant_id, key), (customer_id, data) in session.info.pop("customers_pending", {}).items():
+        cache.put(merchant_id, key, customer_id, data)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop("customers_pending", None)
+
+
+# ==================== WRITE (di transaksi invoice) ====================
+
+_SUMS = ("invoice_count", "lifetime_total", "outstanding_total")
+
+
+def _upsert(db, dialect: str, row: dict) -> str:
+    """Insert customer baru, atau tambah saldo + data terbaru kalau key sudah ada. Returns id"""
+    table = Customer.__table__
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(table).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["merchant_id", "key"],
+            set_={
+                **{name: stmt.excluded[name] for name in ("name", "email", "data", "updated_at")},
+                **{name: table.c[name] + stmt.excluded[name] for name in _SUMS}
+            }
+        )
+        return db.execute(stmt.returning(table.c.id)).scalar_one()
+    # Database lain: SELECT dulu, INSERT kalau belum ada
+    customer_id = db.execute(
+        select(table.c.id).where(table.c.merchant_id == row["merchant_id"], table.c.key == row["key"])
+    ).scalar()
+    if customer_id is None:
+        db.execute(insert(table).values(row))
+        return row["id"]
+    db.execute(
+        update(table).where(table.c.id == customer_id)
+        .values({**_details(row["data"]), **{name: table.c[name] + row[name] for name in _SUMS}})
+    )
+    return customer_id
+
+
+def assign(db, merchant_id: str, data, grand_total: int, status: str = "issued") -> str:
+    """
+    Customer untuk invoice baru di session `db` (di-commit oleh caller, bersama
+    invoice-nya): upsert + saldo. Returns customer_id (None kalau tidak dikenali).
+    Dipanggil sebelum invoice di-add ke session.
+    """
+    key = customer_key(data)
+    if key is None:
+        return None
+    lifetime, outstanding = _balance(status, grand_total or 0)
+    pending = db.info.setdefault("customers_pending", {})
+    known = pending.get((merchant_id, key)) or cache.get(merchant_id, key)
+
+    customer_id = None
+    if known is not None:
+        table = Customer.__table__
+        values = {
+            "invoice_count": table.c.invoice_count + 1,
+            "lifetime_total": table.c.lifetime_total + lifetime,
+            "outstanding_total": table.c.outstanding_total + outstanding
+        }
+        if known[1] != data:
+            values.update(_details(data))
+        if db.execute(update(table).where(table.c.id == known[0]).values(values)).rowcount:
+            customer_id = known[0]
+        else:
+            cache.discard(merchant_id, key)
+    if customer_id is None:
+        now = datetime.utcnow()
+        customer_id = _upsert(db, db.get_bind(Customer).dialect.name, {
+            "id": gen_id("cus"), "merchant_id": merchant_id, "key": key, **_details(data),
+            "invoice_count": 1, "lifetime_total": lifetime, "outstanding_total": outstanding,
+            "created_at": now, "updated_at": now
+        })
+    pending[(merchant_id, key)] = (customer_id, data)
+    return customer_id
+
+
+def record_status(db, invoices, old_status: str, new_status: str):
+    """
+    Status invoice berubah old_status → new_status (satu atau banyak invoice):
+    saldo customer-nya disesuaikan, satu UPDATE (executemany) untuk semua customer.
+    Invoice tanpa customer_id dilewati.
+    """
+    if old_status == new_status:
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    for invoice in invoices:
+        if not invoice.customer_id:
+            continue
+        old = _balance(old_status, invoice.grand_total or 0)
+        new = _balance(new_status, invoice.grand_total or 0)
+        delta = deltas[invoice.customer_id]
+        delta[0] += new[0] - old[0]
+        delta[1] += new[1] - old[1]
+    params = [
+        {"customer_id": customer_id, "lifetime_delta": lifetime, "outstanding_delta": outstanding}
+        for customer_id, (lifetime, outstanding) in deltas.items() if lifetime or outstanding
+    ]
+    if not params:
+        return
+    table = Customer.__table__
+    db.execute(
+        update(table).where(table.c.id == bindparam("customer_id")).values(
+            lifetime_total=table.c.lifetime_total + bindparam("lifetime_delta"),
+            outstanding_total=table.c.outstanding_total + bindparam("outstanding_delta")
+        ),
+        params
+    )
+
+
+# ==================== READ ====================
+
+def customer_dict(customer) -> dict:
+    return {
+        "id": customer.id,
+        "name": customer.name,
+        "email": customer.email,
+        "invoice_count": customer.invoice_count,
+        "lifetime_total": customer.lifetime_total,
+        "outstanding_total": customer.outstanding_total,
+        "created_at": customer.created_at.isoformat(),
+        "updated_at": customer.updated_at.isoformat()
+    }
+
+
+def get_customer(db, merchant_id: str, customer_id: str):
+    return db.query(Customer).filter(
+        Customer.id == customer_id,
+        Customer.merchant_id == merchant_id  # ✅ Security check!
+    ).first()
+
+
+def list_invoices(db, customer, limit: int, cursor: str = None) -> list:
+    """
+    Invoice customer urut (created_at, id) DESC lewat ix_invoices_customer_created.
+    `cursor` = id invoice terakhir halaman sebelumnya; 400 kalau bukan invoice customer ini.
+    """
+    query = db.query(Invoice).options(defer(Invoice.breakdown)).filter(
+        Invoice.customer_id == customer.id,
+        Invoice.merchant_id == customer.merchant_id
+    )
+    if cursor:
+        last = db.query(Invoice.created_at, Invoice.id).filter(
+            Invoice.id == cursor,
+            Invoice.customer_id == customer.id
+        ).first()
+        if not last:
+            raise HTTPException(400, "Invalid cursor")
+        query = query.filter(or_(
+            Invoice.created_at < last.created_at,
+            and_(Invoice.created_at == last.created_at, Invoice.id < last.id)
+        ))
+    return query.order_by(Invoice.created_at.desc(), Invoice.id.desc()).limit(limit).all()
+
+
+# ==================== BACKFILL ====================
+
+@jobs.handler("customers.backfill", max_attempts=10)
+def backfill_customers(payload: dict):
+    """
+    Isi invoices.customer_id (+ saldo customer) untuk invoice lama, online & aman
+    diulang: batch urut id, satu transaksi pendek per batch, jeda
+    CUSTOMER_BACKFILL_PAUSE_MS di antaranya. Hanya invoice yang customer_id-nya NULL.
+    """
+    batch = payload.get("batch", CUSTOMER_BACKFILL_BATCH)
+    pause = payload.get("pause_ms", CUSTOMER_BACKFILL_PAUSE_MS) / 1000
+    linked = created = 0
+    for shard_id in shards.ids():
+        shard_linked, shard_created = _backfill_shard(shard_id, batch, pause)
+        linked += shard_linked
+        created += shard_created
+    logger.info("Customer backfill: %d invoices linked, %d customers touched", linked, created)
+
+
+def _backfill_shard(shard_id, batch: int, pause: float):
+    """Returns (jumlah invoice yang di-link, jumlah customer yang di-upsert) di satu shard"""
+    link = update(Invoice.__table__).where(Invoice.id == bindparam("invoice_id")).values(
+        customer_id=bindparam("new_customer_id")
+    )
+    linked = touched = 0
+    after = ""
+    while True:
+        with shards.writer(shard_id).begin() as conn:
+            # FOR UPDATE (PostgreSQL): status tidak berubah di tengah batch
+            rows = conn.execute(
+                select(Invoice.id, Invoice.merchant_id, Invoice.status, Invoice.grand_total,
+                       Invoice.payload["customer"].label("customer"))
+                .where(Invoice.id > after, Invoice.customer_id.is_(None))
+                .order_by(Invoice.id)
+                .limit(batch)
+                .with_for_update()
+            ).all()
+            if not rows:
+                break
+            groups = {}
+            for row in rows:
+                key = customer_key(row.customer)
+                if key is None:
+                    continue
+                group = groups.setdefault((row.merchant_id, key), {"data": row.customer, "ids": [], "sums": [0, 0, 0]})
+                lifetime, outstanding = _balance(row.status or "issued", row.grand_total or 0)
+                group["ids"].append(row.id)
+                group["data"] = row.customer
+                for i, value in enumerate((1, lifetime, outstanding)):
+                    group["sums"][i] += value
+            now = datetime.utcnow()
+            params = []
+            for (merchant_id, key), group in groups.items():
+                customer_id = _upsert(conn, conn.dialect.name, {
+                    "id": gen_id("cus"), "merchant_id": merchant_id, "key": key, **_details(group["data"]),
+                    **dict(zip(_SUMS, group["sums"])), "created_at": now, "updated_at": now
+                })
+                params.extend({"invoice_id": inv_id, "new_customer_id": customer_id} for inv_id in group["ids"])
+            if params:
+                conn.execute(link, params)
+        linked += len(params)
+        touched += len(groups)
+        after = rows[-1].id
+        if len(rows) < batch:
+            break
+        time.sleep(pause)
+    return linked, touched
@@ -1,37 +1,273 @@
 """
 Database configuration and session management
+
+Engine TIDAK dibuat saat import. init_engines() dipanggil sekali di lifespan
+app (lihat create_app di app/main.py) atau oleh script/benchmark; sesudah itu
+SessionLocal / ReadSessionLocal sudah ter-bind ke engine.
 """
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import os
-from dotenv import load_dotenv
+import sqlite3
+import time
+
+from . import config  # noqa: F401  (load .env sebelum setting di bawah dibaca)
+from . import metrics, tracing
+
+# SQLite profile: "production" (WAL + pragmas + reader/writer pools) atau "default" (setting lama)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))        # 64 MB per connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256 MB
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
+
+
+def _apply_sqlite_pragmas(dbapi_conn, readonly: bool):
+    """Connect-time pragmas (per connection, kecuali journal_mode yang persistent di file)"""
+    cursor = dbapi_conn.cursor()
+    if not readonly:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if readonly:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
 
-load_dotenv()
+def build_engines(url: str, sqlite_profile: str = SQLITE_PROFILE):
+    """
+    Build (writer_engine, reader_engine) untuk satu database URL.
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./invoice.db")
+    - PostgreSQL/lainnya: satu engine untuk read & write
+    - SQLite "production": WAL mode, 1 writer connection (mutations di-serialize
+      di pool, bukan rebutan lock di file) + pool read-only connections untuk GET
+    - SQLite "default" / in-memory: setting lama, satu engine
+    """
+    # SQLite doesn't support pool_pre_ping
+    if not url.startswith("sqlite"):
+        engine = create_engine(
+            url,
+            pool_pre_ping=True,
+            pool_size=5,
+            max_overflow=10
+        )
+        return engine, engine
 
-# SQLite doesn't support pool_pre_ping
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False}
+    path = make_url(url).database
+    if sqlite_profile != "production" or not path or path == ":memory:" or path.startswith("file:"):
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False}
+        )
+        return engine, engine
+
+    writer = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=1,
+        max_overflow=0
     )
-else:
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,
-        pool_size=5,
-        max_overflow=10
+    event.listen(writer, "connect", lambda conn, record: _apply_sqlite_pragmas(conn, readonly=False))
+
+    # Pastikan file ada & sudah WAL sebelum reader (read-only) dibuka
+    with writer.connect():
+        pass
+
+    ro_uri = f"file:{os.path.abspath(path)}?mode=ro"
+    reader = create_engine(
+        url,
+        creator=lambda: sqlite3.connect(
+            ro_uri, uri=True, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000
+        ),
+        pool_size=SQLITE_READ_POOL_SIZE,
+        max_overflow=SQLITE_READ_POOL_SIZE
     )
+    event.listen(reader, "connect", lambda conn, record: _apply_sqlite_pragmas(conn, readonly=True))
+
+    return writer, reader
+
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = None
+read_engine = None
+
+# expire_on_commit=False: session hidup 1 request, jadi object tidak perlu
+# di-reload (query + checkout ulang) setelah handler commit
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+# info["readonly"]: routing shard (app/shards.py) pakai reader engine shard juga
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, info={"readonly": True})
 Base = declarative_base()
 
+
+def init_engines(url: str = None):
+    """
+    Build engine writer/reader dan bind SessionLocal / ReadSessionLocal.
+    Tidak connect ke database (kecuali SQLite production profile yang perlu
+    membuka file sekali untuk WAL). Dipanggil ulang → engine yang sudah ada.
+
+    Returns:
+        (engine, read_engine)
+    """
+    global engine, read_engine
+
+    if engine is not None:
+        return engine, read_engine
+
+    url = url or os.getenv("DATABASE_URL", "sqlite:///./invoice.db")
+    engine, read_engine = build_engines(url)
+    metrics.instrument_engine(engine, "writer")
+    if read_engine is not engine:
+        metrics.instrument_engine(read_engine, "reader")
+
+    SessionLocal.configure(bind=engine)
+    ReadSessionLocal.configure(bind=read_engine)
+    return engine, read_engine
+
+
+def dispose_engines():
+    """Tutup semua pooled connection (shutdown app)"""
+    global engine, read_engine
+
+    for e in {engine, read_engine} - {None}:
+        e.dispose()
+    engine = read_engine = None
+
+
+def prewarm_pools(connections: int):
+    """
+    Buka `connections` connection per pool di awal (maks. ukuran pool), supaya
+    request pertama tidak bayar connect + pragmas.
+    """
+    for e in {engine, read_engine}:
+        size = e.pool.size() if isinstance(e.pool, QueuePool) else 1
+        held = [e.connect() for _ in range(min(connections, size))]
+        for conn in held:
+            conn.close()
+
+
+def ensure_columns(bind=None, tables=None):
+    """
+    Tambah kolom baru (nullable) yang belum ada di tabel existing.
+    Sama seperti index, create_all() tidak menyentuh tabel yang sudah ada.
+    Default: engine utama, semua tabel (shard: bind & tables sendiri).
+    """
+    bind = bind or engine
+    existing_tables = inspect(bind).get_table_names()
+    for table in tables or Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspect(bind).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"Column {table.name}.{column.name} is NOT NULL, needs a real migration")
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as conn:
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+
+
+# Index lama yang sudah diganti (dibuang sesudah penggantinya dibuat)
+REPLACED_INDEXES = {
+    "invoices": ("ix_invoices_merchant_number",),  # → ux_invoices_merchant_number (unique)
+}
+
+# Cara memperbaiki baris dobel kalau index unik gagal dibuat
+INDEX_REPAIR = {
+    "ux_invoices_merchant_number": "run `python -m app.invoicing renumber-duplicates` first",
+}
+
+
+def ensure_indexes(bind=None, tables=None):
+    """
+    Create index yang belum ada di tabel existing, lalu drop index di REPLACED_INDEXES.
+    create_all() hanya bikin index untuk tabel baru, jadi database lama perlu ini.
+    """
+    bind = bind or engine
+    for table in tables or Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=bind, checkfirst=True)
+            except IntegrityError as e:
+                repair = INDEX_REPAIR.get(index.name, "fix them first")
+                raise RuntimeError(
+                    f"Cannot create unique index {index.name}: {table.name} has duplicate rows, {repair}"
+                ) from e
+        obsolete = REPLACED_INDEXES.get(table.name, ())
+        if obsolete and table.name in inspect(bind).get_table_names():
+            existing = {index["name"] for index in inspect(bind).get_indexes(table.name)}
+            for name in obsolete:
+                if name in existing:
+                    with bind.begin() as conn:
+                        conn.exec_driver_sql(f"DROP INDEX {name}")
+
+
+def _pinned_session(bind_engine, factory):
+    """
+    Session yang di-pin ke satu connection selama request.
+
+    Dependency sync jalan di threadpool, jadi nunggu pool (writer cuma 1
+    connection) terjadi di thread, bukan di event loop. Handler async lalu
+    pakai connection yang sudah di-checkout; commit tidak melepas connection,
+    jadi handler tidak pernah checkout ulang di event loop (yang bisa deadlock:
+    loop ke-block nunggu connection yang baru lepas setelah loop jalan lagi).
+    """
+    with bind_engine.connect() as conn:
+        db = factory(bind=conn)
+        try:
+            yield db
+        finally:
+            db.close()
+
+
 def get_db():
     """Dependency untuk FastAPI"""
-    db = SessionLocal()
+    yield from _pinned_session(engine, SessionLocal)
+
+
+def get_read_db():
+    """Dependency untuk GET handlers (read-only pool di SQLite production profile)"""
+    yield from _pinned_session(read_engine, ReadSessionLocal)
+
+
+# POST yang hanya membaca (daftar key terlalu panjang untuk query string)
+READ_ONLY_POSTS = ("/v1/invoices:batchGet",)
+
+
+def get_request_db(request: Request):
+    """
+    Unit of work per request: satu session (= satu pooled connection) yang
+    dipakai bareng oleh auth (get_current_merchant) dan handler.
+
+    - GET/HEAD (dan POST read-only di READ_ONLY_POSTS) → read pool, method lain → writer
+    - Handler sukses → commit; error → rollback
+    """
+    is_read = request.method in ("GET", "HEAD") or request.url.path in READ_ONLY_POSTS
+    factory = ReadSessionLocal if is_read else SessionLocal
+    db = factory()
     try:
+        # Checkout connection di awal supaya waktu tunggu pool tercatat
+        start = time.perf_counter()
+        with tracing.span("db_checkout"):
+            db.connection()
+        # Sinyal antrean pool untuk admission controller (app/admission.py)
+        request.state.db_wait = time.perf_counter() - start
+        metrics.DB_POOL_WAIT.observe(
+            request.state.db_wait,
+            "reader" if is_read and read_engine is not engine else "writer"
+        )
         yield db
+        with tracing.span("uow_commit"):
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
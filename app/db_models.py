@@ -1,16 +1,68 @@
 """
 SQLAlchemy models - sesuai dengan struktur existing
 """
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Text, Boolean, JSON
+from sqlalchemy import Column, String, Integer, BigInteger, Float, Date, DateTime, ForeignKey, Text, Boolean, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
-import uuid
+import os
+import threading
+import time
 import hashlib
 
 
+# ==================== ID GENERATOR ====================
+
+# Crockford base32 (lowercase) - urutan ASCII sama dengan urutan angka,
+# jadi ID bisa di-sort sebagai string biasa
+_ID_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+_id_lock = threading.Lock()
+_id_last_ms = 0
+_id_last_rand = 0
+
+
 def gen_id(prefix: str):
-    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+    """
+    Generate time-ordered ID (ULID-style), contoh: inv_01jab3k9x0m2c4v6b8n0q2s4t6
+
+    Format: 48-bit timestamp (ms) + 80-bit random, di-encode 26 karakter base32.
+    - Sortable: ID baru selalu > ID lama (insert ke index jadi append-mostly)
+    - Monotonic dalam 1 process: ID di milidetik yang sama di-increment, bukan random ulang
+    - 80-bit random: aman dari collision (ID lama cuma 32-bit)
+
+    ID lama (prefix + 8 hex) tetap valid; kolom ID tetap String biasa.
+    """
+    global _id_last_ms, _id_last_rand
+
+    with _id_lock:
+        now_ms = int(time.time() * 1000)
+        if now_ms > _id_last_ms:
+            _id_last_ms = now_ms
+            _id_last_rand = int.from_bytes(os.urandom(10), "big")
+        else:
+            # Same millisecond (atau jam mundur): lanjutkan sequence
+            _id_last_rand += 1
+            if _id_last_rand >= 1 << 80:
+                _id_last_ms += 1
+                _id_last_rand = 0
+        value = (_id_last_ms << 80) | _id_last_rand
+
+    chars = []
+    for _ in range(26):
+        chars.append(_ID_ALPHABET[value & 31])
+        value >>= 5
+    return f"{prefix}_{''.join(reversed(chars))}"
+
+
+def id_timestamp(id_value: str):
+    """Ambil waktu pembuatan dari ID time-ordered (None untuk ID format lama)"""
+    _, _, body = id_value.partition("_")
+    if len(body) != 26 or any(c not in _ID_ALPHABET for c in body):
+        return None
+    ms = 0
+    for c in body[:10]:
+        ms = (ms << 5) | _ID_ALPHABET.index(c)
+    return datetime.utcfromtimestamp(ms / 1000)
 
 
 class Merchant(Base):
@@ -29,6 +81,12 @@ class Merchant(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    # Shard map (lihat app/shards.py): database tempat invoice, usage log &
+    # webhook merchant ini. NULL = database utama. shard_state "moving" = sedang
+    # dipindah, write ditolak sementara (503)
+    shard_id = Column(String(50), nullable=True)
+    shard_state = Column(String(20), nullable=True)
+    
     # Relations
     api_keys = relationship("APIKey", back_populates="merchant")
     invoices = relationship("Invoice", back_populates="merchant")
@@ -52,6 +110,33 @@ class APIKey(Base):
     merchant = relationship("Merchant", back_populates="api_keys")
 
 
+class Customer(Base):
+    """Customer per merchant, di-upsert saat create invoice (lihat app/customers.py)"""
+    __tablename__ = "customers"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("cus"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+
+    # Lookup key ter-normalisasi: "email:...", "tax:..." atau "name:..."
+    key = Column(String(255), nullable=False)
+    name = Column(String(255), nullable=True)
+    email = Column(String(255), nullable=True)
+    data = Column(JSON, nullable=False)  # dict customer dari invoice terakhir
+
+    # Di-update di transaksi invoice (create / perubahan status), nominal tanpa konversi currency
+    invoice_count = Column(Integer, nullable=False, default=0)    # semua status
+    lifetime_total = Column(BigInteger, nullable=False, default=0)     # grand_total selain void
+    outstanding_total = Column(BigInteger, nullable=False, default=0)  # grand_total status issued
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Target upsert (ON CONFLICT), satu customer per key per merchant
+        Index("ux_customers_merchant_key", "merchant_id", "key", unique=True),
+    )
+
+
 class Invoice(Base):
     """Invoice - simpan semua data"""
     __tablename__ = "invoices"
@@ -70,11 +155,46 @@ class Invoice(Base):
     tax_total = Column(Integer, default=0)
     grand_total = Column(Integer, default=0)
     
+    # Rincian per baris (rupiah integer) dihitung sekali saat create, lihat
+    # invoicing.calc_breakdown. NULL = invoice lama yang belum di-backfill
+    breakdown = Column(JSON(none_as_null=True), nullable=True)
+
+    # NULL = invoice lama yang belum di-backfill, atau tanpa data customer
+    customer_id = Column(String, ForeignKey("customers.id"), nullable=True)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     merchant = relationship("Merchant", back_populates="invoices")
 
+    __table_args__ = (
+        # List & keyset pagination per merchant (created_at DESC, id DESC)
+        Index("ix_invoices_merchant_created", "merchant_id", "created_at", "id"),
+        # Nomor unik per merchant: lookup per nomor (batchGet, rekonsiliasi pembayaran),
+        # dan nomor dobel (next_number_db balapan) gagal di insert, bukan diam-diam tersimpan
+        Index("ux_invoices_merchant_number", "merchant_id", "number", unique=True),
+        # Rekonsiliasi pembayaran: cari per nominal
+        Index("ix_invoices_merchant_total", "merchant_id", "grand_total"),
+        # Invoice per customer (keyset pagination created_at DESC, id DESC)
+        Index("ix_invoices_customer_created", "customer_id", "created_at", "id"),
+    )
+
+class Payment(Base):
+    """Pembayaran (mutasi bank) yang sudah dicocokkan ke invoice"""
+    __tablename__ = "payments"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("pay"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+    invoice_id = Column(String, ForeignKey("invoices.id"), nullable=False, index=True)
+
+    amount = Column(Integer, nullable=False)
+    paid_on = Column(Date, nullable=False)
+    reference = Column(String(500), nullable=True)
+    matched_by = Column(String(20), nullable=False)  # "number" | "amount"
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class UsageLog(Base):
     """Track API usage for billing and analytics"""
     __tablename__ = "usage_logs"
@@ -95,6 +215,166 @@ class UsageLog(Base):
     user_agent = Column(String(500), nullable=True)
     ip_address = Column(String(50), nullable=True)
 
+    __table_args__ = (
+        Index("ix_usage_logs_merchant_created", "merchant_id", "created_at"),
+    )
+
+
+class WebhookEndpoint(Base):
+    """Endpoint webhook milik merchant (lihat app/webhooks.py)"""
+    __tablename__ = "webhook_endpoints"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("whe"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False, index=True)
+
+    url = Column(String(2000), nullable=False)
+    secret = Column(String(100), nullable=False)  # key HMAC, harus plaintext untuk signing
+    events = Column(JSON, nullable=False)          # ["invoice.created", ...]
+    batch_size = Column(Integer, nullable=False, default=1)  # event per POST
+
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class WebhookEvent(Base):
+    """Outbox: ditulis di transaksi yang sama dengan perubahan invoice"""
+    __tablename__ = "webhook_events"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("evt"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+    type = Column(String(50), nullable=False)
+    data = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # NULL = belum di-fan-out ke webhook_deliveries
+    dispatched_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_webhook_events_dispatched", "dispatched_at", "id"),
+    )
+
+
+class WebhookDelivery(Base):
+    """Satu event ke satu endpoint: status, retry & hasil terakhir"""
+    __tablename__ = "webhook_deliveries"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("whd"))
+    endpoint_id = Column(String, ForeignKey("webhook_endpoints.id"), nullable=False)
+    event_id = Column(String, ForeignKey("webhook_events.id"), nullable=False)
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+
+    status = Column(String(20), nullable=False, default="pending")  # pending | delivered | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_status_code = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_webhook_deliveries_due", "status", "next_attempt_at"),
+        Index("ix_webhook_deliveries_endpoint", "endpoint_id", "created_at"),
+    )
+
+
+class InvoiceChange(Base):
+    """Change log per merchant (append-only), ditulis di transaksi invoice-nya (lihat app/changefeed.py)"""
+    __tablename__ = "invoice_changes"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("chg"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+    seq = Column(Integer, nullable=False)  # 1, 2, 3, ... per merchant tanpa celah = cursor feed
+    invoice_id = Column(String, nullable=False)
+    type = Column(String(50), nullable=False)  # invoice.created | invoice.updated | invoice.paid
+    data = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Unique: dua transaksi yang (salah) dapat seq sama → satu gagal, bukan feed dobel
+        Index("ix_invoice_changes_merchant_seq", "merchant_id", "seq", unique=True),
+    )
+
+
+class RevenueDaily(Base):
+    """Agregat invoice per merchant per hari (issue_date), tanpa invoice void (lihat app/revenue.py)"""
+    __tablename__ = "revenue_daily"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("rvd"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    currency = Column(String(10), nullable=False)
+
+    # BigInteger: jumlah rupiah satu bucket bisa lewat batas int32
+    invoice_count = Column(Integer, nullable=False, default=0)
+    subtotal = Column(BigInteger, nullable=False, default=0)
+    tax_total = Column(BigInteger, nullable=False, default=0)
+    grand_total = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        # Target upsert (ON CONFLICT) & range scan per merchant
+        Index("ix_revenue_daily_merchant_day", "merchant_id", "day", "currency", unique=True),
+    )
+
+
+class RevenueMonthly(Base):
+    """Agregat invoice per merchant per bulan (issue_date) per status (lihat app/revenue.py)"""
+    __tablename__ = "revenue_monthly"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("rvm"))
+    merchant_id = Column(String, ForeignKey("merchants.id"), nullable=False)
+    month = Column(Date, nullable=False)  # tanggal 1
+    status = Column(String(20), nullable=False)
+    currency = Column(String(10), nullable=False)
+
+    invoice_count = Column(Integer, nullable=False, default=0)
+    subtotal = Column(BigInteger, nullable=False, default=0)
+    tax_total = Column(BigInteger, nullable=False, default=0)
+    grand_total = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_revenue_monthly_merchant_month", "merchant_id", "month", "status", "currency", unique=True),
+    )
+
+
+class Job(Base):
+    """Background job (lihat app/jobs.py)"""
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True, default=lambda: gen_id("job"))
+    kind = Column(String(100), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+
+    # queued → running → done / failed (running + locked_until lewat = boleh di-claim ulang)
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Lease worker: token claim + visibility timeout
+    locked_by = Column(String(100), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+
+    last_error = Column(Text, nullable=True)
+    # Unik: job terjadwal (cron) tidak ter-enqueue dua kali untuk waktu yang sama
+    dedupe_key = Column(String(200), nullable=True, unique=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
+
+
+class SchedulerLease(Base):
+    """Leader lease: hanya satu worker yang menjalankan jadwal cron"""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String(100), primary_key=True)
+    holder = Column(String(100), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
 def hash_key(key: str) -> str:
     """Hash API key untuk storage"""
     return hashlib.sha256(key.encode()).hexdigest()
\ No newline at end of file
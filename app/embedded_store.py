@@ -0,0 +1,454 @@
+"""
+Embedded storage backend (STORAGE_BACKEND=embedded) - tanpa database server / SQL
+
+Untuk edge kiosk (satu process, disk lokal) dan test run yang cepat.
+Interface: app/repository.py.
+
+HOW IT WORKS:
+1. Semua row (merchants, api_keys, invoices, usage_logs) ada di memory:
+   dict per tabel (id → row) + secondary index
+   - merchant: email → merchant
+   - api key: key_hash → key, merchant → [key id]
+   - invoice: merchant → [(created_at, id)] terurut (list, keyset & offset
+     pagination pakai bisect), (merchant, nomor) → invoice, jumlah invoice
+     per (merchant, bulan) untuk nomor urut berikutnya
+   - usage log: merchant → [(created_at, id)] terurut
+2. Row tidak pernah diubah di tempat: update = row baru (copy-on-write), jadi
+   snapshot bisa ditulis di background thread tanpa menahan lock
+3. Durable lewat append-only log `log.<gen>`: satu perubahan = satu frame
+   (panjang + crc32 + pickle [(tabel, row), ...]), atomic saat replay.
+   commit() (akhir tiap request) = flush ke OS; EMBEDDED_SYNCHRONOUS=full
+   menambah fsync per commit (seperti PRAGMA synchronous SQLite)
+4. Tiap EMBEDDED_SNAPSHOT_EVERY frame: log baru dibuka, isi tabel di-snapshot
+   di background thread (tmp → fsync → rename), lalu log lama dihapus.
+   Shutdown normal juga menulis snapshot, jadi startup berikutnya cepat
+5. Startup: load snapshot + replay log sesudahnya. Frame terakhir yang
+   terpotong (crash di tengah write) dibuang dan log dipotong di situ
+6. Satu process per data dir (flock): jangan pakai `uvicorn --workers` > 1
+"""
+import bisect
+import fcntl
+import gc
+import logging
+import os
+import pickle
+import struct
+import threading
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+
+from .db_models import gen_id
+from .invoicing import check_quota, created_response, invoice_values, number_prefix
+from .repository import Repository
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDED_DATA_DIR = os.getenv("EMBEDDED_DATA_DIR", "./invoice-data")
+EMBEDDED_SYNCHRONOUS = os.getenv("EMBEDDED_SYNCHRONOUS", "normal").lower()  # normal | full
+EMBEDDED_SNAPSHOT_EVERY = int(os.getenv("EMBEDDED_SNAPSHOT_EVERY", "50000"))
+
+TABLES = ("merchants", "api_keys", "invoices", "usage_logs")
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK = 5000  # row per frame snapshot (GIL dilepas di antara chunk)
+
+_FRAME = struct.Struct("<II")  # panjang payload, crc32 payload
+
+
+def _frame(obj) -> bytes:
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return _FRAME.pack(len(data), zlib.crc32(data)) + data
+
+
+def _read_frames(data: bytes):
+    """Yield (offset akhir frame, object) untuk frame yang utuh; berhenti di frame terpotong / rusak"""
+    view = memoryview(data)
+    offset = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        start = offset + _FRAME.size
+        end = start + length
+        if end > len(data) or zlib.crc32(view[start:end]) != crc:
+            return
+        yield end, pickle.loads(view[start:end])
+        offset = end
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class EmbeddedStore(Repository):
+    """Semua data di memory + log/snapshot di `path`; satu instance per process"""
+
+    backend = "embedded"
+
+    def __init__(self, snapshot_every: int = EMBEDDED_SNAPSHOT_EVERY, synchronous: str = EMBEDDED_SYNCHRONOUS):
+        self.snapshot_every = snapshot_every
+        self.fsync_commit = synchronous == "full"
+        self.path = None
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._log = None
+        self._gen = 0
+        self._frames = 0        # frame di log sejak snapshot terakhir
+        self._unflushed = False
+        self._snapshot_thread = None
+        self._reset()
+
+    def _reset(self):
+        self.merchants = {}
+        self.api_keys = {}
+        self.invoices = {}
+        self.usage_logs = {}
+        self._merchant_by_email = {}
+        self._key_by_hash = {}
+        self._keys_by_merchant = {}
+        self._invoice_order = {}      # merchant_id → [(created_at, id)] ascending
+        self._invoice_by_number = {}  # (merchant_id, number) → invoice
+        self._number_count = {}       # (merchant_id, "INV/2025/10") → jumlah invoice
+        self._usage_order = {}        # merchant_id → [(created_at, id)] ascending
+
+    # ==================== INDEXES ====================
+
+    @staticmethod
+    def _insert_ordered(order: list, entry: tuple):
+        # ID & created_at naik terus → hampir selalu append
+        if not order or order[-1] < entry:
+            order.append(entry)
+        else:
+            bisect.insort(order, entry)
+
+    def _apply(self, table: str, row):
+        """Pasang row (baru / versi baru) di tabel + semua index-nya"""
+        rows = getattr(self, table)
+        old = rows.get(row.id)
+        rows[row.id] = row
+
+        if table == "merchants":
+            if old is not None and old.email != row.email:
+                self._merchant_by_email.pop(old.email, None)
+            self._merchant_by_email[row.email] = row
+        elif table == "api_keys":
+            if old is None:
+                self._keys_by_merchant.setdefault(row.merchant_id, []).append(row.id)
+            self._key_by_hash[row.key_hash] = row
+        elif table == "invoices":
+            self._invoice_by_number[(row.merchant_id, row.number)] = row
+            if old is None:
+                self._insert_ordered(self._invoice_order.setdefault(row.merchant_id, []), (row.created_at, row.id))
+                month = (row.merchant_id, row.number.rpartition("/")[0])
+                self._number_count[month] = self._number_count.get(month, 0) + 1
+        elif table == "usage_logs":
+            if old is None:
+                self._insert_ordered(self._usage_order.setdefault(row.merchant_id, []), (row.created_at, row.id))
+
+    def _write(self, changes: list):
+        """Apply [(tabel, row), ...] ke memory + satu frame di log (dipanggil dengan lock)"""
+        for table, row in changes:
+            self._apply(table, row)
+        self._log.write(_frame([(table, vars(row)) for table, row in changes]))
+        self._frames += 1
+        self._unflushed = True
+
+    @staticmethod
+    def _replace(row, **fields):
+        return SimpleNamespace(**{**vars(row), **fields})
+
+    # ==================== OPEN / REPLAY ====================
+
+    def _log_path(self, gen: int):
+        return os.path.join(self.path, f"log.{gen:08d}")
+
+    def _log_gens(self):
+        return sorted(int(name[4:]) for name in os.listdir(self.path) if name.startswith("log.") and name[4:].isdigit())
+
+    def open(self, path: str):
+        """Load snapshot + replay log; sesudah ini store siap dipakai"""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock_file = open(os.path.join(path, "LOCK"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"Embedded data dir '{path}' is used by another process")
+
+        # Replay bikin jutaan object yang tetap hidup: GC di tengahnya cuma buang waktu (~2x lebih lambat)
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._replay()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        self._log = open(self._log_path(self._gen), "ab")
+        logger.info(
+            "Embedded store %s: %d merchants, %d invoices (%d log frames replayed)",
+            path, len(self.merchants), len(self.invoices), self._frames
+        )
+        return self
+
+    def _replay(self):
+        self._reset()
+        path = self.path
+        start_gen = 0
+        snapshot = os.path.join(path, "snapshot")
+        if os.path.exists(snapshot):
+            with open(snapshot, "rb") as f:
+                data = f.read()
+            frames = _read_frames(data)
+            end, header = next(frames, (0, None))
+            if not header or header.get("version") != SNAPSHOT_VERSION:
+                raise RuntimeError(f"Unreadable embedded snapshot: {snapshot}")
+            start_gen = header["log_gen"]
+            for end, changes in frames:
+                for table, row in changes:
+                    self._apply(table, SimpleNamespace(**row))
+            if end != len(data):
+                raise RuntimeError(f"Corrupt embedded snapshot: {snapshot}")
+
+        gens = [gen for gen in self._log_gens() if gen >= start_gen]
+        for gen in gens:
+            log_path = self._log_path(gen)
+            with open(log_path, "rb") as f:
+                data = f.read()
+            good = 0
+            for good, changes in _read_frames(data):
+                for table, row in changes:
+                    self._apply(table, SimpleNamespace(**row))
+                self._frames += 1
+            if good != len(data):
+                logger.warning("Embedded log %s: dropping %d bytes after last complete frame", log_path, len(data) - good)
+                with open(log_path, "r+b") as f:
+                    f.truncate(good)
+
+        for gen in self._log_gens():
+            if gen < start_gen:
+                os.remove(self._log_path(gen))  # sisa snapshot yang selesai tepat sebelum crash
+
+        self._gen = gens[-1] if gens else start_gen
+
+    def close(self):
+        """Tunggu snapshot yang jalan, snapshot terakhir (kalau ada log), tutup log & lock"""
+        if self._log is None:
+            return
+        if self._snapshot_thread:
+            self._snapshot_thread.join()
+        with self._lock:
+            if self._frames:
+                gen, tables = self._rotate()
+                self._write_snapshot(gen, tables)
+            self._log.close()
+            self._log = None
+        self._lock_file.close()
+        self._lock_file = None
+
+    # ==================== COMMIT / SNAPSHOT ====================
+
+    def commit(self):
+        with self._lock:
+            if not self._unflushed or self._log is None:
+                return
+            self._log.flush()
+            if self.fsync_commit:
+                os.fsync(self._log.fileno())
+            self._unflushed = False
+            if self._frames >= self.snapshot_every and not (
+                self._snapshot_thread and self._snapshot_thread.is_alive()
+            ):
+                self._snapshot_thread = threading.Thread(
+                    target=self._write_snapshot, args=self._rotate(), name="embedded-snapshot", daemon=True
+                )
+                self._snapshot_thread.start()
+
+    def _rotate(self):
+        """Tutup log sekarang, buka log.<gen+1>; returns (gen, isi tabel saat ini) untuk snapshot"""
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log.close()
+        self._gen += 1
+        self._log = open(self._log_path(self._gen), "ab")
+        self._frames = 0
+        # Row immutable: cukup copy list referensi, pickle-nya di luar lock
+        return self._gen, {table: list(getattr(self, table).values()) for table in TABLES}
+
+    def _write_snapshot(self, gen: int, tables: dict):
+        snapshot = os.path.join(self.path, "snapshot")
+        tmp = snapshot + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_frame({"version": SNAPSHOT_VERSION, "log_gen": gen, "created_at": datetime.utcnow()}))
+            for table, rows in tables.items():
+                for i in range(0, len(rows), SNAPSHOT_CHUNK):
+                    f.write(_frame([(table, vars(row)) for row in rows[i:i + SNAPSHOT_CHUNK]]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, snapshot)
+        _fsync_dir(self.path)
+        for old in self._log_gens():
+            if old < gen:
+                os.remove(self._log_path(old))
+
+    def ping(self):
+        return "embedded"
+
+    # ==================== MERCHANTS ====================
+
+    def get_merchant(self, merchant_id):
+        return self.merchants.get(merchant_id)
+
+    def get_merchant_by_email(self, email):
+        return self._merchant_by_email.get(email)
+
+    def get_active_merchant(self, merchant_id):
+        merchant = self.merchants.get(merchant_id)
+        return merchant if merchant is not None and merchant.is_active else None
+
+    def create_merchant(self, key_hash, key_prefix, key_name, **fields):
+        now = datetime.utcnow()
+        merchant = SimpleNamespace(**{
+            "id": gen_id("mrc"), "plan": "free", "quota_limit": 10, "quota_used": 0, "is_active": True,
+            "created_at": now, **fields
+        })
+        api_key = self._new_key(merchant.id, key_hash, key_prefix, key_name, now)
+        with self._lock:
+            if merchant.email in self._merchant_by_email:
+                raise HTTPException(400, f"Email '{merchant.email}' is already registered")
+            self._write([("merchants", merchant), ("api_keys", api_key)])
+        return merchant, api_key
+
+    def update_merchant(self, merchant, **fields):
+        with self._lock:
+            merchant = self._replace(self.merchants[merchant.id], **fields)
+            self._write([("merchants", merchant)])
+        return merchant
+
+    def reset_quotas(self):
+        with self._lock:
+            active = [m for m in self.merchants.values() if m.is_active]
+            changes = [("merchants", self._replace(m, quota_used=0)) for m in active if m.quota_used > 0]
+            if changes:
+                self._write(changes)
+        return len(active), len(changes)
+
+    # ==================== API KEYS ====================
+
+    @staticmethod
+    def _new_key(merchant_id, key_hash, key_prefix, name, now):
+        return SimpleNamespace(
+            id=gen_id("key"), merchant_id=merchant_id, key_hash=key_hash, key_prefix=key_prefix, name=name,
+            is_active=True, last_used=None, created_at=now
+        )
+
+    def find_active_key(self, key_hash):
+        api_key = self._key_by_hash.get(key_hash)
+        return api_key if api_key is not None and api_key.is_active else None
+
+    def touch_api_key(self, key_id, now):
+        with self._lock:
+            self._write([("api_keys", self._replace(self.api_keys[key_id], last_used=now))])
+
+    def list_api_keys(self, merchant_id):
+        keys = [self.api_keys[key_id] for key_id in self._keys_by_merchant.get(merchant_id, ())]
+        return sorted(keys, key=lambda key: key.created_at, reverse=True)
+
+    def get_api_key(self, merchant_id, key_id):
+        api_key = self.api_keys.get(key_id)
+        return api_key if api_key is not None and api_key.merchant_id == merchant_id else None
+
+    def create_api_key(self, merchant_id, key_hash, key_prefix, name):
+        api_key = self._new_key(merchant_id, key_hash, key_prefix, name, datetime.utcnow())
+        with self._lock:
+            self._write([("api_keys", api_key)])
+        return api_key
+
+    def revoke_api_key(self, api_key):
+        with self._lock:
+            api_key = self._replace(self.api_keys[api_key.id], is_active=False)
+            self._write([("api_keys", api_key)])
+        return api_key
+
+    # ==================== INVOICES ====================
+
+    def create_invoice(self, merchant, payload):
+        values = invoice_values(payload)
+        prefix = number_prefix()
+        with self._lock:
+            merchant = self.merchants[merchant.id]  # quota terbaru
+            check_quota(merchant)
+            now = datetime.utcnow()
+            seq = self._number_count.get((merchant.id, prefix), 0) + 1
+            invoice = SimpleNamespace(
+                id=gen_id("inv"), merchant_id=merchant.id, number=f"{prefix}/{seq:04d}", status="issued",
+                created_at=now, updated_at=now, **values
+            )
+            merchant = self._replace(merchant, quota_used=merchant.quota_used + 1)
+            self._write([("invoices", invoice), ("merchants", merchant)])
+        return created_response(invoice, merchant)
+
+    def get_invoice(self, merchant_id, inv_id):
+        invoice = self.invoices.get(inv_id)
+        return invoice if invoice is not None and invoice.merchant_id == merchant_id else None
+
+    def get_invoice_by_number(self, merchant_id, number):
+        return self._invoice_by_number.get((merchant_id, number))
+
+    def get_invoices(self, merchant_id, keys, by="id", columns=None):
+        get = self.get_invoice if by == "id" else self.get_invoice_by_number
+        found = {}
+        for key in keys:
+            invoice = get(merchant_id, key)
+            if invoice is not None:
+                found[key] = invoice
+        return found
+
+    def list_invoices(self, merchant_id, limit, offset=0, cursor=None):
+        order = self._invoice_order.get(merchant_id, [])
+        if cursor:
+            last = self.get_invoice(merchant_id, cursor)
+            if last is None:
+                raise HTTPException(400, "Invalid cursor")
+            end = bisect.bisect_left(order, (last.created_at, last.id))
+        else:
+            end = max(len(order) - offset, 0)
+        return [self.invoices[inv_id] for _, inv_id in reversed(order[max(end - limit, 0):end])]
+
+    def count_invoices(self, merchant_id, since=None):
+        order = self._invoice_order.get(merchant_id, [])
+        if since is None:
+            return len(order)
+        return len(order) - bisect.bisect_left(order, (since,))
+
+    def update_invoice(self, merchant, invoice, changes, event_type):
+        # Backend embedded tidak punya outbox webhook: event_type tidak dipakai
+        with self._lock:
+            invoice = self._replace(self.invoices[invoice.id], updated_at=datetime.utcnow(), **changes)
+            self._write([("invoices", invoice)])
+        return invoice
+
+    # ==================== USAGE ====================
+
+    def log_usage(self, merchant_id, **fields):
+        row = SimpleNamespace(**{"id": gen_id("log"), "merchant_id": merchant_id, "created_at": datetime.utcnow(), **fields})
+        with self._lock:
+            self._write([("usage_logs", row)])
+
+    def usage_summary(self, merchant_id, since):
+        order = self._usage_order.get(merchant_id, [])
+        by_endpoint = {}
+        total_ms = timed = 0
+        for _, log_id in order[bisect.bisect_left(order, (since,)):]:
+            row = self.usage_logs[log_id]
+            by_endpoint[row.endpoint] = by_endpoint.get(row.endpoint, 0) + 1
+            if row.response_time_ms is not None:
+                total_ms += row.response_time_ms
+                timed += 1
+        return sum(by_endpoint.values()), list(by_endpoint.items()), (total_ms / timed if timed else 0)
@@ -0,0 +1,138 @@
+"""
+Group commit untuk POST /v1/invoices (opsional, GROUP_COMMIT=true)
+
+HOW IT WORKS:
+1. Handler tidak commit sendiri, tapi submit (merchant_id, payload) ke queue
+2. Satu writer task mengambil semua request yang pending (max GROUP_COMMIT_MAX_BATCH,
+   kumpulkan paling lama GROUP_COMMIT_MAX_WAIT_MS) dan memproses semuanya
+   dalam SATU transaksi → satu COMMIT (satu fsync) untuk banyak invoice
+3. Dengan DATABASE_SHARDS, batch dipecah per shard merchant: satu transaksi
+   per shard (tiap shard punya writer sendiri)
+4. Tiap request dapat hasil/error-nya sendiri:
+   - Quota habis → 429 hanya untuk request itu, batch jalan terus
+   - Error database → batch di-rollback, lalu diulang satu per satu
+     supaya error hanya kena ke request yang memang gagal
+"""
+import asyncio
+import os
+from collections import defaultdict
+
+from .db_models import Merchant
+from .invoicing import create_invoice_record
+from . import shards, sqlstats, tracing
+
+
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT", "false").lower() == "true"
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv("GROUP_COMMIT_MAX_WAIT_MS", "2"))
+
+
+class GroupCommitWriter:
+    """Queue + writer task untuk create invoice (satu per event loop / worker)"""
+
+    def __init__(self, max_batch: int = GROUP_COMMIT_MAX_BATCH, max_wait_ms: float = GROUP_COMMIT_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    def start(self):
+        """Start writer task di event loop yang sedang jalan"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._loop = None
+
+    async def submit(self, merchant_id: str, payload, shard_id: str = None):
+        """Antri-kan create invoice, tunggu sampai batch-nya di-commit"""
+        if self._loop is not asyncio.get_running_loop() or not self._task or self._task.done():
+            self.start()
+
+        future = self._loop.create_future()
+        self._queue.put_nowait((merchant_id, shard_id, payload, future))
+        return await future
+
+    async def _run(self):
+        # Task ini mewarisi context request pertama; query batch bukan milik request itu
+        sqlstats.current.set(None)
+        tracing.current.set(None)
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+
+            # Kumpulkan selama masih ada request baru yang masuk; kalau sepi
+            # (concurrency rendah) langsung commit tanpa menunggu max_wait
+            while len(batch) < self.max_batch and self._loop.time() < deadline:
+                while not self._queue.empty() and len(batch) < self.max_batch:
+                    batch.append(self._queue.get_nowait())
+                await asyncio.sleep(0)
+                if self._queue.empty():
+                    break
+
+            # Transaksi jalan di thread: checkout connection writer tidak boleh
+            # memblok event loop (request lain bisa sedang memegang connection
+            # itu sambil menunggu giliran di loop → deadlock di pool_size=1)
+            outcomes = await asyncio.to_thread(self._commit_batch, batch)
+
+            for future, outcome in outcomes:
+                if future.done():
+                    continue  # client sudah disconnect / request di-cancel
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+    def _commit_batch(self, batch):
+        """Returns list (future, result/exception) untuk tiap job di batch"""
+        by_shard = defaultdict(list)
+        for job in batch:
+            by_shard[job[1]].append(job)
+
+        outcomes = []
+        for shard_id, jobs in by_shard.items():
+            try:
+                outcomes += self._apply(shard_id, jobs)
+            except Exception:
+                # Error database di tengah batch: ulang satu per satu (isolasi error)
+                for job in jobs:
+                    try:
+                        outcomes += self._apply(shard_id, [job])
+                    except Exception as e:
+                        outcomes.append((job[3], e))
+        return outcomes
+
+    def _apply(self, shard_id, jobs):
+        """Proses jobs (merchant di shard yang sama) dalam satu transaksi. Raise kalau ada error database."""
+        db = shards.session(shard_id)
+        try:
+            outcomes = []
+            for merchant_id, _, payload, future in jobs:
+                merchant = db.get(Merchant, merchant_id)
+                try:
+                    outcomes.append((future, create_invoice_record(db, merchant, payload)))
+                except Exception as e:
+                    # Error validasi (quota) terjadi sebelum ada perubahan di session
+                    if db.new or db.dirty:
+                        raise
+                    outcomes.append((future, e))
+            db.commit()
+            return outcomes
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+writer = GroupCommitWriter()
@@ -0,0 +1,438 @@
+"""
+Invoice creation logic - dipakai oleh endpoint POST /v1/invoices
+dan oleh group-commit writer (app/group_commit.py)
+
+Perbaikan nomor invoice dobel (database lama, sebelum index unik):
+    python -m app.invoicing renumber-duplicates [--merchant ID] [--dry-run]
+"""
+from fastapi import HTTPException
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+import argparse
+import logging
+import os
+import time
+
+from . import config  # noqa: F401  (python -m app.invoicing: load .env sebelum module lain)
+from .models import CreateInvoice, Item, Charges
+from .db_models import Merchant, Invoice, gen_id
+from . import changefeed, customers, database, jobs, metrics, revenue, shards, tracing, webhooks
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== MONEY ====================
+#
+# Semua nilai uang disimpan sebagai rupiah integer. Aturan pembulatan:
+# 1. Input (float dari JSON) dibaca lewat Decimal(str(x)), bukan float aritmetika,
+#    jadi 0.1 + 0.2 tidak jadi 0.30000000000000004
+# 2. Per baris: base = qty * unit_price - discount, dibulatkan ROUND_HALF_UP ke rupiah
+# 3. Pajak exclusive: tax = round(base * rate), total baris = base + tax
+#    Pajak inclusive: net = round(base / (1 + rate)), tax = base - net, total baris = base
+#    (net + tax selalu persis = base)
+# 4. Total invoice = jumlah nilai baris yang sudah dibulatkan (tidak dibulatkan ulang),
+#    jadi baris di HTML / export selalu pas dengan subtotal & tax_total
+# 5. grand_total = subtotal + tax_total + shipping + service + rounding - discount_total
+
+BREAKDOWN_VERSION = 1
+BACKFILL_BATCH = int(os.getenv("BREAKDOWN_BACKFILL_BATCH", "500"))
+BACKFILL_PAUSE_MS = int(os.getenv("BREAKDOWN_BACKFILL_PAUSE_MS", "50"))
+
+_ONE = Decimal(1)
+
+
+def to_rupiah(value) -> int:
+    """Bulatkan ke rupiah (ROUND_HALF_UP: .5 menjauhi nol)"""
+    if isinstance(value, Decimal):
+        amount = value
+    else:
+        amount = Decimal(str(value or 0))
+    return int(amount.quantize(_ONE, rounding=ROUND_HALF_UP))
+
+
+def calc_breakdown(items: list[Item], charges: Charges, discount_total: float):
+    """
+    Rincian invoice dalam rupiah integer (disimpan di Invoice.breakdown):
+    lines[i] = {base, tax, net, total} sejajar dengan payload["items"][i],
+    plus subtotal (sebelum pajak), tax_total, charges, discount_total, grand_total.
+    """
+    lines = []
+    subtotal = tax_total = 0
+    for i in items:
+        base = to_rupiah(Decimal(str(i.qty)) * Decimal(str(i.unit_price)) - Decimal(str(i.discount)))
+        rate = Decimal(str(i.tax_rate))
+        if i.is_tax_inclusive:
+            net = to_rupiah(base / (1 + rate)) if rate > 0 else base
+            tax = base - net
+            total = base
+        else:
+            net = base
+            tax = to_rupiah(base * rate)
+            total = base + tax
+        lines.append({"base": base, "tax": tax, "net": net, "total": total})
+        subtotal += net
+        tax_total += tax
+
+    shipping, service, rounding = to_rupiah(charges.shipping), to_rupiah(charges.service), to_rupiah(charges.rounding)
+    discount = to_rupiah(discount_total)
+    return {
+        "version": BREAKDOWN_VERSION,
+        "lines": lines,
+        "subtotal": subtotal,
+        "tax_total": tax_total,
+        "shipping": shipping,
+        "service": service,
+        "rounding": rounding,
+        "discount_total": discount,
+        "grand_total": subtotal + tax_total + shipping + service + rounding - discount
+    }
+
+
+def calc_totals(items: list[Item], charges: Charges, discount_total: float):
+    """Calculate invoice totals (subset calc_breakdown)"""
+    breakdown = calc_breakdown(items, charges, discount_total)
+    return {
+        "subtotal": breakdown["subtotal"],
+        "tax_total": breakdown["tax_total"],
+        "grand_total": breakdown["grand_total"]
+    }
+
+
+def payload_breakdown(payload: dict, totals=None):
+    """
+    Hitung breakdown dari payload JSON tersimpan (invoice lama / backfill).
+
+    `totals` (row dengan subtotal/tax_total/grand_total): total tersimpan tetap
+    dipakai, karena itu jumlah yang sudah ditagihkan. Baris dihitung ulang dengan
+    aturan di atas; kalau jumlahnya beda dari total tersimpan, "legacy_totals": True.
+    """
+    breakdown = calc_breakdown(
+        [Item(**i) for i in payload.get("items", [])],
+        Charges(**(payload.get("charges") or {})),
+        payload.get("discount_total", 0)
+    )
+    if totals is not None:
+        stored = {key: getattr(totals, key) for key in ("subtotal", "tax_total", "grand_total")}
+        if any(breakdown[key] != value for key, value in stored.items()):
+            breakdown.update(stored, legacy_totals=True)
+    return breakdown
+
+
+def invoice_breakdown(invoice):
+    """Breakdown untuk render/export: yang tersimpan, atau dihitung (belum di-backfill)"""
+    return invoice.breakdown or payload_breakdown(invoice.payload or {}, invoice)
+
+
+def number_prefix(today: date = None):
+    """Prefix nomor invoice bulan ini, contoh: INV/2025/10"""
+    today = today or date.today()
+    return f"INV/{today.year}/{today.month:02d}"
+
+
+def next_number_db(merchant_id: str, db: Session):
+    """Generate invoice number per merchant (persistent)"""
+    prefix = number_prefix()
+
+    count = db.query(Invoice).filter(
+        Invoice.merchant_id == merchant_id,
+        Invoice.number.like(f"{prefix}/%")
+    ).count()
+
+    seq = count + 1
+    return f"{prefix}/{seq:04d}"
+
+
+def check_quota(merchant: Merchant):
+    """Raise 429 kalau quota bulanan merchant sudah habis"""
+    if merchant.quota_used >= merchant.quota_limit:
+        metrics.QUOTA_REJECTIONS.inc(merchant.plan)
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "Quota exceeded",
+                "message": f"Your '{merchant.plan}' plan allows {merchant.quota_limit} invoices per month",
+                "quota_used": merchant.quota_used,
+                "quota_limit": merchant.quota_limit,
+                "suggestion": "Upgrade your plan to create more invoices",
+                "upgrade_url": "/v1/merchants/me/upgrade"
+            }
+        )
+
+
+def invoice_values(payload: CreateInvoice):
+    """Kolom invoice baru dari request body: payload JSON, totals & breakdown (semua storage backend)"""
+    with tracing.span("calc_totals"):
+        breakdown = calc_breakdown(payload.items, payload.charges, payload.discount_total)
+
+    with tracing.span("payload_dump"):
+        payload_json = payload.model_dump(mode="json")
+
+    return {
+        "payload": payload_json,
+        "subtotal": breakdown["subtotal"],
+        "tax_total": breakdown["tax_total"],
+        "grand_total": breakdown["grand_total"],
+        "breakdown": breakdown
+    }
+
+
+def created_response(invoice, merchant):
+    """Response body POST /v1/invoices (merchant sesudah quota_used di-increment)"""
+    return {
+        "id": invoice.id,
+        "number": invoice.number,
+        "status": invoice.status,
+        "merchant_id": merchant.id,
+        "totals": {
+            "subtotal": invoice.subtotal,
+            "tax_total": invoice.tax_total,
+            "grand_total": invoice.grand_total
+        },
+        "quota_remaining": merchant.quota_limit - merchant.quota_used,
+        "links": {
+            "self": f"/v1/invoices/{invoice.id}",
+            "html": f"/v1/invoices/{invoice.id}/html"
+        }
+    }
+
+
+def create_invoice_record(db: Session, merchant: Merchant, payload: CreateInvoice):
+    """
+    Insert invoice + upsert customer + event webhook (outbox) + increment quota
+    di session `db` (belum di-commit).
+
+    Di-flush supaya invoice berikutnya di transaksi yang sama (group commit)
+    dapat nomor urut yang benar dari next_number_db.
+
+    Returns:
+        Response body untuk POST /v1/invoices
+    """
+    check_quota(merchant)
+
+    # Generate invoice
+    inv_id = gen_id("inv")
+    with tracing.span("next_number"):
+        # Create bersamaan untuk merchant yang sama (juga dari worker / process lain)
+        # antre di sini, jadi COUNT-nya melihat invoice yang sudah di-commit
+        # (index unik menolak nomor dobel)
+        changefeed.lock_merchant(db, merchant.id)
+        number = next_number_db(merchant.id, db)  # ✅ Per merchant!
+
+    values = invoice_values(payload)
+    with tracing.span("customer"):
+        customer_id = customers.assign(db, merchant.id, values["payload"].get("customer"), values["grand_total"])
+
+    invoice = Invoice(
+        id=inv_id,
+        merchant_id=merchant.id,  # ✅ Auto dari auth!
+        number=number,
+        status="issued",
+        customer_id=customer_id,
+        **values
+    )
+
+    db.add(invoice)
+    data = webhooks.invoice_data(invoice)
+    webhooks.emit(db, merchant, "invoice.created", data)
+    changefeed.record(db, merchant.id, "invoice.created", data)
+    revenue.record_create(db, merchant.id, invoice)
+    merchant.quota_used += 1
+    with tracing.span("insert"):
+        db.flush()
+
+    return created_response(invoice, merchant)
+
+
+# ==================== BACKFILL ====================
+
+@jobs.handler("invoices.backfill_breakdown", max_attempts=10)
+def backfill_breakdowns(payload: dict):
+    """
+    Isi Invoice.breakdown untuk invoice lama (online, aman diulang):
+    batch kecil urut id (keyset), satu transaksi pendek per batch, jeda
+    BACKFILL_PAUSE_MS di antaranya supaya writer tetap bisa melayani request.
+    Hanya baris yang masih NULL yang di-update.
+    """
+    batch = payload.get("batch", BACKFILL_BATCH)
+    pause = payload.get("pause_ms", BACKFILL_PAUSE_MS) / 1000
+    after = payload.get("after", "")
+    filled = legacy = 0
+    stmt = (
+        update(Invoice)
+        .where(Invoice.id == bindparam("invoice_id"), Invoice.breakdown.is_(None))
+        .values(breakdown=bindparam("new_breakdown"))
+    )
+
+    # Shard satu per satu: jeda antar batch tetap membatasi beban writer
+    for shard_id in shards.ids():
+        shard_filled, shard_legacy = _backfill_shard(shard_id, stmt, batch, pause, after)
+        filled += shard_filled
+        legacy += shard_legacy
+
+    logger.info("Breakdown backfill: %d invoices filled (%d keep stored legacy totals)", filled, legacy)
+
+
+def _backfill_shard(shard_id, stmt, batch, pause, after):
+    """Returns (jumlah invoice terisi, jumlah yang tetap pakai legacy totals) di satu shard"""
+    filled = legacy = 0
+    while True:
+        with shards.writer(shard_id).begin() as conn:
+            rows = conn.execute(
+                select(Invoice.id, Invoice.payload, Invoice.subtotal, Invoice.tax_total, Invoice.grand_total)
+                .where(Invoice.id > after, Invoice.breakdown.is_(None))
+                .order_by(Invoice.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                break
+            params = []
+            for row in rows:
+                breakdown = payload_breakdown(row.payload or {}, row)
+                legacy += bool(breakdown.get("legacy_totals"))
+                params.append({"invoice_id": row.id, "new_breakdown": breakdown})
+            conn.execute(stmt, params)
+        filled += len(rows)
+        after = rows[-1].id
+        if len(rows) < batch:
+            break
+        time.sleep(pause)
+    return filled, legacy
+
+
+# ==================== NOMOR DOBEL ====================
+
+def _number_seq(number: str) -> int:
+    """Nomor urut di akhir nomor invoice (INV/2025/10/0042 → 42), 0 kalau bukan angka"""
+    tail = number.rpartition("/")[2]
+    return int(tail) if tail.isdigit() else 0
+
+
+def duplicate_merchants(shard_id=None) -> list:
+    """Merchant yang punya nomor invoice dobel di satu shard"""
+    db = shards.session(shard_id, readonly=True)
+    try:
+        return sorted(set(db.scalars(
+            select(Invoice.merchant_id)
+            .group_by(Invoice.merchant_id, Invoice.number)
+            .having(func.count() > 1)
+        )))
+    finally:
+        db.close()
+
+
+def renumber_duplicates(merchant_id: str, shard_id=None, dry_run: bool = False) -> list:
+    """
+    Nomor baru untuk invoice bernomor dobel satu merchant, supaya index unik
+    ux_invoices_merchant_number bisa dibuat. Dobel tersisa di database lama:
+    next_number_db di dua worker membaca COUNT yang sama sebelum lock_merchant
+    memegang write lock SQLite.
+
+    Per nomor dobel, invoice paling awal (created_at, id) tetap memakai nomornya;
+    sisanya dapat nomor urut kosong terkecil merchant di bulan (prefix) yang sama,
+    jadi nomor 1..COUNT terisi dan next_number_db (COUNT + 1) tidak bentrok. Satu
+    transaksi di bawah lock_merchant (aman selagi server jalan); nomor baru
+    dikirim sebagai invoice.updated (webhook & change feed).
+
+    Returns [{"invoice_id", "old", "new"}]
+    """
+    db = shards.session(shard_id)
+    try:
+        changefeed.lock_merchant(db, merchant_id)
+        duplicated = (
+            select(Invoice.number)
+            .where(Invoice.merchant_id == merchant_id)
+            .group_by(Invoice.number)
+            .having(func.count() > 1)
+        )
+        invoices = db.scalars(
+            select(Invoice)
+            .where(Invoice.merchant_id == merchant_id, Invoice.number.in_(duplicated))
+            .order_by(Invoice.number, Invoice.created_at, Invoice.id)
+        ).all()
+        merchant = db.get(Merchant, merchant_id)
+
+        kept, used, changes = set(), {}, []
+        for invoice in invoices:
+            if invoice.number not in kept:
+                kept.add(invoice.number)
+                continue
+            prefix = invoice.number.rpartition("/")[0]
+            if prefix not in used:
+                used[prefix] = set(map(_number_seq, db.scalars(select(Invoice.number).where(
+                    Invoice.merchant_id == merchant_id, Invoice.number.like(f"{prefix}/%")
+                ))))
+            seq = 1
+            while seq in used[prefix]:
+                seq += 1
+            used[prefix].add(seq)
+            number = f"{prefix}/{seq:04d}"
+            changes.append({"invoice_id": invoice.id, "old": invoice.number, "new": number})
+            invoice.number = number
+            data = webhooks.invoice_data(invoice)
+            webhooks.emit(db, merchant, "invoice.updated", data)
+            changefeed.record(db, merchant_id, "invoice.updated", data)
+
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+        return changes
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main():
+    """
+    python -m app.invoicing renumber-duplicates [--merchant ID] [--dry-run]
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.invoicing", description="Invoice tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    renumber = commands.add_parser(
+        "renumber-duplicates", help="Give duplicate invoice numbers a new number (the earliest invoice keeps it)"
+    )
+    renumber.add_argument("--merchant", help="Only this merchant id")
+    renumber.add_argument("--dry-run", action="store_true", help="Print the new numbers without saving them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    engine, _ = database.init_engines()
+    database.Base.metadata.create_all(bind=engine)
+    database.ensure_columns()
+    # Tanpa ensure_indexes: index unik itulah yang gagal dibuat selama nomor masih dobel
+    shards.init_shards(indexes=False)
+    try:
+        directory = database.ReadSessionLocal()
+        try:
+            query = select(Merchant.id, Merchant.shard_id)
+            if args.merchant:
+                query = query.where(Merchant.id == args.merchant)
+            owners = {merchant_id: shard_id or shards.MAIN for merchant_id, shard_id in directory.execute(query)}
+        finally:
+            directory.close()
+
+        merchants = renumbered = 0
+        for shard_id in shards.ids():
+            for merchant_id in duplicate_merchants(shard_id):
+                if owners.get(merchant_id) != shard_id:
+                    continue  # merchant lain (--merchant), atau sisa pindah shard yang terputus
+                changes = renumber_duplicates(merchant_id, shard_id, args.dry_run)
+                for change in changes:
+                    print({"merchant_id": merchant_id, **change})
+                merchants += 1
+                renumbered += len(changes)
+        print({"merchants": merchants, "renumbered": renumbered, "dry_run": args.dry_run})
+    finally:
+        shards.dispose_shards()
+        database.dispose_engines()
+
+
+if __name__ == "__main__":
+    # Jalankan lewat module app.invoicing yang asli (engines shard), bukan salinan __main__
+    from app.invoicing import main as _main
+
+    _main()
@@ -0,0 +1,584 @@
+"""
+Background jobs: queue di tabel database (SQLite & Postgres) + worker pool async
+
+HOW IT WORKS:
+1. enqueue(db, kind, payload) menambah baris `jobs` di session caller → job ikut
+   commit/rollback bersama perubahan datanya (tidak ada job untuk data yang batal)
+2. Worker claim job secara optimistic (tanpa SELECT ... FOR UPDATE, jalan di
+   SQLite maupun Postgres):
+   - SELECT id kandidat: queued & run_at <= now, atau running & lease sudah habis
+   - UPDATE ... SET status='running', locked_by=<token unik>, locked_until=now+visibility
+     WHERE id IN (kandidat) AND <kondisi yang sama>
+   - job yang didapat = baris dengan token itu; worker lain yang kalah cepat
+     tidak dapat apa-apa (rowcount 0), tidak ada job yang dipegang dua worker
+3. Selama handler jalan, heartbeat memperpanjang lease tiap 1/3 visibility
+   timeout. Worker mati → lease habis → job di-claim ulang (at-least-once:
+   handler harus idempotent)
+4. Handler error → retry dengan exponential backoff + jitter sampai max_attempts,
+   sesudah itu status "failed" (error terakhir di last_error)
+5. Jadwal cron (5 field, UTC) hanya di-enqueue oleh leader: pemegang lease di
+   tabel scheduler_leases (diperpanjang tiap tick, diambil alih worker lain
+   kalau habis). dedupe_key unik per (jadwal, waktu) → dua leader pun tidak
+   bisa enqueue jadwal yang sama dua kali. Jadwal yang terlewat digabung jadi satu.
+6. Handler sync jalan di thread (asyncio.to_thread), handler async di event loop;
+   maksimal JOBS_CONCURRENCY job paralel per worker process
+
+Menjalankan worker:
+- Di dalam server API: JOBS_WORKER=true (start/stop di lifespan)
+- Process terpisah: python -m app.jobs
+"""
+import asyncio
+import inspect
+import itertools
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from . import config  # noqa: F401  (python -m app.jobs: load .env sebelum module lain)
+from . import database, metrics, shards, sqlstats, tracing
+from .database import SessionLocal
+from .db_models import Job, Merchant, SchedulerLease, UsageLog
+
+
+logger = logging.getLogger("app.jobs")
+
+JOBS_WORKER_ENABLED = os.getenv("JOBS_WORKER", "false").lower() == "true"
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "4"))
+JOBS_POLL_INTERVAL_MS = float(os.getenv("JOBS_POLL_INTERVAL_MS", "500"))
+JOBS_VISIBILITY_TIMEOUT_S = int(os.getenv("JOBS_VISIBILITY_TIMEOUT_S", "60"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_BACKOFF_BASE_S = float(os.getenv("JOBS_BACKOFF_BASE_S", "5"))
+JOBS_BACKOFF_MAX_S = float(os.getenv("JOBS_BACKOFF_MAX_S", "3600"))
+JOBS_RETENTION_DAYS = int(os.getenv("JOBS_RETENTION_DAYS", "7"))
+JOBS_SCHEDULER_ENABLED = os.getenv("JOBS_SCHEDULER", "true").lower() == "true"
+SCHEDULER_LEASE_S = int(os.getenv("SCHEDULER_LEASE_S", "30"))
+USAGE_LOG_RETENTION_DAYS = int(os.getenv("USAGE_LOG_RETENTION_DAYS", "90"))
+
+
+# ==================== REGISTRY ====================
+
+class JobHandler:
+    def __init__(self, kind: str, fn, max_attempts: int):
+        self.kind = kind
+        self.fn = fn
+        self.max_attempts = max_attempts
+        self.is_async = inspect.iscoroutinefunction(fn)
+
+
+HANDLERS = {}
+SCHEDULES = {}  # name → (Cron, kind, payload)
+# Service long-running (start() / async stop()) yang ikut start/stop bersama
+# JobWorker, mis. webhook dispatcher (app/webhooks.py)
+SERVICES = []
+
+
+def handler(kind: str, max_attempts: int = None):
+    """
+    Register handler untuk satu jenis job. Handler dipanggil dengan payload (dict),
+    boleh sync (jalan di thread) atau async. Raise = gagal → retry.
+    """
+    def decorator(fn):
+        HANDLERS[kind] = JobHandler(kind, fn, max_attempts or JOBS_MAX_ATTEMPTS)
+        return fn
+    return decorator
+
+
+def schedule(name: str, cron: str, kind: str = None, payload: dict = None):
+    """Enqueue job `kind` (default: name) sesuai ekspresi cron (UTC)"""
+    SCHEDULES[name] = (Cron(cron), kind or name, payload or {})
+
+
+# ==================== CRON ====================
+
+def _parse_field(field: str, lo: int, hi: int):
+    values = set()
+    for part in field.split(","):
+        base, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if base == "*":
+            start, end = lo, hi
+        elif "-" in base:
+            start, end = (int(v) for v in base.split("-", 1))
+        else:
+            start = int(base)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end or step < 1:
+            raise ValueError(f"Invalid cron field {field!r} (range {lo}-{hi})")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class Cron:
+    """Ekspresi cron 5 field: menit jam tanggal bulan hari (0/7 = Minggu), waktu UTC"""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, lo, hi) for field, (lo, hi) in zip(fields, self.RANGES)
+        )
+        self.weekdays = frozenset(d % 7 for d in weekdays)
+        # Aturan cron: kalau tanggal DAN hari dibatasi, cukup salah satu yang cocok
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, t: datetime) -> bool:
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def next_after(self, t: datetime) -> datetime:
+        """Waktu jadwal berikutnya, > t (resolusi menit)"""
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t.year + 5
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never matches: {self.expr!r}")
+
+
+# ==================== QUEUE ====================
+
+def enqueue(db, kind: str, payload: dict = None, run_at: datetime = None,
+            max_attempts: int = None, dedupe_key: str = None) -> Job:
+    """
+    Tambah job ke session `db`. Caller yang commit (job ikut transaksi caller).
+    """
+    registered = HANDLERS.get(kind)
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts or (registered.max_attempts if registered else JOBS_MAX_ATTEMPTS),
+        run_at=run_at or datetime.utcnow(),
+        dedupe_key=dedupe_key
+    )
+    db.add(job)
+    return job
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(Job.status == "queued", Job.run_at <= now),
+        and_(Job.status == "running", Job.locked_until < now)
+    )
+
+
+_claim_seq = itertools.count()
+
+
+def claim(worker_id: str, limit: int, visibility_timeout: int = JOBS_VISIBILITY_TIMEOUT_S):
+    """
+    Claim sampai `limit` job yang siap jalan. Returns list Job (detached).
+    Konflik dengan worker lain (atau SQLite busy) → list kosong/lebih sedikit,
+    dicoba lagi di poll berikutnya.
+    """
+    now = datetime.utcnow()
+    token = f"{worker_id}/{next(_claim_seq)}"
+    db = SessionLocal()
+    try:
+        ids = db.execute(
+            select(Job.id).where(_claimable(now)).order_by(Job.run_at).limit(limit)
+        ).scalars().all()
+        if not ids:
+            db.rollback()
+            return []
+
+        result = db.execute(
+            update(Job)
+            .where(Job.id.in_(ids), _claimable(now))
+            .values(
+                status="running",
+                locked_by=token,
+                locked_until=now + timedelta(seconds=visibility_timeout),
+                attempts=Job.attempts + 1
+            )
+            .execution_options(synchronize_session=False)
+        )
+        jobs = []
+        if result.rowcount:
+            jobs = db.execute(select(Job).where(Job.locked_by == token)).scalars().all()
+        db.commit()
+        return jobs
+    except OperationalError:
+        # SQLite: writer lain commit duluan (snapshot basi / busy) → coba lagi nanti
+        db.rollback()
+        return []
+    finally:
+        db.close()
+
+
+def _finish(job: Job, **values) -> bool:
+    """Update job yang masih kita pegang. False kalau lease sudah pindah ke worker lain."""
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.locked_by == job.locked_by)
+            .values(**values)
+        )
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+
+def extend_lease(job: Job, visibility_timeout: int = JOBS_VISIBILITY_TIMEOUT_S) -> bool:
+    return _finish(job, locked_until=datetime.utcnow() + timedelta(seconds=visibility_timeout))
+
+
+def complete(job: Job) -> bool:
+    return _finish(job, status="done", locked_by=None, locked_until=None,
+                   finished_at=datetime.utcnow(), last_error=None)
+
+
+def backoff_seconds(attempts: int, base: float = None, maximum: float = None) -> float:
+    """Exponential backoff (base * 2^(attempts-1), maks. `maximum`) + jitter 50-100%"""
+    base = JOBS_BACKOFF_BASE_S if base is None else base
+    maximum = JOBS_BACKOFF_MAX_S if maximum is None else maximum
+    delay = min(maximum, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def fail(job: Job, error: str) -> str:
+    """Retry (dengan backoff) atau tandai failed. Returns "retry" / "failed"."""
+    now = datetime.utcnow()
+    if job.attempts < job.max_attempts:
+        _finish(job, status="queued", locked_by=None, locked_until=None, last_error=error,
+                run_at=now + timedelta(seconds=backoff_seconds(job.attempts)))
+        return "retry"
+    _finish(job, status="failed", locked_by=None, locked_until=None, last_error=error, finished_at=now)
+    return "failed"
+
+
+# ==================== SCHEDULER (LEADER ELECTION) ====================
+
+def acquire_leadership(holder: str, name: str = "scheduler", lease_seconds: int = SCHEDULER_LEASE_S) -> bool:
+    """
+    Ambil / perpanjang lease leader. True kalau `holder` leader sampai
+    now + lease_seconds. Asumsi: jam antar host kurang lebih sinkron (NTP).
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=lease_seconds)
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(SchedulerLease)
+            .where(
+                SchedulerLease.name == name,
+                or_(SchedulerLease.holder == holder, SchedulerLease.expires_at < now)
+            )
+            .values(holder=holder, expires_at=expires_at)
+        )
+        if result.rowcount == 0:
+            if db.get(SchedulerLease, name) is not None:
+                db.rollback()
+                return False
+            db.add(SchedulerLease(name=name, holder=holder, expires_at=expires_at))
+        db.commit()
+        return True
+    except (IntegrityError, OperationalError):
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def release_leadership(holder: str, name: str = "scheduler"):
+    """Lepas lease (shutdown) supaya worker lain bisa langsung ambil alih"""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+            .values(expires_at=datetime(1970, 1, 1))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def enqueue_scheduled(due) -> int:
+    """Enqueue (name, kind, payload, fire_time) yang jatuh tempo; duplikat di-skip"""
+    created = 0
+    for name, kind, payload, fire_time in due:
+        db = SessionLocal()
+        try:
+            enqueue(db, kind, payload, run_at=fire_time, dedupe_key=f"cron:{name}:{fire_time:%Y-%m-%dT%H:%M}")
+            db.commit()
+            created += 1
+        except IntegrityError:
+            db.rollback()  # sudah di-enqueue leader sebelumnya
+        finally:
+            db.close()
+    return created
+
+
+# ==================== WORKER POOL ====================
+
+class JobWorker:
+    """Poll + jalankan job (maks. `concurrency` paralel) dan scheduler kalau jadi leader"""
+
+    def __init__(self, concurrency: int = JOBS_CONCURRENCY, poll_interval_ms: float = JOBS_POLL_INTERVAL_MS,
+                 scheduler: bool = JOBS_SCHEDULER_ENABLED, visibility_timeout: int = JOBS_VISIBILITY_TIMEOUT_S):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval_ms / 1000
+        self.scheduler = scheduler
+        self.visibility_timeout = visibility_timeout
+        self.worker_id = f"{socket.gethostname()[:40]}:{os.getpid()}:{os.urandom(3).hex()}"
+        self.processed = 0
+        self.is_leader = False
+        self._running = set()
+        self._tasks = []
+        self._wakeup = None
+
+    def start(self):
+        """Start poll loop (+ scheduler) di event loop yang sedang jalan"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [loop.create_task(self._poll_loop())]
+        if self.scheduler and SCHEDULES:
+            self._tasks.append(loop.create_task(self._schedule_loop()))
+        for service in SERVICES:
+            service.start()
+
+    async def stop(self, timeout: float = 10):
+        """Stop claim job baru, tunggu job yang sedang jalan (maks. timeout)"""
+        if not self._tasks:
+            return  # belum start / sudah stop
+        for service in SERVICES:
+            await service.stop()
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._running:
+            _, pending = await asyncio.wait(self._running, timeout=timeout)
+            for task in pending:
+                task.cancel()  # lease dibiarkan habis → job di-claim ulang worker lain
+
+        if self.is_leader:
+            self.is_leader = False
+            await asyncio.to_thread(release_leadership, self.worker_id)
+
+    def wake(self):
+        """Poll sekarang (mis. sesudah enqueue di process yang sama)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _poll_loop(self):
+        # Task ini mewarisi context request/lifespan; query job bukan milik request
+        sqlstats.current.set(None)
+        tracing.current.set(None)
+
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            free = self.concurrency - len(self._running)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = await asyncio.to_thread(claim, self.worker_id, free, self.visibility_timeout)
+                except Exception:
+                    logger.exception("Job claim failed")
+
+            for job in jobs:
+                task = loop.create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._job_done)
+
+            # Queue kosong, atau semua slot terpakai → tunggu slot/job baru
+            if free == 0 or len(jobs) < free:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _job_done(self, task):
+        self._running.discard(task)
+        self.wake()
+
+    async def _heartbeat(self, job: Job):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            if not await asyncio.to_thread(extend_lease, job, self.visibility_timeout):
+                logger.warning("Lost lease on job %s (%s); it may run twice", job.id, job.kind)
+                return
+
+    async def _execute(self, job: Job):
+        registered = HANDLERS.get(job.kind)
+        start = time.perf_counter()
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job))
+        try:
+            if registered is None:
+                raise LookupError(f"No handler registered for job kind {job.kind!r}")
+            if job.attempts > job.max_attempts:
+                # Lease attempt terakhir habis (worker mati di tengah jalan)
+                raise RuntimeError("Lease expired during final attempt")
+            if registered.is_async:
+                await registered.fn(job.payload)
+            else:
+                await asyncio.to_thread(registered.fn, job.payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            error = None
+        finally:
+            heartbeat.cancel()
+
+        if error is None:
+            await asyncio.to_thread(complete, job)
+            outcome = "done"
+        else:
+            outcome = await asyncio.to_thread(fail, job, error)
+            logger.warning("Job %s (%s) attempt %d failed (%s): %s", job.id, job.kind, job.attempts, outcome, error)
+
+        self.processed += 1
+        metrics.JOBS_PROCESSED.inc(job.kind, outcome)
+        metrics.JOB_DURATION.observe(time.perf_counter() - start, job.kind)
+
+    async def _schedule_loop(self):
+        sqlstats.current.set(None)
+        tracing.current.set(None)
+
+        next_run = {}
+        while True:
+            try:
+                self.is_leader = await asyncio.to_thread(acquire_leadership, self.worker_id)
+                if not self.is_leader:
+                    next_run.clear()
+                else:
+                    now = datetime.utcnow()
+                    due = []
+                    for name, (cron, kind, payload) in SCHEDULES.items():
+                        if name not in next_run:
+                            # Termasuk menit sekarang: leader baru tidak melewatkan jadwal
+                            next_run[name] = cron.next_after(now - timedelta(minutes=1))
+                        fire_time = None
+                        while next_run[name] <= now:
+                            fire_time = next_run[name]
+                            next_run[name] = cron.next_after(fire_time)
+                        if fire_time:
+                            due.append((name, kind, payload, fire_time))
+                    if due and await asyncio.to_thread(enqueue_scheduled, due):
+                        self.wake()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            await asyncio.sleep(SCHEDULER_LEASE_S / 3)
+
+
+worker = JobWorker()
+
+
+def run_worker():
+    """Worker process terpisah (python -m app.jobs), stop dengan SIGINT/SIGTERM"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    engine, _ = database.init_engines()
+    database.Base.metadata.create_all(bind=engine)
+    database.ensure_columns()
+    database.ensure_indexes()
+    shards.init_shards()
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        worker.start()
+        logger.info("Job worker %s started (concurrency %d)", worker.worker_id, worker.concurrency)
+        try:
+            await stop.wait()
+        finally:
+            await worker.stop()
+            shards.dispose_shards()
+            database.dispose_engines()
+
+    asyncio.run(run())
+
+
+# ==================== BUILT-IN JOBS ====================
+
+@handler("quotas.reset_monthly")
+def reset_monthly_quotas(payload: dict):
+    """
+    Reset quota_used semua merchant aktif (pengganti cron → /admin/reset-all-quotas).
+    Catatan at-least-once: kalau job ini jalan ulang, invoice yang dibuat di
+    antara dua reset ikut ter-reset (menguntungkan merchant, bukan sebaliknya).
+    """
+    with database.engine.begin() as conn:
+        result = conn.execute(
+            update(Merchant)
+            .where(Merchant.is_active == True, Merchant.quota_used > 0)
+            .values(quota_used=0)
+        )
+    logger.info("Monthly quota reset: %d merchants", result.rowcount)
+
+
+@handler("usage_logs.retention")
+def purge_usage_logs(payload: dict):
+    """Hapus usage log lebih tua dari USAGE_LOG_RETENTION_DAYS, per batch (transaksi pendek), semua shard paralel"""
+    days = payload.get("days", USAGE_LOG_RETENTION_DAYS)
+    batch = payload.get("batch", 5000)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    def purge(shard_id):
+        total = 0
+        while True:
+            with shards.writer(shard_id).begin() as conn:
+                ids = select(UsageLog.id).where(UsageLog.created_at < cutoff).limit(batch)
+                deleted = conn.execute(delete(UsageLog).where(UsageLog.id.in_(ids))).rowcount
+            total += deleted
+            if deleted < batch:
+                return total
+
+    total = sum(shards.fan_out(purge).values())
+    logger.info("Usage log retention (%d days): deleted %d rows", days, total)
+
+
+@handler("jobs.cleanup")
+def purge_finished_jobs(payload: dict):
+    """Hapus job "done" lebih tua dari JOBS_RETENTION_DAYS (job "failed" disimpan untuk diperiksa)"""
+    cutoff = datetime.utcnow() - timedelta(days=payload.get("days", JOBS_RETENTION_DAYS))
+    with database.engine.begin() as conn:
+        result = conn.execute(delete(Job).where(Job.status == "done", Job.finished_at < cutoff))
+    logger.info("Job cleanup: deleted %d finished jobs", result.rowcount)
+
+
+schedule("quotas.reset_monthly", "0 0 1 * *")
+schedule("usage_logs.retention", "30 3 * * *")
+schedule("jobs.cleanup", "45 3 * * *")
+
+
+if __name__ == "__main__":
+    # Import app.main supaya semua handler (termasuk dari modul lain) ter-register
+    # di module app.jobs yang asli, bukan di __main__ ini
+    import app.main  # noqa: F401
+    from app.jobs import run_worker as _run_worker
+
+    _run_worker()
@@ -1,53 +1,42 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, Request
-from fastapi.responses import HTMLResponse, PlainTextResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from sqlalchemy import func, select
 from datetime import date, datetime, timedelta
+from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
+import csv
+import io
+import json
 import os
-
-from .auth import get_current_merchant
-from .models import CreateInvoice, Item, Charges
-from .database import get_db, engine, Base
-from .db_models import Merchant, Invoice, APIKey, UsageLog, hash_key, gen_id
-# from .middleware import log_request_middleware  # Skip dulu untuk fix error
-
-# Create tables
-try:
-    Base.metadata.create_all(bind=engine)
-except Exception as e:
-    print(f"Warning: Could not create tables: {e}")
-
-app = FastAPI(
-    title="UMKM Invoice API - Multi-tenant",
-    version="4.0.0",
-    description="Multi-tenant invoice API with usage tracking & analytics"
+import zlib
+
+from . import config  # noqa: F401  (load .env sebelum module lain baca os.getenv)
+from .auth import get_current_merchant, is_admin_key
+from .models import CreateInvoice, UpdateInvoice, CreateWebhook, BatchGetInvoices
+from .database import (
+    get_request_db, Base, init_engines, dispose_engines, prewarm_pools,
+    ensure_columns, ensure_indexes
 )
-
-# Add middleware (skip dulu untuk fix error)
-# app.middleware("http")(log_request_middleware)
-
-# CORS configuration (untuk frontend nanti)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Production: ganti dengan domain spesifik
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from .db_models import Merchant, Invoice, Job, WebhookEndpoint, WebhookDelivery, hash_key, gen_id
+from .invoicing import invoice_breakdown, payload_breakdown, check_quota
+from .repository import Repository, get_repository, require_sql
+from . import (
+    admission, authcache, changefeed, customers, group_commit, metrics, sqlstats, profiler, tracing, compression,
+    jobs, webhooks, payments, repository, revenue, shards
 )
+# from .middleware import log_request_middleware  # Skip dulu untuk fix error
 
-USE_DATABASE = os.getenv("USE_DATABASE", "false").lower() == "true"
-DB = {}  # In-memory fallback
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", "0"))
+
+router = APIRouter()
 
 
 # ==================== ROOT & LANDING PAGE ====================
 
-@app.get("/", response_class=HTMLResponse)
-async def landing_page():
-    """
-    Landing page - Marketing & onboarding
-    """
-    html = """
+LANDING_HTML = """
     <!DOCTYPE html>
     <html lang="id">
     <head>
@@ -207,7 +196,19 @@ async def landing_page():
     </body>
     </html>
     """
-    return html
+
+
+LANDING_PAGE = compression.StaticPage(LANDING_HTML, "text/html; charset=utf-8")
+
+
+@router.get("/", response_class=HTMLResponse)
+async def landing_page(request: Request):
+    """
+    Landing page - Marketing & onboarding
+
+    Di-compress sekali saat startup, dikirim dengan ETag + Cache-Control
+    """
+    return LANDING_PAGE.response(request)
 
 
 # ==================== HELPER FUNCTIONS ====================
@@ -220,57 +221,19 @@ def rupiah(n: float) -> str:
         return "Rp 0"
 
 
-def calc_totals(items: list[Item], charges: Charges, discount_total: float):
-    """Calculate invoice totals"""
-    subtotal = sum(i.qty * i.unit_price - i.discount for i in items)
-    tax_total = 0.0
-    for i in items:
-        base = (i.unit_price * i.qty - i.discount)
-        if i.is_tax_inclusive:
-            base_wo_tax = base / (1 + i.tax_rate) if i.tax_rate > 0 else base
-            tax_total += base - base_wo_tax
-        else:
-            tax_total += base * i.tax_rate
-    grand = subtotal + tax_total + charges.shipping + charges.service + charges.rounding - discount_total
-    return {
-        "subtotal": round(subtotal),
-        "tax_total": round(tax_total),
-        "grand_total": round(grand)
-    }
-
-
-def next_number_db(merchant_id: str, db: Session):
-    """Generate invoice number per merchant (persistent)"""
-    today = date.today()
-    year, month = today.year, today.month
-    
-    count = db.query(Invoice).filter(
-        Invoice.merchant_id == merchant_id,
-        Invoice.number.like(f"INV/{year}/{month:02d}/%")
-    ).count()
-    
-    seq = count + 1
-    return f"INV/{year}/{month:02d}/{seq:04d}"
-
-
 # ==================== HEALTH CHECK ====================
 
-@app.get("/healthz")
-async def healthz(db: Session = Depends(get_db)):
+@router.get("/healthz")
+async def healthz(request: Request, repo: Repository = Depends(get_repository)):
     """Health check endpoint"""
     try:
-        if USE_DATABASE:
-            db.execute(text("SELECT 1"))
-            db_status = "connected"
-        else:
-            db_status = "in-memory mode"
-        
         return {
             "ok": True,
-            "version": "3.0.0",
-            "database": db_status,
-            "mode": "database" if USE_DATABASE else "legacy",
-            "multi_tenant": USE_DATABASE
+            "version": request.app.version,
+            "database": repo.ping(),
+            "storage": repo.backend,
+            "multi_tenant": True,
+            "admission": admission.controller.state()
         }
     except Exception as e:
         return {
@@ -280,14 +243,24 @@ async def healthz(db: Session = Depends(get_db)):
         }
 
 
+@router.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """
+    Prometheus metrics (text format) untuk worker ini
+
+    Tidak menyentuh database: hanya baca counter in-memory & state pool.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ==================== MERCHANT MANAGEMENT ====================
 
-@app.post("/v1/merchants/register")
+@router.post("/v1/merchants/register")
 async def register_merchant(
     name: str = Query(..., description="Merchant name"),
     email: str = Query(..., description="Merchant email (must be unique)"),
     plan: str = Query("free", description="Subscription plan: free, starter, pro"),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     PUBLIC ENDPOINT - Register new merchant
@@ -312,7 +285,7 @@ async def register_merchant(
         raise HTTPException(400, "Invalid email format")
     
     # Check if email already exists
-    existing = db.query(Merchant).filter(Merchant.email == email).first()
+    existing = repo.get_merchant_by_email(email)
     if existing:
         raise HTTPException(
             400,
@@ -328,29 +301,21 @@ async def register_merchant(
     }
     quota = quota_map.get(plan, 10)
     
-    # Create merchant
-    merchant = Merchant(
-        name=name,
-        email=email,
-        plan=plan,
-        quota_limit=quota,
-        quota_used=0
-    )
-    db.add(merchant)
-    db.flush()
-    
     # Generate unique API key
     api_key_value = f"inv_live_{os.urandom(16).hex()}"
     key_hash_value = hash_key(api_key_value)
     
-    api_key = APIKey(
-        merchant_id=merchant.id,
+    # Create merchant + API key
+    merchant, api_key = repo.create_merchant(
         key_hash=key_hash_value,
         key_prefix=api_key_value[:15],
-        name="Default API Key"
+        key_name="Default API Key",
+        name=name,
+        email=email,
+        plan=plan,
+        quota_limit=quota
     )
-    db.add(api_key)
-    db.commit()
+    repo.commit()
     
     return {
         "success": True,
@@ -371,7 +336,7 @@ async def register_merchant(
     }
 
 
-@app.get("/v1/merchants/me")
+@router.get("/v1/merchants/me")
 async def get_merchant_info(
     merchant: Merchant = Depends(get_current_merchant)
 ):
@@ -400,19 +365,17 @@ async def get_merchant_info(
 
 # ==================== API KEY MANAGEMENT ====================
 
-@app.get("/v1/merchants/me/api-keys")
+@router.get("/v1/merchants/me/api-keys")
 async def list_api_keys(
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     List all API keys for current merchant
     
     Shows: key prefix (not full key!), status, last used
     """
-    keys = db.query(APIKey).filter(
-        APIKey.merchant_id == merchant.id
-    ).order_by(APIKey.created_at.desc()).all()
+    keys = repo.list_api_keys(merchant.id)
     
     return {
         "merchant_id": merchant.id,
@@ -432,11 +395,11 @@ async def list_api_keys(
     }
 
 
-@app.post("/v1/merchants/me/api-keys")
+@router.post("/v1/merchants/me/api-keys")
 async def create_api_key(
     name: str = Query(..., description="Name/label for this API key"),
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     Create new API key for current merchant
@@ -450,15 +413,8 @@ async def create_api_key(
     api_key_value = f"inv_live_{os.urandom(16).hex()}"
     key_hash_value = hash_key(api_key_value)
     
-    api_key = APIKey(
-        merchant_id=merchant.id,
-        key_hash=key_hash_value,
-        key_prefix=api_key_value[:15],
-        name=name
-    )
-    db.add(api_key)
-    db.commit()
-    db.refresh(api_key)
+    api_key = repo.create_api_key(merchant.id, key_hash_value, api_key_value[:15], name)
+    repo.commit()
     
     return {
         "success": True,
@@ -471,11 +427,11 @@ async def create_api_key(
     }
 
 
-@app.delete("/v1/merchants/me/api-keys/{key_id}")
+@router.delete("/v1/merchants/me/api-keys/{key_id}")
 async def revoke_api_key(
     key_id: str,
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     Revoke/deactivate an API key
@@ -486,10 +442,7 @@ async def revoke_api_key(
     """
     
     # Find key
-    api_key = db.query(APIKey).filter(
-        APIKey.id == key_id,
-        APIKey.merchant_id == merchant.id
-    ).first()
+    api_key = repo.get_api_key(merchant.id, key_id)
     
     if not api_key:
         raise HTTPException(404, "API key not found")
@@ -498,8 +451,8 @@ async def revoke_api_key(
         raise HTTPException(400, "API key is already revoked")
     
     # Deactivate
-    api_key.is_active = False
-    db.commit()
+    api_key = repo.revoke_api_key(api_key)
+    repo.commit()
     
     return {
         "success": True,
@@ -511,125 +464,391 @@ async def revoke_api_key(
 
 # ==================== INVOICE ENDPOINTS ====================
 
-@app.post("/v1/invoices")
+@router.post("/v1/invoices")
 async def create_invoice(
-    request: Request,
     payload: CreateInvoice,
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     Create new invoice
     
     MULTI-TENANT: Each merchant gets their own invoice numbering & data
     
+    GROUP_COMMIT=true (backend sql): insert digabung dengan request lain yang
+    datang bersamaan ke satu transaksi (lihat app/group_commit.py)
+    
     Requires: X-API-Key header
     """
     
-    # Set merchant_id in request state (for middleware logging)
-    request.state.merchant_id = merchant.id
+    # Check quota (cepat, sebelum antri)
+    with tracing.span("quota_check"):
+        check_quota(merchant)
     
-    # Check quota
-    if merchant.quota_used >= merchant.quota_limit:
-        raise HTTPException(
-            status_code=429,
-            detail={
-                "error": "Quota exceeded",
-                "message": f"Your '{merchant.plan}' plan allows {merchant.quota_limit} invoices per month",
-                "quota_used": merchant.quota_used,
-                "quota_limit": merchant.quota_limit,
-                "suggestion": "Upgrade your plan to create more invoices",
-                "upgrade_url": "/v1/merchants/me/upgrade"
-            }
-        )
-    
-    # Generate invoice
-    inv_id = gen_id("inv")
-    number = next_number_db(merchant.id, db)  # ✅ Per merchant!
-    totals = calc_totals(payload.items, payload.charges, payload.discount_total)
-    
-    payload_json = payload.model_dump(mode="json")
-    
-    invoice = Invoice(
-        id=inv_id,
-        merchant_id=merchant.id,  # ✅ Auto dari auth!
-        number=number,
-        status="issued",
-        payload=payload_json,
-        subtotal=totals["subtotal"],
-        tax_total=totals["tax_total"],
-        grand_total=totals["grand_total"]
-    )
-    
-    db.add(invoice)
-    
-    # FIX: Re-query merchant from current session to ensure it's tracked
-    merchant_in_session = db.query(Merchant).filter(Merchant.id == merchant.id).first()
-    merchant_in_session.quota_used += 1
-    
-    db.commit()
-    db.refresh(merchant_in_session)
+    if group_commit.GROUP_COMMIT_ENABLED and repo.backend == "sql":
+        # Lepas connection request ini dulu, writer butuh connection sendiri
+        repo.commit()
+        with tracing.span("group_commit"):
+            result = await group_commit.writer.submit(merchant.id, payload, merchant.shard_id)
+    else:
+        result = repo.create_invoice(merchant, payload)
+        with tracing.span("commit"):
+            repo.commit()
     
+    metrics.INVOICES_CREATED.inc(merchant.plan)
+    with tracing.span("serialize"):
+        return JSONResponse(content=result)
+
+
+def _invoice_summary(inv) -> dict:
+    """Satu baris daftar invoice (GET /v1/invoices, GET /v1/customers/{id}/invoices)"""
     return {
-        "id": inv_id,
-        "number": number,
-        "status": "issued",
-        "merchant_id": merchant.id,
-        "totals": totals,
-        "quota_remaining": merchant_in_session.quota_limit - merchant_in_session.quota_used,
-        "links": {
-            "self": f"/v1/invoices/{inv_id}",
-            "html": f"/v1/invoices/{inv_id}/html"
-        }
+        "id": inv.id,
+        "number": inv.number,
+        "status": inv.status,
+        "customer": inv.payload.get("customer", {}),
+        "grand_total": inv.grand_total,
+        "created_at": inv.created_at.isoformat()
     }
 
 
-@app.get("/v1/invoices")
+@router.get("/v1/invoices")
 async def list_invoices(
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db),
+    repo: Repository = Depends(get_repository),
     limit: int = Query(50, description="Max results to return"),
-    offset: int = Query(0, description="Pagination offset")
+    offset: int = Query(0, description="Pagination offset"),
+    cursor: Optional[str] = Query(None, description="Keyset cursor: pass next_cursor (invoice id) from previous page")
 ):
     """
     List invoices for current merchant
     
     DATA ISOLATION: Only shows invoices belonging to current merchant
+
+    PAGINATION:
+    - offset: cara lama (makin dalam makin lambat, plus COUNT per page)
+    - cursor: keyset pagination pakai invoice id terakhir → cepat di page berapapun,
+      tanpa COUNT. Ambil halaman berikutnya dengan ?cursor=<next_cursor>
     """
     
-    invoices = db.query(Invoice).filter(
-        Invoice.merchant_id == merchant.id  # ✅ Filter by merchant!
-    ).order_by(Invoice.created_at.desc()).limit(limit).offset(offset).all()
-    
-    total = db.query(Invoice).filter(
-        Invoice.merchant_id == merchant.id
-    ).count()
+    invoices = repo.list_invoices(merchant.id, limit, offset, cursor)  # ✅ Filter by merchant!
     
-    return {
+    response = {
         "merchant_id": merchant.id,
         "merchant_name": merchant.name,
-        "total": total,
         "limit": limit,
         "offset": offset,
-        "invoices": [
-            {
-                "id": inv.id,
-                "number": inv.number,
-                "status": inv.status,
-                "customer": inv.payload.get("customer", {}),
-                "grand_total": inv.grand_total,
-                "created_at": inv.created_at.isoformat()
-            }
-            for inv in invoices
-        ]
+        "next_cursor": invoices[-1].id if len(invoices) == limit else None,
+        "invoices": [_invoice_summary(inv) for inv in invoices]
+    }
+
+    if not cursor:
+        response["total"] = repo.count_invoices(merchant.id)
+
+    return response
+
+
+# ==================== EXPORT (CSV / NDJSON) ====================
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_CSV_COLUMNS = [
+    "invoice_id", "number", "status", "issue_date", "due_date", "customer_name", "currency",
+    "item_name", "qty", "unit", "unit_price", "discount", "tax_rate", "is_tax_inclusive",
+    "item_tax", "item_total", "subtotal", "tax_total", "grand_total", "created_at"
+]
+
+
+def _export_lines(merchant_id: str, shard_id: Optional[str], fmt: str, date_from: Optional[date],
+                  date_to: Optional[date]):
+    """
+    Yield export lines (str) untuk satu merchant.
+
+    Pakai session sendiri (bukan Depends(get_request_db)) karena generator ini baru jalan
+    setelah handler return, dan rows dibaca lewat server-side cursor (yield_per)
+    supaya memory tetap konstan berapapun jumlah invoice.
+    """
+    db = shards.session(shard_id, readonly=True)
+    try:
+        stmt = select(
+            Invoice.id, Invoice.number, Invoice.status, Invoice.payload,
+            Invoice.subtotal, Invoice.tax_total, Invoice.grand_total, Invoice.breakdown, Invoice.created_at
+        ).where(Invoice.merchant_id == merchant_id)
+
+        if date_from:
+            stmt = stmt.where(Invoice.created_at >= datetime.combine(date_from, datetime.min.time()))
+        if date_to:
+            stmt = stmt.where(Invoice.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+
+        stmt = stmt.order_by(Invoice.created_at, Invoice.id).execution_options(
+            yield_per=EXPORT_BATCH_SIZE,
+            stream_results=True
+        )
+
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        if fmt == "csv":
+            writer.writerow(EXPORT_CSV_COLUMNS)
+
+        for row in db.execute(stmt):
+            p = row.payload or {}
+            breakdown = row.breakdown or payload_breakdown(p, row)
+            created_at = row.created_at.isoformat() if row.created_at else ""
+
+            if fmt == "ndjson":
+                buf.write(json.dumps({
+                    "id": row.id,
+                    "number": row.number,
+                    "status": row.status,
+                    "payload": p,
+                    "totals": {
+                        "subtotal": row.subtotal,
+                        "tax_total": row.tax_total,
+                        "grand_total": row.grand_total
+                    },
+                    "breakdown": breakdown,
+                    "created_at": created_at
+                }, separators=(",", ":")))
+                buf.write("\n")
+            else:
+                head = [
+                    row.id, row.number, row.status, p.get("issue_date", ""), p.get("due_date") or "",
+                    p.get("customer", {}).get("name", ""), p.get("currency", "IDR")
+                ]
+                tail = [row.subtotal, row.tax_total, row.grand_total, created_at]
+                # Satu baris per line item; invoice tanpa item tetap muncul 1 baris
+                items = p.get("items") or [{}]
+                lines = breakdown["lines"] or [{}]
+                for i, line in zip(items, lines):
+                    writer.writerow(head + [
+                        i.get("name", ""), i.get("qty", ""), i.get("unit", ""), i.get("unit_price", ""),
+                        i.get("discount", ""), i.get("tax_rate", ""), i.get("is_tax_inclusive", ""),
+                        line.get("tax", ""), line.get("total", "")
+                    ] + tail)
+
+            if buf.tell() >= EXPORT_CHUNK_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        db.close()
+
+
+def _gzip_stream(chunks):
+    """Compress stream on the fly (format gzip, bukan raw deflate)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/v1/invoices/export", dependencies=[Depends(require_sql)])
+async def export_invoices(
+    format: str = Query("csv", description="Export format: csv or ndjson"),
+    date_from: Optional[date] = Query(None, alias="from", description="Start date (inclusive), e.g. 2025-10-01"),
+    date_to: Optional[date] = Query(None, alias="to", description="End date (inclusive), e.g. 2025-10-31"),
+    gzip: bool = Query(False, description="Compress output with gzip (.gz download)"),
+    merchant: Merchant = Depends(get_current_merchant)
+):
+    """
+    Export all invoices for current merchant (streaming)
+
+    - csv: satu baris per line item (cocok untuk spreadsheet)
+    - ndjson: satu invoice per baris (payload lengkap)
+
+    Tanpa OFFSET & tanpa COUNT(*): rows di-stream langsung dari database,
+    jadi memory server konstan walaupun invoice-nya jutaan.
+    """
+
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(400, "Invalid format. Available formats: csv, ndjson")
+
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(400, "'from' must be before or equal to 'to'")
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"invoices-{merchant.id}.{format}"
+    body = _export_lines(merchant.id, merchant.shard_id, format, date_from, date_to)
+
+    if gzip:
+        body = _gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+# ==================== CHANGE FEED (long-poll / SSE) ====================
+
+@router.get("/v1/invoices/changes", dependencies=[Depends(require_sql)])
+async def list_invoice_changes(
+    since: Optional[str] = Query(None, description="Cursor: next_cursor dari response sebelumnya (kosong = dari awal)"),
+    limit: int = Query(100, ge=1, le=changefeed.CHANGES_PAGE_SIZE),
+    wait: float = Query(0, ge=0, le=changefeed.CHANGES_LONGPOLL_MAX_S,
+                        description="Long-poll: tunggu maks. sekian detik kalau belum ada perubahan"),
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """
+    Perubahan invoice (invoice.created / invoice.updated / invoice.paid) sesudah cursor
+
+    Pengganti polling GET /v1/invoices: simpan next_cursor, lalu panggil lagi dengan
+    ?since=<next_cursor>&wait=25. Tanpa COUNT, satu query lewat index (merchant_id, seq).
+    - Resume exact: tidak ada perubahan yang terlewat atau dobel antar panggilan
+    - has_more: masih ada perubahan lain, langsung panggil lagi
+    - 410: cursor terlalu lama (sudah lewat retention), sync ulang lewat GET /v1/invoices
+    """
+    cursor = changefeed.parse_cursor(since)
+    changes = changefeed.read(db, merchant.id, cursor, limit)
+
+    if not changes and wait > 0:
+        # Tunggu broadcaster tanpa memegang koneksi database
+        db.commit()
+        sub = changefeed.broadcaster.subscribe(merchant.id, merchant.shard_id, cursor, limit, behind=False)
+        try:
+            changes = await sub.next(wait)
+        finally:
+            changefeed.broadcaster.unsubscribe(sub)
+
+    return {
+        "changes": [change.body for change in changes],
+        "next_cursor": str(changes[-1].seq if changes else cursor),
+        "has_more": len(changes) == limit
+    }
+
+
+async def _change_events(merchant_id: str, shard_id: Optional[str], cursor: int, first: list):
+    """Event SSE: backlog `first`, lalu perubahan dari broadcaster + heartbeat"""
+    # Chunk pertama langsung dikirim supaya header response (dan proxy) tidak menunggu perubahan
+    yield f"retry: {changefeed.SSE_RETRY_MS}\n\n" + "".join(change.sse for change in first)
+
+    sub = changefeed.broadcaster.subscribe(
+        merchant_id, shard_id, first[-1].seq if first else cursor, behind=len(first) == changefeed.CHANGES_PAGE_SIZE
+    )
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + changefeed.CHANGES_STREAM_MAX_S
+    try:
+        while (remaining := closes_at - loop.time()) > 0:
+            changes = await sub.next(min(changefeed.CHANGES_HEARTBEAT_S, remaining))
+            yield "".join(change.sse for change in changes) if changes else ": keep-alive\n\n"
+    finally:
+        changefeed.broadcaster.unsubscribe(sub)
+
+
+@router.get("/v1/invoices/changes/stream", dependencies=[Depends(require_sql)])
+async def stream_invoice_changes(
+    request: Request,
+    since: Optional[str] = Query(None, description="Cursor awal (diabaikan kalau ada header Last-Event-ID)"),
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """
+    Server-Sent Events: perubahan invoice di-push begitu di-commit
+
+    Tiap event: `id: <cursor>`, `event: <type>`, `data: <JSON sama dengan /v1/invoices/changes>`.
+    EventSource reconnect otomatis dengan header Last-Event-ID → lanjut persis sesudah
+    event terakhir yang diterima. Stream ditutup server tiap CHANGES_STREAM_MAX_S
+    (reconnect biasa). 410 kalau cursor sudah lewat retention.
+    """
+    cursor = changefeed.parse_cursor(request.headers.get("last-event-id") or since)
+    first = changefeed.read(db, merchant.id, cursor)
+
+    return StreamingResponse(
+        _change_events(merchant.id, merchant.shard_id, cursor, first),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== BATCH GET ====================
+
+# Field detail invoice → kolom yang perlu dimuat (sparse fields batchGet)
+INVOICE_FIELDS = {
+    "id": (),
+    "number": (),
+    "status": ("status",),
+    "merchant_id": ("merchant_id",),
+    "customer_id": ("customer_id",),
+    "payload": ("payload",),
+    "totals": ("subtotal", "tax_total", "grand_total"),
+    "breakdown": ("breakdown", "payload", "subtotal", "tax_total", "grand_total"),
+    "created_at": ("created_at",)
+}
+
+
+def _invoice_detail(invoice, fields=INVOICE_FIELDS) -> dict:
+    """Body GET /v1/invoices/{id}; `fields` = subset key yang diisi"""
+    detail = {
+        "id": lambda: invoice.id,
+        "number": lambda: invoice.number,
+        "status": lambda: invoice.status,
+        "merchant_id": lambda: invoice.merchant_id,
+        "customer_id": lambda: getattr(invoice, "customer_id", None),  # embedded: tidak ada
+        "payload": lambda: invoice.payload,
+        "totals": lambda: {
+            "subtotal": invoice.subtotal,
+            "tax_total": invoice.tax_total,
+            "grand_total": invoice.grand_total
+        },
+        "breakdown": lambda: invoice_breakdown(invoice),
+        "created_at": lambda: invoice.created_at.isoformat()
     }
+    return {name: detail[name]() for name in fields}
+
+
+@router.post("/v1/invoices:batchGet")
+async def batch_get_invoices(
+    body: BatchGetInvoices,
+    merchant: Merchant = Depends(get_current_merchant),
+    repo: Repository = Depends(get_repository)
+):
+    """
+    Ambil banyak invoice sekaligus (maks. 1000) berdasarkan `ids` ATAU `numbers`
+
+    - results: urut sama dengan request; yang tidak ada / bukan milik merchant
+      ini → {"found": false}
+    - fields: subset field detail (id, number, status, merchant_id, customer_id,
+      payload, totals, breakdown, created_at); hanya kolom itu yang dimuat
+
+    Pengganti loop GET /v1/invoices/{id}: satu auth + satu IN-query per 500 key.
+    Read-only, jadi lewat read pool walaupun POST (lihat get_request_db).
+    """
+
+    if (body.ids is None) == (body.numbers is None):
+        raise HTTPException(400, "Provide exactly one of 'ids' or 'numbers'")
+    fields = body.fields or list(INVOICE_FIELDS)
+    unknown = [name for name in fields if name not in INVOICE_FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(INVOICE_FIELDS)}")
+
+    by, keys = ("id", body.ids) if body.ids is not None else ("number", body.numbers)
+    columns = sorted({column for name in fields for column in INVOICE_FIELDS[name]})
+    found = repo.get_invoices(merchant.id, keys, by=by, columns=columns)  # ✅ Filter by merchant!
+
+    results = [
+        {by: key, "found": True, "invoice": _invoice_detail(found[key], fields)} if key in found
+        else {by: key, "found": False}
+        for key in keys
+    ]
+    return {"found": sum(1 for result in results if result["found"]),
+            "missing": sum(1 for result in results if not result["found"]), "results": results}
 
 
-@app.get("/v1/invoices/{inv_id}")
+@router.get("/v1/invoices/{inv_id}")
 async def get_invoice(
     inv_id: str,
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     Get invoice detail
@@ -637,10 +856,31 @@ async def get_invoice(
     DATA ISOLATION: Only shows if invoice belongs to current merchant
     """
     
-    invoice = db.query(Invoice).filter(
-        Invoice.id == inv_id,
-        Invoice.merchant_id == merchant.id  # ✅ Security check!
-    ).first()
+    invoice = repo.get_invoice(merchant.id, inv_id)  # ✅ Security check!
+    
+    if not invoice:
+        raise HTTPException(
+            404,
+            "Invoice not found or you don't have permission to access it"
+        )
+    
+    return _invoice_detail(invoice)
+
+
+@router.patch("/v1/invoices/{inv_id}")
+async def update_invoice(
+    inv_id: str,
+    payload: UpdateInvoice,
+    merchant: Merchant = Depends(get_current_merchant),
+    repo: Repository = Depends(get_repository)
+):
+    """
+    Update status (issued / paid / void) atau notes invoice
+    
+    Webhook: invoice.paid kalau status jadi "paid", selain itu invoice.updated
+    """
+    
+    invoice = repo.get_invoice(merchant.id, inv_id)
     
     if not invoice:
         raise HTTPException(
@@ -648,26 +888,36 @@ async def get_invoice(
             "Invoice not found or you don't have permission to access it"
         )
     
+    if invoice.status == "void":
+        raise HTTPException(409, "Invoice is void and can no longer be changed")
+    
+    changes = {}
+    if payload.notes is not None and payload.notes != invoice.payload.get("notes"):
+        changes["payload"] = {**invoice.payload, "notes": payload.notes}
+    
+    event_type = "invoice.updated"
+    if payload.status and payload.status != invoice.status:
+        if payload.status == "paid":
+            event_type = "invoice.paid"
+        changes["status"] = payload.status
+    
+    if changes:
+        invoice = repo.update_invoice(merchant, invoice, changes, event_type)
+        repo.commit()
+    
     return {
         "id": invoice.id,
         "number": invoice.number,
         "status": invoice.status,
-        "merchant_id": invoice.merchant_id,
-        "payload": invoice.payload,
-        "totals": {
-            "subtotal": invoice.subtotal,
-            "tax_total": invoice.tax_total,
-            "grand_total": invoice.grand_total
-        },
-        "created_at": invoice.created_at.isoformat()
+        "updated": bool(changes)
     }
 
 
-@app.get("/v1/invoices/{inv_id}/html", response_class=HTMLResponse)
+@router.get("/v1/invoices/{inv_id}/html", response_class=HTMLResponse)
 async def invoice_html(
     inv_id: str,
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     Render invoice as HTML (printable)
@@ -675,10 +925,8 @@ async def invoice_html(
     DATA ISOLATION: Only renders if invoice belongs to current merchant
     """
     
-    invoice = db.query(Invoice).filter(
-        Invoice.id == inv_id,
-        Invoice.merchant_id == merchant.id  # ✅ Security check!
-    ).first()
+    with tracing.span("invoice_query"):
+        invoice = repo.get_invoice(merchant.id, inv_id)  # ✅ Security check!
     
     if not invoice:
         raise HTTPException(
@@ -698,30 +946,24 @@ async def invoice_html(
         }
     }
     
-    p = d["payload"]
-    rows = ""
-    
-    for i in p.get("items", []):
-        base = i.get("qty", 0) * i.get("unit_price", 0) - i.get("discount", 0)
-        if i.get("is_tax_inclusive"):
-            tax = base - (base / (1 + i.get("tax_rate", 0)))
-            line_total = base
-        else:
-            tax = base * i.get("tax_rate", 0)
-            line_total = base + tax
-        
-        rows += (
-            "<tr>"
-            f"<td>{i.get('name','')}</td>"
-            f"<td style='text-align:right'>{i.get('qty',0)}</td>"
-            f"<td style='text-align:right'>{rupiah(i.get('unit_price',0))}</td>"
-            f"<td style='text-align:right'>{rupiah(i.get('discount',0))}</td>"
-            f"<td style='text-align:right'>{rupiah(int(tax))}</td>"
-            f"<td style='text-align:right'>{rupiah(int(line_total))}</td>"
-            "</tr>"
-        )
-    
-    html = f"""<!doctype html>
+    with tracing.span("render"):
+        p = d["payload"]
+        rows = ""
+    
+        # Pajak & total per baris dari breakdown tersimpan (rupiah integer), tidak dihitung ulang
+        for i, line in zip(p.get("items", []), invoice_breakdown(invoice)["lines"]):
+            rows += (
+                "<tr>"
+                f"<td>{i.get('name','')}</td>"
+                f"<td style='text-align:right'>{i.get('qty',0)}</td>"
+                f"<td style='text-align:right'>{rupiah(i.get('unit_price',0))}</td>"
+                f"<td style='text-align:right'>{rupiah(i.get('discount',0))}</td>"
+                f"<td style='text-align:right'>{rupiah(line['tax'])}</td>"
+                f"<td style='text-align:right'>{rupiah(line['total'])}</td>"
+                "</tr>"
+            )
+    
+        html = f"""<!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
@@ -779,12 +1021,215 @@ async def invoice_html(
     return HTMLResponse(content=html, media_type="text/html")
 
 
+# ==================== CUSTOMERS ====================
+
+@router.get("/v1/customers/{customer_id}/invoices", dependencies=[Depends(require_sql)])
+async def list_customer_invoices(
+    customer_id: str,
+    limit: int = Query(50, ge=1, le=500, description="Max results to return"),
+    cursor: Optional[str] = Query(None, description="Keyset cursor: pass next_cursor (invoice id) from previous page"),
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """
+    Invoice satu customer (customer_id dari detail invoice), terbaru dulu, plus
+    saldo customer (invoice_count, lifetime_total, outstanding_total).
+
+    Keyset pagination lewat index (customer_id, created_at, id): ambil halaman
+    berikutnya dengan ?cursor=<next_cursor>. Invoice lama tanpa customer_id
+    muncul sesudah backfill (POST /admin/customers/backfill).
+    """
+
+    customer = customers.get_customer(db, merchant.id, customer_id)  # ✅ Security check!
+    if not customer:
+        raise HTTPException(404, "Customer not found or you don't have permission to access it")
+
+    invoices = customers.list_invoices(db, customer, limit, cursor)
+    return {
+        "customer": customers.customer_dict(customer),
+        "limit": limit,
+        "next_cursor": invoices[-1].id if len(invoices) == limit else None,
+        "invoices": [_invoice_summary(inv) for inv in invoices]
+    }
+
+
+# ==================== WEBHOOK ENDPOINTS ====================
+
+def _webhook_endpoint_dict(endpoint: WebhookEndpoint):
+    return {
+        "id": endpoint.id,
+        "url": endpoint.url,
+        "events": endpoint.events,
+        "batch_size": endpoint.batch_size,
+        "is_active": endpoint.is_active,
+        "created_at": endpoint.created_at.isoformat()
+    }
+
+
+@router.post("/v1/webhooks", dependencies=[Depends(require_sql)])
+async def create_webhook(
+    payload: CreateWebhook,
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """
+    Register webhook endpoint (plan Pro / Enterprise)
+    
+    Events: invoice.created, invoice.updated, invoice.paid
+    batch_size > 1: beberapa event dalam satu POST ({"events": [...]})
+    
+    Returns: signing secret (shown once!) untuk verifikasi header
+    X-Webhook-Signature: t=<unix>,v1=<hex HMAC-SHA256(secret, "<t>.<body>")>
+    """
+    
+    if merchant.plan not in webhooks.WEBHOOK_PLANS:
+        raise HTTPException(
+            403,
+            detail={
+                "error": "Webhooks not available on your plan",
+                "message": f"Webhooks require one of: {', '.join(webhooks.WEBHOOK_PLANS)}",
+                "upgrade_url": "/v1/merchants/me/upgrade"
+            }
+        )
+    
+    unknown = set(payload.events) - set(webhooks.EVENT_TYPES)
+    if unknown or not payload.events:
+        raise HTTPException(400, f"Unknown event types: {sorted(unknown)}. Available: {list(webhooks.EVENT_TYPES)}")
+    try:
+        webhooks.validate_url(payload.url)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    
+    secret = webhooks.new_secret()
+    endpoint = WebhookEndpoint(
+        id=gen_id("whe"),
+        merchant_id=merchant.id,
+        url=payload.url,
+        secret=secret,
+        events=sorted(set(payload.events)),
+        batch_size=payload.batch_size,
+        is_active=True,
+        created_at=datetime.utcnow()
+    )
+    db.add(endpoint)
+    db.commit()
+    
+    return {
+        **_webhook_endpoint_dict(endpoint),
+        "secret": secret,
+        "warning": "⚠️  SAVE THIS SECRET! It will not be shown again."
+    }
+
+
+@router.get("/v1/webhooks", dependencies=[Depends(require_sql)])
+async def list_webhooks(
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """List webhook endpoints milik merchant (secret tidak ditampilkan)"""
+    
+    endpoints = db.query(WebhookEndpoint).filter(
+        WebhookEndpoint.merchant_id == merchant.id
+    ).order_by(WebhookEndpoint.created_at).all()
+    
+    return {"webhooks": [_webhook_endpoint_dict(e) for e in endpoints]}
+
+
+@router.delete("/v1/webhooks/{endpoint_id}", dependencies=[Depends(require_sql)])
+async def delete_webhook(
+    endpoint_id: str,
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """Nonaktifkan webhook endpoint (delivery yang masih pending jadi failed)"""
+    
+    endpoint = db.query(WebhookEndpoint).filter(
+        WebhookEndpoint.id == endpoint_id,
+        WebhookEndpoint.merchant_id == merchant.id
+    ).first()
+    
+    if not endpoint:
+        raise HTTPException(404, "Webhook endpoint not found")
+    
+    endpoint.is_active = False
+    db.commit()
+    
+    return {"success": True, "id": endpoint.id}
+
+
+@router.get("/v1/webhooks/{endpoint_id}/deliveries", dependencies=[Depends(require_sql)])
+async def list_webhook_deliveries(
+    endpoint_id: str,
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db),
+    limit: int = Query(50, ge=1, le=200)
+):
+    """Delivery terbaru ke satu endpoint (status, attempts, error terakhir)"""
+    
+    deliveries = db.query(WebhookDelivery).filter(
+        WebhookDelivery.endpoint_id == endpoint_id,
+        WebhookDelivery.merchant_id == merchant.id
+    ).order_by(WebhookDelivery.created_at.desc()).limit(limit).all()
+    
+    return {
+        "deliveries": [
+            {
+                "id": d.id,
+                "event_id": d.event_id,
+                "status": d.status,
+                "attempts": d.attempts,
+                "last_status_code": d.last_status_code,
+                "last_error": d.last_error,
+                "next_attempt_at": d.next_attempt_at.isoformat() if d.status == "pending" else None,
+                "delivered_at": d.delivered_at.isoformat() if d.delivered_at else None
+            }
+            for d in deliveries
+        ]
+    }
+
+
+# ==================== PAYMENTS ====================
+
+@router.post("/v1/payments:reconcile", dependencies=[Depends(require_sql)])
+async def reconcile_payments(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv or ndjson (default: detect from content)"),
+    dry_run: bool = Query(False, description="Only report matches, don't mark invoices paid"),
+    window_days: int = Query(payments.RECONCILE_DATE_WINDOW_DAYS, ge=0, le=366, description="Amount match: invoice created at most N days before payment date"),
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """
+    Cocokkan file mutasi bank (body: CSV / NDJSON, kolom amount, date, reference)
+    ke invoice "issued", lalu tandai paid sekaligus (lihat app/payments.py)
+    
+    Returns: summary (jumlah per status) + hasil per baris
+    """
+    
+    if format is None and "ndjson" in request.headers.get("content-type", ""):
+        format = "ndjson"
+    
+    body = await request.body()
+    try:
+        lines = payments.read_lines(body, format)
+    except UnicodeDecodeError:
+        raise HTTPException(400, "File must be UTF-8 text")
+    except payments.ReconcileError as e:
+        raise HTTPException(e.status_code, str(e))
+    
+    # Ribuan baris: match + UPDATE di thread, event loop tetap melayani request lain
+    summary, results = await asyncio.to_thread(payments.reconcile, db, merchant, lines, dry_run, window_days)
+    if not dry_run:
+        db.commit()
+    
+    return {"summary": summary, "results": results}
+
+
 # ==================== USAGE & ANALYTICS ====================
 
-@app.get("/v1/merchants/me/usage")
+@router.get("/v1/merchants/me/usage")
 async def get_usage_stats(
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant)
 ):
     """
     Get current usage statistics
@@ -828,10 +1273,10 @@ async def get_usage_stats(
     }
 
 
-@app.get("/v1/merchants/me/analytics")
+@router.get("/v1/merchants/me/analytics")
 async def get_analytics(
     merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db),
+    repo: Repository = Depends(get_repository),
     days: int = Query(30, description="Number of days to analyze")
 ):
     """
@@ -847,34 +1292,11 @@ async def get_analytics(
     # Date range
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    # Total API calls
-    total_calls = db.query(func.count(UsageLog.id)).filter(
-        UsageLog.merchant_id == merchant.id,
-        UsageLog.created_at >= start_date
-    ).scalar() or 0
-    
-    # Calls by endpoint
-    endpoint_stats = db.query(
-        UsageLog.endpoint,
-        func.count(UsageLog.id).label("count")
-    ).filter(
-        UsageLog.merchant_id == merchant.id,
-        UsageLog.created_at >= start_date
-    ).group_by(UsageLog.endpoint).all()
-    
-    # Average response time
-    avg_response_time = db.query(
-        func.avg(UsageLog.response_time_ms)
-    ).filter(
-        UsageLog.merchant_id == merchant.id,
-        UsageLog.created_at >= start_date
-    ).scalar() or 0
+    # Total API calls, calls by endpoint, average response time
+    total_calls, endpoint_stats, avg_response_time = repo.usage_summary(merchant.id, start_date)
     
     # Total invoices created
-    total_invoices = db.query(func.count(Invoice.id)).filter(
-        Invoice.merchant_id == merchant.id,
-        Invoice.created_at >= start_date
-    ).scalar() or 0
+    total_invoices = repo.count_invoices(merchant.id, since=start_date)
     
     return {
         "period": {
@@ -889,14 +1311,59 @@ async def get_analytics(
         },
         "by_endpoint": [
             {
-                "endpoint": stat.endpoint,
-                "calls": stat.count
+                "endpoint": endpoint,
+                "calls": calls
             }
-            for stat in endpoint_stats
+            for endpoint, calls in endpoint_stats
         ]
     }
 
 
+@router.get("/v1/merchants/me/revenue", dependencies=[Depends(require_sql)])
+async def get_revenue(
+    granularity: str = Query("day", description="Bucket: day or month"),
+    date_from: Optional[date] = Query(None, alias="from", description="Start date (inclusive), e.g. 2025-10-01"),
+    date_to: Optional[date] = Query(None, alias="to", description="End date (inclusive), default today"),
+    merchant: Merchant = Depends(get_current_merchant),
+    db: Session = Depends(get_request_db)
+):
+    """
+    Revenue per hari / bulan (berdasarkan issue_date invoice), per currency
+
+    - day: invoice tanpa void; default 30 hari terakhir
+    - month: total tanpa void + rincian by_status; default 12 bulan terakhir
+
+    Dibaca dari tabel agregat (revenue_daily / revenue_monthly) yang di-update
+    bersama invoice, jadi biaya query sebanding jumlah bucket, bukan jumlah invoice.
+    """
+
+    if granularity not in revenue.GRANULARITIES:
+        raise HTTPException(400, "Invalid granularity. Available: day, month")
+
+    date_to = date_to or datetime.utcnow().date()
+    if date_from is None:
+        if granularity == "day":
+            date_from = date_to - timedelta(days=29)
+        else:
+            date_from = (date_to.replace(day=1) - timedelta(days=330)).replace(day=1)
+    if date_from > date_to:
+        raise HTTPException(400, "'from' must be before or equal to 'to'")
+    if granularity == "day" and (date_to - date_from).days >= revenue.REVENUE_MAX_DAYS:
+        raise HTTPException(400, f"Range too large for granularity=day (max {revenue.REVENUE_MAX_DAYS} days)")
+    months = (date_to.year - date_from.year) * 12 + date_to.month - date_from.month
+    if granularity == "month" and months >= revenue.REVENUE_MAX_MONTHS:
+        raise HTTPException(400, f"Range too large for granularity=month (max {revenue.REVENUE_MAX_MONTHS} months)")
+
+    buckets = revenue.report(db, merchant.id, granularity, date_from, date_to)
+    return {
+        "granularity": granularity,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "totals": revenue.totals(buckets),
+        "buckets": buckets
+    }
+
+
 # ==================== PRICING & SUBSCRIPTION ====================
 
 # Pricing configuration
@@ -928,14 +1395,8 @@ PLANS = {
 }
 
 
-@app.get("/v1/pricing")
-async def get_pricing():
-    """
-    PUBLIC ENDPOINT - Get pricing plans
-    
-    Returns all available plans with features & pricing
-    """
-    return {
+PRICING_PAGE = compression.StaticPage(
+    json.dumps({
         "currency": "IDR",
         "plans": [
             {
@@ -944,14 +1405,26 @@ async def get_pricing():
             }
             for plan_id, plan_details in PLANS.items()
         ]
-    }
+    }, ensure_ascii=False, separators=(",", ":")),
+    "application/json"
+)
 
 
-@app.post("/v1/merchants/me/upgrade")
+@router.get("/v1/pricing")
+async def get_pricing(request: Request):
+    """
+    PUBLIC ENDPOINT - Get pricing plans
+    
+    Returns all available plans with features & pricing
+    (statis: di-compress sekali saat startup, dengan ETag + Cache-Control)
+    """
+    return PRICING_PAGE.response(request)
+
+
+@router.post("/v1/merchants/me/upgrade")
 async def request_upgrade(
     new_plan: str = Query(..., description="Plan to upgrade to: starter, pro, enterprise"),
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant)
 ):
     """
     Request plan upgrade
@@ -1005,12 +1478,11 @@ async def request_upgrade(
     }
 
 
-@app.post("/v1/merchants/me/confirm-upgrade")
+@router.post("/v1/merchants/me/confirm-upgrade")
 async def confirm_upgrade(
     new_plan: str = Query(..., description="Plan to upgrade to"),
     payment_proof: str = Query(..., description="Payment reference or transaction ID"),
-    merchant: Merchant = Depends(get_current_merchant),
-    db: Session = Depends(get_db)
+    merchant: Merchant = Depends(get_current_merchant)
 ):
     """
     Confirm manual payment (ADMIN will approve)
@@ -1032,12 +1504,12 @@ async def confirm_upgrade(
     }
 
 
-@app.post("/admin/approve-upgrade/{merchant_id}", include_in_schema=False)
+@router.post("/admin/approve-upgrade/{merchant_id}", include_in_schema=False)
 async def admin_approve_upgrade(
     merchant_id: str,
     new_plan: str = Query(..., description="Plan to upgrade to"),
     admin_key: str = Query(..., description="Admin API key"),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     ADMIN ONLY - Approve upgrade and change merchant plan
@@ -1049,7 +1521,7 @@ async def admin_approve_upgrade(
     if admin_key != ADMIN_KEY:
         raise HTTPException(403, "Unauthorized")
     
-    merchant = db.query(Merchant).filter(Merchant.id == merchant_id).first()
+    merchant = repo.get_merchant(merchant_id)
     if not merchant:
         raise HTTPException(404, "Merchant not found")
     
@@ -1060,10 +1532,8 @@ async def admin_approve_upgrade(
     old_quota = merchant.quota_limit
     
     # Update merchant
-    merchant.plan = new_plan
-    merchant.quota_limit = PLANS[new_plan]["quota"]
-    
-    db.commit()
+    merchant = repo.update_merchant(merchant, plan=new_plan, quota_limit=PLANS[new_plan]["quota"])
+    repo.commit()
     
     return {
         "success": True,
@@ -1081,11 +1551,11 @@ async def admin_approve_upgrade(
 
 # ==================== ADMIN ENDPOINTS ====================
 
-@app.post("/admin/reset-quota/{merchant_id}", include_in_schema=False)
+@router.post("/admin/reset-quota/{merchant_id}", include_in_schema=False)
 async def admin_reset_quota(
     merchant_id: str,
     admin_key: str = Query(..., description="Admin API key"),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     ADMIN ONLY - Reset merchant quota
@@ -1098,13 +1568,13 @@ async def admin_reset_quota(
     if admin_key != ADMIN_KEY:
         raise HTTPException(403, "Unauthorized")
     
-    merchant = db.query(Merchant).filter(Merchant.id == merchant_id).first()
+    merchant = repo.get_merchant(merchant_id)
     if not merchant:
         raise HTTPException(404, "Merchant not found")
     
     old_used = merchant.quota_used
-    merchant.quota_used = 0
-    db.commit()
+    merchant = repo.update_merchant(merchant, quota_used=0)
+    repo.commit()
     
     return {
         "success": True,
@@ -1118,50 +1588,198 @@ async def admin_reset_quota(
     }
 
 
-@app.post("/admin/reset-all-quotas", include_in_schema=False)
+@router.post("/admin/reset-all-quotas", include_in_schema=False)
 async def admin_reset_all_quotas(
     admin_key: str = Query(..., description="Admin API key"),
-    db: Session = Depends(get_db)
+    repo: Repository = Depends(get_repository)
 ):
     """
     ADMIN ONLY - Reset ALL merchants quota
     
-    Use case: Monthly reset (run via cron job on 1st of month)
+    Use case: manual reset. Reset bulanan otomatis: job "quotas.reset_monthly" (app/jobs.py)
     """
     
     ADMIN_KEY = os.getenv("ADMIN_KEY", "admin_secret_key_change_me")
     if admin_key != ADMIN_KEY:
         raise HTTPException(403, "Unauthorized")
     
-    merchants = db.query(Merchant).filter(Merchant.is_active == True).all()
-    
-    reset_count = 0
-    for merchant in merchants:
-        if merchant.quota_used > 0:
-            merchant.quota_used = 0
-            reset_count += 1
-    
-    db.commit()
+    total_merchants, reset_count = repo.reset_quotas()
+    repo.commit()
     
     return {
         "success": True,
         "message": f"Reset quota for {reset_count} merchants",
-        "total_merchants": len(merchants),
+        "total_merchants": total_merchants,
         "reset_date": datetime.utcnow().date().isoformat()
     }
 
 
+@router.get("/admin/jobs", include_in_schema=False, dependencies=[Depends(require_sql)])
+async def admin_list_jobs(
+    admin_key: str = Query(..., description="Admin API key"),
+    status: Optional[str] = Query(None, description="queued | running | done | failed"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_request_db)
+):
+    """
+    ADMIN ONLY - Jumlah job per kind/status + job terbaru (default: yang failed dulu)
+    
+    Worker: JOBS_WORKER=true (di process API) atau `python -m app.jobs`
+    """
+    
+    if not is_admin_key(admin_key):
+        raise HTTPException(403, "Unauthorized")
+    
+    counts = db.execute(
+        select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status)
+    ).all()
+    
+    query = select(Job).order_by(Job.created_at.desc()).limit(limit)
+    query = query.where(Job.status == (status or "failed"))
+    
+    return {
+        "counts": [{"kind": kind, "status": job_status, "count": count} for kind, job_status, count in counts],
+        "jobs": [
+            {
+                "id": job.id,
+                "kind": job.kind,
+                "status": job.status,
+                "attempts": job.attempts,
+                "max_attempts": job.max_attempts,
+                "run_at": job.run_at.isoformat(),
+                "locked_by": job.locked_by,
+                "last_error": job.last_error,
+                "created_at": job.created_at.isoformat()
+            }
+            for job in db.execute(query).scalars()
+        ]
+    }
+
+
+@router.post("/admin/backfill-breakdowns", include_in_schema=False, dependencies=[Depends(require_sql)])
+async def admin_backfill_breakdowns(
+    admin_key: str = Query(..., description="Admin API key"),
+    batch: int = Query(500, ge=10, le=10000, description="Invoices per transaction"),
+    db: Session = Depends(get_request_db)
+):
+    """
+    ADMIN ONLY - Enqueue job "invoices.backfill_breakdown": isi rincian per baris
+    (rupiah integer) untuk invoice lama. Aman diulang; hanya baris NULL yang diisi.
+    """
+    
+    if not is_admin_key(admin_key):
+        raise HTTPException(403, "Unauthorized")
+    
+    def count_remaining(shard_id):
+        with shards.reader(shard_id).connect() as conn:
+            return conn.execute(select(func.count()).where(Invoice.breakdown.is_(None))).scalar()
+
+    remaining = sum((await asyncio.to_thread(shards.fan_out, count_remaining)).values())
+    job = jobs.enqueue(db, "invoices.backfill_breakdown", {"batch": batch})
+    db.commit()
+    jobs.worker.wake()
+    
+    return {"success": True, "job_id": job.id, "invoices_remaining": remaining}
+
+
+@router.post("/admin/customers/backfill", include_in_schema=False, dependencies=[Depends(require_sql)])
+async def admin_backfill_customers(
+    admin_key: str = Query(..., description="Admin API key"),
+    batch: int = Query(500, ge=10, le=10000, description="Invoices per transaction"),
+    db: Session = Depends(get_request_db)
+):
+    """
+    ADMIN ONLY - Enqueue job "customers.backfill": link invoice lama ke customer
+    (dedup per merchant) dan hitung saldonya. Aman diulang; hanya invoice tanpa customer_id.
+    """
+
+    if not is_admin_key(admin_key):
+        raise HTTPException(403, "Unauthorized")
+
+    def count_remaining(shard_id):
+        with shards.reader(shard_id).connect() as conn:
+            return conn.execute(select(func.count()).where(Invoice.customer_id.is_(None))).scalar()
+
+    remaining = sum((await asyncio.to_thread(shards.fan_out, count_remaining)).values())
+    job = jobs.enqueue(db, "customers.backfill", {"batch": batch})
+    db.commit()
+    jobs.worker.wake()
+
+    return {"success": True, "job_id": job.id, "invoices_without_customer": remaining}
+
+
+@router.get("/admin/shards", include_in_schema=False, dependencies=[Depends(require_sql)])
+async def admin_list_shards(admin_key: str = Query(..., description="Admin API key")):
+    """
+    ADMIN ONLY - Per shard: jumlah merchant (shard map), invoice, usage log,
+    delivery webhook pending & latency ping. Query ke semua shard paralel.
+    
+    Pindah merchant: `python -m app.shards move <merchant_id> <shard>`
+    """
+    
+    if not is_admin_key(admin_key):
+        raise HTTPException(403, "Unauthorized")
+    
+    return {"enabled": shards.ENABLED, "shards": await asyncio.to_thread(shards.stats)}
+
+
+# ==================== ADMIN PROFILING ====================
+
+@router.get("/admin/profiles", include_in_schema=False)
+async def admin_list_profiles(
+    admin_key: str = Query(..., description="Admin API key")
+):
+    """
+    ADMIN ONLY - List stored request profiles (terbaru dulu)
+    
+    Trigger profiling: header "X-Profile: 1" + "X-Admin-Key: <ADMIN_KEY>",
+    atau env PROFILE_SAMPLE_RATE (mis. 0.01 = 1% request)
+    """
+    
+    if not is_admin_key(admin_key):
+        raise HTTPException(403, "Unauthorized")
+    
+    stored = list(profiler.sampler.stored.values())
+    return {
+        "active": len(profiler.sampler.active),
+        "stored": len(stored),
+        "stored_bytes": profiler.sampler.stored_bytes,
+        "profiles": [p.summary() for p in reversed(stored)]
+    }
+
+
+@router.get("/admin/profiles/{profile_id}", include_in_schema=False)
+async def admin_get_profile(
+    profile_id: str,
+    admin_key: str = Query(..., description="Admin API key")
+):
+    """
+    ADMIN ONLY - Collapsed stacks satu profile (format flamegraph.pl / speedscope)
+    
+    Contoh: curl ".../admin/profiles/prof_xxx?admin_key=..." | flamegraph.pl > flame.svg
+    """
+    
+    if not is_admin_key(admin_key):
+        raise HTTPException(403, "Unauthorized")
+    
+    profile = profiler.sampler.stored.get(profile_id)
+    if not profile:
+        raise HTTPException(404, "Profile not found (expired or still running)")
+    
+    return PlainTextResponse(profile.collapsed)
+
+
 # ==================== ADMIN SETUP (Development Only) ====================
 
-@app.post("/admin/setup", include_in_schema=False)
-async def admin_setup(db: Session = Depends(get_db)):
+@router.post("/admin/setup", include_in_schema=False)
+async def admin_setup(repo: Repository = Depends(get_repository)):
     """
     DEVELOPMENT ONLY - Setup default merchant
     
     Use /v1/merchants/register for production!
     """
     
-    existing = db.query(Merchant).filter(Merchant.id == "mrc_default").first()
+    existing = repo.get_merchant("mrc_default")
     if existing:
         return {
             "message": "Already setup",
@@ -1169,31 +1787,117 @@ async def admin_setup(db: Session = Depends(get_db)):
             "note": "Use /v1/merchants/register to create new merchants"
         }
     
-    merchant = Merchant(
-        id="mrc_default",
-        name="Default Merchant",
-        email="demo@example.com",
-        plan="free",
-        quota_limit=10
-    )
-    db.add(merchant)
-    db.flush()
-    
     api_key_value = f"inv_test_{os.urandom(12).hex()}"
     key_hash_value = hash_key(api_key_value)
     
-    api_key = APIKey(
-        merchant_id=merchant.id,
+    merchant, api_key = repo.create_merchant(
         key_hash=key_hash_value,
         key_prefix=api_key_value[:12],
-        name="Default API Key"
+        key_name="Default API Key",
+        id="mrc_default",
+        name="Default Merchant",
+        email="demo@example.com",
+        plan="free",
+        quota_limit=10
     )
-    db.add(api_key)
-    db.commit()
+    repo.commit()
     
     return {
         "message": "Setup complete!",
         "merchant_id": merchant.id,
         "api_key": api_key_value,
         "note": "SAVE THIS API KEY!"
-    }
\ No newline at end of file
+    }
+
+
+# ==================== APP FACTORY ====================
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup: engine & pool, tabel/index, pre-warm pool, background task
+    (atau embedded store, STORAGE_BACKEND=embedded), compress halaman statis.
+    Kalau database tidak bisa dihubungi, startup gagal (bukan cuma warning).
+    Shutdown: stop background task, tutup pool.
+    """
+    if repository.STORAGE_BACKEND == "embedded":
+        # Tanpa database: load snapshot + replay log (jobs, webhooks & group commit tidak jalan)
+        repository.open_storage()
+    else:
+        engine, _ = init_engines()
+        Base.metadata.create_all(bind=engine)
+        ensure_columns()
+        ensure_indexes()
+        # DATABASE_SHARDS: engine + tabel tenant per shard
+        shards.init_shards()
+        # Entry dari process sebelumnya bisa basi (database di-reset / diubah saat server mati)
+        authcache.invalidate_all()
+        if DB_POOL_PREWARM > 0:
+            prewarm_pools(DB_POOL_PREWARM)
+        if group_commit.GROUP_COMMIT_ENABLED:
+            group_commit.writer.start()
+        if jobs.JOBS_WORKER_ENABLED:
+            jobs.worker.start()
+    if admission.ADMISSION_ENABLED:
+        admission.controller.cap(admission.concurrency_cap())
+    LANDING_PAGE.prepare()
+    PRICING_PAGE.prepare()
+
+    try:
+        yield
+    finally:
+        await group_commit.writer.stop()
+        await changefeed.broadcaster.stop()
+        await jobs.worker.stop()
+        repository.close_storage()
+        shards.dispose_shards()
+        dispose_engines()
+
+
+def create_app() -> FastAPI:
+    """
+    Build FastAPI app tanpa I/O: database, pool & background task baru
+    dibuka di lifespan (saat uvicorn start / `with TestClient(app)`).
+    """
+    app = FastAPI(
+        title="UMKM Invoice API - Multi-tenant",
+        version="4.0.0",
+        description="Multi-tenant invoice API with usage tracking & analytics",
+        lifespan=lifespan
+    )
+
+    # Add middleware (skip dulu untuk fix error)
+    # app.middleware("http")(log_request_middleware)
+
+    # CORS configuration (untuk frontend nanti)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Production: ganti dengan domain spesifik
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Sampling profiler (opt-in: X-Profile + X-Admin-Key, atau PROFILE_SAMPLE_RATE)
+    app.add_middleware(profiler.ProfilerMiddleware)
+
+    # Hitung & ukur query SQL per request (request.state.sql)
+    app.add_middleware(sqlstats.SQLStatsMiddleware)
+
+    # Server-Timing + traceparent (opt-in: SERVER_TIMING=all / SERVER_TIMING_KEYS)
+    app.add_middleware(tracing.TracingMiddleware)
+
+    # gzip/brotli sesuai Accept-Encoding (StreamingResponse di-compress per chunk)
+    app.add_middleware(compression.CompressionMiddleware)
+
+    # Antre / tolak (503 + Retry-After) sebelum request menyentuh pool database
+    app.add_middleware(admission.AdmissionMiddleware)
+
+    # Metrics paling luar supaya latency mencakup semua middleware
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    app.include_router(router)
+    return app
+
+
+app = create_app()
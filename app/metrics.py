@@ -0,0 +1,257 @@
+"""
+Metrics registry (Prometheus text format) - di-expose di GET /metrics
+
+HOW IT WORKS:
+- Semua angka disimpan in-memory per worker process (tanpa DB). Update
+  datang dari event loop DAN thread (threadpool: get_request_db, event
+  checkout pool, job sync), jadi tiap metric punya threading.Lock sendiri
+  untuk read-modify-write (inc / observe) & snapshot saat scrape
+- Scrape /metrics hanya membaca dict + statistik pool SQLAlchemy
+- Multi-worker uvicorn: tiap worker punya registry sendiri; label `pid`
+  di process_start_time_seconds membantu membedakan worker saat scrape
+
+Metric yang tersedia: lihat bagian "METRICS" di bawah.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra: str = ""):
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self):
+        return []
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Gauge(Metric):
+    """Gauge biasa (set/inc/dec) atau callback (dibaca saat scrape)"""
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value: float, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def _samples(self):
+        if self._callback:
+            values = self._callback()
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels → [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labelvalues)
+            if data is None:
+                data = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            data[index] += 1
+            data[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            snapshot = [(key, list(data)) for key, data in self._values.items()]
+        lines = []
+        for key, data in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """Semua metric dalam Prometheus text format (version 0.0.4)"""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ==================== METRICS ====================
+
+PROCESS_START = Gauge(
+    "process_start_time_seconds", "Start time of this worker process (unix seconds)", ["pid"]
+)
+PROCESS_START.set(time.time(), os.getpid())
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency per route template", ["method", "route"]
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Requests per route template and status code", ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being processed"
+)
+HTTP_IN_FLIGHT.set(0)
+
+INVOICES_CREATED = Counter(
+    "invoices_created_total", "Invoices created per merchant plan", ["plan"]
+)
+QUOTA_REJECTIONS = Counter(
+    "quota_rejections_total", "Invoice creates rejected with 429 (quota exceeded) per plan", ["plan"]
+)
+AUTH_OUTCOMES = Counter(
+    "auth_requests_total", "API key authentication outcomes", ["outcome"]
+)
+AUTH_CACHE = Counter(
+    "auth_cache_lookups_total", "Shared auth cache lookups (hit, miss, stale)", ["result"]
+)
+
+JOBS_PROCESSED = Counter(
+    "jobs_processed_total", "Background jobs finished per kind and outcome (done, retry, failed)", ["kind", "outcome"]
+)
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Background job handler duration", ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+DB_POOL_CHECKOUTS = Counter(
+    "db_pool_checkouts_total", "Connections checked out from the SQLAlchemy pool", ["pool"]
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time a request waited to get its pooled connection", ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+
+_pools = {}
+
+
+def _pool_stats():
+    stats = []
+    for name, pool in _pools.items():
+        for stat in ("size", "checkedout", "overflow"):
+            fn = getattr(pool, stat, None)
+            if fn:
+                stats.append(((name, stat), fn()))
+    return stats
+
+
+DB_POOL = Gauge(
+    "db_pool_connections", "SQLAlchemy pool state (size, checkedout, overflow)", ["pool", "state"],
+    callback=_pool_stats
+)
+
+
+def instrument_engine(engine, name: str):
+    """Track pool checkout & state untuk satu engine (sekali per engine)"""
+    if _pools.get(name) is engine.pool:
+        return
+    _pools[name] = engine.pool
+    event.listen(engine, "checkout", lambda *args: DB_POOL_CHECKOUTS.inc(name))
+
+
+# ==================== ASGI MIDDLEWARE ====================
+
+class MetricsMiddleware:
+    """
+    Catat latency, status & in-flight per route template (bukan path mentah,
+    supaya /v1/invoices/{inv_id} tidak jadi ribuan series).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route_template(self, scope):
+        if self._routes is None:
+            self._routes = {
+                getattr(route, "endpoint", None): route.path
+                for route in scope["app"].routes
+            }
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = self._route_template(scope)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, status[0])
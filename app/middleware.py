@@ -2,12 +2,9 @@
 Middleware untuk track usage & analytics
 """
 from fastapi import Request
-from sqlalchemy.orm import Session
-from datetime import datetime
 import time
 
-from .database import SessionLocal
-from .db_models import UsageLog
+from . import repository
 
 
 async def log_request_middleware(request: Request, call_next):
@@ -43,23 +40,18 @@ async def log_request_middleware(request: Request, call_next):
     
     # Log to database (async, non-blocking)
     try:
-        db = SessionLocal()
-        
         # Only log if merchant authenticated (has merchant_id)
         if merchant_id:
-            usage_log = UsageLog(
-                merchant_id=merchant_id,
-                endpoint=request.url.path,
-                method=request.method,
-                status_code=response.status_code,
-                response_time_ms=response_time_ms,
-                user_agent=request.headers.get("user-agent", ""),
-                ip_address=request.client.host if request.client else ""
-            )
-            db.add(usage_log)
-            db.commit()
-        
-        db.close()
+            with repository.standalone(getattr(request.state, "shard_id", None)) as repo:
+                repo.log_usage(
+                    merchant_id,
+                    endpoint=request.url.path,
+                    method=request.method,
+                    status_code=response.status_code,
+                    response_time_ms=response_time_ms,
+                    user_agent=request.headers.get("user-agent", ""),
+                    ip_address=request.client.host if request.client else ""
+                )
     except Exception as e:
         # Don't fail request if logging fails
         print(f"Usage logging error: {e}")
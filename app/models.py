@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Literal
 from datetime import date
 
 class Item(BaseModel):
@@ -26,3 +26,17 @@ class CreateInvoice(BaseModel):
     issue_date: date
     due_date: Optional[date] = None
     notes: Optional[str] = None
+
+class UpdateInvoice(BaseModel):
+    status: Optional[Literal["issued", "paid", "void"]] = None
+    notes: Optional[str] = None
+
+class BatchGetInvoices(BaseModel):
+    ids: Optional[List[str]] = Field(None, max_length=1000)
+    numbers: Optional[List[str]] = Field(None, max_length=1000)
+    fields: Optional[List[str]] = None
+
+class CreateWebhook(BaseModel):
+    url: str
+    events: List[str] = ["invoice.created", "invoice.updated", "invoice.paid"]
+    batch_size: int = Field(1, ge=1, le=100)
@@ -0,0 +1,354 @@
+"""
+Rekonsiliasi pembayaran: file mutasi bank (CSV / NDJSON) → invoice "paid"
+
+HOW IT WORKS:
+1. Parse semua baris: amount (format "1.250.000,00" / "1,250,000.00" / "1250000"),
+   date (YYYY-MM-DD atau DD/MM/YYYY), reference. Debit (amount <= 0) diabaikan.
+2. Cocokkan per nomor invoice di reference (INV/2025/10/0001, juga INV-2025-10-0001,
+   INV 2025 10 1, ...): satu query IN (...) per RECONCILE_CHUNK nomor, lewat index
+   (merchant_id, number). Nominal harus sama dengan grand_total.
+3. Baris yang belum cocok: fallback nominal persis + window tanggal
+   (invoice dibuat <= RECONCILE_DATE_WINDOW_DAYS hari sebelum tanggal bayar),
+   query IN (...) per chunk nominal lewat index (merchant_id, grand_total).
+   Lebih dari satu kandidat → "ambiguous" (tidak ditandai paid, dicek manual).
+4. Semua invoice yang cocok → paid dalam UPDATE ... WHERE id IN (...) per chunk
+   (bukan per baris), + bulk INSERT payments, change feed & event webhook invoice.paid
+5. Report per baris: matched / amount_mismatch / already_paid / duplicate /
+   ambiguous / unmatched / ignored / invalid
+"""
+import csv
+import io
+import json
+import os
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from sqlalchemy import insert, select, update
+
+from . import changefeed, customers, revenue, webhooks
+from .db_models import Invoice, Payment, gen_id
+
+
+RECONCILE_MAX_LINES = int(os.getenv("RECONCILE_MAX_LINES", "100000"))
+RECONCILE_DATE_WINDOW_DAYS = int(os.getenv("RECONCILE_DATE_WINDOW_DAYS", "60"))
+RECONCILE_CHUNK = 500
+
+_NUMBER_RE = re.compile(r"INV[\s/\-._]*(\d{4})[\s/\-._]*(\d{1,2})[\s/\-._]*(\d{1,6})", re.IGNORECASE)
+_FIELD_ALIASES = {
+    "amount": ("amount", "nominal", "credit", "kredit", "jumlah"),
+    "date": ("date", "tanggal", "value_date", "tgl"),
+    "reference": ("reference", "description", "keterangan", "remark", "berita"),
+}
+
+
+class ReconcileError(ValueError):
+    """File mutasi tidak bisa dibaca (format / header / ukuran)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# ==================== PARSING ====================
+
+def parse_amount(value) -> int:
+    """Nominal rupiah (dibulatkan) dari angka atau teks format ID / EN"""
+    if isinstance(value, (int, float)):
+        return round(value)
+    if value is None:
+        raise ValueError("Missing amount")
+    text = re.sub(r"[^\d,.\-]", "", str(value))
+    separators = [c for c in text if c in ",."]
+    decimal = None
+    if len(set(separators)) == 2:
+        decimal = separators[-1]  # "1.250.000,00" / "1,250,000.00"
+    elif len(separators) == 1 and len(text) - text.rfind(separators[0]) - 1 != 3:
+        decimal = separators[0]  # "1250000,5" (bukan "1.250" = seribu dua ratus lima puluh)
+    for sep in {",", "."} - {decimal}:
+        text = text.replace(sep, "")
+    if decimal:
+        text = text.replace(decimal, ".")
+    try:
+        return round(float(text))
+    except ValueError:
+        raise ValueError(f"Invalid amount: {value!r}") from None
+
+
+def parse_date(value) -> date:
+    return _parse_date_text(str(value).strip())
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(text: str) -> date:
+    """Cache: satu file mutasi cuma punya puluhan tanggal berbeda, strptime mahal"""
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(text[:10], fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date: {text!r}")
+
+
+def extract_number(reference: str):
+    """Nomor invoice (format next_number_db) dari teks berita transfer, atau None"""
+    for match in _NUMBER_RE.finditer(reference or ""):
+        year, month, seq = match.groups()
+        if 1 <= int(month) <= 12:
+            return f"INV/{year}/{int(month):02d}/{int(seq):04d}"
+    return None
+
+
+def _pick_field(record: dict, field: str):
+    for alias in _FIELD_ALIASES[field]:
+        if alias in record:
+            return record[alias]
+    return None
+
+
+def read_lines(body: bytes, fmt: str = None):
+    """
+    Returns list dict {line, amount, date, reference, error}.
+    fmt: "csv" / "ndjson" / None (deteksi dari isi).
+    """
+    text = body.decode("utf-8-sig")
+    if fmt is None:
+        fmt = "ndjson" if text.lstrip().startswith("{") else "csv"
+
+    if fmt == "ndjson":
+        records = []
+        for number, raw in enumerate(text.splitlines(), start=1):
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+                records.append((number, {str(k).lower(): v for k, v in record.items()}))
+            except (ValueError, AttributeError):
+                records.append((number, None))
+    elif fmt == "csv":
+        sample = text[:4096]
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+        if not reader.fieldnames:
+            raise ReconcileError("Empty file")
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        if not any(alias in reader.fieldnames for alias in _FIELD_ALIASES["amount"]):
+            raise ReconcileError(f"CSV header needs an amount column, got {reader.fieldnames}")
+        records = [(reader.line_num, record) for record in reader]
+    else:
+        raise ReconcileError(f"Unknown format {fmt!r} (csv | ndjson)")
+
+    if len(records) > RECONCILE_MAX_LINES:
+        raise ReconcileError(f"Too many lines ({len(records)}), max {RECONCILE_MAX_LINES} per file", 413)
+
+    lines = []
+    for number, record in records:
+        line = {"line": number, "amount": None, "date": None, "reference": "", "error": None}
+        try:
+            if record is None:
+                raise ValueError("Invalid JSON line")
+            line["amount"] = parse_amount(_pick_field(record, "amount"))
+            line["date"] = parse_date(_pick_field(record, "date"))
+            line["reference"] = str(_pick_field(record, "reference") or "")[:500]
+        except (ValueError, TypeError) as e:
+            line["error"] = str(e)
+        lines.append(line)
+    return lines
+
+
+# ==================== MATCHING ====================
+
+def _chunks(values, size: int = RECONCILE_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def reconcile(db, merchant, lines, dry_run: bool = False, window_days: int = RECONCILE_DATE_WINDOW_DAYS):
+    """
+    Cocokkan `lines` (hasil read_lines) ke invoice merchant; kalau bukan dry_run,
+    tandai paid + simpan payments di session `db` (caller yang commit).
+
+    Returns:
+        (summary dict, list hasil per baris)
+    """
+    columns = [
+        Invoice.id, Invoice.number, Invoice.status, Invoice.subtotal, Invoice.tax_total,
+        Invoice.grand_total, Invoice.created_at, Invoice.customer_id
+    ]
+
+    results = []
+    pending = []  # baris valid yang belum cocok
+    for line in lines:
+        if line["error"]:
+            results.append({"line": line["line"], "status": "invalid", "error": line["error"]})
+        elif line["amount"] <= 0:
+            results.append({"line": line["line"], "status": "ignored", "reason": "debit / zero amount"})
+        else:
+            line["number"] = extract_number(line["reference"])
+            pending.append(line)
+
+    used = set()
+    matches = []  # (line, invoice row, matched_by)
+
+    # 1) Nomor invoice di reference
+    numbers = {line["number"] for line in pending if line["number"]}
+    by_number = {}
+    for chunk in _chunks(numbers):
+        for row in db.execute(
+            select(*columns).where(Invoice.merchant_id == merchant.id, Invoice.number.in_(chunk))
+        ):
+            by_number[row.number] = row
+
+    remaining = []
+    for line in pending:
+        invoice = by_number.get(line["number"]) if line["number"] else None
+        if invoice is None:
+            remaining.append(line)
+        elif invoice.id in used:
+            results.append(_result(line, "duplicate", invoice))
+        elif invoice.status == "paid":
+            results.append(_result(line, "already_paid", invoice))
+        elif invoice.status != "issued":
+            results.append(_result(line, "not_payable", invoice))
+        elif invoice.grand_total != line["amount"]:
+            results.append({**_result(line, "amount_mismatch", invoice), "expected_amount": invoice.grand_total})
+        else:
+            used.add(invoice.id)
+            matches.append((line, invoice, "number"))
+
+    # 2) Fallback: nominal persis + window tanggal
+    if remaining:
+        # Window tanggal sengaja tidak di SQL: dengan range created_at, planner memilih
+        # scan ix_invoices_merchant_created (~8x lebih lambat dari seek per nominal)
+        by_amount = defaultdict(list)  # nominal → rows urut created_at
+        for chunk in _chunks({line["amount"] for line in remaining}):
+            for row in db.execute(
+                select(*columns).where(
+                    Invoice.merchant_id == merchant.id,
+                    Invoice.grand_total.in_(chunk),
+                    Invoice.status == "issued"
+                )
+            ):
+                by_amount[row.grand_total].append(row)
+        for rows in by_amount.values():
+            rows.sort(key=lambda row: row.created_at)
+        created = {amount: [row.created_at for row in rows] for amount, rows in by_amount.items()}
+
+        for line in remaining:
+            rows = by_amount.get(line["amount"], ())
+            candidates = []
+            if rows:
+                # Window per baris lewat bisect: nominal pasaran (mis. Rp 50.000) bisa punya ribuan invoice
+                times = created[line["amount"]]
+                lo = bisect_left(times, datetime.combine(line["date"] - timedelta(days=window_days), datetime.min.time()))
+                hi = bisect_left(times, datetime.combine(line["date"] + timedelta(days=1), datetime.min.time()))
+                for row in rows[lo:hi]:
+                    if row.id not in used:
+                        candidates.append(row)
+                        if len(candidates) > 5:
+                            break
+            if len(candidates) == 1:
+                used.add(candidates[0].id)
+                matches.append((line, candidates[0], "amount"))
+            elif candidates:
+                results.append({
+                    "line": line["line"], "status": "ambiguous", "amount": line["amount"],
+                    "candidates": [row.id for row in candidates[:5]]
+                })
+            else:
+                results.append({
+                    "line": line["line"], "status": "unmatched", "amount": line["amount"],
+                    "reference": line["reference"]
+                })
+
+    for line, invoice, matched_by in matches:
+        results.append({**_result(line, "matched", invoice), "matched_by": matched_by})
+    results.sort(key=lambda r: r["line"])
+
+    paid = 0
+    if matches and not dry_run:
+        paid = _apply(db, merchant, matches, merchant.plan in webhooks.WEBHOOK_PLANS)
+
+    summary = defaultdict(int)
+    for result in results:
+        summary[result["status"]] += 1
+    return {
+        "lines": len(lines),
+        "matched_amount": sum(line["amount"] for line, _, _ in matches),
+        "invoices_paid": paid,
+        "dry_run": dry_run,
+        **summary
+    }, results
+
+
+def _result(line, status: str, invoice):
+    return {
+        "line": line["line"], "status": status, "amount": line["amount"],
+        "invoice_id": invoice.id, "number": invoice.number
+    }
+
+
+def _apply(db, merchant, matches, with_events: bool) -> int:
+    """Set-based: UPDATE status per chunk id, bulk INSERT payments, changes & events"""
+    now = datetime.utcnow()
+    # UPDATE ... RETURNING id (SQLite >= 3.35, PostgreSQL): baris yang benar-benar kita ubah
+    returning = db.get_bind(Invoice).dialect.update_returning
+    applied = []
+    for chunk in _chunks(matches):
+        ids = [invoice.id for _, invoice, _ in chunk]
+        # Tanpa filter merchant_id: id sudah dari SELECT per merchant, dan dengan
+        # merchant_id planner SQLite memilih scan ix_invoices_merchant_created, bukan PK
+        stmt = (
+            update(Invoice)
+            .where(Invoice.id.in_(ids), Invoice.status == "issued")
+            .values(status="paid", updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if returning:
+            ours = set(db.execute(stmt.returning(Invoice.id)).scalars())
+            if len(ours) != len(ids):
+                # Sebagian sudah diubah request lain di antara SELECT & UPDATE
+                chunk = [match for match in chunk if match[1].id in ours]
+        elif db.execute(stmt).rowcount != len(ids):
+            # Fallback tanpa RETURNING: baris kita = paid dengan updated_at persis `now`
+            ours = set(db.execute(
+                select(Invoice.id).where(Invoice.id.in_(ids), Invoice.status == "paid", Invoice.updated_at == now)
+            ).scalars())
+            chunk = [match for match in chunk if match[1].id in ours]
+        applied.extend(chunk)
+
+    if not applied:
+        return 0
+
+    db.execute(insert(Payment.__table__), [
+        {
+            "id": gen_id("pay"), "merchant_id": merchant.id, "invoice_id": invoice.id,
+            "amount": line["amount"], "paid_on": line["date"], "reference": line["reference"],
+            "matched_by": matched_by, "created_at": now
+        }
+        for line, invoice, matched_by in applied
+    ])
+
+    # Payload (customer, tanggal) hanya dibaca untuk invoice yang benar-benar dibayar
+    payloads = {}
+    for chunk in _chunks([invoice.id for _, invoice, _ in applied]):
+        payloads.update(db.execute(select(Invoice.id, Invoice.payload).where(Invoice.id.in_(chunk))).all())
+    datas = [
+        webhooks.invoice_data(
+            invoice, status="paid", payload=payloads.get(invoice.id),
+            payment={"amount": line["amount"], "paid_on": line["date"].isoformat(), "reference": line["reference"]}
+        )
+        for line, invoice, _ in applied
+    ]
+    changefeed.record_many(db, merchant.id, "invoice.paid", datas)
+    revenue.record_status(db, merchant.id, [invoice for _, invoice, _ in applied], "issued", "paid", payloads)
+    customers.record_status(db, [invoice for _, invoice, _ in applied], "issued", "paid")
+    if with_events:
+        webhooks.emit_many(db, merchant, "invoice.paid", datas)
+    return len(applied)
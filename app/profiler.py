@@ -0,0 +1,198 @@
+"""
+Sampling profiler untuk request live (opt-in, aman untuk production)
+
+HOW IT WORKS:
+1. Request di-profile kalau:
+   - header "X-Profile: 1" + "X-Admin-Key" yang valid, atau
+   - terpilih random sesuai PROFILE_SAMPLE_RATE (0.0 - 1.0, default 0 = off)
+2. Satu sampler thread (daemon) mengambil stack thread event loop tiap
+   PROFILE_INTERVAL_MS selama request berjalan (sys._current_frames, tanpa
+   tracing → overhead rendah). Kalau task request sedang tidak jalan
+   (menunggu I/O / thread lain), sample dicatat sebagai "(waiting)".
+3. Hasilnya disimpan sebagai collapsed stacks ("a;b;c 12"), format input
+   flamegraph.pl / speedscope, diambil lewat GET /admin/profiles/{id}
+
+Batas keras:
+- PROFILE_MAX_CONCURRENT request di-profile bersamaan (sisanya jalan biasa)
+- PROFILE_MAX_SECONDS sampling per request
+- PROFILE_MAX_STORED profile & PROFILE_MAX_BYTES total (yang lama dibuang)
+"""
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from .auth import is_admin_key
+from .db_models import gen_id
+
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(5 * 1024 * 1024)))
+
+MAX_STACK_DEPTH = 64
+
+
+class Profile:
+    def __init__(self, method: str, path: str, thread_id: int, loop, task, trigger: str):
+        self.id = gen_id("prof")
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.thread_id = thread_id
+        self.loop = loop
+        self.task = task
+        self.started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+        self.duration_ms = None
+        self.status = None
+        self.samples = 0
+        self.stacks = {}
+        self.collapsed = ""
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "samples": self.samples,
+            "bytes": len(self.collapsed)
+        }
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Satu thread untuk semua profile aktif; tidur kalau tidak ada yang aktif"""
+
+    def __init__(self):
+        self.active = {}
+        self.stored = OrderedDict()
+        self.stored_bytes = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def try_start(self, profile: Profile):
+        with self._lock:
+            if len(self.active) >= PROFILE_MAX_CONCURRENT:
+                return False
+            self.active[profile.id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return True
+
+    def finish(self, profile: Profile, status: int):
+        with self._lock:
+            self.active.pop(profile.id, None)
+            stacks, profile.stacks = profile.stacks, None
+
+        profile.status = status
+        profile.duration_ms = round((time.perf_counter() - profile.started) * 1000, 2)
+        profile.collapsed = "\n".join(
+            f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda kv: -kv[1])
+        ) + "\n"
+
+        size = len(profile.collapsed)
+        if size > PROFILE_MAX_BYTES:
+            return
+        with self._lock:
+            self.stored[profile.id] = profile
+            self.stored_bytes += size
+            while len(self.stored) > PROFILE_MAX_STORED or self.stored_bytes > PROFILE_MAX_BYTES:
+                _, old = self.stored.popitem(last=False)
+                self.stored_bytes -= len(old.collapsed)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            if not self.active:
+                self._wake.clear()
+                self._wake.wait()
+                continue
+
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            with self._lock:
+                for profile in self.active.values():
+                    if now - profile.started > PROFILE_MAX_SECONDS:
+                        continue
+                    if asyncio.current_task(profile.loop) is profile.task:
+                        frame = frames.get(profile.thread_id)
+                        stack = _collapse(frame) if frame is not None else "(unknown)"
+                    else:
+                        stack = "(waiting)"
+                    profile.stacks[stack] = profile.stacks.get(stack, 0) + 1
+                    profile.samples += 1
+            del frames
+            time.sleep(interval)
+
+
+sampler = Sampler()
+
+
+class ProfilerMiddleware:
+    """Profile request yang terpilih, tambah header X-Profile-Id di response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _trigger(self, scope):
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1":
+            admin_key = headers.get(b"x-admin-key", b"").decode("latin-1")
+            if is_admin_key(admin_key):
+                return "header"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trigger = self._trigger(scope)
+        if not trigger:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(
+            scope["method"], scope["path"], threading.get_ident(),
+            asyncio.get_running_loop(), asyncio.current_task(), trigger
+        )
+        if not sampler.try_start(profile):
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.finish(profile, status[0])
@@ -0,0 +1,441 @@
+"""
+Repository interface - merchant, API key, invoice & usage log
+
+HOW IT WORKS:
+- Handler inti (register, merchants/me, api-keys, invoices, usage, analytics,
+  admin plan/quota) dan auth tidak query Session langsung, tapi lewat
+  Depends(get_repository) → object dengan interface `Repository` di bawah
+- STORAGE_BACKEND=sql (default): SQLRepository membungkus session request
+  (get_request_db), query-nya sama persis seperti sebelumnya (query budget,
+  auth cache, group commit, webhook outbox tetap jalan). Dengan DATABASE_SHARDS,
+  repo.route(merchant) di auth mengarahkan data tenant ke shard merchant
+  (app/shards.py)
+- STORAGE_BACKEND=embedded: EmbeddedStore (app/embedded_store.py), data di
+  memory + append-only log + snapshot di disk lokal, tanpa database server.
+  Untuk edge kiosk (1 process) dan test run cepat
+- Fitur yang butuh SQL (webhooks, payments, export, jobs) pakai
+  Depends(require_sql): 501 di backend embedded
+
+Object yang di-return (merchant, key, invoice) punya atribut sama dengan
+model di app/db_models.py. Anggap read-only: perubahan HARUS lewat method
+repository (update_merchant, revoke_api_key, ...), lalu commit().
+"""
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import and_, func, or_, text, update
+from sqlalchemy.orm import Session, defer, load_only
+
+from . import changefeed, customers, database, revenue, shards, webhooks
+from .database import get_request_db
+from .db_models import APIKey, Invoice, Merchant, UsageLog
+from .invoicing import create_invoice_record
+from .models import CreateInvoice
+
+
+# "sql" (SQLAlchemy, DATABASE_URL) atau "embedded" (lihat app/embedded_store.py)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sql").lower()
+if STORAGE_BACKEND not in ("sql", "embedded"):
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (sql, embedded)")
+
+# Key per IN (...) di get_invoices (batchGet): jauh di bawah limit parameter SQLite
+BATCH_GET_CHUNK = int(os.getenv("BATCH_GET_CHUNK", "500"))
+
+
+# ==================== INTERFACE ====================
+
+class Repository:
+    """Operasi storage yang dipakai handler; lihat SQLRepository & EmbeddedStore"""
+
+    backend = ""
+
+    def ping(self) -> str:
+        """Status storage untuk /healthz"""
+        raise NotImplementedError
+
+    def commit(self):
+        """Akhir unit of work: perubahan request ini durable"""
+        raise NotImplementedError
+
+    def route(self, merchant):
+        """Data tenant unit of work ini → shard merchant (auth). Default: satu storage, tidak ada routing"""
+
+    # ---------- merchants ----------
+
+    def get_merchant(self, merchant_id: str):
+        raise NotImplementedError
+
+    def get_merchant_by_email(self, email: str):
+        raise NotImplementedError
+
+    def get_active_merchant(self, merchant_id: str):
+        raise NotImplementedError
+
+    def create_merchant(self, key_hash: str, key_prefix: str, key_name: str, **fields):
+        """Merchant baru + API key pertamanya. Returns (merchant, api_key)"""
+        raise NotImplementedError
+
+    def update_merchant(self, merchant, **fields):
+        """Ubah kolom merchant (plan, quota_limit, quota_used, ...). Returns merchant terbaru"""
+        raise NotImplementedError
+
+    def reset_quotas(self):
+        """quota_used = 0 untuk semua merchant aktif. Returns (jumlah merchant aktif, jumlah yang di-reset)"""
+        raise NotImplementedError
+
+    # ---------- api keys ----------
+
+    def find_active_key(self, key_hash: str):
+        raise NotImplementedError
+
+    def touch_api_key(self, key_id: str, now: datetime):
+        """Update last_used (dipanggil auth, paling sering sekali per LAST_USED_RESOLUTION)"""
+        raise NotImplementedError
+
+    def list_api_keys(self, merchant_id: str):
+        """Semua key merchant, terbaru dulu"""
+        raise NotImplementedError
+
+    def get_api_key(self, merchant_id: str, key_id: str):
+        raise NotImplementedError
+
+    def create_api_key(self, merchant_id: str, key_hash: str, key_prefix: str, name: str):
+        raise NotImplementedError
+
+    def revoke_api_key(self, api_key):
+        """is_active = False (tidak dihapus, untuk audit trail). Returns key terbaru"""
+        raise NotImplementedError
+
+    # ---------- invoices ----------
+
+    def create_invoice(self, merchant, payload: CreateInvoice) -> dict:
+        """Nomor urut per merchant + insert + increment quota. Returns response body POST /v1/invoices"""
+        raise NotImplementedError
+
+    def get_invoice(self, merchant_id: str, inv_id: str):
+        raise NotImplementedError
+
+    def get_invoice_by_number(self, merchant_id: str, number: str):
+        raise NotImplementedError
+
+    def get_invoices(self, merchant_id: str, keys, by: str = "id", columns=None) -> dict:
+        """
+        Banyak invoice sekaligus (batchGet): `keys` = id, atau nomor kalau by="number".
+        Returns {key: invoice} untuk yang ketemu (punya merchant ini saja).
+        `columns`: nama kolom Invoice yang dipakai caller (None = semua)
+        """
+        raise NotImplementedError
+
+    def list_invoices(self, merchant_id: str, limit: int, offset: int = 0, cursor: str = None):
+        """
+        Invoice merchant urut (created_at, id) DESC. `cursor` = id invoice
+        terakhir halaman sebelumnya (keyset); 400 kalau cursor tidak valid.
+        """
+        raise NotImplementedError
+
+    def count_invoices(self, merchant_id: str, since: datetime = None) -> int:
+        raise NotImplementedError
+
+    def update_invoice(self, merchant, invoice, changes: dict, event_type: str):
+        """Ubah status / payload invoice, kirim event webhook `event_type` (kalau ada). Returns invoice terbaru"""
+        raise NotImplementedError
+
+    # ---------- usage ----------
+
+    def log_usage(self, merchant_id: str, **fields):
+        raise NotImplementedError
+
+    def usage_summary(self, merchant_id: str, since: datetime):
+        """Returns (total calls, [(endpoint, calls)], rata-rata response time ms)"""
+        raise NotImplementedError
+
+
+# ==================== SQLALCHEMY ====================
+
+class SQLRepository(Repository):
+    """Repository di atas satu Session (session request dari get_request_db)"""
+
+    backend = "sql"
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def ping(self):
+        self.db.execute(text("SELECT 1"))
+        return "connected"
+
+    def commit(self):
+        self.db.commit()
+
+    def route(self, merchant):
+        shards.route(self.db, merchant)
+
+    # ---------- merchants ----------
+
+    def get_merchant(self, merchant_id):
+        return self.db.query(Merchant).filter(Merchant.id == merchant_id).first()
+
+    def get_merchant_by_email(self, email):
+        return self.db.query(Merchant).filter(Merchant.email == email).first()
+
+    def get_active_merchant(self, merchant_id):
+        return self.db.query(Merchant).filter(
+            Merchant.id == merchant_id,
+            Merchant.is_active == True
+        ).first()
+
+    def create_merchant(self, key_hash, key_prefix, key_name, **fields):
+        fields.setdefault("shard_id", shards.place(fields.get("email", "")))
+        merchant = Merchant(quota_used=0, **fields)
+        self.db.add(merchant)
+        self.db.flush()
+
+        api_key = APIKey(
+            merchant_id=merchant.id,
+            key_hash=key_hash,
+            key_prefix=key_prefix,
+            name=key_name
+        )
+        self.db.add(api_key)
+        return merchant, api_key
+
+    def update_merchant(self, merchant, **fields):
+        for name, value in fields.items():
+            setattr(merchant, name, value)
+        return merchant
+
+    def reset_quotas(self):
+        merchants = self.db.query(Merchant).filter(Merchant.is_active == True).all()
+
+        reset_count = 0
+        for merchant in merchants:
+            if merchant.quota_used > 0:
+                merchant.quota_used = 0
+                reset_count += 1
+        return len(merchants), reset_count
+
+    # ---------- api keys ----------
+
+    def find_active_key(self, key_hash):
+        return self.db.query(APIKey).filter(
+            APIKey.key_hash == key_hash,
+            APIKey.is_active == True
+        ).first()
+
+    def touch_api_key(self, key_id, now):
+        """
+        Kalau session request ini session writer, update ikut transaksi request
+        (di-commit oleh get_request_db). Kalau session read-only (GET di SQLite
+        production profile), pakai transaksi kecil terpisah di writer.
+        """
+        stmt = (
+            update(APIKey).where(APIKey.id == key_id).values(last_used=now)
+            .execution_options(authcache_skip=True)  # last_used tidak perlu invalidate auth cache
+        )
+        if self.db.get_bind() is database.engine:
+            self.db.execute(stmt)
+        else:
+            with database.engine.begin() as conn:
+                conn.execute(stmt)
+
+    def list_api_keys(self, merchant_id):
+        return self.db.query(APIKey).filter(
+            APIKey.merchant_id == merchant_id
+        ).order_by(APIKey.created_at.desc()).all()
+
+    def get_api_key(self, merchant_id, key_id):
+        return self.db.query(APIKey).filter(
+            APIKey.id == key_id,
+            APIKey.merchant_id == merchant_id
+        ).first()
+
+    def create_api_key(self, merchant_id, key_hash, key_prefix, name):
+        api_key = APIKey(
+            merchant_id=merchant_id,
+            key_hash=key_hash,
+            key_prefix=key_prefix,
+            name=name
+        )
+        self.db.add(api_key)
+        self.db.flush()  # id & created_at (default kolom) terisi
+        return api_key
+
+    def revoke_api_key(self, api_key):
+        api_key.is_active = False
+        return api_key
+
+    # ---------- invoices ----------
+
+    def create_invoice(self, merchant, payload):
+        # Merchant masih attached ke session request ini (lihat get_request_db)
+        return create_invoice_record(self.db, merchant, payload)
+
+    def get_invoice(self, merchant_id, inv_id):
+        return self.db.query(Invoice).filter(
+            Invoice.id == inv_id,
+            Invoice.merchant_id == merchant_id  # ✅ Security check!
+        ).first()
+
+    def get_invoice_by_number(self, merchant_id, number):
+        return self.db.query(Invoice).filter(
+            Invoice.merchant_id == merchant_id,
+            Invoice.number == number
+        ).first()
+
+    def get_invoices(self, merchant_id, keys, by="id", columns=None):
+        # Satu IN (...) per chunk: by id lewat primary key, by number lewat
+        # index unik (merchant_id, number)
+        key_column = Invoice.id if by == "id" else Invoice.number
+        query = self.db.query(Invoice)
+        if columns is not None:
+            query = query.options(load_only(
+                Invoice.id, Invoice.number, *(getattr(Invoice, name) for name in columns)
+            ))
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(keys), BATCH_GET_CHUNK):
+            rows = query.filter(
+                Invoice.merchant_id == merchant_id,  # ✅ Security check!
+                key_column.in_(keys[i:i + BATCH_GET_CHUNK])
+            ).all()
+            found.update((getattr(invoice, by), invoice) for invoice in rows)
+        return found
+
+    def list_invoices(self, merchant_id, limit, offset=0, cursor=None):
+        query = self.db.query(Invoice).options(defer(Invoice.breakdown)).filter(
+            Invoice.merchant_id == merchant_id  # ✅ Filter by merchant!
+        )
+
+        if cursor:
+            last = self.db.query(Invoice.created_at, Invoice.id).filter(
+                Invoice.id == cursor,
+                Invoice.merchant_id == merchant_id
+            ).first()
+            if not last:
+                raise HTTPException(400, "Invalid cursor")
+
+            query = query.filter(or_(
+                Invoice.created_at < last.created_at,
+                and_(Invoice.created_at == last.created_at, Invoice.id < last.id)
+            ))
+
+        return query.order_by(
+            Invoice.created_at.desc(), Invoice.id.desc()
+        ).limit(limit).offset(0 if cursor else offset).all()
+
+    def count_invoices(self, merchant_id, since=None):
+        query = self.db.query(func.count(Invoice.id)).filter(Invoice.merchant_id == merchant_id)
+        if since is not None:
+            query = query.filter(Invoice.created_at >= since)
+        return query.scalar() or 0
+
+    def update_invoice(self, merchant, invoice, changes, event_type):
+        old_status = invoice.status
+        for name, value in changes.items():
+            setattr(invoice, name, value)
+        data = webhooks.invoice_data(invoice)
+        webhooks.emit(self.db, merchant, event_type, data)
+        changefeed.record(self.db, merchant.id, event_type, data)
+        revenue.record_status(self.db, merchant.id, [invoice], old_status, invoice.status)
+        customers.record_status(self.db, [invoice], old_status, invoice.status)
+        return invoice
+
+    # ---------- usage ----------
+
+    def log_usage(self, merchant_id, **fields):
+        self.db.add(UsageLog(merchant_id=merchant_id, **fields))
+
+    def usage_summary(self, merchant_id, since):
+        in_range = (UsageLog.merchant_id == merchant_id, UsageLog.created_at >= since)
+
+        total_calls = self.db.query(func.count(UsageLog.id)).filter(*in_range).scalar() or 0
+
+        endpoint_stats = self.db.query(
+            UsageLog.endpoint,
+            func.count(UsageLog.id).label("count")
+        ).filter(*in_range).group_by(UsageLog.endpoint).all()
+
+        avg_response_time = self.db.query(
+            func.avg(UsageLog.response_time_ms)
+        ).filter(*in_range).scalar() or 0
+
+        return total_calls, [(stat.endpoint, stat.count) for stat in endpoint_stats], avg_response_time
+
+
+# ==================== DEPENDENCIES ====================
+
+store = None  # EmbeddedStore, dibuka oleh open_storage() (hanya STORAGE_BACKEND=embedded)
+
+
+def open_storage():
+    """
+    Startup (lifespan): buka embedded store (load snapshot + replay log).
+    Backend sql: tidak ada apa-apa, engine dibuka oleh database.init_engines().
+    """
+    global store
+
+    if STORAGE_BACKEND == "embedded" and store is None:
+        from .embedded_store import EmbeddedStore, EMBEDDED_DATA_DIR
+
+        store = EmbeddedStore()
+        store.open(EMBEDDED_DATA_DIR)
+    return store
+
+
+def close_storage():
+    """Shutdown: snapshot terakhir + tutup log (embedded)"""
+    global store
+
+    if store is not None:
+        store.close()
+        store = None
+
+
+async def _sql_repository(db: Session = Depends(get_request_db)):
+    # Session yang sama dengan Depends(get_request_db) di handler (cache per request).
+    # async def: jalan di event loop. Dependency sync butuh slot threadpool lagi
+    # padahal get_request_db sudah pegang writer connection → burst request yang
+    # nunggu writer di threadpool bikin pemegang writer tidak dapat thread (deadlock)
+    return SQLRepository(db)
+
+
+def _embedded_repository():
+    if store is None:
+        raise HTTPException(503, "Storage is not open")
+    try:
+        yield store
+    finally:
+        store.commit()
+
+
+# Dependency handler & auth: dipilih sekali saat import, sesuai STORAGE_BACKEND
+get_repository = _embedded_repository if STORAGE_BACKEND == "embedded" else _sql_repository
+
+
+def require_sql():
+    """Dependency (dependencies=[...]) untuk endpoint yang hanya ada di backend sql"""
+    if STORAGE_BACKEND != "sql":
+        raise HTTPException(501, f"Not available with STORAGE_BACKEND={STORAGE_BACKEND}")
+
+
+@contextmanager
+def standalone(shard_id=None):
+    """Repository di luar request (middleware, script): commit di akhir blok. shard_id: data tenant merchant itu"""
+    if STORAGE_BACKEND == "embedded":
+        try:
+            yield open_storage()
+        finally:
+            store.commit()
+        return
+
+    db = shards.session(shard_id)
+    try:
+        yield SQLRepository(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,416 @@
+"""
+Agregat revenue per merchant: GET /v1/merchants/me/revenue
+
+Dashboard nilai invoice, pajak & jumlah invoice per hari / bulan tanpa
+SUM(grand_total) atas seluruh tabel invoices.
+
+HOW IT WORKS:
+1. Dua tabel agregat (tabel tenant, ikut shard merchant), bucket = issue_date
+   invoice (fallback created_at untuk invoice tanpa issue_date), per currency:
+   - revenue_daily (merchant, day, currency): semua invoice kecuali void
+   - revenue_monthly (merchant, month, status, currency): per status
+2. Di-update di transaksi yang sama dengan create / perubahan status: delta per
+   bucket lalu upsert increment (INSERT ... ON CONFLICT DO UPDATE SET
+   x = x + excluded.x), jadi tidak ada read-modify-write dan tidak ada
+   update yang hilang antar request.
+   - create: +1 ke bucket invoice
+   - status berubah: -1 bucket status lama, +1 bucket status baru
+     (daily hanya berubah kalau void ikut terlibat)
+   Penulis satu merchant di-serialize (changefeed.lock_merchant), sama dengan
+   rebuild di bawah.
+3. Endpoint hanya membaca bucket dalam range: biaya O(jumlah bucket), berapapun
+   jumlah invoice-nya.
+4. Consistency checker (`python -m app.revenue check|rebuild`):
+   - check: hitung ulang dari invoices per chunk (keyset id, REVENUE_CHECK_BATCH
+     baris, read-only) lalu bandingkan dengan agregat → daftar bulan yang beda
+   - rebuild: bulan yang beda (atau semua, --all) dihitung ulang satu transaksi
+     pendek per bulan: hapus bucket bulan itu, baca invoices bulan itu, tulis
+     ulang. Statement pertama = DELETE, jadi writer sudah dipegang sebelum
+     membaca (hasil tepat walau ada write bersamaan). Juga untuk invoice lama
+     (sebelum fitur ini ada).
+"""
+import argparse
+import logging
+import os
+import time
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import config  # noqa: F401  (python -m app.revenue: load .env sebelum module lain)
+from . import changefeed, database, shards
+from .db_models import Invoice, Merchant, RevenueDaily, RevenueMonthly, gen_id
+
+logger = logging.getLogger(__name__)
+
+REVENUE_MAX_DAYS = int(os.getenv("REVENUE_MAX_DAYS", "366"))  # range maks. granularity=day
+REVENUE_MAX_MONTHS = int(os.getenv("REVENUE_MAX_MONTHS", "120"))
+REVENUE_CHECK_BATCH = int(os.getenv("REVENUE_CHECK_BATCH", "5000"))
+REVENUE_REBUILD_PAUSE_MS = float(os.getenv("REVENUE_REBUILD_PAUSE_MS", "50"))
+
+GRANULARITIES = ("day", "month")
+_SUMS = ("invoice_count", "subtotal", "tax_total", "grand_total")
+
+# Bucket satu invoice pada satu status
+State = namedtuple("State", "day currency status subtotal tax_total grand_total")
+
+
+def _day(issue_date, created_at) -> date:
+    if issue_date:
+        try:
+            return date.fromisoformat(str(issue_date)[:10])
+        except ValueError:
+            pass
+    return (created_at or datetime.utcnow()).date()
+
+
+def invoice_state(invoice, payload: dict = None, status: str = None) -> State:
+    """
+    Bucket invoice (atau row hasil query bulk). `payload`: kalau row tanpa kolom
+    payload; `status`: kalau beda dengan invoice.status (mis. status lama).
+    """
+    payload = (invoice.payload if payload is None else payload) or {}
+    return State(
+        _day(payload.get("issue_date"), getattr(invoice, "created_at", None)),
+        payload.get("currency") or "IDR",
+        status or invoice.status or "issued",
+        invoice.subtotal or 0,
+        invoice.tax_total or 0,
+        invoice.grand_total or 0
+    )
+
+
+def _buckets(changes):
+    """(State, +1/-1) → (daily {(day, currency): sums}, monthly {(month, status, currency): sums})"""
+    daily = defaultdict(lambda: [0, 0, 0, 0])
+    monthly = defaultdict(lambda: [0, 0, 0, 0])
+    for state, sign in changes:
+        values = (sign, sign * state.subtotal, sign * state.tax_total, sign * state.grand_total)
+        targets = [monthly[(state.day.replace(day=1), state.status, state.currency)]]
+        if state.status != "void":
+            targets.append(daily[(state.day, state.currency)])
+        for sums in targets:
+            for i, value in enumerate(values):
+                sums[i] += value
+    return (
+        {key: sums for key, sums in daily.items() if any(sums)},
+        {key: sums for key, sums in monthly.items() if any(sums)}
+    )
+
+
+# ==================== WRITE (di transaksi invoice) ====================
+
+def _rows(merchant_id: str, buckets: dict, keys, prefix: str) -> list:
+    return [
+        {"id": gen_id(prefix), "merchant_id": merchant_id, **dict(zip(keys, key)), **dict(zip(_SUMS, sums))}
+        for key, sums in buckets.items()
+    ]
+
+
+def _increment(db, model, keys, rows):
+    """Upsert rows: bucket baru di-insert, yang sudah ada ditambah (satu statement per tabel)"""
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.get_bind(model).dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["merchant_id", *keys],
+            set_={name: table.c[name] + stmt.excluded[name] for name in _SUMS}
+        )
+        db.execute(stmt, rows)
+        return
+    # Database lain: UPDATE dulu, INSERT kalau bucket belum ada
+    for row in rows:
+        updated = db.execute(
+            update(table)
+            .where(*(table.c[name] == row[name] for name in ("merchant_id", *keys)))
+            .values({name: table.c[name] + row[name] for name in _SUMS})
+        ).rowcount
+        if not updated:
+            db.execute(insert(table), [row])
+
+
+def _apply(db, merchant_id: str, changes):
+    daily, monthly = _buckets(changes)
+    if not daily and not monthly:
+        return
+    changefeed.lock_merchant(db, merchant_id)
+    _increment(db, RevenueDaily, ("day", "currency"), _rows(merchant_id, daily, ("day", "currency"), "rvd"))
+    _increment(db, RevenueMonthly, ("month", "status", "currency"),
+               _rows(merchant_id, monthly, ("month", "status", "currency"), "rvm"))
+
+
+def record_create(db, merchant_id: str, invoice):
+    """Invoice baru di session `db` (di-commit oleh caller, bersama invoice-nya)"""
+    _apply(db, merchant_id, [(invoice_state(invoice), 1)])
+
+
+def record_status(db, merchant_id: str, invoices, old_status: str, new_status: str, payloads: dict = None):
+    """
+    Status invoice berubah old_status → new_status (satu atau banyak invoice sekaligus).
+    `payloads`: id → payload, untuk row hasil query bulk tanpa kolom payload.
+    """
+    if old_status == new_status:
+        return
+    changes = []
+    for invoice in invoices:
+        payload = payloads.get(invoice.id) if payloads is not None else None
+        changes.append((invoice_state(invoice, payload, old_status), -1))
+        changes.append((invoice_state(invoice, payload, new_status), 1))
+    _apply(db, merchant_id, changes)
+
+
+# ==================== READ ====================
+
+def _bucket_dict(period: str, currency: str, sums) -> dict:
+    return {"period": period, "currency": currency, **dict(zip(_SUMS, sums))}
+
+
+def report(db, merchant_id: str, granularity: str, date_from: date, date_to: date) -> list:
+    """
+    Bucket dalam range (inklusif), urut periode lalu currency. Bulan: total tanpa
+    void + rincian `by_status`. Satu query lewat index unik (merchant_id, periode, ...);
+    bucket yang sudah kosong (semua invoice-nya pindah status) dilewati.
+    """
+    if granularity == "day":
+        rows = db.execute(
+            select(RevenueDaily.day, RevenueDaily.currency, RevenueDaily.invoice_count, RevenueDaily.subtotal,
+                   RevenueDaily.tax_total, RevenueDaily.grand_total)
+            .where(RevenueDaily.merchant_id == merchant_id, RevenueDaily.day >= date_from,
+                   RevenueDaily.day <= date_to, RevenueDaily.invoice_count != 0)
+            .order_by(RevenueDaily.day, RevenueDaily.currency)
+        ).all()
+        return [_bucket_dict(row.day.isoformat(), row.currency, row[2:]) for row in rows]
+
+    rows = db.execute(
+        select(RevenueMonthly.month, RevenueMonthly.currency, RevenueMonthly.status, RevenueMonthly.invoice_count,
+               RevenueMonthly.subtotal, RevenueMonthly.tax_total, RevenueMonthly.grand_total)
+        .where(RevenueMonthly.merchant_id == merchant_id, RevenueMonthly.month >= date_from.replace(day=1),
+               RevenueMonthly.month <= date_to, RevenueMonthly.invoice_count != 0)
+        .order_by(RevenueMonthly.month, RevenueMonthly.currency, RevenueMonthly.status)
+    ).all()
+    buckets = {}
+    for row in rows:
+        key = (row.month, row.currency)
+        if key not in buckets:
+            buckets[key] = {**_bucket_dict(row.month.strftime("%Y-%m"), row.currency, (0, 0, 0, 0)), "by_status": {}}
+        bucket = buckets[key]
+        bucket["by_status"][row.status] = dict(zip(_SUMS, row[3:]))
+        if row.status != "void":
+            for name, value in zip(_SUMS, row[3:]):
+                bucket[name] += value
+    return list(buckets.values())
+
+
+def totals(buckets: list) -> list:
+    """Jumlah semua bucket per currency"""
+    by_currency = {}
+    for bucket in buckets:
+        sums = by_currency.setdefault(bucket["currency"], dict.fromkeys(_SUMS, 0))
+        for name in _SUMS:
+            sums[name] += bucket[name]
+    return [{"currency": currency, **sums} for currency, sums in sorted(by_currency.items())]
+
+
+# ==================== CONSISTENCY CHECK & REBUILD ====================
+
+_ISSUE_DATE = Invoice.payload["issue_date"].as_string()
+_CURRENCY = Invoice.payload["currency"].as_string()
+
+
+def _source_query(merchant_id: str):
+    """Kolom invoice yang menentukan bucket (tanpa memuat seluruh payload)"""
+    return select(
+        Invoice.id, Invoice.status, _ISSUE_DATE.label("issue_date"), _CURRENCY.label("currency"),
+        Invoice.subtotal, Invoice.tax_total, Invoice.grand_total, Invoice.created_at
+    ).where(Invoice.merchant_id == merchant_id)
+
+
+def _source_state(row) -> State:
+    return State(
+        _day(row.issue_date, row.created_at), row.currency or "IDR", row.status or "issued",
+        row.subtotal or 0, row.tax_total or 0, row.grand_total or 0
+    )
+
+
+def _stored(db, merchant_id: str, month: date = None):
+    """Agregat tersimpan (semua, atau satu bulan); bucket yang sudah nol tidak dihitung"""
+    daily_query = select(RevenueDaily).where(RevenueDaily.merchant_id == merchant_id)
+    monthly_query = select(RevenueMonthly).where(RevenueMonthly.merchant_id == merchant_id)
+    if month is not None:
+        daily_query = daily_query.where(RevenueDaily.day >= month, RevenueDaily.day < _next_month(month))
+        monthly_query = monthly_query.where(RevenueMonthly.month == month)
+    daily = {(row.day, row.currency): [getattr(row, name) for name in _SUMS]
+             for row in db.execute(daily_query).scalars()}
+    monthly = {(row.month, row.status, row.currency): [getattr(row, name) for name in _SUMS]
+               for row in db.execute(monthly_query).scalars()}
+    return (
+        {key: sums for key, sums in daily.items() if any(sums)},
+        {key: sums for key, sums in monthly.items() if any(sums)}
+    )
+
+
+def _next_month(month: date) -> date:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _merge(into, part):
+    for index in (0, 1):
+        for key, sums in part[index].items():
+            total = into[index].setdefault(key, [0, 0, 0, 0])
+            for i, value in enumerate(sums):
+                total[i] += value
+
+
+def _scan(db, query, batch: int):
+    """Agregat dari invoices hasil `query`, per chunk keyset id (memory = jumlah bucket)"""
+    expected, after = ({}, {}), ""
+    while True:
+        rows = db.execute(query.where(Invoice.id > after).order_by(Invoice.id).limit(batch)).all()
+        _merge(expected, _buckets((_source_state(row), 1) for row in rows))
+        if len(rows) < batch:
+            return expected
+        after = rows[-1].id
+
+
+def check_merchant(merchant_id: str, shard_id=None, batch: int = REVENUE_CHECK_BATCH) -> list:
+    """Bulan (tanggal 1) yang agregatnya tidak cocok dengan invoices, urut"""
+    db = shards.session(shard_id, readonly=True)
+    try:
+        expected = _scan(db, _source_query(merchant_id), batch)
+        stored = _stored(db, merchant_id)
+    finally:
+        db.close()
+
+    months = set()
+    for index in (0, 1):
+        for key in expected[index].keys() | stored[index].keys():
+            if expected[index].get(key) != stored[index].get(key):
+                months.add(key[0].replace(day=1))
+    return sorted(months)
+
+
+def rebuild_month(merchant_id: str, month: date, shard_id=None, batch: int = REVENUE_CHECK_BATCH) -> int:
+    """Hitung ulang agregat satu bulan dari invoices (satu transaksi); return jumlah bucket"""
+    start, end = month, _next_month(month)
+    query = _source_query(merchant_id).where(or_(
+        and_(_ISSUE_DATE >= start.isoformat(), _ISSUE_DATE < end.isoformat()),
+        and_(or_(_ISSUE_DATE.is_(None), _ISSUE_DATE == ""),
+             Invoice.created_at >= datetime.combine(start, datetime.min.time()),
+             Invoice.created_at < datetime.combine(end, datetime.min.time()))
+    ))
+    db = shards.session(shard_id)
+    try:
+        changefeed.lock_merchant(db, merchant_id)
+        # DELETE dulu: di SQLite write lock sudah dipegang sebelum invoices dibaca
+        db.execute(delete(RevenueDaily).where(
+            RevenueDaily.merchant_id == merchant_id, RevenueDaily.day >= start, RevenueDaily.day < end
+        ))
+        db.execute(delete(RevenueMonthly).where(
+            RevenueMonthly.merchant_id == merchant_id, RevenueMonthly.month == start
+        ))
+        daily, monthly = _scan(db, query, batch)
+        rows = (
+            (RevenueDaily, _rows(merchant_id, daily, ("day", "currency"), "rvd")),
+            (RevenueMonthly, _rows(merchant_id, monthly, ("month", "status", "currency"), "rvm"))
+        )
+        for model, values in rows:
+            if values:
+                db.execute(insert(model.__table__), values)
+        db.commit()
+        return len(daily) + len(monthly)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def rebuild_merchant(merchant_id: str, shard_id=None, months=None, batch: int = REVENUE_CHECK_BATCH,
+                     pause_ms: float = REVENUE_REBUILD_PAUSE_MS) -> dict:
+    """
+    Rebuild bulan-bulan `months` (default: yang tidak cocok menurut check_merchant),
+    satu transaksi pendek per bulan dengan jeda supaya writer tidak dimonopoli.
+    """
+    if months is None:
+        months = check_merchant(merchant_id, shard_id, batch)
+    buckets = 0
+    for n, month in enumerate(months):
+        if n and pause_ms:
+            time.sleep(pause_ms / 1000)
+        buckets += rebuild_month(merchant_id, month, shard_id, batch)
+    return {"merchant_id": merchant_id, "months": [m.strftime("%Y-%m") for m in months], "buckets": buckets}
+
+
+def _all_months(merchant_id: str, shard_id=None) -> list:
+    """Semua bulan yang punya invoice atau agregat (untuk rebuild --all)"""
+    db = shards.session(shard_id, readonly=True)
+    try:
+        expected = _scan(db, _source_query(merchant_id), REVENUE_CHECK_BATCH)
+        stored = _stored(db, merchant_id)
+    finally:
+        db.close()
+    return sorted({key[0].replace(day=1) for part in (*expected, *stored) for key in part})
+
+
+def main():
+    """
+    python -m app.revenue check [--merchant ID]
+    python -m app.revenue rebuild [--merchant ID] [--all] [--batch N] [--pause-ms MS]
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.revenue", description="Revenue aggregate tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check", help="Compare aggregates with invoices, list mismatched months")
+    rebuild = commands.add_parser("rebuild", help="Recompute mismatched months from invoices")
+    rebuild.add_argument("--all", action="store_true", help="Recompute every month, not only mismatched ones")
+    rebuild.add_argument("--pause-ms", type=float, default=REVENUE_REBUILD_PAUSE_MS)
+    for command in (check, rebuild):
+        command.add_argument("--merchant", help="Only this merchant id")
+        command.add_argument("--batch", type=int, default=REVENUE_CHECK_BATCH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    engine, _ = database.init_engines()
+    database.Base.metadata.create_all(bind=engine)
+    database.ensure_columns()
+    shards.init_shards()
+    try:
+        directory = database.ReadSessionLocal()
+        try:
+            query = select(Merchant.id, Merchant.shard_id).order_by(Merchant.id)
+            if args.merchant:
+                query = query.where(Merchant.id == args.merchant)
+            merchants = directory.execute(query).all()
+        finally:
+            directory.close()
+
+        mismatched = 0
+        for merchant_id, shard_id in merchants:
+            if args.command == "check":
+                months = check_merchant(merchant_id, shard_id, args.batch)
+                mismatched += bool(months)
+                if months:
+                    print({"merchant_id": merchant_id, "months": [m.strftime("%Y-%m") for m in months]})
+            else:
+                months = _all_months(merchant_id, shard_id) if args.all else None
+                result = rebuild_merchant(merchant_id, shard_id, months, args.batch, args.pause_ms)
+                if result["months"]:
+                    print(result)
+        print({"merchants": len(merchants), "mismatched": mismatched} if args.command == "check"
+              else {"merchants": len(merchants)})
+        if mismatched:
+            raise SystemExit(1)
+    finally:
+        shards.dispose_shards()
+        database.dispose_engines()
+
+
+if __name__ == "__main__":
+    # Jalankan lewat module app.revenue yang asli (engines shard), bukan salinan __main__
+    from app.revenue import main as _main
+
+    _main()
@@ -0,0 +1,517 @@
+"""
+Tenant sharding: tiap merchant di salah satu dari N database (DATABASE_SHARDS)
+
+HOW IT WORKS:
+1. Database utama (DATABASE_URL) = directory: merchants, api_keys, jobs,
+   scheduler_leases. Shard map = kolom merchants.shard_id (NULL = "main").
+   Tabel tenant (TENANT_TABLES: customers, invoices, invoice_changes, payments,
+   revenue_*, usage_logs, webhook_*) ada di SETIAP shard, termasuk "main" (data
+   lama yang belum dipindah).
+2. DATABASE_SHARDS="s1=sqlite:///./shard1.db,s2=postgresql://..." → engine
+   writer/reader + pool sendiri per shard (database.build_engines, profil SQLite
+   sama dengan database utama). Kosong (default) = sharding mati, semua query
+   persis seperti sebelumnya.
+3. Routing transparan: auth (get_current_merchant) memanggil repo.route(merchant)
+   → session request mem-bind model & tabel tenant ke engine shard merchant
+   (Session.bind_mapper / bind_table). Query handler tidak berubah: model
+   directory tetap ke database utama. Session read-only (GET/HEAD) → reader shard.
+   Shard map untuk write dibaca dari directory, bukan dari auth cache (cache
+   host lain tidak ikut di-invalidate saat merchant dipindah).
+4. Merchant baru: shard dari SHARD_PLACEMENT (hash email → stabil)
+5. Background (webhook dispatcher, retention, backfill) jalan per shard;
+   query admin lintas shard lewat fan_out(): paralel di thread pool
+6. Pindah merchant online: `python -m app.shards move <merchant_id> <shard>`
+   (lihat move_merchant). Selama fase akhir (drain + catch-up terakhir), write
+   merchant itu dapat 503 + Retry-After; read tetap jalan.
+
+Catatan: request yang menulis ke directory DAN shard (create invoice: quota_used
++ invoice) = dua transaksi, di-commit berurutan (bukan 2PC). Kalau commit shard
+gagal sesudah directory commit, quota terhitung tanpa invoice (jarang, quota
+di-reset bulanan). Di shard, FK ke merchants tidak dibuat (tabelnya di directory).
+"""
+import argparse
+import logging
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import MetaData, delete, func, insert, or_, select, text
+
+from . import config  # noqa: F401  (python -m app.shards: load .env sebelum module lain)
+from . import authcache, database, metrics
+from .database import SessionLocal, ReadSessionLocal
+from .db_models import (
+    Customer, Invoice, InvoiceChange, Merchant, Payment, RevenueDaily, RevenueMonthly, UsageLog, WebhookDelivery,
+    WebhookEndpoint, WebhookEvent
+)
+
+
+logger = logging.getLogger("app.shards")
+
+MAIN = "main"
+SHARD_MOVING = "moving"
+
+# Urutan insert (FK antar tabel tenant); delete pakai urutan terbalik
+TENANT_MODELS = (
+    Customer, Invoice, InvoiceChange, Payment, RevenueDaily, RevenueMonthly, UsageLog, WebhookEndpoint, WebhookEvent,
+    WebhookDelivery
+)
+TENANT_TABLES = tuple(model.__table__ for model in TENANT_MODELS)
+
+SHARD_FANOUT_THREADS = int(os.getenv("SHARD_FANOUT_THREADS", "8"))
+SHARD_MOVE_BATCH = int(os.getenv("SHARD_MOVE_BATCH", "1000"))
+# Tunggu request yang sudah lolos auth sebelum status merchant berubah (> timeout request)
+SHARD_MOVE_DRAIN_S = float(os.getenv("SHARD_MOVE_DRAIN_S", "5"))
+SHARD_MOVE_RETRY_AFTER_S = int(os.getenv("SHARD_MOVE_RETRY_AFTER_S", "5"))
+# Toleransi beda jam antar host app untuk kolom updated_at / created_at (fase delta)
+SHARD_MOVE_CLOCK_SKEW_S = float(os.getenv("SHARD_MOVE_CLOCK_SKEW_S", "60"))
+# Pass delta sebelum freeze (merchant masih live), berhenti kalau sisa perubahan <= 1 batch
+SHARD_MOVE_DELTA_PASSES = int(os.getenv("SHARD_MOVE_DELTA_PASSES", "3"))
+
+
+def _parse_shards(value: str) -> dict:
+    shards = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        shard_id, sep, url = item.partition("=")
+        shard_id = shard_id.strip()
+        if not sep or not shard_id or not url.strip():
+            raise ValueError(f"Invalid DATABASE_SHARDS entry '{item}' (expected <id>=<database url>)")
+        if shard_id == MAIN or shard_id in shards:
+            raise ValueError(f"Duplicate or reserved shard id '{shard_id}' in DATABASE_SHARDS")
+        shards[shard_id] = url.strip()
+    return shards
+
+
+SHARD_URLS = _parse_shards(os.getenv("DATABASE_SHARDS", ""))
+ENABLED = bool(SHARD_URLS)
+
+# Shard untuk merchant baru (default: semua shard di DATABASE_SHARDS, bukan main)
+SHARD_PLACEMENT = [s.strip() for s in os.getenv("SHARD_PLACEMENT", ",".join(SHARD_URLS)).split(",") if s.strip()]
+for _shard_id in SHARD_PLACEMENT:
+    if _shard_id != MAIN and _shard_id not in SHARD_URLS:
+        raise ValueError(f"SHARD_PLACEMENT: unknown shard '{_shard_id}'")
+
+
+# ==================== ENGINES ====================
+
+engines = {}  # shard_id → (writer, reader); kosong kalau sharding mati
+_executor = None
+
+
+def _tenant_metadata() -> MetaData:
+    """Salinan tabel tenant tanpa FK ke tabel directory (merchants tidak ada di shard)"""
+    metadata = MetaData()
+    tenant_names = {table.name for table in TENANT_TABLES}
+    for table in TENANT_TABLES:
+        copy = table.to_metadata(metadata)
+        for constraint in list(copy.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split(".")[0] not in tenant_names:
+                copy.constraints.discard(constraint)
+                for fk in constraint.elements:
+                    fk.parent.foreign_keys.discard(fk)
+                    copy.foreign_keys.discard(fk)
+    return metadata
+
+
+def init_shards(indexes: bool = True):
+    """
+    Engine writer/reader per shard + tabel tenant (create_all, kolom & index baru).
+    Dipanggil sesudah database.init_engines(); dipanggil ulang → engine yang sudah ada.
+    indexes=False: tanpa ensure_indexes (tool perbaikan data yang bikin index unik gagal).
+    """
+    if engines or not ENABLED:
+        return engines
+
+    metadata = _tenant_metadata()
+    built = {MAIN: (database.engine, database.read_engine)}
+    for shard_id, url in SHARD_URLS.items():
+        writer, reader = database.build_engines(url)
+        metrics.instrument_engine(writer, f"{shard_id}:writer")
+        if reader is not writer:
+            metrics.instrument_engine(reader, f"{shard_id}:reader")
+        metadata.create_all(bind=writer)
+        database.ensure_columns(writer, TENANT_TABLES)
+        if indexes:
+            database.ensure_indexes(writer, TENANT_TABLES)
+        built[shard_id] = (writer, reader)
+    engines.update(built)
+    return engines
+
+
+def dispose_shards():
+    """Tutup pool semua shard (kecuali main: database.dispose_engines)"""
+    global _executor
+
+    for shard_id, pair in engines.items():
+        if shard_id != MAIN:
+            for e in set(pair):
+                e.dispose()
+    engines.clear()
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def ids() -> list:
+    """Semua shard yang bisa berisi data tenant ("main" selalu ada)"""
+    return [MAIN, *SHARD_URLS]
+
+
+def _pair(shard_id):
+    if not engines:
+        if shard_id not in (None, MAIN):
+            raise RuntimeError(f"Merchant is on shard '{shard_id}' but DATABASE_SHARDS is not configured")
+        return database.engine, database.read_engine
+    pair = engines.get(shard_id or MAIN)
+    if pair is None:
+        raise RuntimeError(f"Unknown shard '{shard_id}' (DATABASE_SHARDS)")
+    return pair
+
+
+def writer(shard_id=MAIN):
+    return _pair(shard_id)[0]
+
+
+def reader(shard_id=MAIN):
+    return _pair(shard_id)[1]
+
+
+# ==================== ROUTING ====================
+
+def bind(db, shard_id):
+    """Model & tabel tenant di session ini → engine shard (writer, atau reader untuk session read-only)"""
+    if not engines and shard_id in (None, MAIN):
+        return  # sharding mati: session tetap ke database utama
+    target = _pair(shard_id)[1 if db.info.get("readonly") else 0]
+    for model in TENANT_MODELS:
+        db.bind_mapper(model, target)
+        db.bind_table(model.__table__, target)
+
+
+def route(db, merchant):
+    """
+    Session request → shard merchant (dipanggil auth lewat repo.route).
+    Merchant yang sedang dipindah: write ditolak 503 (read tetap dari shard lama).
+    """
+    if merchant.shard_state == SHARD_MOVING and not db.info.get("readonly"):
+        raise HTTPException(
+            status_code=503,
+            detail="Merchant data is being moved, please retry shortly",
+            headers={"Retry-After": str(SHARD_MOVE_RETRY_AFTER_S)}
+        )
+    bind(db, merchant.shard_id)
+
+
+def session(shard_id=MAIN, readonly: bool = False):
+    """Session di luar request (background, export) untuk data tenant satu shard"""
+    db = (ReadSessionLocal if readonly else SessionLocal)()
+    bind(db, shard_id)
+    return db
+
+
+def place(email: str):
+    """Shard untuk merchant baru (None = main / sharding mati)"""
+    if not ENABLED or not SHARD_PLACEMENT:
+        return None
+    shard_id = SHARD_PLACEMENT[zlib.crc32(email.lower().encode()) % len(SHARD_PLACEMENT)]
+    return None if shard_id == MAIN else shard_id
+
+
+# ==================== FAN-OUT ====================
+
+def fan_out(fn, shard_ids=None) -> dict:
+    """
+    Jalankan fn(shard_id) di semua shard secara paralel (thread pool, satu
+    connection per shard). Returns {shard_id: hasil}; error shard mana pun di-raise.
+    Dari handler async: await asyncio.to_thread(shards.fan_out, fn).
+    """
+    global _executor
+
+    shard_ids = list(shard_ids or ids())
+    if len(shard_ids) == 1:
+        return {shard_ids[0]: fn(shard_ids[0])}
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SHARD_FANOUT_THREADS, thread_name_prefix="shard-fanout")
+    futures = {shard_id: _executor.submit(fn, shard_id) for shard_id in shard_ids}
+    return {shard_id: future.result() for shard_id, future in futures.items()}
+
+
+def stats() -> list:
+    """Per shard: jumlah merchant (shard map), invoice, usage log, delivery pending & latency ping"""
+    with database.read_engine.connect() as conn:
+        merchants = dict(conn.execute(select(Merchant.shard_id, func.count()).group_by(Merchant.shard_id)).all())
+    merchants[MAIN] = merchants.pop(None, 0) + merchants.pop(MAIN, 0)
+
+    def one(shard_id):
+        start = time.perf_counter()
+        with reader(shard_id).connect() as conn:
+            conn.execute(text("SELECT 1"))
+            ping_ms = (time.perf_counter() - start) * 1000
+            return {
+                "invoices": conn.execute(select(func.count()).select_from(Invoice)).scalar(),
+                "usage_logs": conn.execute(select(func.count()).select_from(UsageLog)).scalar(),
+                "pending_deliveries": conn.execute(
+                    select(func.count()).select_from(WebhookDelivery).where(WebhookDelivery.status == "pending")
+                ).scalar(),
+                "ping_ms": round(ping_ms, 2)
+            }
+
+    return [
+        {"shard": shard_id, "merchants": merchants.get(shard_id, 0), **result}
+        for shard_id, result in fan_out(one).items()
+    ]
+
+
+# ==================== MOVE MERCHANT (ONLINE) ====================
+
+def _delta_filters(since: datetime) -> dict:
+    """
+    Baris yang bisa berubah sesudah `since` (fase delta: sebelum freeze, lalu catch-up saat freeze).
+    Customer & invoice: updated_at (onupdate, juga untuk UPDATE Core). Usage log, payment &
+    change log: append-only (seq ikut disalin, cursor client tetap berlaku).
+    Delivery: setiap perubahan lewat lease pick_due (next_attempt_at).
+    Endpoint & agregat revenue: sedikit baris per merchant, salin ulang semua.
+    """
+    return {
+        "customers": Customer.updated_at >= since,
+        "invoices": Invoice.updated_at >= since,
+        "invoice_changes": InvoiceChange.created_at >= since,
+        "payments": Payment.created_at >= since,
+        "revenue_daily": None,
+        "revenue_monthly": None,
+        "usage_logs": UsageLog.created_at >= since,
+        "webhook_endpoints": None,
+        "webhook_events": or_(WebhookEvent.dispatched_at.is_(None), WebhookEvent.dispatched_at >= since),
+        "webhook_deliveries": or_(WebhookDelivery.status == "pending", WebhookDelivery.next_attempt_at >= since)
+    }
+
+
+# Kolom yang ikut berubah setiap kali baris berubah. Fase delta membandingkan id + kolom ini
+# dengan target (murah) dan hanya membaca isi penuh baris yang beda. () = append-only, cukup
+# cek id sudah ada. Tabel lain (revenue_*, webhook_endpoints: sedikit baris) dibandingkan utuh.
+_VERSION_COLUMNS = {
+    "customers": ("updated_at",),
+    "invoices": ("updated_at",),
+    "invoice_changes": (),
+    "payments": (),
+    "usage_logs": (),
+    "webhook_events": ("dispatched_at",),
+    "webhook_deliveries": ("status", "attempts", "next_attempt_at"),
+}
+
+
+def _copy_rows(source: str, target: str, table, merchant_id: str, batch: int, where=None,
+               changed_only: bool = False) -> int:
+    """
+    Salin baris merchant (keyset by id, satu transaksi pendek per batch); baris yang sudah ada ditimpa.
+    changed_only (fase delta): baris yang sudah sama di target (lihat _VERSION_COLUMNS) dilewati,
+    jadi window clock skew yang berisi baris yang sudah tersalin cukup discan, tidak ditulis ulang.
+    Returns jumlah baris yang ditulis.
+    """
+    version = _VERSION_COLUMNS.get(table.name) if changed_only else None
+    scanned = [table.c.id] + [table.c[name] for name in version] if version is not None else [table]
+    copied, after = 0, ""
+    while True:
+        query = select(*scanned).where(table.c.merchant_id == merchant_id, table.c.id > after)
+        if where is not None:
+            query = query.where(where)
+        with reader(source).connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(query.order_by(table.c.id).limit(batch))]
+        if not rows:
+            break
+        after = rows[-1]["id"]
+        full_batch = len(rows) == batch
+        if changed_only:
+            with writer(target).connect() as conn:
+                existing = {
+                    row.id: dict(row._mapping)
+                    for row in conn.execute(select(*scanned).where(table.c.id.in_([row["id"] for row in rows])))
+                }
+            rows = [row for row in rows if existing.get(row["id"]) != row]
+            if rows and version is not None:
+                with reader(source).connect() as conn:
+                    changed = select(table).where(table.c.id.in_([row["id"] for row in rows]))
+                    rows = [dict(row._mapping) for row in conn.execute(changed)]
+        if rows:
+            with writer(target).begin() as conn:
+                conn.execute(delete(table).where(table.c.id.in_([row["id"] for row in rows])))
+                conn.execute(insert(table), rows)
+            copied += len(rows)
+        if not full_batch:
+            break
+    return copied
+
+
+def _copy_delta(source: str, target: str, merchant_id: str, batch: int, since: datetime) -> dict:
+    """Salin baris yang berubah sejak `since` (lihat _delta_filters) yang belum sama di target, per tabel"""
+    filters = _delta_filters(since)
+    return {
+        table.name: _copy_rows(source, target, table, merchant_id, batch, filters[table.name], changed_only=True)
+        for table in TENANT_TABLES
+    }
+
+
+def _delete_rows(shard_id: str, merchant_id: str, batch: int) -> int:
+    deleted = 0
+    for table in reversed(TENANT_TABLES):
+        while True:
+            with writer(shard_id).begin() as conn:
+                ids_ = select(table.c.id).where(table.c.merchant_id == merchant_id).limit(batch)
+                count = conn.execute(delete(table).where(table.c.id.in_(ids_))).rowcount
+            deleted += count
+            if count < batch:
+                break
+    return deleted
+
+
+def _set_shard(merchant_id: str, **values):
+    """Ubah shard map + invalidate auth cache (shared memory, semua worker di host ini)"""
+    db = SessionLocal()
+    try:
+        merchant = db.get(Merchant, merchant_id)
+        for name, value in values.items():
+            setattr(merchant, name, value)
+        db.commit()
+    finally:
+        db.close()
+    # Eksplisit: listener session authcache belum tentu ter-import di process CLI
+    authcache.invalidate_merchant(merchant_id)
+
+
+def move_merchant(merchant_id: str, target: str, batch: int = SHARD_MOVE_BATCH,
+                  drain_s: float = SHARD_MOVE_DRAIN_S) -> dict:
+    """
+    Pindah semua data tenant satu merchant ke shard `target`, online:
+    1. Bulk copy per batch dari shard lama (merchant tetap live di shard lama)
+    2. Delta sebelum freeze (merchant masih live): salin baris yang berubah sejak
+       pass sebelumnya (lihat _delta_filters), maks. SHARD_MOVE_DELTA_PASSES pass,
+       berhenti kalau yang tersalin <= 1 batch
+    3. shard_state = "moving": write merchant ditolak 503, tunggu drain_s
+       supaya request yang sudah lolos auth selesai, lalu catch-up terakhir:
+       baris yang berubah sejak pass delta terakhir (- clock skew). Baris yang
+       sudah sama di target hanya dibaca, tidak ditulis ulang
+    4. Flip shard map (shard_id = target, state NULL) → request baru ke shard baru
+    5. Tunggu drain_s lagi (+ AUTH_CACHE_TTL_S kalau auth cache aktif), salin usage
+       log yang masih masuk ke shard lama, lalu hapus data di shard lama
+    Gagal sebelum langkah 4 → state dikembalikan, merchant tetap di shard lama
+    (aman diulang: sisa salinan di target dihapus dulu). Webhook at-least-once:
+    delivery yang sedang dikirim saat pindah bisa terkirim dua kali.
+
+    Biaya freeze (write merchant dapat 503, read tetap jalan): drain_s + catch-up,
+    yaitu baca baris merchant yang updated_at / created_at-nya dalam
+    SHARD_MOVE_CLOCK_SKEW_S sebelum pass delta terakhir + tulis yang benar-benar
+    berubah. Turunkan drain_s (default SHARD_MOVE_DRAIN_S) kalau write request
+    selalu jauh lebih cepat dari itu; write_freeze_s di ringkasan = durasi nyata.
+
+    Auth cache host lain: _set_shard hanya meng-invalidate cache di host ini.
+    Write tidak terpengaruh (auth membaca shard map dari directory untuk write),
+    tapi read & usage log-nya bisa masih ke shard lama sampai entry cache expired,
+    jadi langkah 5 menunggu AUTH_CACHE_TTL_S sebelum menghapus (read di host itu
+    sementara melihat data per saat flip).
+
+    Returns:
+        dict ringkasan (source, target, rows per tabel, durasi freeze)
+    """
+    if target not in ids():
+        raise ValueError(f"Unknown shard '{target}' (available: {', '.join(ids())})")
+
+    db = ReadSessionLocal()
+    try:
+        merchant = db.get(Merchant, merchant_id)
+    finally:
+        db.close()
+    if merchant is None:
+        raise ValueError(f"Merchant '{merchant_id}' not found")
+    source = merchant.shard_id or MAIN
+    if source == target:
+        raise ValueError(f"Merchant '{merchant_id}' is already on shard '{target}'")
+    if merchant.shard_state == SHARD_MOVING:
+        logger.warning("Merchant %s is still marked moving (previous move interrupted), restarting", merchant_id)
+
+    skew = timedelta(seconds=SHARD_MOVE_CLOCK_SKEW_S)
+    summary = {"merchant_id": merchant_id, "source": source, "target": target, "rows": {}}
+    try:
+        # 1. Bulk copy (target dibersihkan dulu dari sisa percobaan sebelumnya)
+        _delete_rows(target, merchant_id, batch)
+        copy_started = datetime.utcnow()
+        for table in TENANT_TABLES:
+            summary["rows"][table.name] = _copy_rows(source, target, table, merchant_id, batch)
+        logger.info("Move %s: bulk copy %s → %s done %s", merchant_id, source, target, summary["rows"])
+
+        # 2. Delta selagi merchant live (sisa perubahan untuk freeze sekecil mungkin)
+        since, summary["pre_freeze_delta_rows"] = copy_started, []
+        for _ in range(SHARD_MOVE_DELTA_PASSES):
+            pass_started = datetime.utcnow()
+            copied = _copy_delta(source, target, merchant_id, batch, since - skew)
+            summary["pre_freeze_delta_rows"].append(sum(copied.values()))
+            since = pass_started
+            if sum(copied.values()) <= batch:
+                break
+
+        # 3. Freeze write, lalu catch-up terakhir
+        freeze_started = datetime.utcnow()
+        frozen_at = time.perf_counter()
+        _set_shard(merchant_id, shard_state=SHARD_MOVING)
+        time.sleep(drain_s)
+        summary["delta_rows"] = _copy_delta(source, target, merchant_id, batch, since - skew)
+    except BaseException:
+        _set_shard(merchant_id, shard_state=None)
+        raise
+
+    # 4. Flip
+    _set_shard(merchant_id, shard_id=None if target == MAIN else target, shard_state=None)
+    summary["write_freeze_s"] = round(time.perf_counter() - frozen_at, 3)
+    logger.info("Move %s: now on shard %s (writes frozen %.2fs)", merchant_id, target, summary["write_freeze_s"])
+
+    # 5. Sisa usage log di shard lama (request read yang di-route sebelum flip, atau
+    #    dari auth cache host lain yang belum expired), lalu cleanup
+    summary["cleanup_wait_s"] = drain_s + (authcache.AUTH_CACHE_TTL_S if authcache.AUTH_CACHE_ENABLED else 0)
+    time.sleep(summary["cleanup_wait_s"])
+    summary["late_usage_logs"] = _copy_rows(
+        source, target, UsageLog.__table__, merchant_id, batch, UsageLog.created_at >= freeze_started - skew
+    )
+    summary["deleted_from_source"] = _delete_rows(source, merchant_id, batch)
+    return summary
+
+
+# ==================== CLI ====================
+
+def main():
+    """
+    python -m app.shards status
+    python -m app.shards move <merchant_id> <shard> [--batch N] [--drain-s S]
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.shards", description="Tenant shard tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Merchants, invoices & ping per shard")
+    move = commands.add_parser("move", help="Move one merchant to another shard (online)")
+    move.add_argument("merchant_id")
+    move.add_argument("shard")
+    move.add_argument("--batch", type=int, default=SHARD_MOVE_BATCH)
+    move.add_argument("--drain-s", type=float, default=SHARD_MOVE_DRAIN_S)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    engine, _ = database.init_engines()
+    database.Base.metadata.create_all(bind=engine)
+    database.ensure_columns()
+    init_shards()
+    try:
+        if args.command == "status":
+            for row in stats():
+                print(row)
+        else:
+            print(move_merchant(args.merchant_id, args.shard, args.batch, args.drain_s))
+    finally:
+        dispose_shards()
+        database.dispose_engines()
+
+
+if __name__ == "__main__":
+    # Jalankan lewat module app.shards yang asli (engines, SHARD_URLS), bukan salinan __main__
+    from app.shards import main as _main
+
+    _main()
@@ -0,0 +1,151 @@
+"""
+SQL instrumentation per request + slow-query log + query budget helper
+
+HOW IT WORKS:
+1. SQLAlchemy event hooks (semua engine) mengukur tiap statement
+2. SQLStatsMiddleware bikin QueryStats per request → request.state.sql
+   (count & total waktu query untuk request itu)
+3. Statement yang lebih lama dari SLOW_QUERY_MS ditulis ke logger
+   "app.sql.slow" sebagai JSON, dengan SQL yang sudah di-normalize
+   (literal & parameter jadi "?", IN (...) dipadatkan)
+4. assert_max_queries(n): helper untuk test/CI, gagal kalau satu blok
+   kode menjalankan lebih dari n query
+
+Contoh (pytest):
+    from app.sqlstats import assert_max_queries
+
+    def test_list_invoices_queries(client, headers):
+        with assert_max_queries(4):
+            client.get("/v1/invoices", headers=headers)
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+DB_QUERIES_PER_REQUEST = metrics.Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", [],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+DB_SLOW_QUERIES = metrics.Counter(
+    "db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS"
+)
+
+
+class QueryStats:
+    """Statistik query untuk satu request (atau satu blok assert_max_queries)"""
+
+    def __init__(self, method: str = "", path: str = "", capture: bool = False):
+        self.method = method
+        self.path = path
+        self.count = 0
+        self.total_seconds = 0.0
+        self.statements = [] if capture else None
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        if self.statements is not None:
+            self.statements.append(statement)
+
+    def as_dict(self):
+        return {"queries": self.count, "query_time_ms": round(self.total_seconds * 1000, 2)}
+
+
+current = contextvars.ContextVar("sql_stats", default=None)
+_captures = []  # blok assert_max_queries yang sedang aktif (lintas thread)
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s|\?")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """SQL tanpa literal/parameter, supaya query yang sama bisa di-group"""
+    sql = _STRING.sub("?", statement)
+    sql = _PARAM.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (?...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._sqlstats_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._sqlstats_start
+
+    stats = current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    for capture in _captures:
+        capture.record(statement, elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc()
+        slow_query_logger.warning(json.dumps({
+            "event": "slow_query",
+            "duration_ms": round(elapsed * 1000, 2),
+            "sql": normalize_sql(statement),
+            "method": stats.method if stats else None,
+            "path": stats.path if stats else None,
+            "executemany": executemany
+        }))
+
+
+class SQLStatsMiddleware:
+    """Pasang QueryStats baru per HTTP request (request.state.sql)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats(scope["method"], scope["path"])
+        scope.setdefault("state", {})["sql"] = stats
+        token = current.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current.reset(token)
+            DB_QUERIES_PER_REQUEST.observe(stats.count)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int):
+    """
+    Gagal (AssertionError) kalau blok ini menjalankan lebih dari max_queries
+    statement SQL. Menghitung query dari thread manapun (TestClient menjalankan
+    app di thread lain), jadi jangan dipakai paralel dengan request lain.
+    """
+    stats = QueryStats(capture=True)
+    _captures.append(stats)
+    try:
+        yield stats
+    finally:
+        _captures.remove(stats)
+
+    if stats.count > max_queries:
+        listing = "\n".join(f"  {i + 1}. {normalize_sql(s)}" for i, s in enumerate(stats.statements))
+        raise AssertionError(f"Expected at most {max_queries} queries, got {stats.count}:\n{listing}")
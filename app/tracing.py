@@ -0,0 +1,166 @@
+"""
+Span API ringan + header Server-Timing + trace file JSONL
+
+HOW IT WORKS:
+1. TracingMiddleware mengaktifkan trace untuk request kalau:
+   - SERVER_TIMING=all (admin flag, semua request), atau
+   - X-API-Key diawali salah satu prefix di SERVER_TIMING_KEYS
+     (comma-separated, mis. prefix yang tampil di /v1/merchants/me/api-keys)
+2. Kode memakai `with span("nama"):` di bagian yang mau diukur.
+   Kalau trace tidak aktif, span() hanya 1x ContextVar.get() dan
+   mengembalikan object no-op → hampir nol biaya.
+3. Saat response dikirim: header Server-Timing (semua span + jumlah query SQL)
+   dan header traceparent (W3C). Trace-id diambil dari header traceparent
+   request kalau ada.
+4. TRACE_FILE=path/trace.jsonl → tiap request yang di-trace ditulis 1 baris JSON
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "off").lower()
+SERVER_TIMING_KEYS = tuple(p.strip() for p in os.getenv("SERVER_TIMING_KEYS", "").split(",") if p.strip())
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, trace_id: str, parent_span_id: str = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.start = time.perf_counter()
+        self.start_epoch = time.time()
+        self.spans = []  # (name, offset_seconds, duration_seconds)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.trace.spans.append((self.name, self.start - self.trace.start, end - self.start))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """Ukur satu fase: `with span("calc_totals"): ...`"""
+    trace = current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+
+def _parse_traceparent(value: str):
+    """W3C traceparent: 00-<32 hex trace-id>-<16 hex parent-id>-<2 hex flags>"""
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None, None
+    if parts[1] == "0" * 32:
+        return None, None
+    return parts[1], parts[2]
+
+
+_file_lock = threading.Lock()
+
+
+def _write_trace_file(trace: Trace, scope, status: int, total: float):
+    record = {
+        "trace_id": trace.trace_id,
+        "span_id": trace.span_id,
+        "parent_span_id": trace.parent_span_id,
+        "method": scope["method"],
+        "path": scope["path"],
+        "status": status,
+        "start": trace.start_epoch,
+        "duration_ms": round(total * 1000, 3),
+        "spans": [
+            {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+            for name, offset, duration in trace.spans
+        ]
+    }
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    try:
+        with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Trace file error: {e}")
+
+
+class TracingMiddleware:
+    """Aktifkan trace untuk request yang opt-in, tambah header Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _enabled(self, headers):
+        if SERVER_TIMING == "all":
+            return True
+        if SERVER_TIMING_KEYS:
+            api_key = headers.get(b"x-api-key", b"").decode("latin-1")
+            return api_key.startswith(SERVER_TIMING_KEYS)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if not self._enabled(headers):
+            return await self.app(scope, receive, send)
+
+        trace_id, parent_id = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        trace = Trace(trace_id or os.urandom(16).hex(), parent_id)
+        token = current.set(trace)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                total = time.perf_counter() - trace.start
+                entries = [f"{name};dur={duration * 1000:.2f}" for name, _, duration in trace.spans]
+                stats = scope.get("state", {}).get("sql")
+                if stats is not None:
+                    entries.append(f'db;desc="{stats.count} queries";dur={stats.total_seconds * 1000:.2f}')
+                entries.append(f"total;dur={total * 1000:.2f}")
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", ", ".join(entries).encode()),
+                    (b"traceparent", f"00-{trace.trace_id}-{trace.span_id}-01".encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current.reset(token)
+            if TRACE_FILE:
+                _write_trace_file(trace, scope, status[0], time.perf_counter() - trace.start)
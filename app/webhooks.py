@@ -0,0 +1,490 @@
+"""
+Webhook: endpoint per merchant, outbox, dan dispatcher async
+
+HOW IT WORKS:
+1. emit(db, merchant, type, data) menulis baris webhook_events (outbox) di session
+   caller → ikut commit/rollback bersama invoice-nya. Request tidak pernah
+   menunggu HTTP call ke merchant. Hanya plan dengan fitur webhook (WEBHOOK_PLANS).
+2. Dispatcher jalan di satu process saja: pemegang lease "webhooks"
+   (jobs.acquire_leadership), ikut start/stop bersama job worker:
+   a. Fan-out: event baru → satu webhook_deliveries per endpoint yang subscribe
+      (satu transaksi per batch event)
+   b. Ambil delivery yang jatuh tempo (next_attempt_at digeser = lease, supaya
+      tidak diambil dua kali), kelompokkan per endpoint: sampai
+      endpoint.batch_size event per POST ({"events": [...]})
+   c. Kirim lewat satu httpx.AsyncClient (connection keep-alive di-pool per host),
+      dibatasi WEBHOOK_CONCURRENCY total, WEBHOOK_HOST_CONNECTIONS per host
+      dan WEBHOOK_MERCHANT_CONCURRENCY per merchant
+   d. 2xx → delivered (di-update per batch, satu UPDATE); lainnya/timeout →
+      retry dengan exponential backoff sampai WEBHOOK_MAX_ATTEMPTS, lalu failed
+   Dengan DATABASE_SHARDS: outbox & delivery ada di shard merchant, tiap tick
+   fan-out & ambil delivery dari semua shard (app/shards.py)
+3. At-least-once & tanpa jaminan urutan: receiver pakai X-Webhook-Id untuk dedupe
+4. Signature: X-Webhook-Signature: t=<unix>,v1=<hex HMAC-SHA256(secret, "<t>.<body>")>
+   Receiver hitung ulang (verify()), bandingkan constant-time, tolak t yang terlalu lama
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import time
+from collections import defaultdict, namedtuple
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import delete, exists, insert, select, update
+
+from . import jobs, shards, sqlstats, tracing
+from .db_models import WebhookDelivery, WebhookEndpoint, WebhookEvent, gen_id
+
+
+logger = logging.getLogger("app.webhooks")
+
+EVENT_TYPES = ("invoice.created", "invoice.updated", "invoice.paid")
+WEBHOOK_PLANS = ("pro", "enterprise")
+
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))
+WEBHOOK_HOST_CONNECTIONS = int(os.getenv("WEBHOOK_HOST_CONNECTIONS", "8"))
+WEBHOOK_MERCHANT_CONCURRENCY = int(os.getenv("WEBHOOK_MERCHANT_CONCURRENCY", "4"))
+WEBHOOK_TIMEOUT_S = float(os.getenv("WEBHOOK_TIMEOUT_S", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE_S = float(os.getenv("WEBHOOK_BACKOFF_BASE_S", "10"))
+WEBHOOK_BACKOFF_MAX_S = float(os.getenv("WEBHOOK_BACKOFF_MAX_S", "21600"))
+WEBHOOK_POLL_INTERVAL_MS = float(os.getenv("WEBHOOK_POLL_INTERVAL_MS", "250"))
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "30"))
+WEBHOOK_ALLOW_PRIVATE_URLS = os.getenv("WEBHOOK_ALLOW_PRIVATE_URLS", "false").lower() == "true"
+WEBHOOK_SIGNATURE_TOLERANCE_S = 300
+
+
+# ==================== EVENTS (OUTBOX) ====================
+
+def invoice_data(invoice, payload: dict = None, **extra):
+    """
+    Isi `data` event invoice.* (subset GET /v1/invoices/{id}).
+    `payload`: kalau `invoice` berupa row tanpa kolom payload (query bulk)
+    """
+    payload = (invoice.payload if payload is None else payload) or {}
+    return {
+        "id": invoice.id,
+        "number": invoice.number,
+        "status": invoice.status,
+        "customer": payload.get("customer"),
+        "issue_date": payload.get("issue_date"),
+        "due_date": payload.get("due_date"),
+        "currency": payload.get("currency", "IDR"),
+        "totals": {
+            "subtotal": invoice.subtotal,
+            "tax_total": invoice.tax_total,
+            "grand_total": invoice.grand_total
+        },
+        **extra
+    }
+
+
+def emit(db, merchant, event_type: str, data: dict):
+    """
+    Tulis event ke outbox di session `db` (di-commit oleh caller).
+    Returns WebhookEvent, atau None kalau plan merchant tidak punya webhook.
+    """
+    if merchant.plan not in WEBHOOK_PLANS:
+        return None
+    event = WebhookEvent(id=gen_id("evt"), merchant_id=merchant.id, type=event_type, data=data)
+    db.add(event)
+    return event
+
+
+def emit_many(db, merchant, event_type: str, datas):
+    """Seperti emit(), tapi bulk INSERT (mis. ribuan invoice.paid dari rekonsiliasi)"""
+    if merchant.plan not in WEBHOOK_PLANS or not datas:
+        return 0
+    now = datetime.utcnow()
+    rows = [
+        {"id": gen_id("evt"), "merchant_id": merchant.id, "type": event_type, "data": data, "created_at": now}
+        for data in datas
+    ]
+    db.execute(insert(WebhookEvent.__table__), rows)
+    return len(rows)
+
+
+# ==================== SIGNATURE ====================
+
+def new_secret() -> str:
+    return f"whsec_{os.urandom(24).hex()}"
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify(secret: str, header: str, body: bytes, tolerance: int = WEBHOOK_SIGNATURE_TOLERANCE_S) -> bool:
+    """Cek header X-Webhook-Signature (untuk receiver / test)"""
+    try:
+        parts = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(parts["t"])
+    except (ValueError, KeyError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = sign(secret, timestamp, body).rsplit("v1=", 1)[1]
+    return hmac.compare_digest(expected, parts.get("v1", ""))
+
+
+def validate_url(url: str):
+    """Raise ValueError kalau URL bukan http(s) atau (default) menunjuk ke jaringan privat"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("Webhook URL must be an absolute http(s) URL")
+    if WEBHOOK_ALLOW_PRIVATE_URLS:
+        return
+    host = parts.hostname
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError("Webhook URL must not point to localhost")
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return  # hostname biasa (resolve saat kirim)
+    if address.is_private or address.is_loopback or address.is_link_local or address.is_reserved:
+        raise ValueError("Webhook URL must not point to a private network address")
+
+
+# ==================== OUTBOX → DELIVERIES ====================
+
+_Delivery = namedtuple(
+    "_Delivery",
+    "shard id merchant_id attempts endpoint_id url secret batch_size is_active event_id event_type data created_at"
+)
+
+
+def fan_out(limit: int = 500, shard_id: str = shards.MAIN) -> int:
+    """Event outbox yang belum diproses → webhook_deliveries. Returns jumlah delivery baru."""
+    db = shards.session(shard_id)
+    try:
+        events = db.execute(
+            select(WebhookEvent.id, WebhookEvent.merchant_id, WebhookEvent.type)
+            .where(WebhookEvent.dispatched_at.is_(None))
+            .order_by(WebhookEvent.id)
+            .limit(limit)
+        ).all()
+        if not events:
+            db.rollback()
+            return 0
+
+        endpoints = defaultdict(list)
+        for endpoint in db.execute(
+            select(WebhookEndpoint.id, WebhookEndpoint.merchant_id, WebhookEndpoint.events)
+            .where(WebhookEndpoint.merchant_id.in_({e.merchant_id for e in events}), WebhookEndpoint.is_active == True)
+        ):
+            endpoints[endpoint.merchant_id].append(endpoint)
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": gen_id("whd"), "endpoint_id": endpoint.id, "event_id": event.id,
+                "merchant_id": event.merchant_id, "status": "pending", "attempts": 0,
+                "next_attempt_at": now, "created_at": now
+            }
+            for event in events
+            for endpoint in endpoints[event.merchant_id]
+            if event.type in endpoint.events
+        ]
+        if rows:
+            db.execute(insert(WebhookDelivery), rows)
+        db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id.in_([e.id for e in events]))
+            .values(dispatched_at=now)
+        )
+        db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+
+def pick_due(limit: int, lease_seconds: float, shard_id: str = shards.MAIN):
+    """Delivery yang jatuh tempo; next_attempt_at digeser (lease) supaya tidak diambil lagi"""
+    now = datetime.utcnow()
+    db = shards.session(shard_id)
+    try:
+        rows = db.execute(
+            select(
+                WebhookDelivery.id, WebhookDelivery.merchant_id, WebhookDelivery.attempts,
+                WebhookEndpoint.id, WebhookEndpoint.url, WebhookEndpoint.secret,
+                WebhookEndpoint.batch_size, WebhookEndpoint.is_active,
+                WebhookEvent.id, WebhookEvent.type, WebhookEvent.data, WebhookEvent.created_at
+            )
+            .join(WebhookEndpoint, WebhookEndpoint.id == WebhookDelivery.endpoint_id)
+            .join(WebhookEvent, WebhookEvent.id == WebhookDelivery.event_id)
+            .where(WebhookDelivery.status == "pending", WebhookDelivery.next_attempt_at <= now)
+            .order_by(WebhookDelivery.next_attempt_at)
+            .limit(limit)
+        ).all()
+        if rows:
+            db.execute(
+                update(WebhookDelivery)
+                .where(WebhookDelivery.id.in_([row[0] for row in rows]))
+                .values(next_attempt_at=now + timedelta(seconds=lease_seconds))
+            )
+        db.commit()
+        return [_Delivery(shard_id, *row) for row in rows]
+    finally:
+        db.close()
+
+
+def mark_delivered(results, shard_id: str = shards.MAIN):
+    """results: list (delivery_ids, status_code) → satu UPDATE per status code"""
+    by_code = defaultdict(list)
+    for ids, status_code in results:
+        by_code[status_code] += ids
+    now = datetime.utcnow()
+    db = shards.session(shard_id)
+    try:
+        for status_code, ids in by_code.items():
+            db.execute(
+                update(WebhookDelivery)
+                .where(WebhookDelivery.id.in_(ids))
+                .values(
+                    status="delivered", attempts=WebhookDelivery.attempts + 1,
+                    last_status_code=status_code, last_error=None, delivered_at=now
+                )
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def mark_failed(deliveries, status_code, error: str):
+    """Retry dengan backoff, atau failed sesudah WEBHOOK_MAX_ATTEMPTS (deliveries dari satu shard)"""
+    now = datetime.utcnow()
+    db = shards.session(deliveries[0].shard)
+    try:
+        for delivery in deliveries:
+            attempts = delivery.attempts + 1
+            values = {"attempts": attempts, "last_status_code": status_code, "last_error": error}
+            if attempts >= WEBHOOK_MAX_ATTEMPTS or not delivery.is_active:
+                values["status"] = "failed"
+            else:
+                delay = jobs.backoff_seconds(attempts, WEBHOOK_BACKOFF_BASE_S, WEBHOOK_BACKOFF_MAX_S)
+                values["next_attempt_at"] = now + timedelta(seconds=delay)
+            db.execute(update(WebhookDelivery).where(WebhookDelivery.id == delivery.id).values(**values))
+        db.commit()
+    finally:
+        db.close()
+
+
+# ==================== DISPATCHER ====================
+
+class _KeyedLimiter:
+    """Semaphore per key (host / merchant), dibuang lagi kalau sudah tidak dipakai"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores = {}
+        self._users = defaultdict(int)
+
+    @asynccontextmanager
+    async def slot(self, key):
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self.limit)
+        self._users[key] += 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._semaphores[key]
+
+
+class WebhookDispatcher:
+    """Kirim webhook_deliveries (hanya di process pemegang lease "webhooks")"""
+
+    def __init__(self, concurrency: int = WEBHOOK_CONCURRENCY, host_connections: int = WEBHOOK_HOST_CONNECTIONS,
+                 merchant_concurrency: int = WEBHOOK_MERCHANT_CONCURRENCY,
+                 poll_interval_ms: float = WEBHOOK_POLL_INTERVAL_MS, transport=None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval_ms / 1000
+        self.max_in_flight = concurrency * 2  # grup yang sudah diambil dari DB (sebagian menunggu slot)
+        self.lease_seconds = max(60, WEBHOOK_TIMEOUT_S * 6)
+        self.transport = transport  # mis. httpx.MockTransport untuk test
+        self.holder = f"{socket.gethostname()[:40]}:{os.getpid()}:{os.urandom(3).hex()}"
+        self.is_leader = False
+        self.sent = 0
+        self._global = None
+        self._hosts = _KeyedLimiter(host_connections)
+        self._merchants = _KeyedLimiter(merchant_concurrency)
+        self._delivered = []
+        self._in_flight = set()
+        self._task = None
+        self._wakeup = None
+
+    def start(self):
+        """Start dispatcher di event loop yang sedang jalan"""
+        self._global = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop ambil delivery baru; yang sedang dikirim ditunggu (maks. WEBHOOK_TIMEOUT_S)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        sqlstats.current.set(None)
+        tracing.current.set(None)
+
+        loop = asyncio.get_running_loop()
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_S, limits=limits, transport=self.transport)
+        renew_at = 0
+        try:
+            while True:
+                self._wakeup.clear()
+                picked = 0
+                try:
+                    if loop.time() >= renew_at:
+                        self.is_leader = await asyncio.to_thread(jobs.acquire_leadership, self.holder, "webhooks")
+                        renew_at = loop.time() + jobs.SCHEDULER_LEASE_S / 3
+                    if self.is_leader:
+                        await self._flush()
+                        for shard_id in shards.ids():
+                            await asyncio.to_thread(fan_out, shard_id=shard_id)
+                            free = self.max_in_flight - len(self._in_flight)
+                            if free <= 0:
+                                continue
+                            deliveries = await asyncio.to_thread(pick_due, free, self.lease_seconds, shard_id)
+                            picked += len(deliveries)
+                            for group in _group(deliveries):
+                                task = loop.create_task(self._send(client, group))
+                                self._in_flight.add(task)
+                                task.add_done_callback(self._send_done)
+                except Exception:
+                    logger.exception("Webhook dispatcher tick failed")
+
+                if picked == 0 or len(self._in_flight) > self.max_in_flight // 2:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            if self._in_flight:
+                await asyncio.wait(self._in_flight, timeout=WEBHOOK_TIMEOUT_S)
+            await self._flush()
+            await client.aclose()
+            if self.is_leader:
+                self.is_leader = False
+                await asyncio.to_thread(jobs.release_leadership, self.holder, "webhooks")
+
+    def _send_done(self, task):
+        self._in_flight.discard(task)
+        # Isi lagi sekali saat setengah slot kosong (bukan tiap request → hemat query)
+        if len(self._in_flight) in (0, self.max_in_flight // 2):
+            self.wake()
+
+    async def _flush(self):
+        if self._delivered:
+            results, self._delivered = self._delivered, []
+            by_shard = defaultdict(list)
+            for shard_id, ids, status_code in results:
+                by_shard[shard_id].append((ids, status_code))
+            for shard_id, shard_results in by_shard.items():
+                await asyncio.to_thread(mark_delivered, shard_results, shard_id)
+
+    async def _send(self, client, group):
+        first = group[0]
+        if not first.is_active:
+            await asyncio.to_thread(mark_failed, group, None, "Endpoint disabled")
+            return
+
+        events = [
+            {"id": d.event_id, "type": d.event_type, "created_at": d.created_at.isoformat() + "Z", "data": d.data}
+            for d in group
+        ]
+        body = json.dumps(
+            events[0] if first.batch_size <= 1 else {"events": events},
+            ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        headers = {
+            "content-type": "application/json",
+            "user-agent": "umkm-invoice-webhooks/1.0",
+            "x-webhook-id": ",".join(d.event_id for d in group),
+            "x-webhook-signature": sign(first.secret, int(time.time()), body)
+        }
+        host = urlsplit(first.url).netloc
+
+        async with self._merchants.slot(first.merchant_id), self._hosts.slot(host), self._global:
+            try:
+                response = await client.post(first.url, content=body, headers=headers)
+                status_code, error = response.status_code, None
+                if not 200 <= status_code < 300:
+                    error = f"HTTP {status_code}"
+            except httpx.HTTPError as e:
+                status_code, error = None, f"{type(e).__name__}: {e}"
+
+        self.sent += len(group)
+        if error is None:
+            self._delivered.append((first.shard, [d.id for d in group], status_code))
+        else:
+            logger.info("Webhook delivery to %s failed (%s), %d event(s)", first.url, error, len(group))
+            await asyncio.to_thread(mark_failed, group, status_code, error[:1000])
+
+
+def _group(deliveries):
+    """Kelompokkan per endpoint, maks. batch_size event per POST"""
+    by_endpoint = defaultdict(list)
+    for delivery in deliveries:
+        by_endpoint[delivery.endpoint_id].append(delivery)
+    for group in by_endpoint.values():
+        size = max(1, group[0].batch_size)
+        for i in range(0, len(group), size):
+            yield group[i:i + size]
+
+
+dispatcher = WebhookDispatcher()
+jobs.SERVICES.append(dispatcher)
+
+
+# ==================== RETENTION ====================
+
+@jobs.handler("webhooks.cleanup")
+def purge_old_deliveries(payload: dict):
+    """Hapus delivery selesai & event lama (> WEBHOOK_RETENTION_DAYS), semua shard paralel"""
+    cutoff = datetime.utcnow() - timedelta(days=payload.get("days", WEBHOOK_RETENTION_DAYS))
+
+    def purge(shard_id):
+        with shards.writer(shard_id).begin() as conn:
+            deliveries = conn.execute(
+                delete(WebhookDelivery)
+                .where(WebhookDelivery.status != "pending", WebhookDelivery.created_at < cutoff)
+            ).rowcount
+            events = conn.execute(
+                delete(WebhookEvent)
+                .where(
+                    WebhookEvent.dispatched_at < cutoff,
+                    ~exists().where(WebhookDelivery.event_id == WebhookEvent.id)
+                )
+            ).rowcount
+        return deliveries, events
+
+    results = shards.fan_out(purge).values()
+    deliveries = sum(d for d, _ in results)
+    events = sum(e for _, e in results)
+    logger.info("Webhook cleanup: deleted %d deliveries, %d events", deliveries, events)
+
+
+jobs.schedule("webhooks.cleanup", "15 4 * * *")
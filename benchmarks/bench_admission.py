@@ -0,0 +1,210 @@
+"""
+Benchmark: tail latency saat overload, admission control off vs on
+
+HOW IT WORKS:
+1. SQLite baru di temp dir (SQLITE_PROFILE=default → QueuePool 5 + 10 overflow,
+   sama seperti PostgreSQL), satu merchant enterprise + --invoices invoice
+2. Server: uvicorn 1 worker lewat `--serve`, dengan database "lambat": tiap
+   statement SQL + --delay-ms (listener before_cursor_execute)
+3. Load open-loop (tidak menunggu response sebelum kirim berikutnya) --rate
+   req/s selama --seconds: 60% read (GET /v1/merchants/me, detail invoice),
+   20% write (POST /v1/invoices), 10% render (HTML), 10% analytics;
+   plus probe GET /healthz tiap 100 ms seperti load balancer
+4. Dijalankan 2x: ADMISSION=false lalu true. Report per kelas: sukses, 503,
+   error/timeout, p50 / p99 / max ms request yang sukses, dan latency /healthz.
+   Yang diharapkan dengan admission: p99 read & healthz tetap di bawah ~1 detik,
+   kelebihan load jadi 503 cepat (bukan timeout 30 detik).
+   Catatan: handler menjalankan query sync di event loop; dengan uvloop
+   (--loop auto) koneksi baru baru di-accept saat loop senggang, jadi antrean
+   terbentuk SEBELUM request sampai ke middleware. Bandingkan --loop asyncio.
+
+Usage:
+    python -m benchmarks.bench_admission --rate 150 --seconds 20 --delay-ms 5 --loop asyncio
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+MIX = [("read", 0.6), ("write", 0.2), ("render", 0.1), ("analytics", 0.1)]
+
+
+def serve(port: int, delay_ms: float, loop: str):
+    """Child process: app dengan setiap statement SQL diperlambat delay_ms"""
+    import uvicorn
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app.main import app
+
+    if delay_ms > 0:
+        event.listen(Engine, "before_cursor_execute", lambda *args: time.sleep(delay_ms / 1000))
+    uvicorn.run(app, port=port, log_level="warning", loop=loop)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(env: dict, delay_ms: float, loop: str = "auto", timeout: float = 60):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_admission", "--serve", str(port), str(delay_ms), loop], env=env
+    )
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as r:
+                if r.status == 200:
+                    return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            time.sleep(0.05)
+    proc.terminate()
+    raise TimeoutError("No response from /healthz")
+
+
+def setup(port: int, invoices: int):
+    import httpx
+
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+        r = client.post("/v1/merchants/register", params={
+            "name": "Admission", "email": "admission@example.com", "plan": "enterprise"
+        })
+        headers = {"X-API-Key": r.json()["api_key"]}
+        body = {"customer": {"name": "Toko X"}, "items": [{"name": "A", "qty": 1, "unit_price": 1000}],
+                "issue_date": "2025-10-13"}
+        ids = [client.post("/v1/invoices", json=body, headers=headers).json()["id"] for _ in range(invoices)]
+    return headers, ids, body
+
+
+async def http_request(port: int, method: str, path: str, headers: dict, body: bytes = None, timeout: float = 30):
+    """HTTP/1.1 minimal (satu koneksi per request): load generator jauh lebih ringan dari httpx"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    try:
+        lines = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if body is not None:
+            lines += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + (body or b""))
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run_load(port: int, headers: dict, ids: list, body: dict, rate: float, seconds: float, seed: int):
+    rng = random.Random(seed)
+    results = {name: [] for name, _ in MIX + [("healthz", 0)]}
+    payload = json.dumps(body).encode()
+
+    async def one(route_class: str):
+        if route_class == "read":
+            request = ("GET", rng.choice(["/v1/merchants/me", f"/v1/invoices/{rng.choice(ids)}"]), None)
+        elif route_class == "write":
+            request = ("POST", "/v1/invoices", payload)
+        elif route_class == "render":
+            request = ("GET", f"/v1/invoices/{rng.choice(ids)}/html", None)
+        elif route_class == "analytics":
+            request = ("GET", "/v1/merchants/me/analytics", None)
+        else:
+            request = ("GET", "/healthz", None)
+        t0 = time.perf_counter()
+        try:
+            status = await http_request(port, *request[:2], headers, request[2])
+            outcome = "ok" if status < 400 else str(status)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            outcome = "error"
+        results[route_class].append((outcome, time.perf_counter() - t0))
+
+    async def health_probe(deadline: float):
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.create_task(one("healthz")))
+            await asyncio.sleep(0.1)
+
+    tasks = []
+    start = time.perf_counter()
+    probe = asyncio.create_task(health_probe(start + seconds))
+    names, weights = zip(*MIX)
+    sent = 0
+    while (elapsed := time.perf_counter() - start) < seconds:
+        while sent < elapsed * rate:
+            tasks.append(asyncio.create_task(one(rng.choices(names, weights)[0])))
+            sent += 1
+        await asyncio.sleep(0.002)
+    await probe
+    await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(samples):
+    ok = sorted(latency for outcome, latency in samples if outcome == "ok")
+    shed = sum(outcome == "503" for outcome, _ in samples)
+    failed = len(samples) - len(ok) - shed
+
+    def pct(q):
+        return ok[min(len(ok) - 1, int(len(ok) * q))] * 1000 if ok else float("nan")
+    return len(samples), len(ok), shed, failed, (statistics.median(ok) * 1000 if ok else float("nan")), pct(0.99), \
+        (ok[-1] * 1000 if ok else float("nan"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=150, help="Request per detik (open loop)")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--delay-ms", type=float, default=5, help="Tambahan latency per statement SQL")
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto", help="uvicorn --loop")
+    parser.add_argument("--serve", nargs=3, metavar=("PORT", "DELAY_MS", "LOOP"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(int(args.serve[0]), float(args.serve[1]), args.serve[2])
+        return
+
+    tmp = tempfile.mkdtemp()
+    env = {
+        **os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'admission.db')}", "SQLITE_PROFILE": "default",
+        "JOBS_WORKER": "false", "AUTH_CACHE": "false"
+    }
+
+    proc, port = start_server({**env, "ADMISSION": "false"}, 0)
+    try:
+        headers, ids, body = setup(port, args.invoices)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    runs = {}
+    for enabled in ("false", "true"):
+        proc, port = start_server({**env, "ADMISSION": enabled}, args.delay_ms, args.loop)
+        try:
+            runs[enabled] = asyncio.run(run_load(port, headers, ids, body, args.rate, args.seconds, seed=1))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print(f"open loop {args.rate:.0f} req/s for {args.seconds:.0f}s, +{args.delay_ms:.0f} ms per SQL statement, "
+          f"--loop {args.loop}")
+    print(f"{'admission':>9} {'class':<10}{'sent':>6}{'ok':>6}{'503':>6}{'error':>6}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for enabled, results in runs.items():
+        label = "on" if enabled == "true" else "off"
+        for name, samples in results.items():
+            sent, ok, shed, failed, p50, p99, worst = summarize(samples)
+            print(f"{label:>9} {name:<10}{sent:>6}{ok:>6}{shed:>6}{failed:>6}{p50:>9.0f}{p99:>9.0f}{worst:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Benchmark: shared auth cache (app/authcache.py) dengan uvicorn multi-worker
+
+HOW IT WORKS:
+1. SQLite baru di temp dir, --merchants merchant (register lewat API)
+2. Throughput: `uvicorn --workers N` dijalankan 2x (AUTH_CACHE=false / true),
+   --clients process load generator (keep-alive, key merchant acak) memanggil
+   GET /v1/merchants/me selama --seconds detik. Report req/s, p50 & p99 ms.
+3. Invalidation end-to-end (cache on): key kedua di-warm ke semua worker,
+   lalu dicabut (DELETE /v1/merchants/me/api-keys/{id}); sesudah response
+   DELETE diterima, --probe request dengan key itu (koneksi baru → worker acak)
+   harus SEMUA 401. Sama untuk upgrade plan lewat /admin/approve-upgrade.
+4. Propagasi mentah antar process: child spin-read cache.get() sampai entry
+   basi, parent invalidate_merchant(); report µs dari invalidate → terlihat.
+
+Usage:
+    python -m benchmarks.bench_authcache --workers 4 --clients 8 --seconds 10
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ADMIN_KEY = os.getenv("ADMIN_KEY", "admin_secret_key_change_me")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(env: dict, workers: int, timeout: float = 60):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        env=env
+    )
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as r:
+                if r.status == 200:
+                    return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            time.sleep(0.05)
+    proc.terminate()
+    raise TimeoutError("No response from /healthz")
+
+
+def request(port: int, method: str, path: str, key: str = None, conn=None):
+    own = conn is None
+    conn = conn or http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request(method, path, headers={"X-API-Key": key} if key else {})
+        r = conn.getresponse()
+        body = r.read()
+        return r.status, json.loads(body) if body else None
+    finally:
+        if own:
+            conn.close()
+
+
+def load_worker(port: int, keys: list, seconds: float, seed: int, out):
+    """Satu process load generator: request berurutan di satu koneksi keep-alive"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    samples, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        conn.request("GET", "/v1/merchants/me", headers={"X-API-Key": rng.choice(keys)})
+        r = conn.getresponse()
+        r.read()
+        samples.append(time.perf_counter() - t0)
+        errors += r.status != 200
+    conn.close()
+    out.put((samples, errors))
+
+
+def run_load(port: int, keys: list, clients: int, seconds: float):
+    queue = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=load_worker, args=(port, keys, seconds, n, queue)) for n in range(clients)
+    ]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    samples = sorted(s for result in results for s in result[0])
+    return {
+        "rps": len(samples) / seconds,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p99_ms": samples[int(len(samples) * 0.99) - 1] * 1000,
+        "errors": sum(result[1] for result in results)
+    }
+
+
+def check_invalidation(port: int, key: str, probe: int):
+    """Revoke key kedua & upgrade plan; hitung response basi sesudah perubahan di-commit"""
+    status, created = request(port, "POST", "/v1/merchants/me/api-keys?name=bench", key)
+    second_key = created["api_key"]
+    for _ in range(probe):
+        request(port, "GET", "/v1/merchants/me", second_key)  # warm: entry di cache
+
+    request(port, "DELETE", f"/v1/merchants/me/api-keys/{created['key_id']}", key)
+    revoked_ok = sum(request(port, "GET", "/v1/merchants/me", second_key)[0] != 401 for _ in range(probe))
+
+    merchant_id = request(port, "GET", "/v1/merchants/me", key)[1]["id"]
+    request(port, "POST", f"/admin/approve-upgrade/{merchant_id}?new_plan=pro&admin_key={ADMIN_KEY}")
+    stale_plan = sum(request(port, "GET", "/v1/merchants/me", key)[1]["plan"] != "pro" for _ in range(probe))
+    return revoked_ok, stale_plan
+
+
+def _spin_until_stale(path: str, key_hash: str, ready, out):
+    from app.authcache import SharedAuthCache
+
+    cache = SharedAuthCache(path)
+    ready.set()
+    while cache.get(key_hash) is not None:
+        pass
+    out.put(time.monotonic())
+
+
+def raw_propagation(tmp: str, runs: int):
+    """µs dari invalidate_merchant() di process ini sampai child melihat entry basi"""
+    from app.authcache import SharedAuthCache
+
+    path = os.path.join(tmp, "propagation.cache")
+    cache = SharedAuthCache(path)
+    key_hash = "ab" * 32
+    samples = []
+    for _ in range(runs):
+        cache.put(key_hash, "mrc_bench", {"merchant": {"id": "mrc_bench"}}, cache.token())
+        ready, out = multiprocessing.Event(), multiprocessing.Queue()
+        child = multiprocessing.Process(target=_spin_until_stale, args=(path, key_hash, ready, out))
+        child.start()
+        ready.wait()
+        time.sleep(0.05)
+        t0 = time.monotonic()
+        cache.invalidate_merchant("mrc_bench")
+        samples.append((out.get() - t0) * 1e6)
+        child.join()
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8, help="Process load generator")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--merchants", type=int, default=200)
+    parser.add_argument("--probe", type=int, default=200, help="Request sesudah revoke / upgrade")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    base_env = {
+        **os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'authcache.db')}", "JOBS_WORKER": "false",
+        "AUTH_CACHE_PATH": os.path.join(tmp, "auth.cache")
+    }
+
+    proc, port = start_server({**base_env, "AUTH_CACHE": "false"}, 1)
+    try:
+        keys = []
+        for n in range(args.merchants):
+            status, body = request(
+                port, "POST", f"/v1/merchants/register?name=Bench+{n}&email=bench{n}%40example.com"
+            )
+            keys.append(body["api_key"])
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    results = {}
+    for enabled in ("false", "true"):
+        proc, port = start_server({**base_env, "AUTH_CACHE": enabled}, args.workers)
+        try:
+            run_load(port, keys, args.clients, 1)  # warm-up (cache & koneksi)
+            results[enabled] = run_load(port, keys, args.clients, args.seconds)
+            if enabled == "true":
+                revoked_ok, stale_plan = check_invalidation(port, keys[0], args.probe)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print(f"GET /v1/merchants/me, uvicorn --workers {args.workers}, {args.clients} clients, "
+          f"{args.merchants} merchants, {args.seconds:.0f}s")
+    print(f"{'auth cache':>11}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for enabled, r in results.items():
+        label = "on" if enabled == "true" else "off"
+        print(f"{label:>11}{r['rps']:>10,.0f}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['errors']:>8}")
+    print(f"after revoke:  {revoked_ok}/{args.probe} requests still accepted (expected 0)")
+    print(f"after upgrade: {stale_plan}/{args.probe} responses with old plan (expected 0)")
+    median_us, max_us = raw_propagation(tmp, 20)
+    print(f"cross-process invalidation visible after: median {median_us:.0f} µs, max {max_us:.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: sync sekumpulan invoice dengan loop GET /v1/invoices/{id} vs POST /v1/invoices:batchGet
+
+HOW IT WORKS:
+1. SQLite baru di temp dir, satu merchant dengan --invoices invoice (insert langsung)
+2. Ambil --keys invoice acak (sebagian --missing tidak ada) dengan:
+   - loop: GET /v1/invoices/{id} per invoice (404 untuk yang tidak ada)
+   - batch: POST /v1/invoices:batchGet per 1000 id
+   - batch-number: sama, by nomor invoice (index unik merchant_id, number)
+   - batch-sparse: by id, fields=id,status,totals (payload & breakdown tidak dimuat)
+3. Report per mode: waktu total, request HTTP & statement SQL
+
+Usage:
+    python -m benchmarks.bench_batch_get --invoices 50000 --keys 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BATCH_MAX = 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=50_000)
+    parser.add_argument("--keys", type=int, default=2000, help="Invoice yang di-sync")
+    parser.add_argument("--missing", type=float, default=0.05, help="Bagian key yang tidak ada")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update({"DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}", "JOBS_WORKER": "false",
+                       "ADMISSION": "false"})
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, insert
+    from sqlalchemy.engine import Engine
+    from app import database
+    from app.db_models import Invoice
+    from app.main import app
+
+    statements = {"n": 0}
+
+    def count(*_):
+        statements["n"] += 1
+
+    with TestClient(app) as client:
+        r = client.post("/v1/merchants/register", params={
+            "name": "Bench", "email": "batchget@example.com", "plan": "enterprise"
+        })
+        headers = {"X-API-Key": r.json()["api_key"]}
+        merchant_id = r.json()["merchant_id"]
+        payload = {"customer": {"name": "Toko"}, "currency": "IDR", "issue_date": "2025-01-01",
+                   "items": [{"name": f"Item {i}", "qty": 1, "unit_price": 10000} for i in range(5)]}
+        start = datetime(2025, 1, 1)
+        with database.engine.begin() as conn:
+            for offset in range(0, args.invoices, 5000):
+                conn.execute(insert(Invoice), [
+                    {"id": f"inv_{n:012d}", "merchant_id": merchant_id, "number": f"INV/2025/01/{n + 1:06d}",
+                     "status": "issued", "payload": payload, "subtotal": 50000, "tax_total": 0,
+                     "grand_total": 50000, "created_at": start + timedelta(seconds=n),
+                     "updated_at": start + timedelta(seconds=n)}
+                    for n in range(offset, min(offset + 5000, args.invoices))
+                ])
+
+        rng = random.Random(1)
+        picked = rng.sample(range(args.invoices), args.keys)
+        ids = [f"inv_{n:012d}" if rng.random() >= args.missing else f"inv_missing_{n}" for n in picked]
+        numbers = [f"INV/2025/01/{n + 1:06d}" if key.startswith("inv_0") else f"NOPE/{n}"
+                   for n, key in zip(picked, ids)]
+        client.get("/v1/merchants/me", headers=headers)  # warm-up auth cache
+
+        def loop():
+            found = 0
+            for inv_id in ids:
+                found += client.get(f"/v1/invoices/{inv_id}", headers=headers).status_code == 200
+            return found, len(ids)
+
+        def batch(key: str, keys: list, fields=None):
+            found = requests = 0
+            for i in range(0, len(keys), BATCH_MAX):
+                body = {key: keys[i:i + BATCH_MAX]}
+                if fields:
+                    body["fields"] = fields
+                found += client.post("/v1/invoices:batchGet", json=body, headers=headers).json()["found"]
+                requests += 1
+            return found, requests
+
+        modes = {
+            "loop": loop,
+            "batch": lambda: batch("ids", ids),
+            "batch-number": lambda: batch("numbers", numbers),
+            "batch-sparse": lambda: batch("ids", ids, ["id", "status", "totals"]),
+        }
+        event.listen(Engine, "before_cursor_execute", count)
+        print(f"{args.keys} keys ({args.missing:.0%} missing) of {args.invoices} invoices")
+        print(f"{'mode':<14}{'time':>10}{'requests':>10}{'SQL':>8}{'found':>8}")
+        for name, run in modes.items():
+            statements["n"] = 0
+            t0 = time.perf_counter()
+            found, requests = run()
+            elapsed = time.perf_counter() - t0
+            print(f"{name:<14}{elapsed * 1000:>8,.0f}ms{requests:>10}{statements['n']:>8}{found:>8}")
+
+
+if __name__ == "__main__":
+    main()
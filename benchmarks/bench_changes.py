@@ -0,0 +1,222 @@
+"""
+Benchmark: ERP polling GET /v1/invoices vs change feed (long-poll / SSE)
+
+HOW IT WORKS:
+1. Tiap mode jalan di child process sendiri dengan SQLite baru
+   (SQLITE_PROFILE=production: GET & feed lewat read pool, POST lewat writer):
+   uvicorn di event loop yang sama dengan client (httpx lewat TCP lokal),
+   supaya statement SQL server bisa dihitung (listener before_cursor_execute)
+2. Setup: --merchants merchant enterprise, masing-masing --seed invoice.
+   Client change feed sync awal dulu (tidak dihitung) sampai dapat cursor terbaru
+3. Selama --seconds: writer membuat --rate invoice/detik (round-robin merchant),
+   dan --clients client per merchant mendeteksi invoice baru dengan:
+   - poll: GET /v1/invoices?limit=50&offset=0 (+ COUNT) tiap --interval detik
+   - longpoll: GET /v1/invoices/changes?since=<cursor>&wait=25 berulang
+   - sse: GET /v1/invoices/changes/stream (Last-Event-ID = cursor awal)
+4. Report per mode: request client, statement SQL per detik di read pool
+   (semua query deteksi; POST writer tidak ikut), latency deteksi p50 / p99
+   (invoice di-commit → client melihatnya) dan invoice yang terlewat
+Broadcaster di sini satu process (commit lokal langsung membangunkan feed);
+antar worker, perubahan terdeteksi dalam CHANGES_POLL_INTERVAL_MS.
+
+Usage:
+    python -m benchmarks.bench_changes --merchants 20 --clients 3 --seconds 10 --rate 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BODY = {"customer": {"name": "Toko Maju"}, "items": [{"name": "Kopi", "qty": 1, "unit_price": 85000}],
+        "issue_date": "2025-10-13"}
+MODES = ("poll", "longpoll", "sse")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def child(mode: str, args):
+    """Dijalankan di process terpisah; print hasil (JSON) ke stdout"""
+    import httpx
+    import uvicorn
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import database
+    from app.main import app
+
+    statements = {"total": 0}
+
+    def count(conn, *args):
+        if conn.engine is database.read_engine:
+            statements["total"] += 1
+    event.listen(Engine, "before_cursor_execute", count)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning", timeout_graceful_shutdown=1))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits)
+
+    merchants = []
+    for n in range(args.merchants):
+        r = await client.post("/v1/merchants/register", params={
+            "name": f"ERP {n}", "email": f"erp{n}@example.com", "plan": "enterprise"
+        })
+        headers = {"X-API-Key": r.json()["api_key"]}
+        for _ in range(args.seed):
+            await client.post("/v1/invoices", json=BODY, headers=headers)
+        merchants.append(headers)
+
+    async def initial_cursor(headers):
+        cursor = "0"
+        while True:
+            page = (await client.get("/v1/invoices/changes", params={"since": cursor, "limit": 500},
+                                     headers=headers)).json()
+            cursor = page["next_cursor"]
+            if not page["has_more"]:
+                return cursor
+
+    cursors = [await initial_cursor(headers) for headers in merchants]
+
+    created = {}  # invoice id → waktu commit (response diterima)
+    seen = []     # (invoice id, waktu terlihat) per client
+    requests = {"n": 0}
+
+    async def poll(m, found):
+        while True:
+            page = (await client.get("/v1/invoices", params={"limit": 50, "offset": 0},
+                                     headers=merchants[m])).json()
+            requests["n"] += 1
+            now = time.perf_counter()
+            for inv in page["invoices"]:
+                found.setdefault(inv["id"], now)
+            await asyncio.sleep(args.interval)
+
+    async def longpoll(m, found):
+        cursor = cursors[m]
+        while True:
+            page = (await client.get("/v1/invoices/changes", params={"since": cursor, "wait": 25},
+                                     headers=merchants[m])).json()
+            requests["n"] += 1
+            now = time.perf_counter()
+            for change in page["changes"]:
+                found.setdefault(change["invoice_id"], now)
+            cursor = page["next_cursor"]
+
+    async def sse(m, found):
+        headers = {**merchants[m], "Last-Event-ID": cursors[m]}
+        requests["n"] += 1
+        async with client.stream("GET", "/v1/invoices/changes/stream", headers=headers) as stream:
+            async for line in stream.aiter_lines():
+                if line.startswith("data:"):
+                    found.setdefault(json.loads(line[5:])["invoice_id"], time.perf_counter())
+
+    clients = []
+    for m in range(args.merchants):
+        for _ in range(args.clients):
+            found = {}
+            seen.append((m, found))
+            clients.append(asyncio.create_task({"poll": poll, "longpoll": longpoll, "sse": sse}[mode](m, found)))
+
+    await asyncio.sleep(0.5)  # semua client sudah connect / poll pertama
+    statements["total"] = 0
+    requests["n"] = 0
+    by_merchant = [set() for _ in merchants]
+    t0 = time.perf_counter()
+    n = 0
+    while time.perf_counter() - t0 < args.seconds:
+        m = n % args.merchants
+        r = await client.post("/v1/invoices", json=BODY, headers=merchants[m])
+        created[r.json()["id"]] = time.perf_counter()
+        by_merchant[m].add(r.json()["id"])
+        n += 1
+        await asyncio.sleep(max(0.0, t0 + n / args.rate - time.perf_counter()))
+    elapsed = time.perf_counter() - t0
+    feed_statements = statements["total"]
+    feed_requests = requests["n"]
+
+    await asyncio.sleep(args.interval + 0.5)  # beri waktu deteksi invoice terakhir
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    await client.aclose()
+    server.should_exit = True
+    await server_task
+
+    latencies, missed = [], 0
+    for m, found in seen:
+        for inv_id in by_merchant[m]:
+            if inv_id in found:
+                latencies.append((found[inv_id] - created[inv_id]) * 1000)
+            else:
+                missed += 1
+    print(json.dumps({
+        "requests_per_s": feed_requests / elapsed,
+        "statements_per_s": feed_statements / elapsed,
+        "invoices": len(created),
+        "p50_ms": _percentile(latencies, 0.5),
+        "p99_ms": _percentile(latencies, 0.99),
+        "missed": missed
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=3, help="Integrasi (client) per merchant")
+    parser.add_argument("--seed", type=int, default=200, help="Invoice awal per merchant")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rate", type=float, default=20, help="Invoice baru per detik (semua merchant)")
+    parser.add_argument("--interval", type=float, default=2, help="Interval polling (mode poll)")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.child, args))
+        return
+
+    runs = {}
+    for mode in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                **os.environ, "JOBS_WORKER": "false", "ADMISSION": "false",
+                "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}", "SQLITE_PROFILE": "production",
+                "CHANGES_STREAM_MAX_S": str(args.seconds * 10)
+            }
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_changes", "--child", mode] + [
+                    f"--{name}={getattr(args, name)}" for name in
+                    ("merchants", "clients", "seed", "seconds", "rate", "interval")
+                ],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+            runs[mode] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{args.merchants} merchants × {args.clients} clients, {args.rate:g} invoices/s for {args.seconds:g}s "
+          f"(poll every {args.interval:g}s)")
+    print(f"{'mode':<10}{'req/s':>9}{'read SQL/s':>12}{'detect p50':>12}{'detect p99':>12}{'missed':>8}")
+    for mode, r in runs.items():
+        print(f"{mode:<10}{r['requests_per_s']:>9,.1f}{r['statements_per_s']:>12,.1f}"
+              f"{r['p50_ms']:>10,.0f}ms{r['p99_ms']:>10,.0f}ms{r['missed']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark: export invoice (CSV/NDJSON) dengan memory konstan
+
+HOW IT WORKS:
+1. Bikin SQLite database baru di folder temp
+2. Isi N invoice sintetis (default 1.000.000) lewat bulk insert
+3. Jalankan export di child process (supaya peak RSS-nya murni dari export)
+4. Bandingkan peak RSS dengan batas (--max-rss-mb); exit code 1 kalau lewat
+
+Usage:
+    python -m benchmarks.bench_export --invoices 1000000 --format csv
+    python -m benchmarks.bench_export --invoices 100000 --format ndjson --gzip
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+MERCHANT_ID = "mrc_bench"
+
+
+def seed(database_url: str, invoices: int, batch: int = 10000):
+    os.environ["DATABASE_URL"] = database_url
+    from app.database import init_engines, Base
+    from app.db_models import Merchant, Invoice
+
+    engine, _ = init_engines()
+    Base.metadata.create_all(bind=engine)
+
+    start = datetime(2025, 1, 1)
+    payload = {
+        "customer": {"name": "Toko Benchmark"},
+        "items": [
+            {"name": "Produk A", "qty": 2, "unit": "pcs", "unit_price": 10000, "discount": 0, "tax_rate": 0.11, "is_tax_inclusive": False},
+            {"name": "Produk B", "qty": 1, "unit": "pcs", "unit_price": 25000, "discount": 0, "tax_rate": 0.11, "is_tax_inclusive": False}
+        ],
+        "charges": {"shipping": 0, "service": 0, "rounding": 0},
+        "discount_total": 0,
+        "tax_strategy": "per_item",
+        "currency": "IDR",
+        "issue_date": "2025-01-01",
+        "due_date": None,
+        "notes": None
+    }
+
+    with engine.begin() as conn:
+        conn.execute(Merchant.__table__.insert(), [{
+            "id": MERCHANT_ID, "name": "Bench", "email": "bench@example.com",
+            "plan": "enterprise", "quota_limit": 999999, "quota_used": 0,
+            "is_active": True, "created_at": start
+        }])
+
+    for offset in range(0, invoices, batch):
+        rows = [
+            {
+                "id": f"inv_{n:012d}",
+                "merchant_id": MERCHANT_ID,
+                "number": f"INV/2025/01/{n + 1:04d}",
+                "status": "issued",
+                "payload": payload,
+                "subtotal": 45000,
+                "tax_total": 4950,
+                "grand_total": 49950,
+                "created_at": start + timedelta(seconds=n),
+                "updated_at": start + timedelta(seconds=n)
+            }
+            for n in range(offset, min(offset + batch, invoices))
+        ]
+        with engine.begin() as conn:
+            conn.execute(Invoice.__table__.insert(), rows)
+
+
+def export(database_url: str, fmt: str, gzip: bool):
+    """Child process: consume export stream, print bytes & rows"""
+    os.environ["DATABASE_URL"] = database_url
+    from app.database import init_engines
+    from app.main import _export_lines, _gzip_stream
+
+    init_engines()
+
+    body = _export_lines(MERCHANT_ID, None, fmt, None, None)
+    if gzip:
+        body = _gzip_stream(body)
+
+    size = 0
+    for chunk in body:
+        size += len(chunk)
+    print(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--max-rss-mb", type=float, default=200)
+    parser.add_argument("--export-only", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.export_only:
+        export(args.export_only, args.format, args.gzip)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+
+        t0 = time.perf_counter()
+        seed(database_url, args.invoices)
+        print(f"seeded {args.invoices:,} invoices in {time.perf_counter() - t0:.1f}s")
+
+        cmd = [sys.executable, "-m", "benchmarks.bench_export", "--export-only", database_url, "--format", args.format]
+        if args.gzip:
+            cmd.append("--gzip")
+
+        t0 = time.perf_counter()
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        elapsed = time.perf_counter() - t0
+
+        # ru_maxrss: KB di Linux, bytes di macOS
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+        print(f"exported {int(out.strip().splitlines()[-1]):,} bytes ({args.format}{', gzip' if args.gzip else ''}) in {elapsed:.1f}s")
+        print(f"peak RSS export process: {peak_mb:.1f} MB (limit {args.max_rss_mb:.0f} MB)")
+
+        if peak_mb > args.max_rss_mb:
+            print("FAIL: peak RSS above limit")
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: creates/sec vs concurrency, dengan dan tanpa group commit
+
+HOW IT WORKS:
+1. Jalankan FastAPI app in-process (httpx ASGITransport) dengan SQLite baru
+   (atau DATABASE_URL yang sudah di-set)
+2. Register merchant plan enterprise
+3. Untuk tiap concurrency level, kirim --requests POST /v1/invoices sekaligus,
+   sekali dengan GROUP_COMMIT off dan sekali on
+4. Report creates/sec per kombinasi
+
+Usage:
+    python -m benchmarks.bench_group_commit --requests 2000 --concurrency 1 16 64 256
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+
+BODY = {
+    "customer": {"name": "Toko Flash Sale"},
+    "items": [{"name": "Produk A", "qty": 2, "unit_price": 10000, "tax_rate": 0.11}],
+    "issue_date": "2025-10-13"
+}
+
+
+async def run_level(client, headers, requests: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with sem:
+            r = await client.post("/v1/invoices", json=BODY, headers=headers)
+            if r.status_code != 200:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - t0), errors
+
+
+async def main_async(args):
+    import httpx
+    from app.main import app
+    from app import group_commit
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        r = await client.post("/v1/merchants/register", params={
+            "name": "Bench", "email": f"bench{os.getpid()}@example.com", "plan": "enterprise"
+        })
+        headers = {"X-API-Key": r.json()["api_key"]}
+
+        print(f"{'concurrency':>11} {'off (creates/s)':>16} {'on (creates/s)':>15}")
+        for concurrency in args.concurrency:
+            row = []
+            for enabled in (False, True):
+                group_commit.GROUP_COMMIT_ENABLED = enabled
+                rate, errors = await run_level(client, headers, args.requests, concurrency)
+                row.append(f"{rate:,.0f}" + (f" ({errors} err)" if errors else ""))
+            print(f"{concurrency:>11} {row[0]:>16} {row[1]:>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Creates per (concurrency, mode)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark: throughput job queue (jobs/detik) per concurrency & jumlah worker process
+
+HOW IT WORKS:
+1. Database baru (SQLite temp file, atau --database-url untuk Postgres)
+2. Per concurrency: bulk insert --jobs job "bench.noop" (handler sync, opsional
+   --work-ms sleep untuk mensimulasikan I/O), lalu ukur waktu sampai semua "done"
+   - --processes 1: JobWorker di process ini
+   - --processes N: N child process `app.jobs` worker di database yang sama
+     (uji claim optimistic antar process)
+3. Report jobs/detik + cek at-least-once tanpa duplikat: total attempts harus
+   sama dengan jumlah job (attempts > jumlah job = job yang di-claim dua kali)
+4. Juga ukur enqueue: satu transaksi per job (seperti dari request) vs batch
+
+Usage:
+    python -m benchmarks.bench_jobs --jobs 2000 --concurrency 1 4 16
+    python -m benchmarks.bench_jobs --jobs 2000 --concurrency 8 --processes 4 --work-ms 5
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def _register_bench_handler(work_ms: float):
+    from app import jobs
+
+    @jobs.handler("bench.noop")
+    def noop(payload):
+        if work_ms:
+            time.sleep(work_ms / 1000)
+
+
+def _reset_and_fill(count: int):
+    from app import database
+    from app.db_models import Job
+    from app.db_models import gen_id
+
+    now = datetime.utcnow()
+    with database.engine.begin() as conn:
+        conn.execute(Job.__table__.delete())
+        rows = [
+            {"id": gen_id("job"), "kind": "bench.noop", "payload": {"n": i}, "status": "queued",
+             "attempts": 0, "max_attempts": 5, "run_at": now, "created_at": now}
+            for i in range(count)
+        ]
+        conn.execute(Job.__table__.insert(), rows)
+
+
+def _progress():
+    from sqlalchemy import func, select
+    from app import database
+    from app.db_models import Job
+
+    with database.engine.connect() as conn:
+        done = conn.execute(select(func.count()).where(Job.status == "done")).scalar()
+        attempts = conn.execute(select(func.coalesce(func.sum(Job.attempts), 0))).scalar()
+    return done, attempts
+
+
+def bench_enqueue(count: int):
+    from app import jobs
+    from app.database import SessionLocal
+
+    t0 = time.perf_counter()
+    for i in range(count):
+        db = SessionLocal()
+        jobs.enqueue(db, "bench.noop", {"n": i})
+        db.commit()
+        db.close()
+    single = count / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    for i in range(count):
+        jobs.enqueue(db, "bench.noop", {"n": i})
+    db.commit()
+    db.close()
+    batch = count / (time.perf_counter() - t0)
+    print(f"enqueue: {single:,.0f} jobs/s (1 commit per job), {batch:,.0f} jobs/s (1 commit per {count})")
+
+
+async def _run_in_process(count: int, concurrency: int, poll_ms: float):
+    from app import jobs
+
+    worker = jobs.JobWorker(concurrency=concurrency, poll_interval_ms=poll_ms, scheduler=False)
+    t0 = time.perf_counter()
+    worker.start()
+    while worker.processed < count:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - t0
+    await worker.stop()
+    return elapsed
+
+
+def _run_processes(database_url: str, count: int, concurrency: int, processes: int, poll_ms: float, work_ms: float):
+    env = {
+        **os.environ, "DATABASE_URL": database_url, "JOBS_CONCURRENCY": str(concurrency),
+        "JOBS_POLL_INTERVAL_MS": str(poll_ms), "JOBS_SCHEDULER": "false"
+    }
+    children = [
+        subprocess.Popen([sys.executable, "-m", "benchmarks.bench_jobs", "--child", "--work-ms", str(work_ms)], env=env)
+        for _ in range(processes)
+    ]
+    try:
+        time.sleep(2)  # import + start worker (di luar pengukuran)
+        _reset_and_fill(count)
+        t0 = time.perf_counter()
+        while _progress()[0] < count:
+            time.sleep(0.01)
+        return time.perf_counter() - t0
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+
+
+def run_child(work_ms: float):
+    """Child process: worker app.jobs + handler bench.noop"""
+    from app import jobs
+
+    _register_bench_handler(work_ms)
+    jobs.run_worker()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Default: SQLite baru di temp dir")
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--work-ms", type=float, default=0, help="Sleep per job (simulasi I/O)")
+    parser.add_argument("--poll-ms", type=float, default=50)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.work_ms)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'jobs.db')}"
+        os.environ["DATABASE_URL"] = database_url
+        from app import database
+        import app.db_models  # noqa: F401 (register tabel di Base.metadata)
+
+        engine, _ = database.init_engines()
+        database.Base.metadata.create_all(bind=engine)
+        database.ensure_indexes()
+        _register_bench_handler(args.work_ms)
+
+        bench_enqueue(min(args.jobs, 1000))
+
+        print(f"\n{args.jobs:,} jobs, work {args.work_ms} ms/job, {args.processes} process(es)")
+        print(f"{'concurrency':>12}{'seconds':>10}{'jobs/s':>10}{'duplicates':>12}")
+        for concurrency in args.concurrency:
+            if args.processes > 1:
+                elapsed = _run_processes(
+                    database_url, args.jobs, concurrency, args.processes, args.poll_ms, args.work_ms
+                )
+            else:
+                _reset_and_fill(args.jobs)
+                elapsed = asyncio.run(_run_in_process(args.jobs, concurrency, args.poll_ms))
+            done, attempts = _progress()
+            print(f"{concurrency:>12}{elapsed:>10.2f}{done / elapsed:>10,.0f}{attempts - done:>12}")
+
+        database.dispose_engines()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark: POST /v1/payments:reconcile dengan file mutasi besar (default 50k baris)
+
+HOW IT WORKS:
+1. SQLite baru di temp dir, satu merchant (--plan, default pro = ikut tulis
+   event webhook) dengan --invoices invoice dari benchmarks.datagen
+   (--months 2 supaya sebagian besar masuk window tanggal fallback nominal)
+2. File mutasi --lines baris dari invoice acak (tiap invoice paling banyak sekali):
+   - --with-number bagian: reference berisi nomor invoice, format acak
+     (INV/2025/10/0001, inv-2025-10-1, "INV 2025 10 0001")
+   - sisanya: reference tanpa nomor (fallback nominal + tanggal)
+   - --noise bagian: nominal acak / debit / baris rusak
+3. Ukur dry_run dulu (hanya matching), lalu request asli (matching + UPDATE
+   set-based + INSERT payments + events), lewat TestClient
+4. Report detik, baris/detik & summary; cek jumlah invoice paid di database
+   sama dengan summary.invoices_paid
+
+Usage:
+    python -m benchmarks.bench_reconcile --invoices 60000 --lines 50000
+    python -m benchmarks.bench_reconcile --lines 50000 --format ndjson --plan starter
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+
+def build_file(rows, lines: int, with_number: float, noise: float, fmt: str, seed: int):
+    rng = random.Random(seed)
+    picked = rng.sample(rows, min(lines, len(rows)))
+    records = []
+    for row in picked:
+        year, month, seq = row.number.split("/")[1:]
+        paid_on = (row.created_at + timedelta(days=rng.randint(0, 14))).date()
+        amount = row.grand_total
+        if rng.random() < noise:
+            kind = rng.choice(["random", "debit", "broken"])
+            if kind == "random":
+                amount = rng.randint(1, 10 ** 9)
+            elif kind == "debit":
+                amount = -amount
+            else:
+                records.append({"amount": "abc", "date": "??", "reference": "rusak"})
+                continue
+        if rng.random() < with_number:
+            reference = rng.choice([
+                f"TRF {row.number} Toko", f"pembayaran inv-{year}-{int(month)}-{int(seq)}", f"INV {year} {month} {seq}"
+            ])
+        else:
+            reference = f"TRANSFER DARI {rng.choice(['BUDI', 'SITI', 'ANDI'])} {rng.randint(1000, 9999)}"
+        records.append({
+            "amount": f"{amount:,}".replace(",", ".") + ",00", "date": paid_on.strftime("%d/%m/%Y"),
+            "reference": reference
+        })
+
+    if fmt == "ndjson":
+        return "\n".join(json.dumps(record) for record in records).encode()
+    out = ["tanggal;keterangan;nominal"]
+    out += [f"{r['date']};{r['reference']};{r['amount']}" for r in records]
+    return "\n".join(out).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=60000)
+    parser.add_argument("--lines", type=int, default=50000)
+    parser.add_argument("--with-number", type=float, default=0.7, help="Bagian baris yang menyebut nomor invoice")
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--plan", default="pro")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'reconcile.db')}")
+    os.environ["JOBS_WORKER"] = "false"
+    os.environ.setdefault("RECONCILE_MAX_LINES", str(max(args.lines, 100000)))
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+    from app import database
+    from app.db_models import Invoice, Merchant
+    from app.main import app
+    from benchmarks.datagen import generate
+
+    client = TestClient(app)
+    client.__enter__()  # lifespan: init engines & tabel
+
+    t0 = time.perf_counter()
+    api_key = generate(database.engine, 1, args.invoices, seed=args.seed, months=2, log=lambda *_: None)[0]
+    with database.engine.begin() as conn:
+        conn.execute(Merchant.__table__.update().values(plan=args.plan))
+        rows = conn.execute(select(Invoice.number, Invoice.grand_total, Invoice.created_at)).all()
+    print(f"generated {args.invoices:,} invoices in {time.perf_counter() - t0:.1f}s")
+
+    body = build_file(rows, args.lines, args.with_number, args.noise, args.format, args.seed)
+    headers = {"X-API-Key": api_key}
+    print(f"mutation file: {args.lines:,} lines, {len(body) / 1e6:.1f} MB {args.format}")
+
+    for dry_run in (True, False):
+        t0 = time.perf_counter()
+        r = client.post(
+            "/v1/payments:reconcile", params={"dry_run": dry_run, "format": args.format}, content=body, headers=headers
+        )
+        elapsed = time.perf_counter() - t0
+        r.raise_for_status()
+        summary = r.json()["summary"]
+        label = "dry run" if dry_run else "apply"
+        print(f"{label:>8}: {elapsed:.2f}s → {summary['lines'] / elapsed:,.0f} lines/s")
+        print(f"          {summary}")
+
+    with database.engine.connect() as conn:
+        paid = conn.execute(select(func.count()).where(Invoice.status == "paid")).scalar()
+    print(f"invoices paid in database: {paid:,} (summary: {summary['invoices_paid']:,})")
+
+    client.__exit__(None, None, None)
+
+
+if __name__ == "__main__":
+    main()
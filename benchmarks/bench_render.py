@@ -0,0 +1,117 @@
+"""
+Benchmark: biaya render HTML invoice, breakdown dihitung saat render vs tersimpan
+
+HOW IT WORKS:
+1. SQLite baru di temp dir, satu merchant enterprise, per ukuran --items
+   dibuat --invoices invoice lewat POST /v1/invoices (breakdown tersimpan)
+2. "before": kolom breakdown di-NULL-kan (= invoice lama sebelum backfill),
+   GET /v1/invoices/{id}/html menghitung pajak & total per baris dari payload
+3. Backfill lewat handler job invoices.backfill_breakdown (diukur: invoice/detik)
+4. "after": render yang sama membaca breakdown tersimpan
+5. Report median / p95 ms per request + biaya invoice_breakdown() saja (µs),
+   karena query, auth & template sama di kedua kondisi
+
+Usage:
+    python -m benchmarks.bench_render --items 1 10 50 --invoices 50 --repeat 200
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def run_renders(client, headers, ids, repeat: int):
+    samples = []
+    for n in range(repeat):
+        inv_id = ids[n % len(ids)]
+        t0 = time.perf_counter()
+        r = client.get(f"/v1/invoices/{inv_id}/html", headers=headers)
+        samples.append((time.perf_counter() - t0) * 1000)
+        r.raise_for_status()
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def breakdown_us(ids, repeat: int):
+    """Biaya invoice_breakdown() saja per invoice (µs), tanpa HTTP & query"""
+    from app.database import SessionLocal
+    from app.db_models import Invoice
+    from app.invoicing import invoice_breakdown
+
+    db = SessionLocal()
+    try:
+        invoices = db.query(Invoice).filter(Invoice.id.in_(ids)).all()
+        t0 = time.perf_counter()
+        for n in range(repeat):
+            invoice_breakdown(invoices[n % len(invoices)])
+        return (time.perf_counter() - t0) / repeat * 1e6
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--invoices", type=int, default=50, help="Invoice per ukuran")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'render.db')}")
+    os.environ["JOBS_WORKER"] = "false"
+
+    from fastapi.testclient import TestClient
+    from app import database
+    from app.db_models import Invoice
+    from app.invoicing import backfill_breakdowns
+    from app.main import app
+
+    client = TestClient(app)
+    client.__enter__()  # lifespan: init engines & tabel
+    r = client.post("/v1/merchants/register", params={
+        "name": "Render", "email": f"render-{os.getpid()}@example.com", "plan": "enterprise"
+    })
+    headers = {"X-API-Key": r.json()["api_key"]}
+
+    ids = {}
+    for count in args.items:
+        items = [
+            {"name": f"Item {n}", "qty": 1 + n % 3, "unit_price": 12500 + 500 * n, "discount": 250 * (n % 2),
+             "tax_rate": 0.11, "is_tax_inclusive": n % 4 == 0}
+            for n in range(count)
+        ]
+        body = {"customer": {"name": "Toko X"}, "items": items, "issue_date": "2025-10-13"}
+        ids[count] = [
+            client.post("/v1/invoices", json=body, headers=headers).json()["id"] for _ in range(args.invoices)
+        ]
+
+    results = {}
+    with database.engine.begin() as conn:
+        conn.execute(Invoice.__table__.update().values(breakdown=None))
+    for count in args.items:
+        run_renders(client, headers, ids[count], 20)  # warm-up
+        results[count] = [(*run_renders(client, headers, ids[count], args.repeat), breakdown_us(ids[count], args.repeat))]
+
+    total = sum(len(v) for v in ids.values())
+    t0 = time.perf_counter()
+    backfill_breakdowns({"pause_ms": 0})
+    backfill_rate = total / (time.perf_counter() - t0)
+
+    for count in args.items:
+        run_renders(client, headers, ids[count], 20)
+        results[count].append((*run_renders(client, headers, ids[count], args.repeat), breakdown_us(ids[count], args.repeat)))
+
+    client.__exit__(None, None, None)
+
+    print(f"GET /v1/invoices/{{id}}/html, {args.repeat} requests per cell (ms)")
+    print(f"{'items':>6}{'before p50':>12}{'before p95':>12}{'after p50':>11}{'after p95':>11}"
+          f"{'breakdown before':>18}{'after':>9}")
+    for count in args.items:
+        (b50, b95, b_us), (a50, a95, a_us) = results[count]
+        print(f"{count:>6}{b50:>12.2f}{b95:>12.2f}{a50:>11.2f}{a95:>11.2f}{b_us:>16.1f}µs{a_us:>7.1f}µs")
+    print(f"backfill: {total:,} invoices at {backfill_rate:,.0f} invoices/s")
+
+
+if __name__ == "__main__":
+    main()
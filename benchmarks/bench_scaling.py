@@ -0,0 +1,152 @@
+"""
+Benchmark: latency query utama vs ukuran data (10k / 100k / 1M invoice)
+
+HOW IT WORKS:
+1. Untuk tiap ukuran, child process baru dengan SQLite baru di temp dir
+   (engine app satu per process, jadi satu process = satu database)
+2. Isi data lewat benchmarks.datagen (--merchants merchant, invoice dibagi rata,
+   usage logs setengah jumlah invoice), lalu semua merchant jadi enterprise
+   supaya create tidak kena quota
+3. Ukur tiap query/endpoint untuk merchant pertama: --repeat kali setelah warm-up,
+   lewat TestClient (sama seperti request asli: auth + handler + serialisasi)
+4. Tabel median ms per ukuran + faktor pertumbuhan terhadap ukuran terkecil.
+   Query yang sehat (index) tumbuh ~1x; yang scan per merchant tumbuh linear.
+
+Usage:
+    python -m benchmarks.bench_scaling --sizes 10000 100000 1000000
+    python -m benchmarks.bench_scaling --sizes 10000 50000 --repeat 10 --output scaling.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def measure(fn, repeat: int, warmup: int = 3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3)
+    }
+
+
+def run_child(database_url: str, size: int, merchants: int, repeat: int):
+    """Child process: generate data, ukur query, print JSON"""
+    os.environ["DATABASE_URL"] = database_url
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app import database
+    from app.database import SessionLocal
+    from app.db_models import Merchant
+    from app.invoicing import next_number_db
+    from benchmarks.datagen import generate
+
+    client = TestClient(app)
+    client.__enter__()  # lifespan: init engines & tabel
+
+    per_merchant = max(1, size // merchants)
+    t0 = time.perf_counter()
+    api_keys = generate(
+        database.engine, merchants, per_merchant, usage_logs_per_merchant=per_merchant // 2,
+        log=lambda msg: print(msg, file=sys.stderr)
+    )
+    generate_seconds = time.perf_counter() - t0
+
+    with database.engine.begin() as conn:
+        conn.execute(Merchant.__table__.update().values(plan="enterprise", quota_limit=999999))
+
+    headers = {"X-API-Key": api_keys[0]}
+    merchant_id = client.get("/v1/merchants/me", headers=headers).json()["id"]
+    inv_id = client.get("/v1/invoices?limit=1", headers=headers).json()["invoices"][0]["id"]
+    deep_offset = max(0, per_merchant - 50)
+    deep_cursor = client.get(f"/v1/invoices?limit=1&offset={deep_offset}", headers=headers).json()["invoices"][0]["id"]
+    admin_key = os.getenv("ADMIN_KEY", "admin_secret_key_change_me")
+    body = {"customer": {"name": "Toko X"}, "items": [{"name": "A", "qty": 1, "unit_price": 1000}], "issue_date": "2025-10-13"}
+
+    def get(path):
+        return lambda: client.get(path, headers=headers).raise_for_status()
+
+    def next_number():
+        db = SessionLocal()
+        try:
+            next_number_db(merchant_id, db)
+        finally:
+            db.close()
+
+    checks = {
+        "auth (GET /v1/merchants/me)": get("/v1/merchants/me"),
+        "next_number_db": next_number,
+        "create (POST /v1/invoices)": lambda: client.post("/v1/invoices", json=body, headers=headers).raise_for_status(),
+        "list first page": get("/v1/invoices?limit=50"),
+        "list deep offset": get(f"/v1/invoices?limit=50&offset={deep_offset}"),
+        "list deep cursor": get(f"/v1/invoices?limit=50&cursor={deep_cursor}"),
+        "detail": get(f"/v1/invoices/{inv_id}"),
+        "html": get(f"/v1/invoices/{inv_id}/html"),
+        "usage": get("/v1/merchants/me/usage"),
+        "analytics 30d": get("/v1/merchants/me/analytics?days=30"),
+        "analytics 365d": get("/v1/merchants/me/analytics?days=365"),
+        "reset-all-quotas": lambda: client.post(f"/admin/reset-all-quotas?admin_key={admin_key}").raise_for_status(),
+    }
+
+    results = {name: measure(fn, repeat) for name, fn in checks.items()}
+    print(json.dumps({
+        "size": size,
+        "merchants": merchants,
+        "invoices_per_merchant": per_merchant,
+        "generate_seconds": round(generate_seconds, 1),
+        "results": results
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Total invoice")
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="Tulis hasil JSON ke file ini")
+    parser.add_argument("--child", nargs=2, metavar=("DATABASE_URL", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.merchants, args.repeat)
+        return
+
+    runs = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = f"sqlite:///{os.path.join(tmp, 'scaling.db')}"
+            cmd = [
+                sys.executable, "-m", "benchmarks.bench_scaling", "--child", database_url, str(size),
+                "--merchants", str(args.merchants), "--repeat", str(args.repeat)
+            ]
+            out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+            run = json.loads(out.strip().splitlines()[-1])
+            runs.append(run)
+            print(f"{size:,} invoices: generated in {run['generate_seconds']}s", file=sys.stderr)
+
+    names = list(runs[0]["results"])
+    header = f"{'query (median ms)':<30}" + "".join(f"{run['size']:>12,}" for run in runs) + f"{'growth':>9}"
+    print(header)
+    for name in names:
+        values = [run["results"][name]["median_ms"] for run in runs]
+        growth = values[-1] / values[0] if values[0] else 0
+        print(f"{name:<30}" + "".join(f"{v:>12.2f}" for v in values) + f"{growth:>8.1f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
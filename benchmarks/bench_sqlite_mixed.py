@@ -0,0 +1,126 @@
+"""
+Benchmark: mixed read/write load di SQLite, profile "default" vs "production"
+
+HOW IT WORKS:
+1. Bikin SQLite database baru per profile, isi invoice awal
+2. Jalankan N reader threads (query list invoice per merchant) dan
+   M writer threads (insert invoice + update quota, commit per invoice)
+3. Setelah --seconds, report reads/sec, writes/sec, dan error (database is locked)
+
+Usage:
+    python -m benchmarks.bench_sqlite_mixed --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+
+MERCHANTS = 20
+
+
+def seed(engine, invoices: int):
+    from app.database import Base
+    from app.db_models import Merchant, Invoice, gen_id
+
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(Merchant.__table__.insert(), [
+            {"id": f"mrc_{m}", "name": f"M{m}", "email": f"m{m}@example.com", "plan": "enterprise",
+             "quota_limit": 999999, "quota_used": 0, "is_active": True, "created_at": now}
+            for m in range(MERCHANTS)
+        ])
+        conn.execute(Invoice.__table__.insert(), [
+            {"id": gen_id("inv"), "merchant_id": f"mrc_{n % MERCHANTS}", "number": f"INV/2025/01/{n:04d}",
+             "status": "issued", "payload": {"customer": {"name": "Toko"}, "items": []},
+             "subtotal": 1000, "tax_total": 110, "grand_total": 1110, "created_at": now, "updated_at": now}
+            for n in range(invoices)
+        ])
+
+
+def run(profile: str, database_url: str, readers: int, writers: int, seconds: float, invoices: int):
+    from app.database import build_engines
+    from app.db_models import Merchant, Invoice, gen_id
+
+    writer_engine, reader_engine = build_engines(database_url, sqlite_profile=profile)
+    seed(writer_engine, invoices)
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def reader(n):
+        done = errors = 0
+        while time.perf_counter() < stop:
+            try:
+                with reader_engine.connect() as conn:
+                    conn.execute(
+                        select(Invoice.id, Invoice.number, Invoice.grand_total)
+                        .where(Invoice.merchant_id == f"mrc_{(n + done) % MERCHANTS}")
+                        .order_by(Invoice.created_at.desc()).limit(50)
+                    ).all()
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts["reads"] += done
+            counts["errors"] += errors
+
+    def writer(n):
+        done = errors = 0
+        while time.perf_counter() < stop:
+            merchant_id = f"mrc_{(n + done) % MERCHANTS}"
+            now = datetime.utcnow()
+            try:
+                with writer_engine.begin() as conn:
+                    conn.execute(Invoice.__table__.insert(), [{
+                        "id": gen_id("inv"), "merchant_id": merchant_id, "number": f"INV/2025/02/{n}-{done:06d}",
+                        "status": "issued", "payload": {"customer": {"name": "Toko"}, "items": []},
+                        "subtotal": 1000, "tax_total": 110, "grand_total": 1110,
+                        "created_at": now, "updated_at": now
+                    }])
+                    conn.execute(
+                        update(Merchant).where(Merchant.id == merchant_id)
+                        .values(quota_used=Merchant.quota_used + 1)
+                    )
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    writer_engine.dispose()
+    reader_engine.dispose()
+    return {k: v / seconds if k != "errors" else v for k, v in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--invoices", type=int, default=50_000, help="Rows seeded before the run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ("default", "production"):
+            url = f"sqlite:///{os.path.join(tmp, profile + '.db')}"
+            r = run(profile, url, args.readers, args.writers, args.seconds, args.invoices)
+            print(f"{profile:>10}: {r['reads']:,.0f} reads/sec  {r['writes']:,.0f} writes/sec  {r['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: waktu import app.main dan time-to-first-response uvicorn
+
+HOW IT WORKS:
+1. Import time: `python -X importtime -c "import app.main"` di process baru,
+   total waktu + modul paling mahal (cumulative) dari output importtime
+2. Cek import tanpa efek samping: tidak ada file database yang terbentuk
+3. Time-to-first-response: start `uvicorn app.main:app` dengan SQLite baru,
+   poll GET /healthz sampai 200; diulang --runs kali, report median
+   (mencakup import, lifespan: engine + create_all + pre-warm, request pertama)
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5
+    DB_POOL_PREWARM=2 python -m benchmarks.bench_startup --runs 5 --top 20
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+
+def import_time(top: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'import.db')}"}
+        t0 = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app.main"],
+            env=env, capture_output=True, text=True, check=True
+        )
+        wall = time.perf_counter() - t0
+        side_effects = os.listdir(tmp)
+
+    # Format: "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        head, cumulative_us, name = line.split("|")
+        self_us = head.split(":")[1]
+        modules.append((int(cumulative_us), int(self_us), name.strip()))
+
+    app_main = next((m for m in modules if m[2] == "app.main"), None)
+    print(f"import app.main: {app_main[0] / 1000:.1f} ms cumulative (process wall {wall * 1000:.0f} ms)")
+    print(f"files created by import: {side_effects or 'none'}")
+    print(f"\ntop {top} imports (cumulative ms):")
+    for cumulative, self_us, name in sorted(modules, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:>8.1f}  {self_us / 1000:>7.1f} self  {name}")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def first_response(timeout: float = 30):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = _free_port()
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.db')}"}
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            env=env
+        )
+        try:
+            while time.perf_counter() - t0 < timeout:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as r:
+                        if r.status == 200:
+                            return time.perf_counter() - t0
+                except OSError:
+                    if proc.poll() is not None:
+                        raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+                    time.sleep(0.005)
+            raise TimeoutError("No response from /healthz")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Jumlah modul termahal yang ditampilkan")
+    args = parser.parse_args()
+
+    import_time(args.top)
+
+    samples = [first_response() for _ in range(args.runs)]
+    print(
+        f"\ntime to first response (uvicorn start → GET /healthz 200): "
+        f"median {statistics.median(samples) * 1000:.0f} ms, min {min(samples) * 1000:.0f} ms, "
+        f"max {max(samples) * 1000:.0f} ms ({args.runs} runs)"
+    )
+
+
+if __name__ == "__main__":
+    main()
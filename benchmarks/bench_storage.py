@@ -0,0 +1,177 @@
+"""
+Benchmark: storage backend embedded (app/embedded_store.py) vs SQLite
+
+HOW IT WORKS:
+1. Tiap backend jalan di child process sendiri (STORAGE_BACKEND dibaca saat
+   import): SQLite baru (SQLITE_PROFILE production) atau data dir baru
+2. Lewat interface repository (tanpa HTTP, satu unit of work + commit per
+   operasi seperti satu request): --merchants merchant, lalu --invoices
+   create invoice, get invoice acak, list halaman pertama, halaman keyset di
+   tengah, count, dan update status
+3. Startup dengan data: lifespan app (buka database / load snapshot), dan
+   untuk embedded juga replay log saja (seperti setelah crash, tanpa snapshot)
+4. Report µs per operasi (median) dan ops/detik per backend
+
+Usage:
+    python -m benchmarks.bench_storage --invoices 20000 --reads 5000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BODY = {
+    "customer": {"name": "Toko Maju", "email": "toko@example.com"},
+    "items": [
+        {"name": "Kopi Arabica 250g", "qty": 2, "unit_price": 85000, "tax_rate": 0.11},
+        {"name": "Ongkir", "qty": 1, "unit_price": 15000}
+    ],
+    "issue_date": "2025-10-13"
+}
+
+
+def timed(fn, runs: int):
+    samples = []
+    for n in range(runs):
+        t0 = time.perf_counter()
+        fn(n)
+        samples.append(time.perf_counter() - t0)
+    return {"median_us": statistics.median(samples) * 1e6, "ops": runs / sum(samples)}
+
+
+def child(backend: str, merchants: int, invoices: int, reads: int):
+    """Dijalankan di process terpisah; print hasil (JSON) ke stdout"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.models import CreateInvoice
+    from app import repository
+
+    payload = CreateInvoice(**BODY)
+    rng = random.Random(1)
+    results = {}
+
+    t0 = time.perf_counter()
+    client = TestClient(app)
+    client.__enter__()
+    results["startup_empty_ms"] = (time.perf_counter() - t0) * 1000
+
+    merchant_ids = []
+
+    def register(n):
+        with repository.standalone() as repo:
+            merchant, _ = repo.create_merchant(
+                key_hash=f"{n:064x}", key_prefix="inv_live_bench", key_name="bench",
+                name=f"Bench {n}", email=f"bench{n}@example.com", plan="enterprise", quota_limit=10 ** 9
+            )
+            merchant_ids.append(merchant.id)
+    timed(register, merchants)
+
+    invoice_ids = []
+
+    def create(n):
+        with repository.standalone() as repo:
+            merchant = repo.get_merchant(merchant_ids[n % merchants])
+            invoice_ids.append((merchant.id, repo.create_invoice(merchant, payload)["id"]))
+    results["create_invoice"] = timed(create, invoices)
+
+    def get(n):
+        with repository.standalone() as repo:
+            merchant_id, inv_id = rng.choice(invoice_ids)
+            assert repo.get_invoice(merchant_id, inv_id) is not None
+    results["get_invoice"] = timed(get, reads)
+
+    def first_page(n):
+        with repository.standalone() as repo:
+            repo.list_invoices(merchant_ids[n % merchants], 50)
+    results["list_first_page"] = timed(first_page, max(reads // 10, 1))
+
+    def keyset_page(n):
+        with repository.standalone() as repo:
+            merchant_id, inv_id = invoice_ids[len(invoice_ids) // 2 + n % 100]
+            repo.list_invoices(merchant_id, 50, cursor=inv_id)
+    results["list_keyset_page"] = timed(keyset_page, max(reads // 10, 1))
+
+    def count(n):
+        with repository.standalone() as repo:
+            repo.count_invoices(merchant_ids[n % merchants])
+    results["count_invoices"] = timed(count, max(reads // 10, 1))
+
+    def mark_paid(n):
+        with repository.standalone() as repo:
+            merchant_id, inv_id = invoice_ids[n]
+            merchant = repo.get_merchant(merchant_id)
+            repo.update_invoice(merchant, repo.get_invoice(merchant_id, inv_id), {"status": "paid"}, "invoice.paid")
+    results["update_invoice"] = timed(mark_paid, min(reads, invoices))
+
+    if backend == "embedded":
+        # Salinan data dir sebelum shutdown = state seperti setelah crash (log saja)
+        crash_copy = repository.store.path + "-crash"
+        shutil.copytree(repository.store.path, crash_copy, ignore=shutil.ignore_patterns("LOCK"))
+
+    client.__exit__(None, None, None)
+
+    t0 = time.perf_counter()
+    with TestClient(app) as client:
+        results["startup_with_data_ms"] = (time.perf_counter() - t0) * 1000
+
+    if backend == "embedded":
+        from app.embedded_store import EmbeddedStore
+
+        t0 = time.perf_counter()
+        store = EmbeddedStore().open(crash_copy)
+        results["replay_log_ms"] = (time.perf_counter() - t0) * 1000
+        store.close()
+
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--invoices", type=int, default=20_000)
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--child", choices=["sql", "embedded"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.merchants, args.invoices, args.reads)
+        return
+
+    runs = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("sql", "embedded"):
+            env = {
+                **os.environ, "STORAGE_BACKEND": backend, "JOBS_WORKER": "false", "AUTH_CACHE": "false",
+                "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}", "SQLITE_PROFILE": "production",
+                # snapshot hanya saat shutdown, supaya replay log mengukur semua operasi
+                "EMBEDDED_DATA_DIR": os.path.join(tmp, "data"), "EMBEDDED_SNAPSHOT_EVERY": str(10 ** 9)
+            }
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_storage", "--child", backend, "--merchants",
+                 str(args.merchants), "--invoices", str(args.invoices), "--reads", str(args.reads)],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+            runs[backend] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{args.merchants} merchants, {args.invoices:,} invoices, {args.reads:,} reads; "
+          f"one unit of work + commit per operation")
+    print(f"{'operation':<18}{'sqlite µs':>11}{'embedded µs':>13}{'sqlite ops/s':>14}{'embedded ops/s':>16}")
+    for op in ("create_invoice", "get_invoice", "list_first_page", "list_keyset_page", "count_invoices",
+               "update_invoice"):
+        sql, emb = runs["sql"][op], runs["embedded"][op]
+        print(f"{op:<18}{sql['median_us']:>11,.0f}{emb['median_us']:>13,.1f}{sql['ops']:>14,.0f}{emb['ops']:>16,.0f}")
+    print(f"{'startup (empty)':<18}{runs['sql']['startup_empty_ms']:>10,.0f}ms"
+          f"{runs['embedded']['startup_empty_ms']:>12,.0f}ms")
+    print(f"{'startup (data)':<18}{runs['sql']['startup_with_data_ms']:>10,.0f}ms"
+          f"{runs['embedded']['startup_with_data_ms']:>12,.0f}ms  (embedded: snapshot load)")
+    print(f"{'replay log only':<18}{'-':>12}{runs['embedded']['replay_log_ms']:>12,.0f}ms  (after crash, no snapshot)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Benchmark: webhook delivery end-to-end terhadap receiver lokal (stand-in merchant)
+
+HOW IT WORKS:
+1. Receiver: ASGI app kecil di uvicorn (thread terpisah, 127.0.0.1:<port acak>)
+   - verifikasi X-Webhook-Signature dengan secret per endpoint (path /hook/<nomor merchant>)
+   - --fail-rate: sebagian request dijawab 500 (uji retry + backoff)
+   - --latency-ms: delay per request (simulasi server merchant yang lambat)
+   - catat event unik, duplikat, jumlah POST & jumlah TCP connection (client port)
+2. --merchants merchant plan pro, masing-masing satu endpoint (--batch-size)
+3. --invoices invoice dibuat lewat API (POST /v1/invoices) → event di outbox
+4. WebhookDispatcher jalan sampai semua event diterima receiver;
+   report events/detik, POST, connection (keep-alive: jauh lebih kecil dari POST),
+   signature invalid (harus 0), duplikat (at-least-once: > 0 hanya kalau retry
+   setelah receiver sempat terima)
+Receiver jalan di process yang sama (berbagi GIL dengan dispatcher), jadi
+events/detik di sini batas bawah; receiver asli di host lain lebih cepat.
+
+Usage:
+    python -m benchmarks.bench_webhooks --merchants 20 --invoices 2000
+    python -m benchmarks.bench_webhooks --batch-size 50 --latency-ms 20 --fail-rate 0.1
+    python -m benchmarks.bench_webhooks --no-keepalive   # pembanding: connection baru per POST
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+
+class Receiver:
+    """Stand-in endpoint merchant"""
+
+    def __init__(self, fail_rate: float = 0, latency_ms: float = 0, seed: int = 1):
+        self.secrets = {}  # path terakhir → secret
+        self.fail_rate = fail_rate
+        self.latency = latency_ms / 1000
+        self.rng = random.Random(seed)
+        self.events = set()
+        self.duplicates = 0
+        self.posts = 0
+        self.failed = 0
+        self.bad_signatures = 0
+        self.connections = set()
+
+    async def __call__(self, scope, receive, send):
+        from app.webhooks import verify
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        self.posts += 1
+        self.connections.add(tuple(scope["client"]))
+        headers = dict(scope["headers"])
+        secret = self.secrets.get(scope["path"].rsplit("/", 1)[-1], "")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if not verify(secret, headers.get(b"x-webhook-signature", b"").decode(), body):
+            self.bad_signatures += 1
+            status = 400
+        elif self.rng.random() < self.fail_rate:
+            self.failed += 1
+            status = 500
+        else:
+            data = json.loads(body)
+            for event in data.get("events", [data]):
+                if event["id"] in self.events:
+                    self.duplicates += 1
+                self.events.add(event["id"])
+            status = 200
+
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-length", b"2")]})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def start_receiver(receiver: Receiver):
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        receiver, host="127.0.0.1", port=port, log_level="warning", lifespan="off", access_log=False
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--invoices", type=int, default=2000, help="Total invoice (= event invoice.created)")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--merchant-concurrency", type=int, default=4)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--no-keepalive", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'webhooks.db')}")
+    os.environ["WEBHOOK_ALLOW_PRIVATE_URLS"] = "true"
+    os.environ.setdefault("WEBHOOK_BACKOFF_BASE_S", "0.2")  # retry cepat untuk benchmark
+    os.environ["JOBS_WORKER"] = "false"  # dispatcher dijalankan manual di bawah
+
+    import httpx
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, select
+    from app import database, webhooks
+    from app.db_models import Merchant, WebhookDelivery
+    from app.main import app
+
+    receiver = Receiver(args.fail_rate, args.latency_ms)
+    server, port = start_receiver(receiver)
+
+    client = TestClient(app)
+    client.__enter__()  # lifespan: init engines & tabel
+    keys = []
+    for m in range(args.merchants):
+        r = client.post("/v1/merchants/register", params={
+            "name": f"Webhook {m}", "email": f"webhook{m}-{os.getpid()}@example.com", "plan": "pro"
+        })
+        headers = {"X-API-Key": r.json()["api_key"]}
+        endpoint = client.post("/v1/webhooks", headers=headers, json={
+            "url": f"http://127.0.0.1:{port}/hook/{m}", "batch_size": args.batch_size
+        }).json()
+        receiver.secrets[str(m)] = endpoint["secret"]
+        keys.append(headers)
+
+    with database.engine.begin() as conn:
+        conn.execute(Merchant.__table__.update().values(quota_limit=10 ** 9))
+
+    body = {"customer": {"name": "Toko X"}, "items": [{"name": "A", "qty": 1, "unit_price": 1000}], "issue_date": "2025-10-13"}
+    t0 = time.perf_counter()
+    for i in range(args.invoices):
+        headers = keys[i % len(keys)]
+        client.post("/v1/invoices", json=body, headers=headers).raise_for_status()
+    create_seconds = time.perf_counter() - t0
+
+    transport = None
+    if args.no_keepalive:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_keepalive_connections=0))
+
+    async def dispatch():
+        dispatcher = webhooks.WebhookDispatcher(
+            concurrency=args.concurrency, merchant_concurrency=args.merchant_concurrency,
+            poll_interval_ms=20, transport=transport
+        )
+        start = time.perf_counter()
+        dispatcher.start()
+        while len(receiver.events) < args.invoices and time.perf_counter() - start < args.timeout:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await dispatcher.stop()
+        return elapsed
+
+    elapsed = asyncio.run(dispatch())
+    with database.engine.connect() as conn:
+        states = dict(conn.execute(
+            select(WebhookDelivery.status, func.count()).group_by(WebhookDelivery.status)
+        ).all())
+
+    client.__exit__(None, None, None)
+    server.should_exit = True
+
+    print(f"created {args.invoices:,} invoices in {create_seconds:.1f}s (outbox write ikut transaksi create)")
+    print(
+        f"delivered {len(receiver.events):,}/{args.invoices:,} events in {elapsed:.2f}s "
+        f"→ {len(receiver.events) / elapsed:,.0f} events/s"
+    )
+    print(
+        f"POSTs {receiver.posts:,} (500s injected: {receiver.failed:,}), TCP connections {len(receiver.connections):,}, "
+        f"bad signatures {receiver.bad_signatures}, duplicates {receiver.duplicates}"
+    )
+    print(f"deliveries by status: {states}")
+
+
+if __name__ == "__main__":
+    main()
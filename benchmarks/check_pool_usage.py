@@ -0,0 +1,68 @@
+"""
+Check: satu pooled connection checkout per authenticated request
+
+HOW IT WORKS:
+1. Pakai SQLite database baru (atau DATABASE_URL yang sudah di-set)
+2. Register merchant, buat 1 invoice, lalu warm-up (last_used sudah ter-update)
+3. Hitung event "checkout" di semua engine selama tiap request
+4. Exit code 1 kalau ada endpoint yang checkout lebih dari sekali
+
+Usage:
+    python -m benchmarks.check_pool_usage
+"""
+import os
+import sys
+import tempfile
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'pool.db')}")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from app import database
+    from app.main import app
+
+    client = TestClient(app)
+    client.__enter__()  # lifespan: init engines
+
+    checkouts = []
+    for e in {database.engine, database.read_engine}:
+        event.listen(e, "checkout", lambda *args: checkouts.append(1))
+
+    r = client.post("/v1/merchants/register", params={
+        "name": "Pool Check", "email": f"pool{os.getpid()}@example.com", "plan": "pro"
+    })
+    headers = {"X-API-Key": r.json()["api_key"]}
+    body = {"customer": {"name": "Toko X"}, "items": [{"name": "A", "qty": 1, "unit_price": 1000}], "issue_date": "2025-10-13"}
+    inv_id = client.post("/v1/invoices", json=body, headers=headers).json()["id"]
+    customer_id = client.get(f"/v1/invoices/{inv_id}", headers=headers).json()["customer_id"]
+    client.get("/v1/merchants/me", headers=headers)
+
+    cases = [
+        ("GET", "/v1/merchants/me", None),
+        ("GET", "/v1/merchants/me/api-keys", None),
+        ("GET", "/v1/invoices", None),
+        ("GET", f"/v1/invoices/{inv_id}", None),
+        ("GET", f"/v1/invoices/{inv_id}/html", None),
+        ("GET", "/v1/merchants/me/usage", None),
+        ("GET", "/v1/merchants/me/analytics", None),
+        ("POST", "/v1/invoices", body),
+        ("GET", f"/v1/customers/{customer_id}/invoices", None),
+        ("POST", "/v1/invoices:batchGet", {"ids": [inv_id, "inv_missing"]}),
+    ]
+
+    failed = False
+    for method, path, json_body in cases:
+        checkouts.clear()
+        r = client.request(method, path, json=json_body, headers=headers)
+        status = "OK" if len(checkouts) == 1 and r.status_code < 400 else "FAIL"
+        failed |= status == "FAIL"
+        print(f"{status:4} {method:4} {path:45} status={r.status_code} checkouts={len(checkouts)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Check: query budget per endpoint (gagal kalau ada N+1 / round-trip tambahan)
+
+HOW IT WORKS:
+1. Pakai SQLite database baru (atau DATABASE_URL yang sudah di-set)
+2. Register merchant, buat 1 invoice, warm-up
+3. Jalankan tiap endpoint di dalam assert_max_queries(budget)
+4. Exit code 1 kalau ada endpoint yang melebihi budget (query-nya ditampilkan)
+
+Usage:
+    python -m benchmarks.check_query_budgets
+"""
+import os
+import sys
+import tempfile
+
+# Budget = jumlah statement SQL maksimal per request (auth = 2 SELECT saat auth cache miss)
+BUDGETS = [
+    ("GET", "/v1/merchants/me", 2),
+    ("GET", "/v1/merchants/me/api-keys", 3),
+    ("GET", "/v1/invoices", 4),
+    ("GET", "/v1/invoices?cursor={inv_id}", 4),
+    ("GET", "/v1/invoices/{inv_id}", 3),
+    ("GET", "/v1/invoices/{inv_id}/html", 3),
+    ("GET", "/v1/merchants/me/usage", 2),
+    ("GET", "/v1/merchants/me/analytics", 6),
+    ("GET", "/v1/merchants/me/revenue", 3),
+    ("GET", "/v1/merchants/me/revenue?granularity=month", 3),
+    ("POST", "/v1/invoices:batchGet", 3),  # satu IN (...) per BATCH_GET_CHUNK key
+    ("GET", "/v1/customers/{customer_id}/invoices", 4),
+    ("GET", "/v1/customers/{customer_id}/invoices?cursor={inv_id}", 5),
+    # + INSERT webhook_events (outbox, plan pro), upsert revenue_daily & revenue_monthly, UPDATE customers (cache hit)
+    ("POST", "/v1/invoices", 9),
+]
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'budget.db')}")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.sqlstats import assert_max_queries
+
+    client = TestClient(app)
+    client.__enter__()  # lifespan: init engines & tabel
+    r = client.post("/v1/merchants/register", params={
+        "name": "Budget Check", "email": f"budget{os.getpid()}@example.com", "plan": "pro"
+    })
+    headers = {"X-API-Key": r.json()["api_key"]}
+    body = {"customer": {"name": "Toko X"}, "items": [{"name": "A", "qty": 1, "unit_price": 1000}], "issue_date": "2025-10-13"}
+    inv_id = client.post("/v1/invoices", json=body, headers=headers).json()["id"]
+    customer_id = client.get(f"/v1/invoices/{inv_id}", headers=headers).json()["customer_id"]
+    client.get("/v1/merchants/me", headers=headers)
+
+    failed = False
+    for method, path, budget in BUDGETS:
+        path = path.format(inv_id=inv_id, customer_id=customer_id)
+        try:
+            with assert_max_queries(budget) as stats:
+                if path.endswith(":batchGet"):
+                    json_body = {"ids": [inv_id, "inv_missing"], "fields": ["id", "status", "totals"]}
+                else:
+                    json_body = body if method == "POST" else None
+                r = client.request(method, path, json=json_body, headers=headers)
+            status = "OK" if r.status_code < 400 else "FAIL"
+            detail = ""
+        except AssertionError as e:
+            status, detail = "FAIL", f"\n{e}"
+        failed |= status == "FAIL"
+        print(f"{status:4} {method:4} {path:45} queries={stats.count}/{budget}{detail}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Check: tenant sharding dengan beberapa file SQLite lokal (app/shards.py)
+
+HOW IT WORKS:
+1. Database utama + 2 shard SQLite baru di temp dir (DATABASE_SHARDS=s1,s2)
+2. Register --merchants merchant, buat invoice, webhook endpoint & PATCH lewat
+   API. Dicek langsung di file SQLite: baris tenant ada di shard merchant saja
+   (tidak di database utama / shard lain), dan GET / list / export / analytics
+   membaca dari shard yang benar
+3. /admin/shards (fan-out paralel) cocok dengan isi file
+4. Pindah satu merchant online: --bulk invoice tambahan di shard asal, lalu
+   `python -m app.shards move` jalan di process terpisah SAMBIL merchant itu
+   terus create invoice & GET lewat API. Sesudahnya: semua invoice yang dapat
+   200 ada di shard tujuan, shard asal kosong, write selama freeze dapat 503
+   (CLI pakai auth cache sendiri seperti host lain: cache API tidak di-invalidate),
+   change feed (seq) tetap lanjut tanpa celah dari shard tujuan, dan agregat
+   revenue di shard tujuan cocok dengan invoices setelah bulan invoice bulk
+   (di-insert langsung, tanpa agregat) di-rebuild; saldo customer ikut pindah
+5. Exit code 1 kalau ada yang tidak cocok
+
+Usage:
+    python -m benchmarks.check_shards --merchants 6 --bulk 20000
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BODY = {"customer": {"name": "Toko X"}, "items": [{"name": "A", "qty": 1, "unit_price": 1000}],
+        "issue_date": "2025-10-13"}
+TENANT_TABLES = (
+    "customers", "invoices", "invoice_changes", "revenue_daily", "revenue_monthly", "usage_logs", "webhook_endpoints",
+    "webhook_events", "webhook_deliveries"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--merchants", type=int, default=6)
+    parser.add_argument("--bulk", type=int, default=20_000, help="Invoice tambahan merchant yang dipindah")
+    parser.add_argument("--drain-s", type=float, default=0.5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    files = {name: os.path.join(tmp, f"{name}.db") for name in ("main", "s1", "s2")}
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{files['main']}",
+        "DATABASE_SHARDS": f"s1=sqlite:///{files['s1']},s2=sqlite:///{files['s2']}",
+        "JOBS_WORKER": "false",
+        # move menunggu satu TTL auth cache sebelum hapus data di shard lama
+        "AUTH_CACHE_TTL_S": "3"
+    })
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import insert
+    from app import revenue, shards
+    from app.db_models import Invoice, gen_id
+    from app.main import app
+
+    failures = []
+
+    def check(ok: bool, message: str):
+        print(f"{'OK' if ok else 'FAIL':4} {message}")
+        if not ok:
+            failures.append(message)
+
+    def rows(shard: str, table: str, merchant_id: str) -> int:
+        with sqlite3.connect(files[shard]) as conn:
+            return conn.execute(f"SELECT count(*) FROM {table} WHERE merchant_id = ?", (merchant_id,)).fetchone()[0]
+
+    with TestClient(app) as client:
+        merchants = []
+        for n in range(args.merchants):
+            r = client.post("/v1/merchants/register", params={
+                "name": f"Shard {n}", "email": f"shard{n}@example.com", "plan": "enterprise"
+            })
+            headers = {"X-API-Key": r.json()["api_key"]}
+            merchant_id = r.json()["merchant_id"]
+            with sqlite3.connect(files["main"]) as conn:
+                shard = conn.execute("SELECT shard_id FROM merchants WHERE id = ?", (merchant_id,)).fetchone()[0]
+            client.post("/v1/webhooks", json={"url": "https://example.com/hook"}, headers=headers)
+            ids = [client.post("/v1/invoices", json=BODY, headers=headers).json()["id"] for _ in range(3)]
+            client.patch(f"/v1/invoices/{ids[0]}", json={"status": "paid"}, headers=headers)
+            merchants.append((merchant_id, shard, headers, ids))
+
+        placed = {shard for _, shard, _, _ in merchants}
+        check(placed <= {"s1", "s2"} and len(placed) == 2, f"new merchants spread over shards: {sorted(placed)}")
+
+        for merchant_id, shard, headers, ids in merchants:
+            elsewhere = sum(rows(other, table, merchant_id) for other in files if other != shard
+                            for table in TENANT_TABLES)
+            check(rows(shard, "invoices", merchant_id) == 3 and rows(shard, "webhook_events", merchant_id) == 4
+                  and elsewhere == 0, f"{merchant_id} tenant rows only in {shard}")
+            listed = client.get("/v1/invoices", headers=headers).json()
+            detail = client.get(f"/v1/invoices/{ids[0]}", headers=headers).json()
+            export = client.get("/v1/invoices/export", params={"format": "ndjson"}, headers=headers).text
+            analytics = client.get("/v1/merchants/me/analytics", headers=headers)
+            check(len(listed["invoices"]) == 3 and detail["status"] == "paid" and len(export.splitlines()) == 3
+                  and analytics.status_code == 200, f"{merchant_id} reads routed to {shard}")
+
+        t0 = time.perf_counter()
+        admin = client.get("/admin/shards", params={"admin_key": "admin_secret_key_change_me"}).json()
+        by_shard = {row["shard"]: row for row in admin["shards"]}
+        expected = {s: sum(3 for _, shard, _, _ in merchants if shard == s) for s in ("s1", "s2")}
+        check(by_shard["main"]["invoices"] == 0 and all(by_shard[s]["invoices"] == expected[s] for s in expected),
+              f"/admin/shards fan-out in {(time.perf_counter() - t0) * 1000:.0f} ms: "
+              + ", ".join(f"{s}={row['merchants']}m/{row['invoices']}i" for s, row in by_shard.items()))
+
+        # ---------- online move ----------
+        merchant_id, source, headers, ids = merchants[0]
+        target = "s2" if source == "s1" else "s1"
+        with shards.writer(source).begin() as conn:
+            conn.execute(insert(Invoice), [
+                {"id": gen_id("inv"), "merchant_id": merchant_id, "number": f"BULK/{n:06d}", "status": "issued",
+                 "payload": BODY, "subtotal": 1000, "tax_total": 0, "grand_total": 1000}
+                for n in range(args.bulk)
+            ])
+        created = set(ids)
+
+        t0 = time.perf_counter()
+        move = subprocess.Popen(
+            [sys.executable, "-m", "app.shards", "move", merchant_id, target, "--drain-s", str(args.drain_s)],
+            # Auth cache terpisah = "host lain": invalidate dari CLI tidak sampai ke cache API
+            # di process ini, entry-nya basi sampai TTL (write harus tetap ke shard yang benar)
+            env={**os.environ, "AUTH_CACHE_PATH": os.path.join(tmp, "cli-host.authcache")},
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        statuses = {}
+        while move.poll() is None:
+            r = client.post("/v1/invoices", json=BODY, headers=headers)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            if r.status_code == 200:
+                created.add(r.json()["id"])
+            read = client.get(f"/v1/invoices/{ids[1]}", headers=headers)
+            statuses[f"GET {read.status_code}"] = statuses.get(f"GET {read.status_code}", 0) + 1
+        output = move.stdout.read()
+        elapsed = time.perf_counter() - t0
+        check(move.returncode == 0, f"move {source} → {target} exit {move.returncode} in {elapsed:.1f}s")
+        print("     " + output.strip().splitlines()[-1] if output.strip() else "")
+        print(f"     requests during move: {statuses}")
+
+        for _ in range(5):
+            r = client.post("/v1/invoices", json=BODY, headers=headers)
+            created.add(r.json().get("id"))
+        total = args.bulk + len(created)
+        check(rows(target, "invoices", merchant_id) == total and rows(source, "invoices", merchant_id) == 0,
+              f"{total} invoices on {target}, 0 left on {source}")
+        check(rows(target, "webhook_endpoints", merchant_id) == 1
+              and len(client.get("/v1/webhooks", headers=headers).json()["webhooks"]) == 1,
+              "webhook endpoint moved")
+        with sqlite3.connect(files[target]) as conn:
+            seqs = [seq for seq, in conn.execute(
+                "SELECT seq FROM invoice_changes WHERE merchant_id = ? ORDER BY seq", (merchant_id,))]
+        feed = client.get("/v1/invoices/changes", params={"since": len(seqs) - 5}, headers=headers).json()
+        check(seqs == list(range(1, len(seqs) + 1)) and [c["cursor"] for c in feed["changes"]]
+              == [str(seq) for seq in seqs[-5:]], f"change feed seq 1..{len(seqs)} without gaps after move")
+        stale = revenue.check_merchant(merchant_id, target)
+        revenue.rebuild_merchant(merchant_id, target, stale)
+        check([month.isoformat() for month in stale] == ["2025-10-01"]
+              and not revenue.check_merchant(merchant_id, target),
+              f"revenue aggregates on {target} consistent after rebuilding {len(stale)} month(s)")
+        customer_id = client.get(f"/v1/invoices/{ids[0]}", headers=headers).json()["customer_id"]
+        customer = client.get(f"/v1/customers/{customer_id}/invoices", headers=headers).json()["customer"]
+        check(rows(target, "customers", merchant_id) == 1 and customer["invoice_count"] == len(created - {None}),
+              f"customer moved with balance ({customer['invoice_count']} invoices)")
+        missing = [inv_id for inv_id in created
+                   if client.get(f"/v1/invoices/{inv_id}", headers=headers).status_code != 200]
+        check(not missing, f"every invoice acknowledged with 200 is readable after move ({len(created)})")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Generator data sintetis: merchants, API keys, invoices, usage logs
+
+HOW IT WORKS:
+1. Bulk insert lewat SQLAlchemy Core (executemany per batch, tanpa ORM)
+   → jutaan baris dalam hitungan menit, bukan jam lewat API
+2. Deterministik dari --seed: seed yang sama → data (dan API key) yang sama
+3. Distribusi dibuat mirip data asli:
+   - plan merchant: kebanyakan free/starter, sedikit pro/enterprise
+   - jumlah item per invoice miring ke 1-3, kadang sampai 20
+   - harga bertingkat (bulat ke Rp 500), PPN 11% (sebagian inclusive), diskon sesekali
+   - created_at tersebar --months bulan ke belakang, nomor invoice urut per bulan
+     (INV/YYYY/MM/NNNN, sama seperti next_number_db)
+   - usage logs: endpoint campuran, sebagian kecil 4xx, latency log-normal
+4. API key merchant pertama dicetak supaya bisa langsung dipakai ke API
+
+Usage:
+    python -m benchmarks.datagen --database-url sqlite:///./big.db \\
+        --merchants 100 --invoices-per-merchant 10000 --usage-logs-per-merchant 2000 --seed 42
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+BATCH = 10000
+
+PLAN_WEIGHTS = [("free", 50), ("starter", 30), ("pro", 15), ("enterprise", 5)]
+PLAN_QUOTA = {"free": 10, "starter": 100, "pro": 1000, "enterprise": 999999}
+
+PRODUCTS = ["Kopi Susu", "Roti Bakar", "Kaos Polos", "Sepatu Lari", "Jasa Desain", "Langganan Bulanan",
+            "Paket Data", "Servis AC", "Kemeja Batik", "Tas Kulit", "Sabun Cuci", "Beras 5kg"]
+CUSTOMERS = ["Budi", "Siti", "Andi", "Dewi", "Rudi", "Rina", "Agus", "Wati", "Joko", "Sri"]
+USAGE_ENDPOINTS = [
+    ("/v1/invoices", "POST", 30), ("/v1/invoices", "GET", 25), ("/v1/invoices/{id}", "GET", 20),
+    ("/v1/invoices/{id}/html", "GET", 10), ("/v1/merchants/me", "GET", 10), ("/v1/merchants/me/usage", "GET", 5)
+]
+
+_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def make_id(prefix: str, created_at: datetime, rng: random.Random):
+    """ID format gen_id (time-ordered), tapi timestamp & random dari parameter"""
+    value = (int((created_at - _EPOCH).total_seconds() * 1000) << 80) | rng.getrandbits(80)
+    chars = []
+    for _ in range(26):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+    return f"{prefix}_{''.join(reversed(chars))}"
+
+
+def _item(rng: random.Random):
+    qty = rng.choices([1, 2, 3, 5, 10, 25], weights=[50, 20, 10, 10, 7, 3])[0]
+    unit_price = round(rng.lognormvariate(10.5, 1.0) / 500) * 500 or 500
+    tax_rate = rng.choices([0.11, 0.0], weights=[85, 15])[0]
+    return {
+        "name": rng.choice(PRODUCTS),
+        "qty": qty,
+        "unit": "pcs",
+        "unit_price": unit_price,
+        "discount": rng.choice([0, 0, 0, 0, 1000, 5000]) if unit_price * qty > 10000 else 0,
+        "tax_rate": tax_rate,
+        "is_tax_inclusive": tax_rate > 0 and rng.random() < 0.2
+    }
+
+
+def _invoice_payload(rng: random.Random, issue_date):
+    count = min(20, int(rng.expovariate(0.5)) + 1)
+    return {
+        "customer": {"name": f"{rng.choice(CUSTOMERS)} {rng.randint(1, 999)}"},
+        "items": [_item(rng) for _ in range(count)],
+        "charges": {"shipping": rng.choice([0, 0, 10000, 15000, 25000]), "service": 0, "rounding": 0},
+        "discount_total": 0,
+        "tax_strategy": "per_item",
+        "currency": "IDR",
+        "issue_date": issue_date.isoformat(),
+        "due_date": (issue_date + timedelta(days=14)).isoformat(),
+        "notes": None
+    }
+
+
+def generate(engine, merchants: int, invoices_per_merchant: int, usage_logs_per_merchant: int = 0,
+             seed: int = 42, months: int = 12, now: datetime = None, log=print):
+    """
+    Isi database `engine` (tabel sudah dibuat). Returns list API key (plaintext)
+    per merchant, urut sama dengan merchant yang dibuat.
+    """
+    from app.db_models import Merchant, APIKey, Invoice, UsageLog, hash_key
+    from app.invoicing import calc_breakdown
+
+    rng = random.Random(seed)
+    now = now or datetime.utcnow().replace(microsecond=0)
+    span_seconds = months * 30 * 86400
+    month_start = now.replace(day=1, hour=0, minute=0, second=0)
+
+    merchant_rows, key_rows, api_keys = [], [], []
+    plans = [name for name, _ in PLAN_WEIGHTS]
+    weights = [weight for _, weight in PLAN_WEIGHTS]
+    for m in range(merchants):
+        created_at = now - timedelta(seconds=span_seconds + rng.randint(0, 86400 * 30))
+        plan = rng.choices(plans, weights=weights)[0]
+        merchant_id = make_id("mrc", created_at, rng)
+        merchant_rows.append({
+            "id": merchant_id, "name": f"Merchant {m}", "email": f"merchant{m}-{seed}@example.com",
+            "plan": plan, "quota_limit": PLAN_QUOTA[plan], "quota_used": 0,
+            "is_active": True, "created_at": created_at
+        })
+        key = f"inv_live_{rng.getrandbits(128):032x}"
+        api_keys.append(key)
+        key_rows.append({
+            "id": make_id("key", created_at, rng), "merchant_id": merchant_id,
+            "key_hash": hash_key(key), "key_prefix": key[:12] + "...", "name": "Default Key",
+            "is_active": True, "last_used": None, "created_at": created_at
+        })
+
+    with engine.begin() as conn:
+        conn.execute(Merchant.__table__.insert(), merchant_rows)
+        conn.execute(APIKey.__table__.insert(), key_rows)
+
+    t0 = time.perf_counter()
+    total = 0
+    rows = []
+    for merchant in merchant_rows:
+        # Waktu invoice urut naik supaya nomor per bulan juga urut
+        offsets = sorted(rng.randint(0, span_seconds) for _ in range(invoices_per_merchant))
+        seq = {}
+        this_month = 0
+        for offset in offsets:
+            created_at = now - timedelta(seconds=span_seconds - offset)
+            period = (created_at.year, created_at.month)
+            seq[period] = seq.get(period, 0) + 1
+            if created_at >= month_start:
+                this_month += 1
+
+            payload = _invoice_payload(rng, created_at.date())
+            breakdown = calc_breakdown(
+                [SimpleNamespace(**i) for i in payload["items"]],
+                SimpleNamespace(**payload["charges"]),
+                payload["discount_total"]
+            )
+            rows.append({
+                "id": make_id("inv", created_at, rng),
+                "merchant_id": merchant["id"],
+                "number": f"INV/{period[0]}/{period[1]:02d}/{seq[period]:04d}",
+                "status": "issued",
+                "payload": payload,
+                "subtotal": breakdown["subtotal"],
+                "tax_total": breakdown["tax_total"],
+                "grand_total": breakdown["grand_total"],
+                "breakdown": breakdown,
+                "created_at": created_at,
+                "updated_at": created_at
+            })
+            if len(rows) >= BATCH:
+                with engine.begin() as conn:
+                    conn.execute(Invoice.__table__.insert(), rows)
+                total += len(rows)
+                rows = []
+                log(f"  invoices: {total:,} ({total / (time.perf_counter() - t0):,.0f}/s)")
+        merchant["quota_used"] = min(this_month, merchant["quota_limit"])
+
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(Invoice.__table__.insert(), rows)
+
+    with engine.begin() as conn:
+        table = Merchant.__table__
+        for merchant in merchant_rows:
+            conn.execute(
+                table.update().where(table.c.id == merchant["id"]).values(quota_used=merchant["quota_used"])
+            )
+
+    endpoints = [(path, method) for path, method, _ in USAGE_ENDPOINTS]
+    endpoint_weights = [weight for _, _, weight in USAGE_ENDPOINTS]
+    rows = []
+    for merchant in merchant_rows:
+        for _ in range(usage_logs_per_merchant):
+            created_at = now - timedelta(seconds=rng.randint(0, span_seconds))
+            path, method = rng.choices(endpoints, weights=endpoint_weights)[0]
+            rows.append({
+                "id": make_id("log", created_at, rng),
+                "merchant_id": merchant["id"],
+                "endpoint": path,
+                "method": method,
+                "status_code": rng.choices([200, 400, 401, 404, 429], weights=[92, 3, 2, 2, 1])[0],
+                "response_time_ms": int(rng.lognormvariate(3.0, 0.6)),
+                "created_at": created_at,
+                "user_agent": "datagen",
+                "ip_address": f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            })
+            if len(rows) >= BATCH:
+                with engine.begin() as conn:
+                    conn.execute(UsageLog.__table__.insert(), rows)
+                rows = []
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(UsageLog.__table__.insert(), rows)
+
+    return api_keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Default: DATABASE_URL dari environment / .env")
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--invoices-per-merchant", type=int, default=1000)
+    parser.add_argument("--usage-logs-per-merchant", type=int, default=500)
+    parser.add_argument("--months", type=int, default=12, help="Rentang waktu data ke belakang")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--now", type=datetime.fromisoformat, help="Waktu acuan (default: sekarang), mis. 2025-10-01T00:00:00")
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    from app.database import init_engines, Base, ensure_indexes
+    import app.db_models  # noqa: F401 (register tabel di Base.metadata)
+
+    engine, _ = init_engines()
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+
+    t0 = time.perf_counter()
+    api_keys = generate(
+        engine, args.merchants, args.invoices_per_merchant, args.usage_logs_per_merchant,
+        seed=args.seed, months=args.months, now=args.now
+    )
+    print(
+        f"Generated {args.merchants:,} merchants, {args.merchants * args.invoices_per_merchant:,} invoices, "
+        f"{args.merchants * args.usage_logs_per_merchant:,} usage logs in {time.perf_counter() - t0:.1f}s"
+    )
+    if api_keys:
+        print(f"API key merchant pertama: {api_keys[0]}")
+
+
+if __name__ == "__main__":
+    main()
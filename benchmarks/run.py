@@ -0,0 +1,264 @@
+"""
+Benchmark suite: throughput + latency p50/p99 per endpoint dan concurrency
+
+HOW IT WORKS:
+1. Target default: FastAPI app in-process (httpx ASGITransport) dengan
+   SQLite baru di temp dir (atau DATABASE_URL yang sudah di-set).
+   --url http://127.0.0.1:8000 → uvicorn yang sudah jalan (sebaiknya juga
+   dengan database baru, karena benchmark ini menulis data)
+2. Setup: register merchant plan enterprise + --seed invoice lewat API
+3. Untuk tiap concurrency level, tiap skenario dijalankan --requests kali
+   (setelah --warmup request yang tidak dihitung)
+4. Hasil → JSON (--output) dan tabel di stdout
+5. --baseline hasil-lama.json → bandingkan; exit code 1 kalau throughput turun
+   atau p99 naik lebih dari --threshold (default 15%)
+
+Skenario:
+    register            POST /v1/merchants/register
+    auth                GET  /v1/merchants/me (auth + 0 query tambahan)
+    create              POST /v1/invoices
+    list_shallow        GET  /v1/invoices?limit=50
+    list_deep_offset    GET  /v1/invoices?limit=50&offset=<seed-50>
+    list_deep_cursor    GET  /v1/invoices?limit=50&cursor=<invoice ke seed-50>
+    detail              GET  /v1/invoices/{id}
+    html                GET  /v1/invoices/{id}/html
+    analytics           GET  /v1/merchants/me/analytics
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json --threshold 0.15
+    python -m benchmarks.run --url http://127.0.0.1:8000 --concurrency 1 32 --scenarios list_shallow detail
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+BODY = {
+    "customer": {"name": "Toko Benchmark", "email": "bench@example.com"},
+    "items": [
+        {"name": "Produk A", "qty": 2, "unit_price": 10000, "tax_rate": 0.11},
+        {"name": "Produk B", "qty": 1, "unit_price": 250000, "discount": 5000, "tax_rate": 0.11, "is_tax_inclusive": True},
+        {"name": "Jasa Kirim", "qty": 1, "unit_price": 15000}
+    ],
+    "charges": {"shipping": 10000},
+    "issue_date": "2025-10-13"
+}
+
+PAGE = 50
+
+_emails = itertools.count()
+
+
+def _scenarios(ctx):
+    """name → fungsi(client) yang mengirim satu request"""
+    headers = ctx["headers"]
+    inv_id = ctx["inv_id"]
+    run_id = ctx["run_id"]
+
+    def register(client):
+        return client.post("/v1/merchants/register", params={
+            "name": "Bench", "email": f"bench-{run_id}-{next(_emails)}@example.com"
+        })
+
+    return {
+        "register": register,
+        "auth": lambda client: client.get("/v1/merchants/me", headers=headers),
+        "create": lambda client: client.post("/v1/invoices", json=BODY, headers=headers),
+        "list_shallow": lambda client: client.get(f"/v1/invoices?limit={PAGE}", headers=headers),
+        "list_deep_offset": lambda client: client.get(
+            f"/v1/invoices?limit={PAGE}&offset={ctx['deep_offset']}", headers=headers
+        ),
+        "list_deep_cursor": lambda client: client.get(
+            f"/v1/invoices?limit={PAGE}&cursor={ctx['deep_cursor']}", headers=headers
+        ),
+        "detail": lambda client: client.get(f"/v1/invoices/{inv_id}", headers=headers),
+        "html": lambda client: client.get(f"/v1/invoices/{inv_id}/html", headers=headers),
+        "analytics": lambda client: client.get("/v1/merchants/me/analytics", headers=headers),
+    }
+
+
+SCENARIOS = [
+    "register", "auth", "list_shallow", "list_deep_offset", "list_deep_cursor",
+    "detail", "html", "analytics", "create"
+]
+
+
+def percentile(sorted_values, pct: float):
+    """Nearest-rank percentile dari list yang sudah di-sort"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+async def run_scenario(client, send, requests: int, concurrency: int, warmup: int):
+    for _ in range(warmup):
+        await send(client)
+
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            r = await send(client)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+    }
+
+
+async def setup(client, seed: int):
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    r = await client.post("/v1/merchants/register", params={
+        "name": "Bench", "email": f"bench-{run_id}@example.com", "plan": "enterprise"
+    })
+    r.raise_for_status()
+    headers = {"X-API-Key": r.json()["api_key"]}
+
+    sem = asyncio.Semaphore(16)
+
+    async def create():
+        async with sem:
+            r = await client.post("/v1/invoices", json=BODY, headers=headers)
+            r.raise_for_status()
+            return r.json()["id"]
+
+    ids = await asyncio.gather(*(create() for _ in range(max(seed, 1))))
+
+    deep_offset = max(0, len(ids) - PAGE)
+    r = await client.get(f"/v1/invoices?limit=1&offset={deep_offset}", headers=headers)
+    deep_cursor = r.json()["invoices"][0]["id"]
+
+    return {
+        "run_id": run_id,
+        "headers": headers,
+        "inv_id": ids[0],
+        "deep_offset": deep_offset,
+        "deep_cursor": deep_cursor
+    }
+
+
+async def main_async(args):
+    import httpx
+
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url, timeout=60,
+            limits=httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        )
+    else:
+        from app.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    # In-process: jalankan lifespan app (engine, tabel, background task) seperti uvicorn
+    lifespan = contextlib.nullcontext() if args.url else app.router.lifespan_context(app)
+
+    results = {}
+    async with lifespan, client:
+        print(f"Seeding {args.seed} invoices...", file=sys.stderr)
+        ctx = await setup(client, args.seed)
+        scenarios = _scenarios(ctx)
+
+        print(f"{'scenario':<18} {'conc':>5} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for concurrency in args.concurrency:
+            for name in args.scenarios:
+                result = await run_scenario(client, scenarios[name], args.requests, concurrency, args.warmup)
+                results[f"{name}@{concurrency}"] = result
+                print(
+                    f"{name:<18} {concurrency:>5} {result['rps']:>9,.1f} {result['p50_ms']:>9.2f} "
+                    f"{result['p99_ms']:>9.2f} {result['errors']:>7}"
+                )
+
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "target": args.url or "in-process",
+            "database": None if args.url else os.environ["DATABASE_URL"],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+
+def compare(current, baseline, threshold: float):
+    """Returns list regresi (str) dibanding baseline"""
+    regressions = []
+    for key, result in current["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if not base:
+            continue
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{key}: rps {base['rps']} → {result['rps']}")
+        if result["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(f"{key}: p99 {base['p99_ms']}ms → {result['p99_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Target uvicorn yang sudah jalan (default: in-process ASGI)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per (scenario, concurrency)")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--seed", type=int, default=500, help="Invoices dibuat sebelum benchmark (deep page)")
+    parser.add_argument("--output", help="Tulis hasil JSON ke file ini")
+    parser.add_argument("--baseline", help="Hasil JSON sebelumnya untuk dibandingkan")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Toleransi regresi (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    if not args.url:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+    report = asyncio.run(main_async(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\nREGRESSION (threshold {args.threshold:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regression vs {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()